@@ -9,6 +9,9 @@ import tabulate
 import pysegmenttree._pysegmenttree_py
 import pysegmenttree.c_extensions
 
+# Number of queries and updates made by a single run of the benches
+QUERIES = 10000
+
 
 def get_random_query(start: int, end: int):
     query = [random.randint(start, end), random.randint(start, end)]
@@ -16,12 +19,20 @@ def get_random_query(start: int, end: int):
     return query
 
 
+def get_value_range(tree_cls: Type):
+    # Trees with unsigned items reject negative values
+    if tree_cls.__name__.startswith("UInt"):
+        return 0, 200
+    return -100, 100
+
+
 def bench_build(tree_cls: Type, size: int = 1_000_000):
     print(f"\n{tree_cls.__name__}: build")
     print(f"Tree size: {size}")
 
     random.seed(42)
-    container = [random.randint(-100, 100) for _ in range(size)]
+    low, high = get_value_range(tree_cls)
+    container = [random.randint(low, high) for _ in range(size)]
 
     context = {**globals(), **locals()}
     return timeit.repeat(
@@ -32,12 +43,13 @@ def bench_build(tree_cls: Type, size: int = 1_000_000):
     )
 
 
-def bench_query(tree_cls: Type, size: int = 100_000, queries: int = 10000):
+def bench_query(tree_cls: Type, size: int = 100_000, queries: int = QUERIES):
     print(f"\n{tree_cls.__name__}: query")
     print(f"Tree size: {size}, queries count: {queries}")
 
     random.seed(42)
-    container = [random.randint(-100, 100) for _ in range(size)]
+    low, high = get_value_range(tree_cls)
+    container = [random.randint(low, high) for _ in range(size)]
 
     tree = tree_cls(container)
     prepared_queries = [get_random_query(0, size - 1) for _ in range(queries)]
@@ -51,16 +63,17 @@ def bench_query(tree_cls: Type, size: int = 100_000, queries: int = 10000):
     )
 
 
-def bench_update(tree_cls: Type, size: int = 100_000, queries: int = 10000):
+def bench_update(tree_cls: Type, size: int = 100_000, queries: int = QUERIES):
     print(f"\n{tree_cls.__name__}: update")
     print(f"Tree size: {size}, queries count: {queries}")
 
     random.seed(42)
-    container = [random.randint(-100, 100) for _ in range(size)]
+    low, high = get_value_range(tree_cls)
+    container = [random.randint(low, high) for _ in range(size)]
 
     tree = tree_cls(container)
     prepared_queries = [
-        [random.randint(0, size - 1), random.randint(-100, 100)] for _ in range(queries)
+        [random.randint(0, size - 1), random.randint(low, high)] for _ in range(queries)
     ]
 
     context = {**globals(), **locals()}
@@ -76,21 +89,38 @@ IMPLEMENTATIONS = [
     pysegmenttree._pysegmenttree_py.PySegmentTree,
     pysegmenttree.c_extensions.IntSegmentTree,
     pysegmenttree.c_extensions.FloatSegmentTree,
+    pysegmenttree.c_extensions.Int32SegmentTree,
+    pysegmenttree.c_extensions.UInt32SegmentTree,
+    pysegmenttree.c_extensions.UInt64SegmentTree,
+    pysegmenttree.c_extensions.Float32SegmentTree,
 ]
 
 BENCHES = {
     "build": bench_build,
     "query": bench_query,
-    "update": bench_query,
+    "update": bench_update,
+}
+
+# Number of calls made by a single run of the bench, used to show the per-call latency
+CALLS = {
+    "build": 1,
+    "query": QUERIES,
+    "update": QUERIES,
 }
 
 
 if __name__ == "__main__":
-    results_table = [["-", *(impl.__name__ for impl in IMPLEMENTATIONS)]]
+    headers = ["-", *(impl.__name__ for impl in IMPLEMENTATIONS)]
+    results_table = [headers]
+    per_call_table = [headers]
     for bench, func in BENCHES.items():
         results_table.append([bench])
+        per_call_table.append([bench])
         for tree_cls in IMPLEMENTATIONS:
             timeit_results = func(tree_cls)
             mean = statistics.mean(timeit_results)
             results_table[-1].append(mean)
+            per_call_table[-1].append(round(min(timeit_results) / CALLS[bench] * 1e9))
     print(tabulate.tabulate(results_table, headers="firstrow", tablefmt="grid"))
+    print("\nPer-call latency, ns")
+    print(tabulate.tabulate(per_call_table, headers="firstrow", tablefmt="grid"))
@@ -1,5 +1,20 @@
 from ._abc import QueryFunction
-from ._segmenttree import PySegmentTree, stree
+from ._segmenttree import (
+    PySegmentTree,
+    attach_stree,
+    open_stree,
+    save_stree,
+    share_stree,
+    stree,
+)
 
 __version__ = "0.2.0"
-__all__ = ["PySegmentTree", "QueryFunction", "stree"]
+__all__ = [
+    "PySegmentTree",
+    "QueryFunction",
+    "attach_stree",
+    "open_stree",
+    "save_stree",
+    "share_stree",
+    "stree",
+]
@@ -1,7 +1,8 @@
 from enum import Enum
 from functools import lru_cache
-from operator import add
-from typing import Callable, Generic, List, Optional, TypeVar, Union
+from math import gcd
+from operator import add, and_, mul, or_, xor
+from typing import Callable, Generic, List, Optional, Sequence, TypeVar, Union
 
 T = TypeVar("T")
 Func = Callable[[T, T], T]
@@ -11,6 +12,11 @@ class QueryFunction(Enum):
     SUM = "sum"
     MIN = "min"
     MAX = "max"
+    PRODUCT = "product"
+    GCD = "gcd"
+    XOR = "xor"
+    AND = "and"
+    OR = "or"
 
     @lru_cache()
     def _map(self, value: "QueryFunction"):
@@ -18,6 +24,11 @@ class QueryFunction(Enum):
             QueryFunction.SUM: add,
             QueryFunction.MIN: min,
             QueryFunction.MAX: max,
+            QueryFunction.PRODUCT: mul,
+            QueryFunction.GCD: gcd,
+            QueryFunction.XOR: xor,
+            QueryFunction.AND: and_,
+            QueryFunction.OR: or_,
         }[value]
 
     def to_python_func(self):
@@ -38,5 +49,22 @@ class AbstractSegmentTree(Generic[T]):
     def update(self, i: int, value: T) -> None:
         raise NotImplementedError()
 
+    def query_many(self, starts: Sequence[int], ends: Sequence[int]) -> Sequence[T]:
+        raise NotImplementedError()
+
+    def update_many(self, indices: Sequence[int], values: Sequence[T]) -> None:
+        raise NotImplementedError()
+
+    def max_right(self, start: int, predicate: Union[Callable[[T], bool], T]) -> int:
+        raise NotImplementedError()
+
+    def min_left(self, end: int, predicate: Union[Callable[[T], bool], T]) -> int:
+        raise NotImplementedError()
+
+    def find_first(
+        self, start: int, predicate: Union[Callable[[T], bool], T]
+    ) -> Optional[int]:
+        raise NotImplementedError()
+
     def __len__(self) -> int:
         raise NotImplementedError()
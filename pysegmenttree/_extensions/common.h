@@ -1,3 +1,9 @@
+#ifndef PYSEGMENTTREE_COMMON_H
+#define PYSEGMENTTREE_COMMON_H
+
+#include <stdbool.h>
+#include <stdint.h>
+
 #define MAX(x, y) (((x) > (y)) ? (x) : (y))
 #define MIN(x, y) (((x) < (y)) ? (x) : (y))
 
@@ -10,4 +16,1599 @@ enum QueryFunc {
     Sum = 1,
     Min,
     Max,
+    Product,
+    Gcd,
+    Xor,
+    And,
+    Or,
+};
+
+/* The last functions supported by the int and the float trees, gcd and bitwise ones are int only */
+#define QUERY_FUNC_MAX Or
+#define FLOAT_QUERY_FUNC_MAX Product
+
+static const char *const query_func_names[] = {NULL, "sum", "min", "max", "product", "gcd", "xor", "and", "or"};
+
+/* Parses the `func` argument of the constructors, NULL means the sum */
+static int
+query_func_parse(const char *name, enum QueryFunc last, enum QueryFunc *res)
+{
+    if (name == NULL) {
+        *res = Sum;
+        return 0;
+    }
+    for (int func = Sum; func <= (int)last; func++) {
+        if (strcmp(name, query_func_names[func]) == 0) {
+            *res = (enum QueryFunc)func;
+            return 0;
+        }
+    }
+
+    switch(last) {
+        case Max:
+            PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'sum', 'min' or 'max'");
+            break;
+        case Product:
+            PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'sum', 'min', 'max' or 'product'");
+            break;
+        default:
+            PyErr_SetString(PyExc_ValueError,
+                            "Invalid 'func' argument, must be 'sum', 'min', 'max', 'product', 'gcd', 'xor', 'and' or 'or'");
+            break;
+    }
+    return -1;
+}
+
+/*
+    Binary snapshot of a tree: the header followed by the raw node array.
+    Nodes are stored in the native byte order, which is recorded in the flags.
+    All fields are aligned, so the node array can be used in place.
+*/
+#define SNAPSHOT_MAGIC "PSTR"
+#define SNAPSHOT_VERSION 1
+#define SNAPSHOT_LITTLE_ENDIAN 0x01
+
+typedef struct {
+    char magic[4];
+    uint8_t version;
+    /* struct format character of the nodes */
+    char dtype;
+    /* enum QueryFunc */
+    uint8_t func;
+    uint8_t flags;
+    /* number of elements, the node array holds 2 * size items */
+    uint64_t size;
+    /* seqlock counter of the shared trees, it's odd while the writer modifies the nodes */
+    uint64_t seq;
+} SnapshotHeader;
+
+static void
+snapshot_header_fill(SnapshotHeader *header, char dtype, enum QueryFunc func, Py_ssize_t size)
+{
+    memset(header, 0, sizeof(SnapshotHeader));
+    memcpy(header->magic, SNAPSHOT_MAGIC, sizeof(header->magic));
+    header->version = SNAPSHOT_VERSION;
+    header->dtype = dtype;
+    header->func = (uint8_t)func;
+    header->flags = PY_LITTLE_ENDIAN ? SNAPSHOT_LITTLE_ENDIAN : 0;
+    header->size = (uint64_t)size;
+}
+
+/*
+    Validates the snapshot stored in the buffer and copies its header.
+    The buffer must contain exactly the header and 2 * size nodes of `itemsize` bytes.
+*/
+static int
+snapshot_header_parse(const Py_buffer *view, SnapshotHeader *header, char dtype,
+                      Py_ssize_t itemsize, const char *name)
+{
+    if (view->len < (Py_ssize_t)sizeof(SnapshotHeader)) {
+        PyErr_Format(PyExc_ValueError, "Invalid %s snapshot: data is too short", name);
+        return -1;
+    }
+    memcpy(header, view->buf, sizeof(SnapshotHeader));
+
+    if (memcmp(header->magic, SNAPSHOT_MAGIC, sizeof(header->magic)) != 0) {
+        PyErr_Format(PyExc_ValueError, "Invalid %s snapshot: wrong magic number", name);
+        return -1;
+    }
+    if (header->version != SNAPSHOT_VERSION) {
+        PyErr_Format(PyExc_ValueError, "Unsupported %s snapshot version %d", name, (int)header->version);
+        return -1;
+    }
+    if (header->dtype != dtype) {
+        PyErr_Format(PyExc_ValueError, "Invalid %s snapshot: '%c' items expected, got '%c'",
+                     name, dtype, header->dtype);
+        return -1;
+    }
+    if (header->func < Sum || header->func > (dtype == 'd' ? FLOAT_QUERY_FUNC_MAX : QUERY_FUNC_MAX)) {
+        PyErr_Format(PyExc_ValueError, "Invalid %s snapshot: unknown query function", name);
+        return -1;
+    }
+    if ((header->flags & SNAPSHOT_LITTLE_ENDIAN) != (PY_LITTLE_ENDIAN ? SNAPSHOT_LITTLE_ENDIAN : 0)) {
+        PyErr_Format(PyExc_ValueError, "Invalid %s snapshot: byte order doesn't match", name);
+        return -1;
+    }
+    if (header->size > (uint64_t)(PY_SSIZE_T_MAX - sizeof(SnapshotHeader)) / 2 / itemsize
+        || view->len != (Py_ssize_t)(sizeof(SnapshotHeader) + 2 * header->size * itemsize)) {
+        PyErr_Format(PyExc_ValueError, "Invalid %s snapshot: data size doesn't match", name);
+        return -1;
+    }
+    return 0;
+}
+
+/*
+    Acquires the external storage of the attached tree. Writable buffers are preferred,
+    the read-only ones (bytes, mmap opened with ACCESS_READ, ...) produce a read-only tree.
+    The `sync` option requires the exporting object to have the `flush()` method (e.g. mmap).
+*/
+static int
+storage_open(Py_buffer *storage, PyObject *obj, bool sync)
+{
+    if (PyObject_GetBuffer(obj, storage, PyBUF_WRITABLE) < 0) {
+        if (!PyErr_ExceptionMatches(PyExc_BufferError) && !PyErr_ExceptionMatches(PyExc_TypeError)) {
+            return -1;
+        }
+        PyErr_Clear();
+        if (PyObject_GetBuffer(obj, storage, PyBUF_SIMPLE) < 0) {
+            return -1;
+        }
+    }
+
+    if (sync && !PyObject_HasAttrString(obj, "flush")) {
+        PyErr_Format(PyExc_TypeError, "'sync' requires the storage with the flush() method, got '%.200s'",
+                     Py_TYPE(obj)->tp_name);
+        PyBuffer_Release(storage);
+        return -1;
+    }
+    return 0;
+}
+
+/* Raises TypeError if the tree is attached to the read-only storage */
+static inline int
+storage_check_writable(const Py_buffer *storage, const char *name)
+{
+    if (storage->obj != NULL && storage->readonly) {
+        PyErr_Format(PyExc_TypeError, "%s is attached to the read-only storage", name);
+        return -1;
+    }
+    return 0;
+}
+
+/* Writes the modified pages of the storage back to the file (msync for mmap) */
+static int
+storage_flush(const Py_buffer *storage)
+{
+    PyObject *res = PyObject_CallMethod(storage->obj, "flush", NULL);
+    if (res == NULL) {
+        return -1;
+    }
+    Py_DECREF(res);
+    return 0;
+}
+
+#if defined(_WIN32)
+    #define WIN32_LEAN_AND_MEAN
+    #include <windows.h>
+    #define SEQLOCK_FENCE() MemoryBarrier()
+#else
+    #define SEQLOCK_FENCE() __atomic_thread_fence(__ATOMIC_SEQ_CST)
+#endif
+
+/*
+    Seqlock protecting the node array shared between processes.
+    The single writer makes the counter odd for the time of the modification,
+    readers repeat the walk if the counter was odd or has changed meanwhile.
+    The trees owning their memory have no counter, all functions are no-op for them.
+*/
+static inline uint64_t
+seqlock_read_begin(const volatile uint64_t *seq)
+{
+    uint64_t version = 0;
+
+    if (seq != NULL) {
+        while ((version = *seq) & 1) {
+            /* the writer is active */
+        }
+        SEQLOCK_FENCE();
+    }
+    return version;
+}
+
+static inline bool
+seqlock_read_retry(const volatile uint64_t *seq, uint64_t version)
+{
+    if (seq == NULL) {
+        return false;
+    }
+    SEQLOCK_FENCE();
+    return *seq != version;
+}
+
+static inline void
+seqlock_write_begin(volatile uint64_t *seq)
+{
+    if (seq != NULL) {
+        *seq = *seq + 1;
+        SEQLOCK_FENCE();
+    }
+}
+
+static inline void
+seqlock_write_end(volatile uint64_t *seq)
+{
+    if (seq != NULL) {
+        SEQLOCK_FENCE();
+        *seq = *seq + 1;
+    }
+}
+
+/* Repeats the read statement until it observes the consistent state of the tree */
+#define SEQLOCK_READ(seq, statement)                                \
+    do {                                                            \
+        uint64_t _seqlock_version;                                  \
+        do {                                                        \
+            _seqlock_version = seqlock_read_begin(seq);             \
+            statement;                                              \
+        } while (seqlock_read_retry(seq, _seqlock_version));        \
+    } while (0)
+
+#if !defined(_WIN32)
+    #include <pthread.h>
+#endif
+
+/*
+    Optional reader/writer lock of the tree. The locked trees release the GIL
+    for the time of the walk, so concurrent queries run in parallel.
+    The lock is always enabled in the free-threaded builds.
+
+    The code holding the lock must never acquire the GIL, otherwise
+    it may deadlock with the thread waiting for the lock.
+*/
+#ifdef Py_GIL_DISABLED
+    #define TREE_LOCK_DEFAULT true
+#else
+    #define TREE_LOCK_DEFAULT false
+#endif
+
+typedef struct {
+#if defined(_WIN32)
+    SRWLOCK rwlock;
+#else
+    pthread_rwlock_t rwlock;
+#endif
+    bool enabled;
+} TreeLock;
+
+static int
+tree_lock_init(TreeLock *lock, bool enabled)
+{
+    if (enabled) {
+#if defined(_WIN32)
+        InitializeSRWLock(&lock->rwlock);
+#else
+        if (pthread_rwlock_init(&lock->rwlock, NULL) != 0) {
+            PyErr_SetString(PyExc_RuntimeError, "Can't initialize the tree lock");
+            return -1;
+        }
+#endif
+    }
+    lock->enabled = enabled;
+    return 0;
+}
+
+static void
+tree_lock_destroy(TreeLock *lock)
+{
+#if !defined(_WIN32)
+    if (lock->enabled) {
+        pthread_rwlock_destroy(&lock->rwlock);
+    }
+#endif
+    lock->enabled = false;
+}
+
+static inline void
+tree_lock_acquire(TreeLock *lock, bool write)
+{
+    if (!lock->enabled) {
+        return;
+    }
+#if defined(_WIN32)
+    if (write) {
+        AcquireSRWLockExclusive(&lock->rwlock);
+    } else {
+        AcquireSRWLockShared(&lock->rwlock);
+    }
+#else
+    if (write) {
+        pthread_rwlock_wrlock(&lock->rwlock);
+    } else {
+        pthread_rwlock_rdlock(&lock->rwlock);
+    }
+#endif
+}
+
+static inline void
+tree_lock_release(TreeLock *lock, bool write)
+{
+    if (!lock->enabled) {
+        return;
+    }
+#if defined(_WIN32)
+    if (write) {
+        ReleaseSRWLockExclusive(&lock->rwlock);
+    } else {
+        ReleaseSRWLockShared(&lock->rwlock);
+    }
+#else
+    pthread_rwlock_unlock(&lock->rwlock);
+#endif
+}
+
+/* Per-object locks of the free-threaded builds, the GIL serializes the methods otherwise */
+#ifndef Py_BEGIN_CRITICAL_SECTION
+    #define Py_BEGIN_CRITICAL_SECTION(op) {
+    #define Py_END_CRITICAL_SECTION() }
+#endif
+
+#define TREE_READ false
+#define TREE_WRITE true
+
+/*
+    Runs the statement under the tree lock with the GIL released.
+    The statement must not use the Python API. The trees without the lock
+    run it holding the GIL, unless `allow_threads` is set.
+*/
+#define TREE_RUN(lock, write, allow_threads, statement)             \
+    do {                                                            \
+        if ((lock)->enabled || (allow_threads)) {                   \
+            Py_BEGIN_ALLOW_THREADS                                  \
+            tree_lock_acquire(lock, write);                         \
+            statement;                                              \
+            tree_lock_release(lock, write);                         \
+            Py_END_ALLOW_THREADS                                    \
+        } else {                                                    \
+            statement;                                              \
+        }                                                           \
+    } while (0)
+
+/*
+    Vectorcall entry points. Python 3.6 has no METH_KEYWORDS variant
+    of METH_FASTCALL, but its METH_FASTCALL passes keyword names already.
+*/
+#if PY_VERSION_HEX >= 0x03070000
+    #define METH_FASTCALL_KEYWORDS (METH_FASTCALL | METH_KEYWORDS)
+#else
+    #define METH_FASTCALL_KEYWORDS METH_FASTCALL
+#endif
+
+/*
+    Puts the arguments of the METH_FASTCALL_KEYWORDS call into `out` in the order of `names`.
+    The first `required` arguments are mandatory, others are left untouched if missing.
+*/
+static int
+fastcall_unpack(const char *fname, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames,
+                const char *const *names, Py_ssize_t required, Py_ssize_t total, PyObject **out)
+{
+    Py_ssize_t nkwargs = kwnames == NULL ? 0 : PyTuple_GET_SIZE(kwnames);
+
+    if (nargs > total) {
+        PyErr_Format(PyExc_TypeError, "%s() takes at most %zd arguments (%zd given)",
+                     fname, total, nargs + nkwargs);
+        return -1;
+    }
+    for (Py_ssize_t i = 0; i < nargs; i++) {
+        out[i] = args[i];
+    }
+
+    for (Py_ssize_t k = 0; k < nkwargs; k++) {
+        PyObject *key = PyTuple_GET_ITEM(kwnames, k);
+        Py_ssize_t i = 0;
+
+        while (i < total && PyUnicode_CompareWithASCIIString(key, names[i]) != 0) {
+            i++;
+        }
+        if (i == total) {
+            PyErr_Format(PyExc_TypeError, "'%U' is an invalid keyword argument for %s()", key, fname);
+            return -1;
+        }
+        if (i < nargs || out[i] != NULL) {
+            PyErr_Format(PyExc_TypeError, "argument for %s() given by name ('%s') and position (%zd)",
+                         fname, names[i], i + 1);
+            return -1;
+        }
+        out[i] = args[nargs + k];
+    }
+
+    for (Py_ssize_t i = 0; i < required; i++) {
+        if (out[i] == NULL) {
+            PyErr_Format(PyExc_TypeError, "%s() missing required argument '%s' (pos %zd)",
+                         fname, names[i], i + 1);
+            return -1;
+        }
+    }
+    return 0;
+}
+
+/*
+    Converters with the fast path for the exact small ints and floats,
+    otherwise they behave like the "n", "L" and "d" formats of PyArg_Parse*.
+*/
+static inline bool
+_compact_long_value(PyObject *obj, long long *value)
+{
+    if (!PyLong_CheckExact(obj)) {
+        return false;
+    }
+#if PY_VERSION_HEX >= 0x030C0000
+    if (PyUnstable_Long_IsCompact((PyLongObject *)obj)) {
+        *value = (long long)PyUnstable_Long_CompactValue((PyLongObject *)obj);
+        return true;
+    }
+#else
+    Py_ssize_t size = Py_SIZE(obj);
+    if (size >= -1 && size <= 1) {
+        *value = size * (long long)((PyLongObject *)obj)->ob_digit[0];
+        return true;
+    }
+#endif
+    return false;
+}
+
+static inline int
+ssize_from_object(PyObject *obj, Py_ssize_t *res)
+{
+    long long value;
+
+    if (_compact_long_value(obj, &value)) {
+        *res = (Py_ssize_t)value;
+        return 0;
+    }
+    *res = PyNumber_AsSsize_t(obj, PyExc_OverflowError);
+    return *res == -1 && PyErr_Occurred() ? -1 : 0;
+}
+
+static inline int
+longlong_from_object(PyObject *obj, long long *res)
+{
+    if (_compact_long_value(obj, res)) {
+        return 0;
+    }
+    if (PyFloat_Check(obj)) {
+        PyErr_SetString(PyExc_TypeError, "integer argument expected, got float");
+        return -1;
+    }
+    *res = PyLong_AsLongLong(obj);
+    return *res == -1 && PyErr_Occurred() ? -1 : 0;
+}
+
+static inline int
+double_from_object(PyObject *obj, double *res)
+{
+    if (PyFloat_CheckExact(obj)) {
+        *res = PyFloat_AS_DOUBLE(obj);
+        return 0;
+    }
+    *res = PyFloat_AsDouble(obj);
+    return *res == -1.0 && PyErr_Occurred() ? -1 : 0;
+}
+
+#define SEQUENCE_INDEX 0
+#define SEQUENCE_SLICE 1
+
+/*
+    Unpacks the key of `tree[key]`: the index, negative ones count from the end,
+    or the slice. The index is returned as the slice of the single item.
+    Returns SEQUENCE_INDEX, SEQUENCE_SLICE or -1 on error.
+*/
+static int
+sequence_key_unpack(PyObject *key, Py_ssize_t size, const char *name,
+                    Py_ssize_t *start, Py_ssize_t *step, Py_ssize_t *count)
+{
+    if (PyIndex_Check(key)) {
+        Py_ssize_t i = PyNumber_AsSsize_t(key, PyExc_IndexError);
+        if (i == -1 && PyErr_Occurred()) {
+            return -1;
+        }
+        if (i < 0) {
+            i += size;
+        }
+        if (i < 0 || i >= size) {
+            PyErr_Format(PyExc_IndexError, "%s index out of range", name);
+            return -1;
+        }
+        *start = i;
+        *step = 1;
+        *count = 1;
+        return SEQUENCE_INDEX;
+    }
+
+    if (PySlice_Check(key)) {
+        Py_ssize_t stop;
+        if (PySlice_Unpack(key, start, &stop, step) < 0) {
+            return -1;
+        }
+        *count = PySlice_AdjustIndices(size, start, &stop, *step);
+        return SEQUENCE_SLICE;
+    }
+
+    PyErr_Format(PyExc_TypeError, "%s indices must be integers or slices, not %.200s",
+                 name, Py_TYPE(key)->tp_name);
+    return -1;
+}
+
+/* Bounds of the leaves [first, last] touched by the slice of `count` > 0 items */
+static inline void
+sequence_slice_bounds(Py_ssize_t start, Py_ssize_t step, Py_ssize_t count, Py_ssize_t *first, Py_ssize_t *last)
+{
+    Py_ssize_t end = start + (count - 1) * step;
+
+    *first = MIN(start, end);
+    *last = MAX(start, end);
+}
+
+/* Name of the tree type without the module, as it's shown in the error messages */
+static inline const char *
+sequence_type_name(PyObject *self)
+{
+    const char *name = Py_TYPE(self)->tp_name;
+    const char *dot = strrchr(name, '.');
+
+    return dot == NULL ? name : dot + 1;
+}
+
+/*
+    `tree[key]` of the trees reading one leaf at a time through `sq_item`,
+    the slice is returned as the list of the leaves.
+*/
+static PyObject *
+sequence_subscript(PyObject *self, PyObject *key)
+{
+    PySequenceMethods *sq = Py_TYPE(self)->tp_as_sequence;
+    const char *name = sequence_type_name(self);
+    Py_ssize_t start, step, count;
+    int kind = sequence_key_unpack(key, sq->sq_length(self), name, &start, &step, &count);
+
+    if (kind < 0) {
+        return NULL;
+    }
+    if (kind == SEQUENCE_INDEX) {
+        return sq->sq_item(self, start);
+    }
+
+    PyObject *res = PyList_New(count);
+
+    for (Py_ssize_t i = 0; res != NULL && i < count; i++) {
+        PyObject *item = sq->sq_item(self, start + i * step);
+        if (item == NULL) {
+            Py_CLEAR(res);
+            break;
+        }
+        PyList_SET_ITEM(res, i, item);
+    }
+    return res;
+}
+
+/* Raises the error of `del tree[i]`, returns -1 */
+static inline int
+sequence_no_deletion(const char *name)
+{
+    PyErr_Format(PyExc_TypeError, "%s doesn't support item deletion", name);
+    return -1;
+}
+
+/* `tree[i] = value` through `sq_ass_item`, the trees using it don't support the slice assignment */
+static int
+sequence_ass_subscript(PyObject *self, PyObject *key, PyObject *value)
+{
+    PySequenceMethods *sq = Py_TYPE(self)->tp_as_sequence;
+    const char *name = sequence_type_name(self);
+    Py_ssize_t start, step, count;
+
+    if (value == NULL) {
+        return sequence_no_deletion(name);
+    }
+
+    int kind = sequence_key_unpack(key, sq->sq_length(self), name, &start, &step, &count);
+    if (kind < 0) {
+        return -1;
+    }
+    if (kind == SEQUENCE_SLICE) {
+        PyErr_Format(PyExc_TypeError, "%s doesn't support slice assignment", name);
+        return -1;
+    }
+    return sq->sq_ass_item(self, start, value);
+}
+
+/* Turns the result of the method returning None into the status of `sq_ass_item` */
+static inline int
+sequence_status(PyObject *res)
+{
+    if (res == NULL) {
+        return -1;
+    }
+    Py_DECREF(res);
+    return 0;
+}
+
+#if defined(__SIZEOF_INT128__)
+/* 128-bit integers are supported by gcc and clang, but not by msvc */
+#define HAVE_INT128 1
+#define INT128_MAX_VALUE ((__int128)(((unsigned __int128)1 << 127) - 1))
+#define INT128_MIN_VALUE (-INT128_MAX_VALUE - 1)
+
+static PyObject *
+int128_to_object(__int128 value)
+{
+    if (value >= LLONG_MIN && value <= LLONG_MAX) {
+        return PyLong_FromLongLong((long long)value);
+    }
+
+    /* high * 2^64 + low, the arithmetic shift keeps the sign in the high part */
+    PyObject *high = PyLong_FromLongLong((long long)(value >> 64));
+    PyObject *low = PyLong_FromUnsignedLongLong((unsigned long long)value);
+    PyObject *shift = PyLong_FromLong(64);
+    PyObject *res = NULL;
+
+    if (high != NULL && low != NULL && shift != NULL) {
+        Py_SETREF(high, PyNumber_Lshift(high, shift));
+        if (high != NULL) {
+            res = PyNumber_Add(high, low);
+        }
+    }
+    Py_XDECREF(high);
+    Py_XDECREF(low);
+    Py_XDECREF(shift);
+    return res;
+}
+
+static int
+int128_from_object(PyObject *obj, __int128 *res)
+{
+    long long value;
+    int overflow;
+
+    if (_compact_long_value(obj, &value)) {
+        *res = value;
+        return 0;
+    }
+    if (PyFloat_Check(obj)) {
+        PyErr_SetString(PyExc_TypeError, "integer argument expected, got float");
+        return -1;
+    }
+    value = PyLong_AsLongLongAndOverflow(obj, &overflow);
+    if (value == -1 && PyErr_Occurred()) {
+        return -1;
+    }
+    if (overflow == 0) {
+        *res = value;
+        return 0;
+    }
+
+    /* Splits the number into the high and the low 64 bits */
+    PyObject *num = PyNumber_Index(obj);
+    PyObject *mask = PyLong_FromUnsignedLongLong(ULLONG_MAX);
+    PyObject *shift = PyLong_FromLong(64);
+    PyObject *low_obj = NULL, *high_obj = NULL;
+    unsigned long long low = 0;
+    long long high = 0;
+    int ret = -1;
+
+    if (num != NULL && mask != NULL && shift != NULL
+        && (low_obj = PyNumber_And(num, mask)) != NULL
+        && (high_obj = PyNumber_Rshift(num, shift)) != NULL) {
+        low = PyLong_AsUnsignedLongLong(low_obj);
+        high = PyLong_AsLongLongAndOverflow(high_obj, &overflow);
+
+        if (!PyErr_Occurred()) {
+            if (overflow != 0) {
+                PyErr_SetString(PyExc_OverflowError, "Python int too large to convert to 128-bit integer");
+            } else {
+                *res = (__int128)(((unsigned __int128)(unsigned long long)high << 64) | low);
+                ret = 0;
+            }
+        }
+    }
+    Py_XDECREF(num);
+    Py_XDECREF(mask);
+    Py_XDECREF(shift);
+    Py_XDECREF(low_obj);
+    Py_XDECREF(high_obj);
+    return ret;
+}
+#endif
+
+/* Kinds of the pending operations stored in the internal nodes of lazy trees */
+enum LazyTag {
+    NoTag = 0,
+    AddTag,
+    AssignTag,
 };
+
+#if defined(_WIN32)
+    #define __builtin_saddll_overflow saddll_overflow
+    #define __builtin_smulll_overflow smulll_overflow
+
+    /*
+        msvc doesn't have builtin intrinsic function for safe integer addition,
+        thus we create our own.
+    */
+    inline bool saddll_overflow(long long a, long long b, long long *res) {
+        unsigned long long buf = 0;
+
+        if (a > 0 && b > 0) {
+            buf = a + b;
+
+            if (buf > LLONG_MAX) {
+                return true;
+            }
+        } else if (a < 0 && b < 0) {
+            buf = -a - b;
+
+            if (buf > -LLONG_MIN) {
+                return true;
+            }
+        }
+
+        *res = a + b;
+        return false;
+    }
+
+    /* The same goes for the safe integer multiplication */
+    inline bool smulll_overflow(long long a, long long b, long long *res) {
+        if (a != 0 && b != 0) {
+            bool overflow;
+
+            if (a > 0) {
+                overflow = b > 0 ? a > LLONG_MAX / b : b < LLONG_MIN / a;
+            } else {
+                overflow = b > 0 ? a < LLONG_MIN / b : b < LLONG_MAX / a;
+            }
+
+            if (overflow) {
+                return true;
+            }
+        }
+
+        *res = a * b;
+        return false;
+    }
+#endif
+
+#if defined(_MSC_VER)
+    #include <intrin.h>
+#endif
+
+/* Index of the highest set bit, x must be positive */
+static inline int
+floor_log2(unsigned long long x)
+{
+#if defined(_MSC_VER)
+    unsigned long index;
+    _BitScanReverse64(&index, x);
+    return (int)index;
+#else
+    return 63 - __builtin_clzll(x);
+#endif
+}
+
+/*
+    Node of the arena-allocated trees (dynamic and persistent), children are
+    referenced by their arena index. The 0-th node is the empty subtree.
+*/
+typedef struct {
+    long long value;
+    uint32_t left;
+    uint32_t right;
+} IntArenaNode;
+
+typedef struct {
+    double value;
+    uint32_t left;
+    uint32_t right;
+} FloatArenaNode;
+
+#define DYNAMIC_ROOT 1
+#define DYNAMIC_INITIAL_CAPACITY 64
+#define DYNAMIC_MAX_NODES ((Py_ssize_t)UINT32_MAX)
+#define DYNAMIC_MAX_DEPTH (8 * sizeof(Py_ssize_t))
+
+/* Greatest common divisor of the absolute values, it doesn't fit into long long only for 2^63 */
+static inline long long
+int_gcd(long long left, long long right, bool *overflow)
+{
+    unsigned long long a = left < 0 ? 0ULL - (unsigned long long)left : (unsigned long long)left;
+    unsigned long long b = right < 0 ? 0ULL - (unsigned long long)right : (unsigned long long)right;
+
+    while (b != 0) {
+        unsigned long long rem = a % b;
+        a = b;
+        b = rem;
+    }
+    if (a > LLONG_MAX) {
+        *overflow = true;
+    }
+    return (long long)a;
+}
+
+/* Product of the residues in [0, modulus) */
+static inline long long
+int_mulmod(long long left, long long right, long long modulus)
+{
+#ifdef HAVE_INT128
+    return (long long)((__int128)left * right % modulus);
+#else
+    /* Double-and-add, the intermediate sums are below 2 * modulus, so they fit into unsigned long long */
+    unsigned long long a = (unsigned long long)left, b = (unsigned long long)right;
+    unsigned long long m = (unsigned long long)modulus, res = 0;
+
+    while (b != 0) {
+        if (b & 1) {
+            res += a;
+            if (res >= m) {
+                res -= m;
+            }
+        }
+        a += a;
+        if (a >= m) {
+            a -= m;
+        }
+        b >>= 1;
+    }
+    return (long long)res;
+#endif
+}
+
+/* Residue of the value in [0, modulus), like the python `%` operator */
+static inline long long
+int_mod(long long value, long long modulus)
+{
+    long long res = value % modulus;
+    return res < 0 ? res + modulus : res;
+}
+
+/* Query function kernels shared by the trees */
+static inline long long
+int_identity(enum QueryFunc func)
+{
+    switch(func) {
+        case Sum:
+        case Gcd:
+        case Xor:
+        case Or:
+            return 0;
+        case Min:
+            return LLONG_MAX;
+        case Max:
+            return LLONG_MIN;
+        case Product:
+            return 1;
+        case And:
+            return -1;
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+static inline long long
+int_combine(enum QueryFunc func, long long left, long long right, bool *overflow)
+{
+    long long res = 0;
+
+    switch(func) {
+        case Sum:
+            if (__builtin_saddll_overflow(left, right, &res)) {
+                *overflow = true;
+            }
+            return res;
+        case Min:
+            return MIN(left, right);
+        case Max:
+            return MAX(left, right);
+        case Product:
+            if (__builtin_smulll_overflow(left, right, &res)) {
+                *overflow = true;
+            }
+            return res;
+        case Gcd:
+            return int_gcd(left, right, overflow);
+        case Xor:
+            return left ^ right;
+        case And:
+            return left & right;
+        case Or:
+            return left | right;
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+static inline double
+float_identity(enum QueryFunc func)
+{
+    switch(func) {
+        case Sum:
+            return 0;
+        case Min:
+            return Py_HUGE_VAL;
+        case Max:
+            return -Py_HUGE_VAL;
+        case Product:
+            return 1;
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+static inline double
+float_combine(enum QueryFunc func, double left, double right)
+{
+    switch(func) {
+        case Sum:
+            return left + right;
+        case Min:
+            return MIN(left, right);
+        case Max:
+            return MAX(left, right);
+        case Product:
+            return left * right;
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+/*
+    Returns the struct format character of a native 1-D buffer,
+    or 0 if the format has a non-native byte order or more than one item.
+*/
+static inline char
+buffer_format_char(const Py_buffer *view)
+{
+    const char *format = view->format;
+
+    if (format == NULL) {
+        return 'B';
+    }
+    if (format[0] == '@') {
+        format++;
+    }
+    if (format[0] == '\0' || format[1] != '\0') {
+        return 0;
+    }
+    return format[0];
+}
+
+static inline bool
+is_integer_format(char format)
+{
+    return format != 0 && strchr("bBhHiIlLqQnN", format) != NULL;
+}
+
+static inline bool
+is_float_format(char format)
+{
+    return format == 'f' || format == 'd';
+}
+
+/* Returns the pointer to i-th item of a (possibly strided) 1-D buffer */
+static inline const char *
+buffer_item_ptr(const Py_buffer *view, Py_ssize_t i)
+{
+    Py_ssize_t stride = view->strides != NULL ? view->strides[0] : view->itemsize;
+    return (const char *)view->buf + i * stride;
+}
+
+/*
+    Acquires a C-contiguous 1-D buffer of integers,
+    which is used to pass indices to the batch methods.
+*/
+static int
+get_integer_buffer(PyObject *obj, Py_buffer *view, const char *name)
+{
+    if (PyObject_GetBuffer(obj, view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) < 0) {
+        return -1;
+    }
+
+    if (view->ndim != 1 || !is_integer_format(buffer_format_char(view))) {
+        PyErr_Format(PyExc_TypeError, "'%s' must be a 1-D buffer of integers", name);
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+/*
+    Acquires a C-contiguous 1-D buffer of integers or floats,
+    which is used to pass values to the batch methods of float trees.
+*/
+static int
+get_number_buffer(PyObject *obj, Py_buffer *view, const char *name)
+{
+    if (PyObject_GetBuffer(obj, view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) < 0) {
+        return -1;
+    }
+
+    char format = buffer_format_char(view);
+    if (view->ndim != 1 || !(is_integer_format(format) || is_float_format(format))) {
+        PyErr_Format(PyExc_TypeError, "'%s' must be a 1-D buffer of numbers", name);
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+/*
+    Reads i-th element of an integer buffer.
+    Sets *overflow if an unsigned value doesn't fit into long long.
+*/
+static inline long long
+buffer_get_integer(const Py_buffer *view, Py_ssize_t i, int *overflow)
+{
+    const char *ptr = buffer_item_ptr(view, i);
+
+    switch (buffer_format_char(view)) {
+        case 'b':
+            return *(const signed char *)ptr;
+        case 'B':
+            return *(const unsigned char *)ptr;
+        case 'h':
+            return *(const short *)ptr;
+        case 'H':
+            return *(const unsigned short *)ptr;
+        case 'i':
+            return *(const int *)ptr;
+        case 'I':
+            return *(const unsigned int *)ptr;
+        case 'l':
+            return *(const long *)ptr;
+        case 'q':
+            return *(const long long *)ptr;
+        case 'n':
+            return *(const Py_ssize_t *)ptr;
+        case 'L':
+        case 'Q':
+        case 'N': {
+            unsigned long long value;
+
+            if (view->itemsize == sizeof(unsigned long)) {
+                value = *(const unsigned long *)ptr;
+            } else if (view->itemsize == sizeof(size_t)) {
+                value = *(const size_t *)ptr;
+            } else {
+                value = *(const unsigned long long *)ptr;
+            }
+
+            if (value > LLONG_MAX) {
+                *overflow = 1;
+                return LLONG_MAX;
+            }
+            return (long long)value;
+        }
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+/*
+    Reads i-th element of an integer buffer as unsigned.
+    Sets *overflow if the value is negative.
+*/
+static inline unsigned long long
+buffer_get_unsigned(const Py_buffer *view, Py_ssize_t i, int *overflow)
+{
+    const char *ptr = buffer_item_ptr(view, i);
+
+    switch (buffer_format_char(view)) {
+        case 'L':
+        case 'Q':
+        case 'N':
+            if (view->itemsize == sizeof(unsigned long)) {
+                return *(const unsigned long *)ptr;
+            } else if (view->itemsize == sizeof(size_t)) {
+                return *(const size_t *)ptr;
+            }
+            return *(const unsigned long long *)ptr;
+        default: {
+            long long value = buffer_get_integer(view, i, overflow);
+
+            if (value < 0) {
+                *overflow = 1;
+                return 0;
+            }
+            return (unsigned long long)value;
+        }
+    }
+}
+
+/* Reads i-th element of an integer or float buffer. */
+static inline double
+buffer_get_double(const Py_buffer *view, Py_ssize_t i)
+{
+    const char *ptr = buffer_item_ptr(view, i);
+
+    switch (buffer_format_char(view)) {
+        case 'f':
+            return *(const float *)ptr;
+        case 'd':
+            return *(const double *)ptr;
+        case 'L':
+        case 'Q':
+        case 'N':
+            if (view->itemsize == sizeof(unsigned long)) {
+                return (double)*(const unsigned long *)ptr;
+            } else if (view->itemsize == sizeof(size_t)) {
+                return (double)*(const size_t *)ptr;
+            }
+            return (double)*(const unsigned long long *)ptr;
+        default: {
+            int overflow = 0;
+            return (double)buffer_get_integer(view, i, &overflow);
+        }
+    }
+}
+
+/*
+    Acquires a 1-D (possibly strided) buffer of numbers used as a tree source.
+    Float items are accepted only if `allow_float` is set.
+*/
+static int
+get_source_buffer(PyObject *obj, Py_buffer *view, bool allow_float)
+{
+    if (PyObject_GetBuffer(obj, view, PyBUF_FORMAT | PyBUF_STRIDES) < 0) {
+        return -1;
+    }
+
+    char format = buffer_format_char(view);
+    if (view->ndim != 1 || !(is_integer_format(format) || (allow_float && is_float_format(format)))) {
+        PyErr_SetString(PyExc_TypeError,
+                        allow_float ? "'source' must be a 1-D buffer of numbers"
+                                    : "'source' must be a 1-D buffer of integers");
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+/*
+    Copies `count` items of `itemsize` bytes from a (possibly strided) buffer.
+    Contiguous buffers are copied with a single memcpy.
+*/
+static void
+buffer_copy_items(const Py_buffer *view, void *dest, Py_ssize_t count)
+{
+    Py_ssize_t itemsize = view->itemsize;
+
+    if (view->strides == NULL || view->strides[0] == itemsize) {
+        memcpy(dest, view->buf, itemsize * count);
+        return;
+    }
+
+    for (Py_ssize_t i = 0; i < count; i++) {
+        memcpy((char *)dest + i * itemsize, buffer_item_ptr(view, i), itemsize);
+    }
+}
+
+/* Two nodes per level at most */
+#define CANONICAL_NODES_MAX (2 * 8 * sizeof(Py_ssize_t))
+
+/*
+    Decomposes the interval [left, right) of a bottom-up tree with the leaves
+    located at [offset, 2 * offset) into the canonical nodes used by queries.
+    Nodes are listed in the left to right order, the number of nodes is returned.
+    Every canonical node is a root of a perfect subtree: all its leaves lie
+    within the interval, so descending into children keeps the range contiguous.
+*/
+static int
+canonical_nodes(Py_ssize_t left, Py_ssize_t right, Py_ssize_t offset, Py_ssize_t *nodes)
+{
+    Py_ssize_t right_nodes[CANONICAL_NODES_MAX / 2];
+    int count = 0, right_count = 0;
+
+    left += offset;
+    right += offset;
+
+    while (left < right) {
+        if (left & 1) {
+            nodes[count++] = left++;
+        }
+        if (right & 1) {
+            right_nodes[right_count++] = --right;
+        }
+        left >>= 1;
+        right >>= 1;
+    }
+
+    while (right_count > 0) {
+        nodes[count++] = right_nodes[--right_count];
+    }
+    return count;
+}
+
+/* Source of the tree elements: either a list or a 1-D buffer */
+typedef struct {
+    PyObject *list;
+    Py_buffer view;
+    Py_ssize_t size;
+    /* Set if the list is collected from the iterable by `tree_source_open_iterable` */
+    bool owned;
+} TreeSource;
+
+static int
+tree_source_open(TreeSource *src, PyObject *source, bool allow_float)
+{
+    if (PyObject_CheckBuffer(source)) {
+        if (get_source_buffer(source, &src->view, allow_float) < 0) {
+            return -1;
+        }
+        src->list = NULL;
+        src->size = src->view.shape[0];
+        src->owned = false;
+        return 0;
+    }
+
+    if (!PyList_Check(source)) {
+        PyErr_Format(PyExc_TypeError, "'source' must be a list or a buffer, not %.200s",
+                     Py_TYPE(source)->tp_name);
+        return -1;
+    }
+    src->size = PyList_GET_SIZE(source);
+    src->list = source;
+    src->owned = false;
+    return 0;
+}
+
+/* Same as `tree_source_open`, but other iterables are collected into the list first */
+static int
+tree_source_open_iterable(TreeSource *src, PyObject *source, bool allow_float)
+{
+    if (PyList_Check(source) || PyObject_CheckBuffer(source)) {
+        return tree_source_open(src, source, allow_float);
+    }
+
+    PyObject *list = PySequence_List(source);
+    if (list == NULL) {
+        return -1;
+    }
+    tree_source_open(src, list, allow_float);
+    src->owned = true;
+    return 0;
+}
+
+static void
+tree_source_close(TreeSource *src)
+{
+    if (src->list == NULL) {
+        PyBuffer_Release(&src->view);
+    } else if (src->owned) {
+        Py_DECREF(src->list);
+    }
+}
+
+/*
+    Fills in `src->size` integers from the source.
+    Buffers of 64-bit integers (array.array, NumPy arrays, mmap, ...)
+    are copied without creating any intermediate python objects.
+*/
+static int
+tree_source_read_ints(TreeSource *src, long long *dest)
+{
+    if (src->list == NULL) {
+        char format = buffer_format_char(&src->view);
+
+        if (src->view.itemsize == sizeof(long long) && (format == 'q' || format == 'l')) {
+            buffer_copy_items(&src->view, dest, src->size);
+            return 0;
+        }
+
+        for (Py_ssize_t i = 0; i < src->size; i++) {
+            int overflow = 0;
+            long long val = buffer_get_integer(&src->view, i, &overflow);
+
+            if (overflow != 0) {
+                PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+                return -1;
+            }
+            dest[i] = val;
+        }
+        return 0;
+    }
+
+    for (Py_ssize_t i = 0; i < src->size; i++) {
+        PyObject *item = PyList_GetItem(src->list, i);
+
+        int overflow;
+        long long val = PyLong_AsLongLongAndOverflow(item, &overflow);
+
+        if (overflow != 0) {
+            PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+            return -1;
+        }
+        if (val == -1 && PyErr_Occurred()) {
+            return -1;
+        }
+        dest[i] = val;
+    }
+    return 0;
+}
+
+/* Same as `tree_source_read_ints`, but for doubles */
+static int
+tree_source_read_doubles(TreeSource *src, double *dest)
+{
+    if (src->list == NULL) {
+        if (buffer_format_char(&src->view) == 'd') {
+            buffer_copy_items(&src->view, dest, src->size);
+            return 0;
+        }
+
+        for (Py_ssize_t i = 0; i < src->size; i++) {
+            dest[i] = buffer_get_double(&src->view, i);
+        }
+        return 0;
+    }
+
+    for (Py_ssize_t i = 0; i < src->size; i++) {
+        PyObject *item = PyList_GetItem(src->list, i);
+        double val = PyFloat_AsDouble(item);
+
+        if (val == -1.0 && PyErr_Occurred()) {
+            return -1;
+        }
+        dest[i] = val;
+    }
+    return 0;
+}
+
+static int
+_compare_nodes_desc(const void *a, const void *b)
+{
+    Py_ssize_t left = *(const Py_ssize_t *)a;
+    Py_ssize_t right = *(const Py_ssize_t *)b;
+    return (left < right) - (left > right);
+}
+
+/*
+    Collects the dirty nodes of a batch update.
+
+    `nodes` holds `count` leaf positions. They are sorted in descending order
+    and deduplicated, the function returns the number of unique positions.
+    Afterwards the array is used as a circular queue by `dirty_queue_next`:
+    since parents always have smaller indices than their children, popping
+    the nodes in descending order guarantees, that every dirty ancestor
+    is recomputed exactly once and only after all of its dirty children.
+*/
+static Py_ssize_t
+dirty_queue_init(Py_ssize_t *nodes, Py_ssize_t count)
+{
+    if (count == 0) {
+        return 0;
+    }
+
+    qsort(nodes, count, sizeof(Py_ssize_t), _compare_nodes_desc);
+
+    Py_ssize_t unique = 1;
+    for (Py_ssize_t i = 1; i < count; i++) {
+        if (nodes[i] != nodes[unique - 1]) {
+            nodes[unique++] = nodes[i];
+        }
+    }
+    return unique;
+}
+
+typedef struct {
+    Py_ssize_t *nodes;
+    Py_ssize_t capacity;
+    Py_ssize_t head;
+    Py_ssize_t length;
+} DirtyQueue;
+
+/* Pops the next dirty node and schedules its parent, returns 0 when empty */
+static inline Py_ssize_t
+dirty_queue_next(DirtyQueue *queue)
+{
+    if (queue->length == 0) {
+        return 0;
+    }
+
+    Py_ssize_t node = queue->nodes[queue->head];
+    queue->head = (queue->head + 1) % queue->capacity;
+    queue->length--;
+
+    Py_ssize_t parent = node >> 1;
+    Py_ssize_t tail = (queue->head + queue->length - 1) % queue->capacity;
+
+    if (parent > 0 && (queue->length == 0 || queue->nodes[tail] != parent)) {
+        queue->nodes[(queue->head + queue->length) % queue->capacity] = parent;
+        queue->length++;
+    }
+    return node;
+}
+
+/*
+    Acquires a writable C-contiguous 1-D output buffer,
+    which must hold exactly `size` items of the `format` type.
+*/
+static int
+get_output_buffer(PyObject *obj, Py_buffer *view, char format, Py_ssize_t size)
+{
+    if (PyObject_GetBuffer(obj, view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS | PyBUF_WRITABLE) < 0) {
+        return -1;
+    }
+
+    char view_format = buffer_format_char(view);
+    bool compatible = (
+        view_format == format
+        || (format == 'q' && view_format == 'l' && view->itemsize == sizeof(long long))
+    );
+
+    if (view->ndim != 1 || !compatible) {
+        PyErr_Format(PyExc_TypeError, "'out' must be a 1-D buffer of '%c' items", format);
+        PyBuffer_Release(view);
+        return -1;
+    }
+
+    if (view->shape[0] != size) {
+        PyErr_Format(PyExc_ValueError, "'out' must have exactly %zd items", size);
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+/* Creates a zero-filled `array.array` of the specified typecode and length. */
+static PyObject *
+new_typed_array(char typecode, Py_ssize_t itemsize, Py_ssize_t size)
+{
+    PyObject *array_module = PyImport_ImportModule("array");
+    if (array_module == NULL) {
+        return NULL;
+    }
+
+    PyObject *zeros = PyBytes_FromStringAndSize(NULL, itemsize * size);
+    if (zeros == NULL) {
+        Py_DECREF(array_module);
+        return NULL;
+    }
+    memset(PyBytes_AS_STRING(zeros), 0, itemsize * size);
+
+    PyObject *res = PyObject_CallMethod(array_module, "array", "CO", typecode, zeros);
+    Py_DECREF(zeros);
+    Py_DECREF(array_module);
+    return res;
+}
+
+/*
+    Aggregates kept by the multi-aggregate trees: bit `func - Sum` of the mask
+    is set if the node array of that function is kept.
+*/
+#define MULTI_FUNCS 3
+#define MULTI_ALL ((1u << MULTI_FUNCS) - 1)
+
+/*
+    Parses the sequence of the aggregate names into the mask, None means `allowed`.
+    'count' is accepted too, it's calculated from the interval bounds.
+*/
+static int
+multi_funcs_parse(PyObject *funcs, unsigned int allowed, unsigned int *mask)
+{
+    if (funcs == NULL || funcs == Py_None) {
+        *mask = allowed;
+        return 0;
+    }
+    if (PyUnicode_Check(funcs)) {
+        PyErr_SetString(PyExc_TypeError, "'funcs' must be a sequence of the function names, not str");
+        return -1;
+    }
+
+    PyObject *seq = PySequence_Fast(funcs, "'funcs' must be a sequence of the function names");
+    if (seq == NULL) {
+        return -1;
+    }
+
+    *mask = 0;
+    for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(seq); i++) {
+        PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+        const char *name = PyUnicode_Check(item) ? PyUnicode_AsUTF8(item) : NULL;
+        int func = Sum;
+
+        if (name == NULL) {
+            if (!PyErr_Occurred()) {
+                PyErr_SetString(PyExc_TypeError, "'funcs' must be a sequence of the function names");
+            }
+            Py_DECREF(seq);
+            return -1;
+        }
+        if (strcmp(name, "count") == 0) {
+            continue;
+        }
+        while (func < Sum + MULTI_FUNCS && strcmp(name, query_func_names[func]) != 0) {
+            func++;
+        }
+        if (func == Sum + MULTI_FUNCS) {
+            PyErr_Format(PyExc_ValueError, "Invalid aggregate '%s', must be 'sum', 'min', 'max' or 'count'", name);
+            Py_DECREF(seq);
+            return -1;
+        }
+        if (!(allowed & (1u << (func - Sum)))) {
+            PyErr_Format(PyExc_ValueError, "Aggregate '%s' isn't kept by the tree", name);
+            Py_DECREF(seq);
+            return -1;
+        }
+        *mask |= 1u << (func - Sum);
+    }
+    Py_DECREF(seq);
+    return 0;
+}
+
+/* Tuple of the aggregate names in the mask, in the order of the fields of Aggregates */
+static PyObject *
+multi_funcs_names(unsigned int mask)
+{
+    PyObject *res = PyTuple_New(0);
+
+    for (int f = 0; f < MULTI_FUNCS && res != NULL; f++) {
+        if (mask & (1u << f)) {
+            PyObject *name = PyUnicode_FromString(query_func_names[Sum + f]);
+            if (name == NULL || _PyTuple_Resize(&res, PyTuple_GET_SIZE(res) + 1) < 0) {
+                Py_XDECREF(name);
+                Py_XDECREF(res);
+                return NULL;
+            }
+            PyTuple_SET_ITEM(res, PyTuple_GET_SIZE(res) - 1, name);
+        }
+    }
+    return res;
+}
+
+static PyStructSequence_Field aggregates_fields[] = {
+    {"sum", "Sum of the interval, None if it isn't requested"},
+    {"min", "Minimum of the interval, None if it isn't requested"},
+    {"max", "Maximum of the interval, None if it isn't requested"},
+    {"count", "Number of the elements in the interval"},
+    {NULL},
+};
+
+static PyStructSequence_Desc aggregates_desc = {
+    "pysegmenttree.c_extensions.Aggregates",
+    "Results of the multi-aggregate tree query",
+    aggregates_fields,
+    4,
+};
+
+/* Initialized by the module */
+static PyTypeObject aggregates_type;
+
+/* Creates Aggregates, steals the references to `values`, NULL items are replaced with None */
+static PyObject *
+aggregates_new(PyObject *values[MULTI_FUNCS], Py_ssize_t count)
+{
+    PyObject *res = PyStructSequence_New(&aggregates_type);
+    PyObject *count_obj = PyLong_FromSsize_t(count);
+
+    if (res == NULL || count_obj == NULL) {
+        for (int f = 0; f < MULTI_FUNCS; f++) {
+            Py_XDECREF(values[f]);
+        }
+        Py_XDECREF(count_obj);
+        Py_XDECREF(res);
+        return NULL;
+    }
+
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        if (values[f] == NULL) {
+            Py_INCREF(Py_None);
+            values[f] = Py_None;
+        }
+        PyStructSequence_SET_ITEM(res, f, values[f]);
+    }
+    PyStructSequence_SET_ITEM(res, MULTI_FUNCS, count_obj);
+    return res;
+}
+
+#endif /* PYSEGMENTTREE_COMMON_H */
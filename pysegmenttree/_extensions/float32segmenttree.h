@@ -0,0 +1,11 @@
+/* Segment tree with 32-bit float items, see typedsegmenttree.h */
+#define TYPED_NAME "Float32SegmentTree"
+#define TYPED_PREFIX float32segmenttree
+#define TYPED_T float
+#define TYPED_ACC double
+#define TYPED_FORMAT "f"
+#define TYPED_KIND TYPED_FLOAT
+#define TYPED_MIN -Py_HUGE_VAL
+#define TYPED_MAX Py_HUGE_VAL
+#define TYPED_FINITE_MAX FLT_MAX
+#include "typedsegmenttree.h"
@@ -0,0 +1,413 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Dynamic (implicit-node) segment tree over the [0, size) index space.
+
+    Nodes are created on the first update of the covered interval and are taken
+    from the arena, which grows by doubling, so the memory is proportional to
+    the number of touched leaves times Log[size]. Children are referenced by
+    their arena index, the 0-th node is the shared empty subtree holding
+    the identity element of the query function.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    FloatArenaNode *nodes;
+    Py_ssize_t count;
+    Py_ssize_t capacity;
+    enum QueryFunc func;
+} FloatDynamicSegmentTreeObject;
+
+static void
+floatdynamicsegmenttree_dealloc(FloatDynamicSegmentTreeObject* self)
+{
+    free(self->nodes);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+floatdynamicsegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    FloatDynamicSegmentTreeObject *self;
+
+    self = (FloatDynamicSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+        self->count = 0;
+        self->capacity = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+/* Takes the empty node from the arena, returns 0 on failure */
+static uint32_t
+_floatdynamicsegmenttree_alloc(FloatDynamicSegmentTreeObject *self)
+{
+    if (self->count == self->capacity) {
+        Py_ssize_t capacity = self->capacity * 2;
+        if (capacity > DYNAMIC_MAX_NODES) {
+            capacity = DYNAMIC_MAX_NODES;
+        }
+        if (capacity <= self->count) {
+            PyErr_SetString(PyExc_MemoryError, "FloatDynamicSegmentTree node limit is reached");
+            return 0;
+        }
+
+        FloatArenaNode *nodes = (FloatArenaNode*) realloc(self->nodes, sizeof(FloatArenaNode) * capacity);
+        if (nodes == NULL) {
+            PyErr_NoMemory();
+            return 0;
+        }
+        self->nodes = nodes;
+        self->capacity = capacity;
+    }
+
+    FloatArenaNode *node = &self->nodes[self->count];
+    node->value = float_identity(self->func);
+    node->left = node->right = 0;
+    return (uint32_t)self->count++;
+}
+
+static int
+_floatdynamicsegmenttree_reset(FloatDynamicSegmentTreeObject *self, Py_ssize_t size)
+{
+    FloatArenaNode *nodes = (FloatArenaNode*) malloc(sizeof(FloatArenaNode) * DYNAMIC_INITIAL_CAPACITY);
+    if (nodes == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->nodes);
+    self->nodes = nodes;
+    self->capacity = DYNAMIC_INITIAL_CAPACITY;
+    self->count = 0;
+
+    /* The empty subtree and the root */
+    _floatdynamicsegmenttree_alloc(self);
+    _floatdynamicsegmenttree_alloc(self);
+    self->size = size;
+    return 0;
+}
+
+/*
+    Sets i-th element to value, creating the missing nodes on the path.
+*/
+static int
+_floatdynamicsegmenttree_update(FloatDynamicSegmentTreeObject *self, Py_ssize_t i, double value)
+{
+    uint32_t path[DYNAMIC_MAX_DEPTH + 1];
+    bool to_left[DYNAMIC_MAX_DEPTH + 1];
+    double values[DYNAMIC_MAX_DEPTH + 1];
+    int depth = 0;
+    Py_ssize_t lo = 0, hi = self->size;
+
+    path[0] = DYNAMIC_ROOT;
+    while (hi - lo > 1) {
+        Py_ssize_t mid = lo + (hi - lo) / 2;
+        uint32_t child;
+
+        to_left[depth] = i < mid;
+        child = to_left[depth] ? self->nodes[path[depth]].left : self->nodes[path[depth]].right;
+        if (child == 0) {
+            child = _floatdynamicsegmenttree_alloc(self);
+            if (child == 0) {
+                return -1;
+            }
+            if (to_left[depth]) {
+                self->nodes[path[depth]].left = child;
+            } else {
+                self->nodes[path[depth]].right = child;
+            }
+        }
+
+        if (to_left[depth]) {
+            hi = mid;
+        } else {
+            lo = mid;
+        }
+        path[++depth] = child;
+    }
+
+    values[depth] = value;
+    for (int k = depth - 1; k >= 0; k--) {
+        FloatArenaNode *node = &self->nodes[path[k]];
+
+        values[k] = to_left[k]
+            ? float_combine(self->func, values[k + 1], self->nodes[node->right].value)
+            : float_combine(self->func, self->nodes[node->left].value, values[k + 1]);
+    }
+    for (int k = 0; k <= depth; k++) {
+        self->nodes[path[k]].value = values[k];
+    }
+    return 0;
+}
+
+/* Result of the [left, right) query in the subtree of the node covering [lo, hi) */
+static double
+_floatdynamicsegmenttree_query(FloatDynamicSegmentTreeObject *self, uint32_t k, Py_ssize_t lo,
+                             Py_ssize_t hi, Py_ssize_t left, Py_ssize_t right)
+{
+    if (k == 0 || (left <= lo && hi <= right)) {
+        return self->nodes[k].value;
+    }
+
+    Py_ssize_t mid = lo + (hi - lo) / 2;
+    double res = float_identity(self->func);
+
+    if (left < mid) {
+        res = _floatdynamicsegmenttree_query(self, self->nodes[k].left, lo, mid, left, right);
+    }
+    if (right > mid) {
+        res = float_combine(
+            self->func, res, _floatdynamicsegmenttree_query(self, self->nodes[k].right, mid, hi, left, right)
+        );
+    }
+    return res;
+}
+
+/* Applies the updates of the {index: value} mapping */
+static int
+_floatdynamicsegmenttree_update_mapping(FloatDynamicSegmentTreeObject *self, PyObject *source)
+{
+    PyObject *items = PyMapping_Items(source);
+    if (items == NULL) {
+        return -1;
+    }
+    Py_SETREF(items, PySequence_Fast(items, "'source' items must be a sequence"));
+    if (items == NULL) {
+        return -1;
+    }
+
+    for (Py_ssize_t j = 0; j < PySequence_Fast_GET_SIZE(items); j++) {
+        PyObject *item = PySequence_Fast_GET_ITEM(items, j);
+        Py_ssize_t i;
+        double value;
+
+        if (!PyTuple_Check(item) || PyTuple_GET_SIZE(item) != 2) {
+            PyErr_SetString(PyExc_TypeError, "'source' items must be (index, value) pairs");
+            Py_DECREF(items);
+            return -1;
+        }
+        if (ssize_from_object(PyTuple_GET_ITEM(item, 0), &i) < 0
+            || double_from_object(PyTuple_GET_ITEM(item, 1), &value) < 0) {
+            Py_DECREF(items);
+            return -1;
+        }
+        if (i > self->size - 1 || i < 0) {
+            PyErr_SetString(PyExc_IndexError, "FloatDynamicSegmentTree index out of range");
+            Py_DECREF(items);
+            return -1;
+        }
+        if (_floatdynamicsegmenttree_update(self, i, value) < 0) {
+            Py_DECREF(items);
+            return -1;
+        }
+    }
+
+    Py_DECREF(items);
+    return 0;
+}
+
+static int
+floatdynamicsegmenttree_init(FloatDynamicSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"size", "func", "source", NULL};
+    Py_ssize_t size;
+    char* func = NULL;
+    PyObject *source = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "n|zO", kwlist,
+                                     &size, &func, &source))
+        return -1;
+
+    if (size < 0) {
+        PyErr_SetString(PyExc_ValueError, "'size' must be non-negative");
+        return -1;
+    }
+
+    enum QueryFunc query_func;
+    if (query_func_parse(func, FLOAT_QUERY_FUNC_MAX, &query_func) < 0) {
+        return -1;
+    }
+
+    if (source != NULL && source != Py_None && !PyObject_HasAttrString(source, "items")) {
+        PyErr_SetString(PyExc_TypeError, "'source' must be a mapping of indices to values");
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    self->func = query_func;
+    res = _floatdynamicsegmenttree_reset(self, size);
+    if (res == 0 && source != NULL && source != Py_None) {
+        res = _floatdynamicsegmenttree_update_mapping(self, source);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+floatdynamicsegmenttree_mp_len(FloatDynamicSegmentTreeObject *self)
+{
+    return self->size;
+}
+
+static PyObject *
+floatdynamicsegmenttree_query(FloatDynamicSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    double res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        res = _floatdynamicsegmenttree_query(self, DYNAMIC_ROOT, 0, self->size, left, right);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatDynamicSegmentTree index out of range");
+        return NULL;
+    }
+    return PyFloat_FromDouble(res);
+}
+
+static PyObject *
+floatdynamicsegmenttree_update(FloatDynamicSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    double value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || double_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "FloatDynamicSegmentTree index out of range");
+        return NULL;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatdynamicsegmenttree_update(self, i, value);
+    Py_END_CRITICAL_SECTION();
+    if (res < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+floatdynamicsegmenttree_sizeof(FloatDynamicSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return PyLong_FromSsize_t(Py_TYPE(self)->tp_basicsize + self->capacity * sizeof(FloatArenaNode));
+}
+
+/* `tree[i]` descends to the leaf, the untouched ones hold the identity of func */
+static PyObject *
+floatdynamicsegmenttree_sq_item(FloatDynamicSegmentTreeObject *self, Py_ssize_t i)
+{
+    double res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        res = _floatdynamicsegmenttree_query(self, DYNAMIC_ROOT, 0, self->size, i, i + 1);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatDynamicSegmentTree index out of range");
+        return NULL;
+    }
+    return PyFloat_FromDouble(res);
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+floatdynamicsegmenttree_sq_ass_item(FloatDynamicSegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    double item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("FloatDynamicSegmentTree");
+    }
+    if (double_from_object(value, &item) < 0) {
+        return -1;
+    }
+
+    int res = -1;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (i < 0 || i >= self->size) {
+        PyErr_SetString(PyExc_IndexError, "FloatDynamicSegmentTree index out of range");
+    } else {
+        res = _floatdynamicsegmenttree_update(self, i, item);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyMappingMethods floatdynamicsegmenttree_mapping = {
+    .mp_length = (lenfunc)floatdynamicsegmenttree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods floatdynamicsegmenttree_sequence = {
+    .sq_length = (lenfunc)floatdynamicsegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)floatdynamicsegmenttree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)floatdynamicsegmenttree_sq_ass_item,
+};
+
+static PyMemberDef floatdynamicsegmenttree_members[] = {
+    {"node_count", T_PYSSIZET, offsetof(FloatDynamicSegmentTreeObject, count), READONLY,
+    "Number of the allocated nodes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef floatdynamicsegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) floatdynamicsegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Perform query on the [start, end) interval"},
+    {"update", (PyCFunction)(void(*)(void)) floatdynamicsegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Set element with index 'i' to 'value'"},
+    {"__sizeof__", (PyCFunction) floatdynamicsegmenttree_sizeof, METH_NOARGS,
+    "Size of the tree in memory, in bytes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject floatdynamicsegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.FloatDynamicSegmentTree",
+    sizeof(FloatDynamicSegmentTreeObject),
+    .tp_dealloc = (destructor)floatdynamicsegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "FloatDynamicSegmentTree",
+    .tp_as_mapping = &floatdynamicsegmenttree_mapping,
+    .tp_as_sequence = &floatdynamicsegmenttree_sequence,
+    .tp_members = floatdynamicsegmenttree_members,
+    .tp_methods = floatdynamicsegmenttree_methods,
+    .tp_init = (initproc)floatdynamicsegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = floatdynamicsegmenttree_new,
+};
@@ -0,0 +1,342 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Fenwick tree (binary indexed tree), supports only the sum queries.
+
+    The tree takes N + 1 items instead of 2 * N: node k (1-based) holds the sum
+    of the elements (k - lowbit(k), k], the 0-th node is unused.
+    Element values aren't stored, update restores the old value from the nodes,
+    so the result of a query may differ from the direct sum by a rounding error.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    double *tree;
+} FloatFenwickTreeObject;
+
+#ifndef LOWBIT
+#define LOWBIT(k) ((k) & -(k))
+#endif
+
+static void
+floatfenwicktree_dealloc(FloatFenwickTreeObject* self)
+{
+    free(self->tree);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+floatfenwicktree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    FloatFenwickTreeObject *self;
+
+    self = (FloatFenwickTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static int
+_floatfenwicktree_build(FloatFenwickTreeObject *self, PyObject *source)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, true) < 0) {
+        return -1;
+    }
+
+    double *tree = (double*) malloc(sizeof(double) * (src.size + 1));
+    if (tree == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->tree);
+    self->tree = tree;
+    self->size = 0;
+    self->tree[0] = 0;
+
+    int res = tree_source_read_doubles(&src, self->tree + 1);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+
+    /* O(N) build: every node pushes its sum to the parent */
+    for (Py_ssize_t k = 1; k <= src.size; k++) {
+        Py_ssize_t parent = k + LOWBIT(k);
+
+        if (parent <= src.size) {
+            self->tree[parent] += self->tree[k];
+        }
+    }
+    self->size = src.size;
+    return 0;
+}
+
+static int
+floatfenwicktree_init(FloatFenwickTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|s", kwlist,
+                                     &source, &func))
+        return -1;
+
+    if (func != NULL && strcmp(func, "sum") != 0) {
+        PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, FloatFenwickTree supports only 'sum'");
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatfenwicktree_build(self, source);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+floatfenwicktree_mp_len(FloatFenwickTreeObject *self)
+{
+    return self->size;
+}
+
+/* Sum of the first `count` elements */
+static inline double
+_floatfenwicktree_prefix(FloatFenwickTreeObject *self, Py_ssize_t count)
+{
+    double res = 0;
+
+    for (Py_ssize_t k = count; k > 0; k -= LOWBIT(k)) {
+        res += self->tree[k];
+    }
+    return res;
+}
+
+/* Restores the element from the nodes in O(Log[N]) */
+static double
+_floatfenwicktree_get(FloatFenwickTreeObject *self, Py_ssize_t i)
+{
+    Py_ssize_t k = i + 1;
+    Py_ssize_t stop = k - LOWBIT(k);
+    double res = self->tree[k];
+
+    for (k--; k > stop; k -= LOWBIT(k)) {
+        res -= self->tree[k];
+    }
+    return res;
+}
+
+/* Adds delta to the element */
+static PyObject *
+_floatfenwicktree_add(FloatFenwickTreeObject *self, Py_ssize_t i, double delta, bool set)
+{
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "FloatFenwickTree index out of range");
+        return NULL;
+    }
+
+    if (set) {
+        /* delta holds the new value here */
+        delta -= _floatfenwicktree_get(self, i);
+    }
+
+    for (Py_ssize_t k = i + 1; k <= self->size; k += LOWBIT(k)) {
+        self->tree[k] += delta;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+floatfenwicktree_query(FloatFenwickTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    double res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        res = _floatfenwicktree_prefix(self, right) - _floatfenwicktree_prefix(self, left);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatFenwickTree index out of range");
+        return NULL;
+    }
+    return PyFloat_FromDouble(res);
+}
+
+static PyObject *
+floatfenwicktree_update(FloatFenwickTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    double value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || double_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatfenwicktree_add(self, i, value, true);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyObject *
+floatfenwicktree_add(FloatFenwickTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "delta"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    double delta;
+
+    if (fastcall_unpack("add", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || double_from_object(argv[1], &delta) < 0)
+        return NULL;
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatfenwicktree_add(self, i, delta, false);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+/*
+    Finds the smallest index i, such that the sum of the elements [0, i] is not less than value.
+    Descends from the highest power of two, so it takes O(Log[N]) time.
+    Elements must be non-negative, otherwise the prefix sums aren't monotone.
+*/
+static PyObject *
+floatfenwicktree_lower_bound(FloatFenwickTreeObject *self, PyObject *arg)
+{
+    double value;
+
+    if (double_from_object(arg, &value) < 0) {
+        return NULL;
+    }
+
+    Py_ssize_t pos = 0;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    Py_ssize_t step = 1;
+    while (step <= self->size / 2) {
+        step <<= 1;
+    }
+
+    double rest = value;
+
+    for (; step > 0 && self->size > 0; step >>= 1) {
+        Py_ssize_t next = pos + step;
+
+        if (next <= self->size && self->tree[next] < rest) {
+            pos = next;
+            rest -= self->tree[next];
+        }
+    }
+    Py_END_CRITICAL_SECTION();
+    return PyLong_FromSsize_t(pos);
+}
+
+/* `tree[i]` restores the element from the nodes in O(Log[N]) */
+static PyObject *
+floatfenwicktree_sq_item(FloatFenwickTreeObject *self, Py_ssize_t i)
+{
+    double res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        res = _floatfenwicktree_get(self, i);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatFenwickTree index out of range");
+        return NULL;
+    }
+    return PyFloat_FromDouble(res);
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+floatfenwicktree_sq_ass_item(FloatFenwickTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    double item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("FloatFenwickTree");
+    }
+    if (double_from_object(value, &item) < 0) {
+        return -1;
+    }
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatfenwicktree_add(self, i, item, true);
+    Py_END_CRITICAL_SECTION();
+    return sequence_status(res);
+}
+
+static PyMappingMethods floatfenwicktree_mapping = {
+    .mp_length = (lenfunc)floatfenwicktree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods floatfenwicktree_sequence = {
+    .sq_length = (lenfunc)floatfenwicktree_mp_len,
+    .sq_item = (ssizeargfunc)floatfenwicktree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)floatfenwicktree_sq_ass_item,
+};
+
+static PyMethodDef floatfenwicktree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) floatfenwicktree_query, METH_FASTCALL_KEYWORDS,
+    "Perform sum query on the [start, end) interval"},
+    {"update", (PyCFunction)(void(*)(void)) floatfenwicktree_update, METH_FASTCALL_KEYWORDS,
+    "Set element with index 'i' to 'value'"},
+    {"add", (PyCFunction)(void(*)(void)) floatfenwicktree_add, METH_FASTCALL_KEYWORDS,
+    "Add 'delta' to the element with index 'i'"},
+    {"lower_bound", (PyCFunction) floatfenwicktree_lower_bound, METH_O,
+    "Find the first index where the prefix sum reaches 'value'"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject floatfenwicktree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.FloatFenwickTree",
+    sizeof(FloatFenwickTreeObject),
+    .tp_dealloc = (destructor)floatfenwicktree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "FloatFenwickTree",
+    .tp_as_mapping = &floatfenwicktree_mapping,
+    .tp_as_sequence = &floatfenwicktree_sequence,
+    .tp_methods = floatfenwicktree_methods,
+    .tp_init = (initproc)floatfenwicktree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = floatfenwicktree_new,
+};
@@ -0,0 +1,462 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Segment tree with lazy propagation.
+
+    Unlike FloatSegmentTree the number of leaves is rounded up to the power of two
+    (capacity), so every internal node covers a contiguous range of 2^k leaves.
+    The padding leaves hold the identity element of the query function.
+    Internal nodes store a pending operation (tag) which hasn't been applied
+    to their children yet.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    Py_ssize_t capacity;
+    int log;
+    double *tree;
+    double *lazy;
+    char *tag;
+    enum QueryFunc func;
+} FloatLazySegmentTreeObject;
+
+static void
+floatlazysegmenttree_dealloc(FloatLazySegmentTreeObject* self)
+{
+    free(self->tree);
+    free(self->lazy);
+    free(self->tag);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+floatlazysegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    FloatLazySegmentTreeObject *self;
+
+    self = (FloatLazySegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static inline double
+_floatlazysegmenttree_identity(FloatLazySegmentTreeObject *self)
+{
+    switch(self->func) {
+        case Sum:
+            return 0;
+        case Min:
+            return Py_HUGE_VAL;
+        case Max:
+            return -Py_HUGE_VAL;
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+static inline double
+_floatlazysegmenttree_combine(FloatLazySegmentTreeObject *self, double left, double right)
+{
+    switch(self->func) {
+        case Sum:
+            return left + right;
+        case Min:
+            return MIN(left, right);
+        case Max:
+            return MAX(left, right);
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+/* Recomputes k-th node using its children */
+static inline void
+_floatlazysegmenttree_pull(FloatLazySegmentTreeObject *self, Py_ssize_t k)
+{
+    self->tree[k] = _floatlazysegmenttree_combine(self, self->tree[k << 1], self->tree[k << 1 | 1]);
+}
+
+/* Applies the operation to k-th node covering `length` leaves */
+static inline void
+_floatlazysegmenttree_apply(FloatLazySegmentTreeObject *self, Py_ssize_t k,
+                          char tag, double value, Py_ssize_t length)
+{
+    double total = self->func == Sum ? value * length : value;
+
+    if (tag == AssignTag) {
+        self->tree[k] = total;
+    } else {
+        self->tree[k] += total;
+    }
+
+    if (k < self->capacity) {
+        if (tag == AssignTag || self->tag[k] == NoTag) {
+            self->tag[k] = tag;
+            self->lazy[k] = value;
+        } else {
+            /* An addition on top of any pending operation just shifts its value */
+            self->lazy[k] += value;
+        }
+    }
+}
+
+/* Pushes the pending operation of k-th node covering `length` leaves to its children */
+static inline void
+_floatlazysegmenttree_push(FloatLazySegmentTreeObject *self, Py_ssize_t k, Py_ssize_t length)
+{
+    if (self->tag[k] != NoTag) {
+        _floatlazysegmenttree_apply(self, k << 1, self->tag[k], self->lazy[k], length >> 1);
+        _floatlazysegmenttree_apply(self, k << 1 | 1, self->tag[k], self->lazy[k], length >> 1);
+        self->tag[k] = NoTag;
+    }
+}
+
+/* Pushes pending operations down to the boundaries of [left, right) */
+static void
+_floatlazysegmenttree_push_bounds(FloatLazySegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right)
+{
+    for (int i = self->log; i >= 1; i--) {
+        if (((left >> i) << i) != left) {
+            _floatlazysegmenttree_push(self, left >> i, (Py_ssize_t)1 << i);
+        }
+        if (((right >> i) << i) != right) {
+            _floatlazysegmenttree_push(self, (right - 1) >> i, (Py_ssize_t)1 << i);
+        }
+    }
+}
+
+/* Applies the operation to the non-empty interval [left, right) */
+static void
+_floatlazysegmenttree_range_apply(FloatLazySegmentTreeObject *self, Py_ssize_t left,
+                                Py_ssize_t right, char tag, double value)
+{
+    left += self->capacity;
+    right += self->capacity;
+    _floatlazysegmenttree_push_bounds(self, left, right);
+
+    Py_ssize_t l = left, r = right, length = 1;
+    while (l < r) {
+        if (l & 1) {
+            _floatlazysegmenttree_apply(self, l++, tag, value, length);
+        }
+        if (r & 1) {
+            _floatlazysegmenttree_apply(self, --r, tag, value, length);
+        }
+        l >>= 1;
+        r >>= 1;
+        length <<= 1;
+    }
+
+    for (int i = 1; i <= self->log; i++) {
+        if (((left >> i) << i) != left) {
+            _floatlazysegmenttree_pull(self, left >> i);
+        }
+        if (((right >> i) << i) != right) {
+            _floatlazysegmenttree_pull(self, (right - 1) >> i);
+        }
+    }
+}
+
+/* Allocates the tree and builds it from the source */
+static int
+_floatlazysegmenttree_build(FloatLazySegmentTreeObject *self, PyObject *source)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, true) < 0) {
+        return -1;
+    }
+
+    Py_ssize_t capacity = 1;
+    int log = 0;
+    while (capacity < src.size) {
+        capacity <<= 1;
+        log++;
+    }
+
+    free(self->tree);
+    free(self->lazy);
+    free(self->tag);
+    self->tree = (double*) malloc(sizeof(double) * 2 * capacity);
+    self->lazy = (double*) malloc(sizeof(double) * capacity);
+    self->tag = (char*) calloc(capacity, sizeof(char));
+    self->size = 0;
+    self->capacity = capacity;
+    self->log = log;
+
+    if (self->tree == NULL || self->lazy == NULL || self->tag == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    int res = tree_source_read_doubles(&src, self->tree + capacity);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+    self->size = src.size;
+
+    double identity = _floatlazysegmenttree_identity(self);
+    for (Py_ssize_t i = capacity + self->size; i < 2 * capacity; i++) {
+        self->tree[i] = identity;
+    }
+
+    for (Py_ssize_t i = capacity - 1; i > 0; i--) {
+        _floatlazysegmenttree_pull(self, i);
+    }
+    return 0;
+}
+
+static int
+floatlazysegmenttree_init(FloatLazySegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|s", kwlist,
+                                     &source, &func))
+        return -1;
+
+    enum QueryFunc query_func;
+    if (func != NULL) {
+        if (strcmp(func, "sum") == 0) {
+            query_func = Sum;
+        } else if (strcmp(func, "min") == 0) {
+            query_func = Min;
+        } else if (strcmp(func, "max") == 0) {
+            query_func = Max;
+        } else {
+            PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'sum', 'min' or 'max'");
+            return -1;
+        }
+    } else {
+        query_func = Sum;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    self->func = query_func;
+    res = _floatlazysegmenttree_build(self, source);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+floatlazysegmenttree_mp_len(FloatLazySegmentTreeObject *self)
+{
+    return self->size;
+}
+
+static PyObject *
+_floatlazysegmenttree_query(FloatLazySegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right)
+{
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+    if (right > self->size) {
+        PyErr_SetString(PyExc_IndexError, "FloatLazySegmentTree index out of range");
+        return NULL;
+    }
+
+    left += self->capacity;
+    right += self->capacity;
+    _floatlazysegmenttree_push_bounds(self, left, right);
+
+    double res = _floatlazysegmenttree_identity(self);
+
+    while (left < right) {
+        if (left & 1) {
+            res = _floatlazysegmenttree_combine(self, res, self->tree[left++]);
+        }
+        if (right & 1) {
+            res = _floatlazysegmenttree_combine(self, res, self->tree[--right]);
+        }
+        left >>= 1;
+        right >>= 1;
+    }
+
+    return PyFloat_FromDouble(res);
+}
+
+static PyObject *
+floatlazysegmenttree_query(FloatLazySegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatlazysegmenttree_query(self, left, right);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+/* Validates the interval and applies the operation */
+static PyObject *
+_floatlazysegmenttree_range_modify(FloatLazySegmentTreeObject *self, Py_ssize_t left,
+                                   Py_ssize_t right, char tag, double value)
+{
+    if (left > right || left < 0 || right > self->size) {
+        PyErr_SetString(PyExc_IndexError, "FloatLazySegmentTree index out of range");
+        return NULL;
+    }
+    if (left == right) {
+        Py_RETURN_NONE;
+    }
+
+    _floatlazysegmenttree_range_apply(self, left, right, tag, value);
+    Py_RETURN_NONE;
+}
+
+/* Shared by all modifying methods */
+static PyObject *
+_floatlazysegmenttree_modify(FloatLazySegmentTreeObject *self, Py_ssize_t left,
+                             Py_ssize_t right, char tag, double value)
+{
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatlazysegmenttree_range_modify(self, left, right, tag, value);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyObject *
+floatlazysegmenttree_update(FloatLazySegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    double value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || double_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "FloatLazySegmentTree index out of range");
+        return NULL;
+    }
+
+    return _floatlazysegmenttree_modify(self, i, i + 1, AssignTag, value);
+}
+
+static PyObject *
+floatlazysegmenttree_range_add(FloatLazySegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end", "delta"};
+    PyObject *argv[3] = {NULL, NULL, NULL};
+    Py_ssize_t left, right;
+    double delta;
+
+    if (fastcall_unpack("range_add", args, nargs, kwnames, kwlist, 3, 3, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0
+        || double_from_object(argv[2], &delta) < 0)
+        return NULL;
+
+    return _floatlazysegmenttree_modify(self, left, right, AddTag, delta);
+}
+
+static PyObject *
+floatlazysegmenttree_range_assign(FloatLazySegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end", "value"};
+    PyObject *argv[3] = {NULL, NULL, NULL};
+    Py_ssize_t left, right;
+    double value;
+
+    if (fastcall_unpack("range_assign", args, nargs, kwnames, kwlist, 3, 3, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0
+        || double_from_object(argv[2], &value) < 0)
+        return NULL;
+
+    return _floatlazysegmenttree_modify(self, left, right, AssignTag, value);
+}
+
+/* `tree[i]` pushes the pending operations down to the leaf, same as `query(i, i + 1)` */
+static PyObject *
+floatlazysegmenttree_sq_item(FloatLazySegmentTreeObject *self, Py_ssize_t i)
+{
+    PyObject *res = NULL;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (i < 0 || i >= self->size) {
+        PyErr_SetString(PyExc_IndexError, "FloatLazySegmentTree index out of range");
+    } else {
+        res = _floatlazysegmenttree_query(self, i, i + 1);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+floatlazysegmenttree_sq_ass_item(FloatLazySegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    double item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("FloatLazySegmentTree");
+    }
+    if (double_from_object(value, &item) < 0) {
+        return -1;
+    }
+    return sequence_status(_floatlazysegmenttree_modify(self, i, i + 1, AssignTag, item));
+}
+
+static PyMappingMethods floatlazysegmenttree_mapping = {
+    .mp_length = (lenfunc)floatlazysegmenttree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods floatlazysegmenttree_sequence = {
+    .sq_length = (lenfunc)floatlazysegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)floatlazysegmenttree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)floatlazysegmenttree_sq_ass_item,
+};
+
+static PyMethodDef floatlazysegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) floatlazysegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Performs the query operation"},
+    {"update", (PyCFunction)(void(*)(void)) floatlazysegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Performs the update operation"},
+    {"range_add", (PyCFunction)(void(*)(void)) floatlazysegmenttree_range_add, METH_FASTCALL_KEYWORDS,
+    "Adds the value to every element of the interval"},
+    {"range_assign", (PyCFunction)(void(*)(void)) floatlazysegmenttree_range_assign, METH_FASTCALL_KEYWORDS,
+    "Sets every element of the interval to the value"},
+    {NULL},  /* Sentinel */
+};
+
+static PyTypeObject floatlazysegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.FloatLazySegmentTree",
+    sizeof(FloatLazySegmentTreeObject),
+    .tp_dealloc = (destructor)floatlazysegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "FloatLazySegmentTree",
+    .tp_as_mapping = &floatlazysegmenttree_mapping,
+    .tp_as_sequence = &floatlazysegmenttree_sequence,
+    .tp_methods = floatlazysegmenttree_methods,
+    .tp_init = (initproc)floatlazysegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = floatlazysegmenttree_new,
+};
@@ -0,0 +1,373 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Same as IntMultiSegmentTree, but for the double items.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    /* Node arrays indexed by `func - Sum`, NULL if the aggregate isn't kept */
+    double *nodes[MULTI_FUNCS];
+    double *block;
+    unsigned int funcs;
+    /* Tuple of the kept aggregate names */
+    PyObject *names;
+} FloatMultiSegmentTreeObject;
+
+static void
+floatmultisegmenttree_dealloc(FloatMultiSegmentTreeObject* self)
+{
+    free(self->block);
+    Py_XDECREF(self->names);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+floatmultisegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    FloatMultiSegmentTreeObject *self;
+
+    self = (FloatMultiSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static int
+_floatmultisegmenttree_build(FloatMultiSegmentTreeObject *self, PyObject *source, unsigned int funcs)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, true) < 0) {
+        return -1;
+    }
+
+    int kept = 0;
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        kept += (funcs >> f) & 1;
+    }
+
+    Py_ssize_t stride = 2 * MAX(src.size, 1);
+    if (stride > PY_SSIZE_T_MAX / (Py_ssize_t)sizeof(double) / MAX(kept, 1)) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    double *block = (double*) malloc(sizeof(double) * stride * MAX(kept, 1));
+    if (block == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->block);
+    self->block = block;
+    self->size = 0;
+    self->funcs = funcs;
+
+    /* The leaves are read into the scratch array if no aggregate is kept */
+    for (int f = 0, k = 0; f < MULTI_FUNCS; f++) {
+        self->nodes[f] = funcs & (1u << f) ? block + stride * k++ : NULL;
+    }
+
+    int res = tree_source_read_doubles(&src, block + src.size);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        double *nodes = self->nodes[f];
+
+        if (nodes == NULL) {
+            continue;
+        }
+        if (nodes != block) {
+            memcpy(nodes + src.size, block + src.size, sizeof(double) * src.size);
+        }
+        nodes[0] = 0;
+        for (Py_ssize_t i = src.size - 1; i > 0; i--) {
+            nodes[i] = float_combine(Sum + f, nodes[i << 1], nodes[i << 1 | 1]);
+        }
+    }
+    self->size = src.size;
+    return 0;
+}
+
+static int
+floatmultisegmenttree_init(FloatMultiSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "funcs", NULL};
+    PyObject *source = NULL, *funcs_obj = Py_None;
+    unsigned int funcs;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist,
+                                     &source, &funcs_obj))
+        return -1;
+
+    if (multi_funcs_parse(funcs_obj, MULTI_ALL, &funcs) < 0) {
+        return -1;
+    }
+    PyObject *names = multi_funcs_names(funcs);
+    if (names == NULL) {
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatmultisegmenttree_build(self, source, funcs);
+    if (res == 0) {
+        Py_XSETREF(self->names, names);
+        names = NULL;
+    }
+    Py_END_CRITICAL_SECTION();
+    Py_XDECREF(names);
+    return res;
+}
+
+static inline Py_ssize_t
+floatmultisegmenttree_mp_len(FloatMultiSegmentTreeObject *self)
+{
+    return self->size;
+}
+
+/* Accumulates the aggregates in the mask on the non-empty interval [left, right) */
+static void
+_floatmultisegmenttree_query(FloatMultiSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right,
+                             unsigned int mask, double res[MULTI_FUNCS])
+{
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        res[f] = float_identity(Sum + f);
+    }
+
+    left += self->size;
+    right += self->size;
+    while (left < right) {
+        if (left & 1) {
+            for (int f = 0; f < MULTI_FUNCS; f++) {
+                if (mask & (1u << f)) {
+                    res[f] = float_combine(Sum + f, res[f], self->nodes[f][left]);
+                }
+            }
+            left++;
+        }
+        if (right & 1) {
+            --right;
+            for (int f = 0; f < MULTI_FUNCS; f++) {
+                if (mask & (1u << f)) {
+                    res[f] = float_combine(Sum + f, res[f], self->nodes[f][right]);
+                }
+            }
+        }
+        left >>= 1;
+        right >>= 1;
+    }
+}
+
+static PyObject *
+floatmultisegmenttree_query(FloatMultiSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end", "funcs"};
+    PyObject *argv[3] = {NULL, NULL, NULL};
+    Py_ssize_t left, right;
+    unsigned int mask;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 3, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0
+        || multi_funcs_parse(argv[2], self->funcs, &mask) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    double res[MULTI_FUNCS];
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        _floatmultisegmenttree_query(self, left, right, mask, res);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatMultiSegmentTree index out of range");
+        return NULL;
+    }
+
+    PyObject *values[MULTI_FUNCS] = {NULL};
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        if ((mask & (1u << f)) && (values[f] = PyFloat_FromDouble(res[f])) == NULL) {
+            for (int k = 0; k < f; k++) {
+                Py_XDECREF(values[k]);
+            }
+            return NULL;
+        }
+    }
+    return aggregates_new(values, right - left);
+}
+
+/* Sets the leaf and recalculates its ancestors in all node arrays in one walk */
+static void
+_floatmultisegmenttree_update(FloatMultiSegmentTreeObject *self, Py_ssize_t i, double value)
+{
+    Py_ssize_t k = i + self->size;
+
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        if (self->nodes[f] != NULL) {
+            self->nodes[f][k] = value;
+        }
+    }
+    for (k >>= 1; k > 0; k >>= 1) {
+        for (int f = 0; f < MULTI_FUNCS; f++) {
+            double *nodes = self->nodes[f];
+
+            if (nodes != NULL) {
+                nodes[k] = float_combine(Sum + f, nodes[k << 1], nodes[k << 1 | 1]);
+            }
+        }
+    }
+}
+
+static PyObject *
+floatmultisegmenttree_update(FloatMultiSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    double value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || double_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i > self->size - 1 || i < 0;
+    if (!out_of_range) {
+        _floatmultisegmenttree_update(self, i, value);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatMultiSegmentTree index out of range");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+floatmultisegmenttree_sizeof(FloatMultiSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    Py_ssize_t res = Py_TYPE(self)->tp_basicsize;
+
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        if (self->nodes[f] != NULL) {
+            res += 2 * MAX(self->size, 1) * sizeof(double);
+        }
+    }
+    return PyLong_FromSsize_t(res);
+}
+
+/* `tree[i]` reads the leaf of the first kept aggregate, the leaves of all aggregates are equal */
+static PyObject *
+floatmultisegmenttree_sq_item(FloatMultiSegmentTreeObject *self, Py_ssize_t i)
+{
+    double res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    for (int f = 0; f < MULTI_FUNCS && !out_of_range; f++) {
+        if (self->nodes[f] != NULL) {
+            res = self->nodes[f][i + self->size];
+            break;
+        }
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatMultiSegmentTree index out of range");
+        return NULL;
+    }
+    return PyFloat_FromDouble(res);
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+floatmultisegmenttree_sq_ass_item(FloatMultiSegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    double item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("FloatMultiSegmentTree");
+    }
+    if (double_from_object(value, &item) < 0) {
+        return -1;
+    }
+
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        _floatmultisegmenttree_update(self, i, item);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatMultiSegmentTree index out of range");
+        return -1;
+    }
+    return 0;
+}
+
+static PyMappingMethods floatmultisegmenttree_mapping = {
+    .mp_length = (lenfunc)floatmultisegmenttree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods floatmultisegmenttree_sequence = {
+    .sq_length = (lenfunc)floatmultisegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)floatmultisegmenttree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)floatmultisegmenttree_sq_ass_item,
+};
+
+static PyMemberDef floatmultisegmenttree_members[] = {
+    {"funcs", T_OBJECT, offsetof(FloatMultiSegmentTreeObject, names), READONLY,
+    "Names of the kept aggregates"},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef floatmultisegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) floatmultisegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Calculates the aggregates on the [start, end) interval"},
+    {"update", (PyCFunction)(void(*)(void)) floatmultisegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Performs the update operation"},
+    {"__sizeof__", (PyCFunction) floatmultisegmenttree_sizeof, METH_NOARGS,
+    "Size of the tree in memory, in bytes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject floatmultisegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.FloatMultiSegmentTree",
+    sizeof(FloatMultiSegmentTreeObject),
+    .tp_dealloc = (destructor)floatmultisegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "FloatMultiSegmentTree",
+    .tp_as_mapping = &floatmultisegmenttree_mapping,
+    .tp_as_sequence = &floatmultisegmenttree_sequence,
+    .tp_members = floatmultisegmenttree_members,
+    .tp_methods = floatmultisegmenttree_methods,
+    .tp_init = (initproc)floatmultisegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = floatmultisegmenttree_new,
+};
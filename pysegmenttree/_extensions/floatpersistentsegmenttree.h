@@ -0,0 +1,583 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Persistent segment tree: `snapshot` freezes the current state as a version,
+    which stays available for queries after the following updates.
+
+    Nodes are taken from the arena shared by all the versions. Update copies
+    the frozen nodes of the path (O(Log[N]) new nodes) and modifies in place
+    the nodes created after the last snapshot, since no version references them.
+    Released versions are reclaimed by `collect`, which copies the nodes
+    reachable from the live roots into the new arena.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    FloatArenaNode *nodes;
+    Py_ssize_t count;
+    Py_ssize_t capacity;
+    /* Nodes before this index may be shared with the versions */
+    Py_ssize_t frozen;
+    uint32_t root;
+    /* Roots of the versions, 0 for the released ones */
+    uint32_t *versions;
+    Py_ssize_t version_count;
+    Py_ssize_t version_capacity;
+    enum QueryFunc func;
+} FloatPersistentSegmentTreeObject;
+
+static void
+floatpersistentsegmenttree_dealloc(FloatPersistentSegmentTreeObject* self)
+{
+    free(self->nodes);
+    free(self->versions);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+floatpersistentsegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    FloatPersistentSegmentTreeObject *self;
+
+    self = (FloatPersistentSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+        self->count = 0;
+        self->capacity = 0;
+        self->version_count = 0;
+        self->version_capacity = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+/* Takes the empty node from the arena, returns 0 on failure */
+static uint32_t
+_floatpersistentsegmenttree_alloc(FloatPersistentSegmentTreeObject *self)
+{
+    if (self->count == self->capacity) {
+        Py_ssize_t capacity = MAX(self->capacity * 2, DYNAMIC_INITIAL_CAPACITY);
+        if (capacity > DYNAMIC_MAX_NODES) {
+            capacity = DYNAMIC_MAX_NODES;
+        }
+        if (capacity <= self->count) {
+            PyErr_SetString(PyExc_MemoryError, "FloatPersistentSegmentTree node limit is reached");
+            return 0;
+        }
+
+        FloatArenaNode *nodes = (FloatArenaNode*) realloc(self->nodes, sizeof(FloatArenaNode) * capacity);
+        if (nodes == NULL) {
+            PyErr_NoMemory();
+            return 0;
+        }
+        self->nodes = nodes;
+        self->capacity = capacity;
+    }
+
+    FloatArenaNode *node = &self->nodes[self->count];
+    node->value = float_identity(self->func);
+    node->left = node->right = 0;
+    return (uint32_t)self->count++;
+}
+
+/* Builds the subtree of [lo, hi) leaves, returns the root or 0 on failure */
+static uint32_t
+_floatpersistentsegmenttree_build_node(FloatPersistentSegmentTreeObject *self, const double *leaves,
+                                     Py_ssize_t lo, Py_ssize_t hi)
+{
+    uint32_t k = _floatpersistentsegmenttree_alloc(self);
+    if (k == 0) {
+        return 0;
+    }
+    if (hi - lo == 1) {
+        self->nodes[k].value = leaves[lo];
+        return k;
+    }
+
+    Py_ssize_t mid = lo + (hi - lo) / 2;
+    uint32_t left = _floatpersistentsegmenttree_build_node(self, leaves, lo, mid);
+    uint32_t right = left ? _floatpersistentsegmenttree_build_node(self, leaves, mid, hi) : 0;
+    if (right == 0) {
+        return 0;
+    }
+
+    self->nodes[k].left = left;
+    self->nodes[k].right = right;
+    self->nodes[k].value = float_combine(self->func, self->nodes[left].value, self->nodes[right].value);
+    return k;
+}
+
+static int
+_floatpersistentsegmenttree_build(FloatPersistentSegmentTreeObject *self, PyObject *source)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, true) < 0) {
+        return -1;
+    }
+
+    double *leaves = (double*) malloc(sizeof(double) * (src.size + 1));
+    if (leaves == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    int res = tree_source_read_doubles(&src, leaves);
+    tree_source_close(&src);
+    if (res < 0) {
+        free(leaves);
+        return -1;
+    }
+
+    free(self->nodes);
+    self->nodes = NULL;
+    self->capacity = self->count = 0;
+    self->version_count = 0;
+    self->size = 0;
+
+    /* The empty subtree */
+    _floatpersistentsegmenttree_alloc(self);
+    if (self->count == 0) {
+        free(leaves);
+        return -1;
+    }
+    self->root = 0;
+    if (src.size > 0) {
+        self->root = _floatpersistentsegmenttree_build_node(self, leaves, 0, src.size);
+        if (self->root == 0) {
+            free(leaves);
+            return -1;
+        }
+    }
+    free(leaves);
+
+    self->frozen = 0;
+    self->size = src.size;
+    return 0;
+}
+
+static int
+floatpersistentsegmenttree_init(FloatPersistentSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|s", kwlist,
+                                     &source, &func))
+        return -1;
+
+    enum QueryFunc query_func;
+    if (query_func_parse(func, FLOAT_QUERY_FUNC_MAX, &query_func) < 0) {
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    self->func = query_func;
+    res = _floatpersistentsegmenttree_build(self, source);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+floatpersistentsegmenttree_mp_len(FloatPersistentSegmentTreeObject *self)
+{
+    return self->size;
+}
+
+/*
+    Sets i-th element of the current version to value.
+*/
+static int
+_floatpersistentsegmenttree_update(FloatPersistentSegmentTreeObject *self, Py_ssize_t i, double value)
+{
+    uint32_t path[DYNAMIC_MAX_DEPTH + 1];
+    bool to_left[DYNAMIC_MAX_DEPTH + 1];
+    double values[DYNAMIC_MAX_DEPTH + 1];
+    int depth = 0;
+    Py_ssize_t lo = 0, hi = self->size;
+
+    path[0] = self->root;
+    while (hi - lo > 1) {
+        Py_ssize_t mid = lo + (hi - lo) / 2;
+
+        to_left[depth] = i < mid;
+        if (to_left[depth]) {
+            hi = mid;
+        } else {
+            lo = mid;
+        }
+        path[depth + 1] = to_left[depth] ? self->nodes[path[depth]].left : self->nodes[path[depth]].right;
+        depth++;
+    }
+
+    values[depth] = value;
+    for (int k = depth - 1; k >= 0; k--) {
+        FloatArenaNode *node = &self->nodes[path[k]];
+
+        values[k] = to_left[k]
+            ? float_combine(self->func, values[k + 1], self->nodes[node->right].value)
+            : float_combine(self->func, self->nodes[node->left].value, values[k + 1]);
+    }
+
+    /* Path copying from the leaf, the failed allocations leave only the unreachable nodes */
+    uint32_t child = 0;
+    for (int k = depth; k >= 0; k--) {
+        uint32_t node = path[k];
+
+        if (node < self->frozen) {
+            node = _floatpersistentsegmenttree_alloc(self);
+            if (node == 0) {
+                return -1;
+            }
+            self->nodes[node] = self->nodes[path[k]];
+        }
+        self->nodes[node].value = values[k];
+        if (k < depth) {
+            if (to_left[k]) {
+                self->nodes[node].left = child;
+            } else {
+                self->nodes[node].right = child;
+            }
+        }
+        child = node;
+    }
+    self->root = child;
+    return 0;
+}
+
+/* Result of the [left, right) query in the subtree of the node covering [lo, hi) */
+static double
+_floatpersistentsegmenttree_query(FloatPersistentSegmentTreeObject *self, uint32_t k, Py_ssize_t lo,
+                                Py_ssize_t hi, Py_ssize_t left, Py_ssize_t right)
+{
+    if (left <= lo && hi <= right) {
+        return self->nodes[k].value;
+    }
+
+    Py_ssize_t mid = lo + (hi - lo) / 2;
+    double res = float_identity(self->func);
+
+    if (left < mid) {
+        res = _floatpersistentsegmenttree_query(self, self->nodes[k].left, lo, mid, left, right);
+    }
+    if (right > mid) {
+        res = float_combine(
+            self->func, res, _floatpersistentsegmenttree_query(self, self->nodes[k].right, mid, hi, left, right)
+        );
+    }
+    return res;
+}
+
+/* Returns the root of the version, or 0 with exception set */
+static uint32_t
+_floatpersistentsegmenttree_version_root(FloatPersistentSegmentTreeObject *self, PyObject *version)
+{
+    Py_ssize_t v;
+
+    if (version == NULL || version == Py_None) {
+        return self->root;
+    }
+    if (ssize_from_object(version, &v) < 0) {
+        return 0;
+    }
+    if (v < 0 || v >= self->version_count || self->versions[v] == 0) {
+        PyErr_Format(PyExc_ValueError, "Version %zd doesn't exist or is released", v);
+        return 0;
+    }
+    return self->versions[v];
+}
+
+static PyObject *
+floatpersistentsegmenttree_query(FloatPersistentSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end", "version"};
+    PyObject *argv[3] = {NULL, NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 3, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    PyObject *res = NULL;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    uint32_t root = _floatpersistentsegmenttree_version_root(self, argv[2]);
+
+    if (root == 0 && PyErr_Occurred()) {
+        res = NULL;
+    } else if (left >= right || left < 0) {
+        res = Py_None;
+        Py_INCREF(res);
+    } else if (right > self->size) {
+        PyErr_SetString(PyExc_IndexError, "FloatPersistentSegmentTree index out of range");
+    } else {
+        res = PyFloat_FromDouble(_floatpersistentsegmenttree_query(self, root, 0, self->size, left, right));
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyObject *
+floatpersistentsegmenttree_update(FloatPersistentSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    double value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || double_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "FloatPersistentSegmentTree index out of range");
+        return NULL;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _floatpersistentsegmenttree_update(self, i, value);
+    Py_END_CRITICAL_SECTION();
+    if (res < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static Py_ssize_t
+_floatpersistentsegmenttree_snapshot(FloatPersistentSegmentTreeObject *self)
+{
+    if (self->version_count == self->version_capacity) {
+        Py_ssize_t capacity = MAX(self->version_capacity * 2, 8);
+        uint32_t *versions = (uint32_t*) realloc(self->versions, sizeof(uint32_t) * capacity);
+
+        if (versions == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        self->versions = versions;
+        self->version_capacity = capacity;
+    }
+
+    self->versions[self->version_count] = self->root;
+    self->frozen = self->count;
+    return self->version_count++;
+}
+
+static PyObject *
+floatpersistentsegmenttree_snapshot(FloatPersistentSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    Py_ssize_t version;
+
+    if (self->size == 0) {
+        PyErr_SetString(PyExc_ValueError, "Can't snapshot the empty tree");
+        return NULL;
+    }
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    version = _floatpersistentsegmenttree_snapshot(self);
+    Py_END_CRITICAL_SECTION();
+    if (version < 0) {
+        return NULL;
+    }
+    return PyLong_FromSsize_t(version);
+}
+
+static PyObject *
+floatpersistentsegmenttree_release(FloatPersistentSegmentTreeObject *self, PyObject *arg)
+{
+    Py_ssize_t v;
+    bool released = false;
+
+    if (ssize_from_object(arg, &v) < 0) {
+        return NULL;
+    }
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (v >= 0 && v < self->version_count && self->versions[v] != 0) {
+        self->versions[v] = 0;
+        released = true;
+    }
+    Py_END_CRITICAL_SECTION();
+    if (!released) {
+        PyErr_Format(PyExc_ValueError, "Version %zd doesn't exist or is released", v);
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+/* Copies the subtree to the new arena, `moved` maps the old indices to the new ones */
+static uint32_t
+_floatpersistentsegmenttree_move(FloatPersistentSegmentTreeObject *self, FloatArenaNode *nodes,
+                               uint32_t *moved, Py_ssize_t *count, uint32_t k)
+{
+    if (k == 0 || moved[k] != 0) {
+        return moved[k];
+    }
+
+    uint32_t left = _floatpersistentsegmenttree_move(self, nodes, moved, count, self->nodes[k].left);
+    uint32_t right = _floatpersistentsegmenttree_move(self, nodes, moved, count, self->nodes[k].right);
+    uint32_t res = (uint32_t)(*count)++;
+
+    nodes[res].value = self->nodes[k].value;
+    nodes[res].left = left;
+    nodes[res].right = right;
+    moved[k] = res;
+    return res;
+}
+
+/* Reclaims the nodes of the released versions, returns their number or -1 on failure */
+static Py_ssize_t
+_floatpersistentsegmenttree_collect(FloatPersistentSegmentTreeObject *self)
+{
+    FloatArenaNode *nodes = (FloatArenaNode*) malloc(sizeof(FloatArenaNode) * self->count);
+    uint32_t *moved = (uint32_t*) calloc(self->count, sizeof(uint32_t));
+    if (nodes == NULL || moved == NULL) {
+        free(nodes);
+        free(moved);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    Py_ssize_t count = 1;
+    nodes[0] = self->nodes[0];
+
+    /* The versions are moved first, so the current root's private nodes stay after the frozen ones */
+    for (Py_ssize_t v = 0; v < self->version_count; v++) {
+        self->versions[v] = _floatpersistentsegmenttree_move(self, nodes, moved, &count, self->versions[v]);
+    }
+    Py_ssize_t frozen = count;
+    self->root = _floatpersistentsegmenttree_move(self, nodes, moved, &count, self->root);
+    free(moved);
+
+    Py_ssize_t freed = self->count - count;
+    free(self->nodes);
+    self->nodes = nodes;
+    self->capacity = self->count;
+    self->count = count;
+    self->frozen = frozen;
+    return freed;
+}
+
+static PyObject *
+floatpersistentsegmenttree_collect(FloatPersistentSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    Py_ssize_t freed;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    freed = _floatpersistentsegmenttree_collect(self);
+    Py_END_CRITICAL_SECTION();
+    if (freed < 0) {
+        return NULL;
+    }
+    return PyLong_FromSsize_t(freed);
+}
+
+static PyObject *
+floatpersistentsegmenttree_sizeof(FloatPersistentSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return PyLong_FromSsize_t(Py_TYPE(self)->tp_basicsize + self->capacity * sizeof(FloatArenaNode)
+                              + self->version_capacity * sizeof(uint32_t));
+}
+
+/* `tree[i]` reads the current version, same as `query(i, i + 1)` */
+static PyObject *
+floatpersistentsegmenttree_sq_item(FloatPersistentSegmentTreeObject *self, Py_ssize_t i)
+{
+    double res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        res = _floatpersistentsegmenttree_query(self, self->root, 0, self->size, i, i + 1);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatPersistentSegmentTree index out of range");
+        return NULL;
+    }
+    return PyFloat_FromDouble(res);
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+floatpersistentsegmenttree_sq_ass_item(FloatPersistentSegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    double item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("FloatPersistentSegmentTree");
+    }
+    if (double_from_object(value, &item) < 0) {
+        return -1;
+    }
+
+    int res = -1;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (i < 0 || i >= self->size) {
+        PyErr_SetString(PyExc_IndexError, "FloatPersistentSegmentTree index out of range");
+    } else {
+        res = _floatpersistentsegmenttree_update(self, i, item);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyMappingMethods floatpersistentsegmenttree_mapping = {
+    .mp_length = (lenfunc)floatpersistentsegmenttree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods floatpersistentsegmenttree_sequence = {
+    .sq_length = (lenfunc)floatpersistentsegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)floatpersistentsegmenttree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)floatpersistentsegmenttree_sq_ass_item,
+};
+
+static PyMemberDef floatpersistentsegmenttree_members[] = {
+    {"node_count", T_PYSSIZET, offsetof(FloatPersistentSegmentTreeObject, count), READONLY,
+    "Number of the allocated nodes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef floatpersistentsegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) floatpersistentsegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Perform query on the [start, end) interval of the version"},
+    {"update", (PyCFunction)(void(*)(void)) floatpersistentsegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Set element with index 'i' to 'value'"},
+    {"snapshot", (PyCFunction) floatpersistentsegmenttree_snapshot, METH_NOARGS,
+    "Freeze the current state, return its version"},
+    {"release", (PyCFunction) floatpersistentsegmenttree_release, METH_O,
+    "Release the version, so its nodes can be collected"},
+    {"collect", (PyCFunction) floatpersistentsegmenttree_collect, METH_NOARGS,
+    "Reclaim the nodes of the released versions, return their number"},
+    {"__sizeof__", (PyCFunction) floatpersistentsegmenttree_sizeof, METH_NOARGS,
+    "Size of the tree in memory, in bytes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject floatpersistentsegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.FloatPersistentSegmentTree",
+    sizeof(FloatPersistentSegmentTreeObject),
+    .tp_dealloc = (destructor)floatpersistentsegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "FloatPersistentSegmentTree",
+    .tp_as_mapping = &floatpersistentsegmenttree_mapping,
+    .tp_as_sequence = &floatpersistentsegmenttree_sequence,
+    .tp_members = floatpersistentsegmenttree_members,
+    .tp_methods = floatpersistentsegmenttree_methods,
+    .tp_init = (initproc)floatpersistentsegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = floatpersistentsegmenttree_new,
+};
@@ -1,19 +1,38 @@
 
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <stdbool.h>
+#include <string.h>
 #include "structmember.h"
+#include "common.h"
 
 typedef struct {
     PyObject_HEAD
     Py_ssize_t size;
+    /* Number of the allocated leaves, the leaves are located at [capacity, capacity + size) */
+    Py_ssize_t capacity;
     double *tree;
     enum QueryFunc func;
+    /* Number of alive buffer exports and the shape of the exported node array */
+    Py_ssize_t exports;
+    Py_ssize_t export_shape;
+    /* External node array of the attached tree, `storage.obj` is NULL if the tree owns its memory */
+    Py_buffer storage;
+    bool sync;
+    /* seqlock counter in the header of the attached snapshot, NULL for the trees owning their memory */
+    uint64_t *seq;
+    TreeLock lock;
 } FloatSegmentTreeObject;
 
 static void
 floatsegmenttree_dealloc(FloatSegmentTreeObject* self)
 {
-    free(self->tree);
+    if (self->storage.obj != NULL) {
+        PyBuffer_Release(&self->storage);
+    } else {
+        free(self->tree);
+    }
+    tree_lock_destroy(&self->lock);
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -30,43 +49,66 @@ floatsegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
     return (PyObject *)self;
 }
 
+/* Allocates the tree and fills in the leaves from the source */
 static int
-floatsegmenttree_init(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+_floatsegmenttree_fill_leaves(FloatSegmentTreeObject *self, PyObject *source)
 {
-    static char *kwlist[] = {"source", "func", NULL};
-    PyObject *source = NULL;
-    char* func = NULL;
+    TreeSource src;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|s", kwlist,
-                                     &source, &func))
+    if (tree_source_open(&src, source, true) < 0) {
         return -1;
+    }
 
-    if (func != NULL) {
-        if (strcmp(func, "sum") == 0) {
-            self->func = Sum;
-        } else if (strcmp(func, "min") == 0) {
-            self->func = Min;
-        } else if (strcmp(func, "max") == 0) {
-            self->func = Max;
-        } else {
-            PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'sum', 'min' or 'max'");
-            return -1;
-        }
+    double *tree = (double*) malloc(sizeof(double) * 2 * MAX(src.size, 1));
+    if (tree == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    if (self->storage.obj != NULL) {
+        PyBuffer_Release(&self->storage);
+        self->sync = false;
+        self->seq = NULL;
     } else {
-        self->func = Sum;
+        free(self->tree);
     }
+    self->tree = tree;
+    self->size = src.size;
+    self->capacity = src.size;
+    /* The 0-th node is never used, but it's visible through the buffer protocol */
+    self->tree[0] = 0;
 
-    if (source) {
-        Py_ssize_t size = PyList_Size(source);
-        self->size = size;
-        self->tree = (double*) malloc(sizeof(double) * 2 * size);
+    int res = tree_source_read_doubles(&src, self->tree + src.size);
+    tree_source_close(&src);
+    return res;
+}
+
+/* Builds the tree, shared by the constructor and the vectorcall entry point */
+static int
+_floatsegmenttree_setup(FloatSegmentTreeObject *self, PyObject *source, const char *func, int threadsafe)
+{
+    if (self->exports > 0) {
+        PyErr_SetString(PyExc_BufferError, "Existing exports of data: FloatSegmentTree cannot be re-initialized");
+        return -1;
+    }
+    /* Other threads may walk the locked tree without the GIL */
+    if (self->lock.enabled) {
+        PyErr_SetString(PyExc_RuntimeError, "Threadsafe FloatSegmentTree cannot be re-initialized");
+        return -1;
+    }
+    if (tree_lock_init(&self->lock, threadsafe || TREE_LOCK_DEFAULT) < 0) {
+        return -1;
+    }
+
+    if (query_func_parse(func, FLOAT_QUERY_FUNC_MAX, &self->func) < 0) {
+        return -1;
+    }
 
-        /* Fill in the elements from source */
-        for (Py_ssize_t i = 0; i < size; i++) {
-            PyObject *item = PyList_GetItem(source, i);
-            double val = PyFloat_AsDouble(item);
-            self->tree[size + i] = val;
+    if (source) {
+        if (_floatsegmenttree_fill_leaves(self, source) < 0) {
+            return -1;
         }
+        Py_ssize_t size = self->size;
 
         for (Py_ssize_t i = size - 1; i > 0; i--) {
             double left = self->tree[i << 1];
@@ -76,6 +118,9 @@ floatsegmenttree_init(FloatSegmentTreeObject *self, PyObject *args, PyObject *kw
                 case Sum:
                     self->tree[i] = left + right;
                     break;
+                case Product:
+                    self->tree[i] = left * right;
+                    break;
                 case Min:
                     self->tree[i] = MIN(left, right);
                     break;
@@ -91,41 +136,88 @@ floatsegmenttree_init(FloatSegmentTreeObject *self, PyObject *args, PyObject *kw
     return 0;
 }
 
-static inline Py_ssize_t
-floatsegmenttree_mp_len(FloatSegmentTreeObject *self)
+static int
+floatsegmenttree_init(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
 {
-    return self->size;
+    static char *kwlist[] = {"source", "func", "threadsafe", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+    int threadsafe = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|sp", kwlist,
+                                     &source, &func, &threadsafe))
+        return -1;
+
+    return _floatsegmenttree_setup(self, source, func, threadsafe);
 }
 
+#if PY_VERSION_HEX >= 0x03090000
+/* Calling the type itself skips the generic tp_new/tp_init argument handling */
 static PyObject *
-floatsegmenttree_query(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+floatsegmenttree_vectorcall(PyObject *type, PyObject *const *args, size_t nargsf, PyObject *kwnames)
 {
-    static char *kwlist[] = {"start", "end", NULL};
-    Py_ssize_t left, right;
+    static const char *const kwlist[] = {"source", "func", "threadsafe"};
+    PyObject *argv[3] = {NULL, NULL, NULL};
+    const char *func = NULL;
+    int threadsafe = 0;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nn|", kwlist,
-                                     &left, &right))
+    if (fastcall_unpack("FloatSegmentTree", args, PyVectorcall_NARGS(nargsf), kwnames, kwlist, 1, 3, argv) < 0)
         return NULL;
 
-    if (left >= right || left < 0) {
-        Py_RETURN_NONE;
+    if (argv[1] != NULL) {
+        if (!PyUnicode_Check(argv[1])) {
+            PyErr_Format(PyExc_TypeError, "FloatSegmentTree() argument 'func' must be str, not %.50s",
+                         Py_TYPE(argv[1])->tp_name);
+            return NULL;
+        }
+        if ((func = PyUnicode_AsUTF8(argv[1])) == NULL) {
+            return NULL;
+        }
+    }
+    if (argv[2] != NULL && (threadsafe = PyObject_IsTrue(argv[2])) < 0) {
+        return NULL;
+    }
+
+    PyObject *self = ((PyTypeObject *)type)->tp_alloc((PyTypeObject *)type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    if (_floatsegmenttree_setup((FloatSegmentTreeObject *)self, argv[0], func, threadsafe) < 0) {
+        Py_DECREF(self);
+        return NULL;
     }
+    return self;
+}
+#endif
+
+static inline Py_ssize_t
+floatsegmenttree_mp_len(FloatSegmentTreeObject *self)
+{
+    return self->size;
+}
 
-    left += self->size;
-    right += self->size;
+/* Performs the query on the non-empty interval [left, right) */
+static double
+_floatsegmenttree_query(FloatSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right)
+{
+    left += self->capacity;
+    right += self->capacity;
     double res;
 
     switch(self->func) {
         case Sum:
             res = 0;
             break;
+        case Product:
+            res = 1;
+            break;
         case Min:
         case Max:
             res = self->tree[left];
             break;
         default:
             Py_UNREACHABLE();
-            return NULL;
+            return 0;
     }
 
     while (left < right) {
@@ -134,6 +226,9 @@ floatsegmenttree_query(FloatSegmentTreeObject *self, PyObject *args, PyObject *k
                 case Sum:
                     res += self->tree[left];
                     break;
+                case Product:
+                    res *= self->tree[left];
+                    break;
                 case Min:
                     res = MIN(self->tree[left], res);
                     break;
@@ -142,7 +237,7 @@ floatsegmenttree_query(FloatSegmentTreeObject *self, PyObject *args, PyObject *k
                     break;
                 default:
                     Py_UNREACHABLE();
-                    return NULL;
+                    return 0;
             }
 
             left++;
@@ -155,6 +250,9 @@ floatsegmenttree_query(FloatSegmentTreeObject *self, PyObject *args, PyObject *k
                 case Sum:
                     res += self->tree[right];
                     break;
+                case Product:
+                    res *= self->tree[right];
+                    break;
                 case Min:
                     res = MIN(res, self->tree[right]);
                     break;
@@ -163,7 +261,7 @@ floatsegmenttree_query(FloatSegmentTreeObject *self, PyObject *args, PyObject *k
                     break;
                 default:
                     Py_UNREACHABLE();
-                    return NULL;
+                    return 0;
             }
         }
 
@@ -171,31 +269,138 @@ floatsegmenttree_query(FloatSegmentTreeObject *self, PyObject *args, PyObject *k
         right >>= 1;
     }
 
+    return res;
+}
+
+static PyObject *
+floatsegmenttree_query(FloatSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    double res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _floatsegmenttree_query(self, left, right)));
+
     PyObject *respy = PyFloat_FromDouble(res);
     return respy;
 }
 
+/*
+    Writes the results of the queries on the intervals [starts[i], ends[i]) into `results`.
+    Returns the number of the first invalid interval or -1, doesn't use the Python API.
+*/
+static Py_ssize_t
+_floatsegmenttree_query_many(FloatSegmentTreeObject *self, Py_buffer *starts, Py_buffer *ends,
+                             double *results, Py_ssize_t count, bool *empty)
+{
+    for (Py_ssize_t i = 0; i < count; i++) {
+        int overflow = 0;
+        long long left = buffer_get_integer(starts, i, &overflow);
+        long long right = buffer_get_integer(ends, i, &overflow);
+
+        if (overflow || left < 0 || right > self->size) {
+            return i;
+        }
+        if (left >= right) {
+            *empty = true;
+            return i;
+        }
+
+        SEQLOCK_READ(self->seq, results[i] = _floatsegmenttree_query(self, (Py_ssize_t)left, (Py_ssize_t)right));
+    }
+    return -1;
+}
 
 static PyObject *
-floatsegmenttree_update(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+floatsegmenttree_query_many(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
 {
-    static char *kwlist[] = {"i", "value", NULL};
-    Py_ssize_t i;
-    double value;
+    static char *kwlist[] = {"starts", "ends", "out", NULL};
+    PyObject *starts_obj, *ends_obj, *out_obj = Py_None;
+    Py_buffer starts, ends, out;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nd|", kwlist,
-                                     &i, &value))
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|O", kwlist,
+                                     &starts_obj, &ends_obj, &out_obj))
         return NULL;
 
-    if (i > self->size - 1 || i < 0) {
-        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+    if (get_integer_buffer(starts_obj, &starts, "starts") < 0) {
+        return NULL;
+    }
+    if (get_integer_buffer(ends_obj, &ends, "ends") < 0) {
+        PyBuffer_Release(&starts);
         return NULL;
     }
 
+    Py_ssize_t count = starts.shape[0];
+    PyObject *res = NULL;
+
+    if (ends.shape[0] != count) {
+        PyErr_SetString(PyExc_ValueError, "'starts' and 'ends' must have the same length");
+        goto finally;
+    }
+
+    if (out_obj == Py_None) {
+        res = new_typed_array('d', sizeof(double), count);
+    } else {
+        Py_INCREF(out_obj);
+        res = out_obj;
+    }
+    if (res == NULL || get_output_buffer(res, &out, 'd', count) < 0) {
+        Py_CLEAR(res);
+        goto finally;
+    }
+
+    bool empty = false;
+    Py_ssize_t failed;
+
+    /* The tree can't be re-initialized while the GIL is released */
+    self->exports++;
+    TREE_RUN(&self->lock, TREE_READ, true,
+             failed = _floatsegmenttree_query_many(self, &starts, &ends, (double*) out.buf, count, &empty));
+    self->exports--;
+
+    if (failed >= 0) {
+        if (empty) {
+            PyErr_Format(PyExc_ValueError, "FloatSegmentTree interval #%zd is empty", failed);
+        } else {
+            PyErr_Format(PyExc_IndexError, "FloatSegmentTree interval #%zd out of range", failed);
+        }
+        Py_CLEAR(res);
+    }
+    PyBuffer_Release(&out);
+
+finally:
+    PyBuffer_Release(&starts);
+    PyBuffer_Release(&ends);
+    return res;
+}
+
+
+/*
+    Sets the leaf and recalculates its ancestors. Returns false if the index
+    is out of range, the size is checked under the lock as well.
+*/
+static bool
+_floatsegmenttree_update(FloatSegmentTreeObject *self, Py_ssize_t i, double value)
+{
     Py_ssize_t parent, indx;
     double left_child = 0, right_child = 0;
 
-    indx = i + self->size;
+    if (i >= self->size) {
+        return false;
+    }
+    seqlock_write_begin(self->seq);
+    indx = i + self->capacity;
     self->tree[indx] = value;
     parent = indx >> 1;
 
@@ -207,6 +412,9 @@ floatsegmenttree_update(FloatSegmentTreeObject *self, PyObject *args, PyObject *
             case Sum:
                 self->tree[parent] = left_child + right_child;
                 break;
+            case Product:
+                self->tree[parent] = left_child * right_child;
+                break;
             case Min:
                 self->tree[parent] = MIN(left_child, right_child);
                 break;
@@ -215,23 +423,1108 @@ floatsegmenttree_update(FloatSegmentTreeObject *self, PyObject *args, PyObject *
                 break;
             default:
                 Py_UNREACHABLE();
-                return NULL;
         }
         parent >>= 1;
     }
+    seqlock_write_end(self->seq);
+    return true;
+}
+
+static PyObject *
+floatsegmenttree_update(FloatSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    double value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || double_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+        return NULL;
+    }
+
+    if (storage_check_writable(&self->storage, "FloatSegmentTree") < 0) {
+        return NULL;
+    }
+
+    bool updated;
+    TREE_RUN(&self->lock, TREE_WRITE, false, updated = _floatsegmenttree_update(self, i, value));
+
+    if (!updated) {
+        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+        return NULL;
+    }
 
+    if (self->sync && storage_flush(&self->storage) < 0) {
+        return NULL;
+    }
     Py_RETURN_NONE;
 }
 
-static PyMappingMethods floatsegmenttree_mapping = {
-    .mp_length = (lenfunc)floatsegmenttree_mp_len,
+/*
+    Writes the validated batch into the leaves at `indices` and recalculates every
+    dirty ancestor exactly once. The indices are checked against the size and turned
+    into the nodes in place under the lock, as a concurrent `pop` could shrink the tree.
+    Returns false if an index is out of range, doesn't use the Python API.
+*/
+static bool
+_floatsegmenttree_update_nodes(FloatSegmentTreeObject *self, Py_ssize_t *nodes, Py_buffer *values, Py_ssize_t count)
+{
+    for (Py_ssize_t i = 0; i < count; i++) {
+        if (nodes[i] >= self->size) {
+            return false;
+        }
+        nodes[i] += self->capacity;
+    }
+
+    /* Write all leaves first, the last value wins for duplicated indices */
+    seqlock_write_begin(self->seq);
+    for (Py_ssize_t i = 0; i < count; i++) {
+        self->tree[nodes[i]] = buffer_get_double(values, i);
+    }
+
+    DirtyQueue queue = {nodes, MAX(count, 1), 0, dirty_queue_init(nodes, count)};
+    Py_ssize_t node;
+
+    while ((node = dirty_queue_next(&queue)) > 0) {
+        if (node >= self->capacity) {
+            continue;
+        }
+
+        double left_child = self->tree[node << 1];
+        double right_child = self->tree[node << 1 | 1];
+
+        switch(self->func) {
+            case Sum:
+                self->tree[node] = left_child + right_child;
+                break;
+            case Product:
+                self->tree[node] = left_child * right_child;
+                break;
+            case Min:
+                self->tree[node] = MIN(left_child, right_child);
+                break;
+            case Max:
+                self->tree[node] = MAX(left_child, right_child);
+                break;
+            default:
+                Py_UNREACHABLE();
+        }
+    }
+    seqlock_write_end(self->seq);
+    return true;
+}
+
+static PyObject *
+floatsegmenttree_update_many(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"indices", "values", NULL};
+    PyObject *indices_obj, *values_obj;
+    Py_buffer indices, values;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|", kwlist,
+                                     &indices_obj, &values_obj))
+        return NULL;
+
+    if (storage_check_writable(&self->storage, "FloatSegmentTree") < 0) {
+        return NULL;
+    }
+    if (get_integer_buffer(indices_obj, &indices, "indices") < 0) {
+        return NULL;
+    }
+    if (get_number_buffer(values_obj, &values, "values") < 0) {
+        PyBuffer_Release(&indices);
+        return NULL;
+    }
+
+    Py_ssize_t count = indices.shape[0];
+    Py_ssize_t *nodes = NULL;
+    PyObject *res = NULL;
+
+    if (values.shape[0] != count) {
+        PyErr_SetString(PyExc_ValueError, "'indices' and 'values' must have the same length");
+        goto finally;
+    }
+
+    nodes = (Py_ssize_t*) PyMem_Malloc(sizeof(Py_ssize_t) * MAX(count, 1));
+    if (nodes == NULL) {
+        PyErr_NoMemory();
+        goto finally;
+    }
+
+    /* Validate the whole batch before touching the tree */
+    for (Py_ssize_t i = 0; i < count; i++) {
+        int overflow = 0;
+        long long indx = buffer_get_integer(&indices, i, &overflow);
+
+        if (overflow || indx > PY_SSIZE_T_MAX || indx < 0) {
+            PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+            goto finally;
+        }
+        nodes[i] = (Py_ssize_t)indx;
+    }
+
+    bool updated;
+    TREE_RUN(&self->lock, TREE_WRITE, false, updated = _floatsegmenttree_update_nodes(self, nodes, &values, count));
+
+    if (!updated) {
+        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+        goto finally;
+    }
+
+    if (self->sync && storage_flush(&self->storage) < 0) {
+        goto finally;
+    }
+
+    Py_INCREF(Py_None);
+    res = Py_None;
+
+finally:
+    PyMem_Free(nodes);
+    PyBuffer_Release(&indices);
+    PyBuffer_Release(&values);
+    return res;
+}
+
+/*
+    Recalculates the ancestors of the leaf nodes [first, last] level by level.
+    Ancestors of the contiguous leaves are contiguous at every level, and every node
+    is recalculated after its children, so it takes O(K + Log[N]) for K leaves.
+    Doesn't use the Python API.
+*/
+static void
+_floatsegmenttree_pull(FloatSegmentTreeObject *self, Py_ssize_t first, Py_ssize_t last)
+{
+    for (first >>= 1, last >>= 1; last > 0; first >>= 1, last >>= 1) {
+        for (Py_ssize_t node = MAX(first, 1); node <= last; node++) {
+            self->tree[node] = float_combine(self->func, self->tree[node << 1], self->tree[node << 1 | 1]);
+        }
+    }
+}
+
+/*
+    Moves the leaves into the new node array with room for `capacity` leaves and rebuilds it,
+    the unused leaves hold the identity. Returns -1 if there is no memory leaving the tree unchanged,
+    doesn't use the Python API.
+*/
+static int
+_floatsegmenttree_grow(FloatSegmentTreeObject *self, Py_ssize_t capacity)
+{
+    double *tree = (double*) malloc(sizeof(double) * 2 * capacity);
+    if (tree == NULL) {
+        return -1;
+    }
+
+    double identity = float_identity(self->func);
+
+    tree[0] = 0;
+    memcpy(tree + capacity, self->tree + self->capacity, sizeof(double) * self->size);
+    for (Py_ssize_t i = capacity + self->size; i < 2 * capacity; i++) {
+        tree[i] = identity;
+    }
+    for (Py_ssize_t i = capacity - 1; i > 0; i--) {
+        tree[i] = float_combine(self->func, tree[i << 1], tree[i << 1 | 1]);
+    }
+
+    free(self->tree);
+    self->tree = tree;
+    self->capacity = capacity;
+    return 0;
+}
+
+/*
+    Appends the leaves, doubling the capacity if they don't fit, so the build pass
+    is paid only on growth. Returns -1 if there is no memory leaving the tree unchanged,
+    doesn't use the Python API.
+*/
+static int
+_floatsegmenttree_push(FloatSegmentTreeObject *self, const double *values, Py_ssize_t count)
+{
+    Py_ssize_t size = self->size + count;
+
+    if (size > self->capacity && _floatsegmenttree_grow(self, MAX(size, 2 * self->capacity)) < 0) {
+        return -1;
+    }
+    if (count == 0) {
+        return 0;
+    }
+
+    Py_ssize_t first = self->capacity + self->size;
+    memcpy(self->tree + first, values, sizeof(double) * count);
+    _floatsegmenttree_pull(self, first, first + count - 1);
+    self->size = size;
+    return 0;
+}
+
+/* Replaces the last leaf with the identity and returns its value */
+static double
+_floatsegmenttree_pop(FloatSegmentTreeObject *self)
+{
+    Py_ssize_t leaf = self->capacity + self->size - 1;
+    double value = self->tree[leaf];
+
+    self->tree[leaf] = float_identity(self->func);
+    _floatsegmenttree_pull(self, leaf, leaf);
+    self->size--;
+    return value;
+}
+
+/* Only the trees owning their memory can change the size */
+static int
+_floatsegmenttree_check_resizable(FloatSegmentTreeObject *self, Py_ssize_t count)
+{
+    if (self->storage.obj != NULL) {
+        PyErr_SetString(PyExc_BufferError, "Attached FloatSegmentTree cannot be resized");
+        return -1;
+    }
+    /* Even `pop` would change the leaves seen through the exported views */
+    if (self->exports > 0) {
+        PyErr_SetString(PyExc_BufferError, "Existing exports of data: FloatSegmentTree cannot be resized");
+        return -1;
+    }
+    if (self->size + count > self->capacity
+        && count > PY_SSIZE_T_MAX / (4 * (Py_ssize_t)sizeof(double)) - self->size) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    return 0;
+}
+
+/* Appends the values and raises the exception on failure */
+static PyObject *
+_floatsegmenttree_extend_values(FloatSegmentTreeObject *self, const double *values, Py_ssize_t count)
+{
+    if (_floatsegmenttree_check_resizable(self, count) < 0) {
+        return NULL;
+    }
+
+    /*
+        The GIL stays held while the node array may be reallocated, so no buffer
+        can be exported from the old one. Readers holding the lock don't wait for the GIL.
+    */
+    tree_lock_acquire(&self->lock, TREE_WRITE);
+    int res = _floatsegmenttree_push(self, values, count);
+    tree_lock_release(&self->lock, TREE_WRITE);
+
+    if (res < 0) {
+        return PyErr_NoMemory();
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+floatsegmenttree_append(FloatSegmentTreeObject *self, PyObject *arg)
+{
+    double value;
+
+    if (double_from_object(arg, &value) < 0) {
+        return NULL;
+    }
+    return _floatsegmenttree_extend_values(self, &value, 1);
+}
+
+static PyObject *
+floatsegmenttree_extend(FloatSegmentTreeObject *self, PyObject *arg)
+{
+    TreeSource src;
+
+    if (tree_source_open_iterable(&src, arg, true) < 0) {
+        return NULL;
+    }
+
+    double *values = (double*) PyMem_Malloc(sizeof(double) * MAX(src.size, 1));
+    if (values == NULL) {
+        tree_source_close(&src);
+        return PyErr_NoMemory();
+    }
+
+    int read = tree_source_read_doubles(&src, values);
+    Py_ssize_t count = src.size;
+
+    /* The source may be the buffer of the tree itself, it must be released before growing */
+    tree_source_close(&src);
+
+    PyObject *res = read < 0 ? NULL : _floatsegmenttree_extend_values(self, values, count);
+    PyMem_Free(values);
+    return res;
+}
+
+static PyObject *
+floatsegmenttree_pop(FloatSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    if (_floatsegmenttree_check_resizable(self, 0) < 0) {
+        return NULL;
+    }
+    if (self->size == 0) {
+        PyErr_SetString(PyExc_IndexError, "pop from empty FloatSegmentTree");
+        return NULL;
+    }
+
+    double value;
+    TREE_RUN(&self->lock, TREE_WRITE, false, value = _floatsegmenttree_pop(self));
+    return PyFloat_FromDouble(value);
+}
+
+
+/* Copies the leaves start, start + step, ... into `dest`, doesn't use the Python API */
+static void
+_floatsegmenttree_read_leaves(FloatSegmentTreeObject *self, Py_ssize_t start, Py_ssize_t step,
+                              Py_ssize_t count, double *dest)
+{
+    const double *leaves = self->tree + self->capacity;
+
+    if (step == 1) {
+        memcpy(dest, leaves + start, sizeof(double) * count);
+        return;
+    }
+    for (Py_ssize_t i = 0; i < count; i++) {
+        dest[i] = leaves[start + i * step];
+    }
+}
+
+/*
+    Writes the values into the leaves start, start + step, ... and recalculates
+    the ancestors of the touched leaves once, so it takes O(K + Log[N]) for the contiguous slice.
+    Doesn't use the Python API.
+*/
+static void
+_floatsegmenttree_assign(FloatSegmentTreeObject *self, Py_ssize_t start, Py_ssize_t step,
+                         Py_ssize_t count, const double *values)
+{
+    double *leaves = self->tree + self->capacity;
+    Py_ssize_t first, last;
+
+    sequence_slice_bounds(start, step, count, &first, &last);
+
+    seqlock_write_begin(self->seq);
+    for (Py_ssize_t i = 0; i < count; i++) {
+        leaves[start + i * step] = values[i];
+    }
+    _floatsegmenttree_pull(self, self->capacity + first, self->capacity + last);
+    seqlock_write_end(self->seq);
+}
+
+static PyObject *
+floatsegmenttree_sq_item(FloatSegmentTreeObject *self, Py_ssize_t i)
+{
+    if (i < 0 || i >= self->size) {
+        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+        return NULL;
+    }
+
+    double value;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, value = self->tree[self->capacity + i]));
+    return PyFloat_FromDouble(value);
+}
+
+/* `tree[i]` returns the leaf, `tree[start:stop:step]` returns the leaves as array('d') */
+static PyObject *
+floatsegmenttree_mp_subscript(FloatSegmentTreeObject *self, PyObject *key)
+{
+    Py_ssize_t start, step, count;
+    int kind = sequence_key_unpack(key, self->size, "FloatSegmentTree", &start, &step, &count);
+
+    if (kind < 0) {
+        return NULL;
+    }
+    if (kind == SEQUENCE_INDEX) {
+        return floatsegmenttree_sq_item(self, start);
+    }
+
+    PyObject *res = new_typed_array('d', sizeof(double), count);
+    Py_buffer out;
+
+    if (res == NULL || get_output_buffer(res, &out, 'd', count) < 0) {
+        Py_XDECREF(res);
+        return NULL;
+    }
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, _floatsegmenttree_read_leaves(self, start, step, count, (double*) out.buf)));
+    PyBuffer_Release(&out);
+    return res;
+}
+
+/* `tree[i] = value` and `tree[start:stop:step] = values`, the slice keeps its length */
+static int
+floatsegmenttree_mp_ass_subscript(FloatSegmentTreeObject *self, PyObject *key, PyObject *value)
+{
+    Py_ssize_t start, step, count;
+    double item, *values = &item;
+    int kind, res = -1;
+
+    if (value == NULL) {
+        PyErr_SetString(PyExc_TypeError, "FloatSegmentTree doesn't support item deletion");
+        return -1;
+    }
+    if ((kind = sequence_key_unpack(key, self->size, "FloatSegmentTree", &start, &step, &count)) < 0) {
+        return -1;
+    }
+    if (storage_check_writable(&self->storage, "FloatSegmentTree") < 0) {
+        return -1;
+    }
+
+    if (kind == SEQUENCE_INDEX) {
+        if (double_from_object(value, &item) < 0) {
+            return -1;
+        }
+    } else {
+        TreeSource src;
+
+        if (tree_source_open_iterable(&src, value, true) < 0) {
+            return -1;
+        }
+        if (src.size != count) {
+            PyErr_Format(PyExc_ValueError, "attempt to assign sequence of size %zd to slice of size %zd",
+                         src.size, count);
+            tree_source_close(&src);
+            return -1;
+        }
+
+        values = (double*) PyMem_Malloc(sizeof(double) * MAX(count, 1));
+        if (values == NULL) {
+            tree_source_close(&src);
+            PyErr_NoMemory();
+            return -1;
+        }
+
+        int read = tree_source_read_doubles(&src, values);
+        tree_source_close(&src);
+        if (read < 0) {
+            goto finally;
+        }
+        if (count == 0) {
+            res = 0;
+            goto finally;
+        }
+    }
+
+    TREE_RUN(&self->lock, TREE_WRITE, false, _floatsegmenttree_assign(self, start, step, count, values));
+
+    if (self->sync && storage_flush(&self->storage) < 0) {
+        goto finally;
+    }
+    res = 0;
+
+finally:
+    if (values != &item) {
+        PyMem_Free(values);
+    }
+    return res;
+}
+
+/* Iterates over the leaves through `tree[i]`, so no buffer is exported */
+static PyObject *
+floatsegmenttree_iter(FloatSegmentTreeObject *self)
+{
+    return PySeqIter_New((PyObject *)self);
+}
+
+
+static Py_ssize_t
+_floatsegmenttree_query_arg(FloatSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right, double *value)
+{
+    Py_ssize_t nodes[CANONICAL_NODES_MAX];
+    int count = canonical_nodes(left, right, self->capacity, nodes);
+
+    *value = _floatsegmenttree_query(self, left, right);
+    for (int i = 0; i < count; i++) {
+        Py_ssize_t node = nodes[i];
+
+        if (self->tree[node] != *value) {
+            continue;
+        }
+
+        while (node < self->capacity) {
+            node <<= 1;
+            if (self->tree[node] != *value) {
+                node++;
+            }
+        }
+        return node - self->capacity;
+    }
+    return -1;
+}
+
+/*
+    Finds the leftmost index of the extreme value on the interval [left, right).
+    The value is found by the regular query first, then the first canonical node
+    holding it is descended to the leaf, so no additional memory is needed.
+*/
+static PyObject *
+floatsegmenttree_query_arg(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"start", "end", NULL};
+    Py_ssize_t left, right;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nn|", kwlist,
+                                     &left, &right))
+        return NULL;
+
+    if (self->func != Min && self->func != Max) {
+        PyErr_SetString(PyExc_ValueError, "query_arg is supported only for 'min' and 'max' trees");
+        return NULL;
+    }
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+    if (right > self->size) {
+        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+        return NULL;
+    }
+
+    double value;
+    Py_ssize_t res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _floatsegmenttree_query_arg(self, left, right, &value)));
+
+    if (res < 0) {
+        /* Unreachable unless the tree contains NaN values */
+        Py_RETURN_NONE;
+    }
+    return Py_BuildValue("(nN)", res, PyFloat_FromDouble(value));
+}
+
+static inline double
+_floatsegmenttree_search_combine(FloatSegmentTreeObject *self, double left, double right)
+{
+    switch(self->func) {
+        case Sum:
+            return left + right;
+        case Min:
+            return MIN(left, right);
+        case Max:
+            return MAX(left, right);
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+/*
+    Checks if the aggregated value satisfies the threshold of the search methods:
+    the sum or the maximum must not exceed it, the minimum must not fall below it.
+*/
+static inline bool
+_floatsegmenttree_within(FloatSegmentTreeObject *self, double value, double threshold)
+{
+    return self->func == Min ? value >= threshold : value <= threshold;
+}
+
+/* Thresholds are meaningful only for the monotone functions */
+static int
+_floatsegmenttree_check_search(FloatSegmentTreeObject *self, const char *method)
+{
+    if (self->func != Sum && self->func != Min && self->func != Max) {
+        PyErr_Format(PyExc_ValueError, "%s is supported only for 'sum', 'min' and 'max' trees", method);
+        return -1;
+    }
+    return 0;
+}
+
+/* Returns the largest end, such that [start, end) satisfies the threshold */
+static Py_ssize_t
+_floatsegmenttree_max_right(FloatSegmentTreeObject *self, Py_ssize_t start, double threshold)
+{
+    Py_ssize_t nodes[CANONICAL_NODES_MAX];
+    int count = canonical_nodes(start, self->size, self->capacity, nodes);
+    bool empty = true;
+    double acc = 0;
+
+    for (int i = 0; i < count; i++) {
+        Py_ssize_t node = nodes[i];
+        double candidate = empty ? self->tree[node] : _floatsegmenttree_search_combine(self, acc, self->tree[node]);
+
+        if (_floatsegmenttree_within(self, candidate, threshold)) {
+            acc = candidate;
+            empty = false;
+            continue;
+        }
+
+        /* The answer is inside this node, descend to the leaf */
+        while (node < self->capacity) {
+            node <<= 1;
+            candidate = empty ? self->tree[node] : _floatsegmenttree_search_combine(self, acc, self->tree[node]);
+
+            if (_floatsegmenttree_within(self, candidate, threshold)) {
+                acc = candidate;
+                empty = false;
+                node++;
+            }
+        }
+        return node - self->capacity;
+    }
+    return self->size;
+}
+
+/* Returns the smallest start, such that [start, end) satisfies the threshold */
+static Py_ssize_t
+_floatsegmenttree_min_left(FloatSegmentTreeObject *self, Py_ssize_t end, double threshold)
+{
+    Py_ssize_t nodes[CANONICAL_NODES_MAX];
+    int count = canonical_nodes(0, end, self->capacity, nodes);
+    bool empty = true;
+    double acc = 0;
+
+    for (int i = count - 1; i >= 0; i--) {
+        Py_ssize_t node = nodes[i];
+        double candidate = empty ? self->tree[node] : _floatsegmenttree_search_combine(self, self->tree[node], acc);
+
+        if (_floatsegmenttree_within(self, candidate, threshold)) {
+            acc = candidate;
+            empty = false;
+            continue;
+        }
+
+        /* The answer is inside this node, descend to the leaf */
+        while (node < self->capacity) {
+            node = node << 1 | 1;
+            candidate = empty ? self->tree[node] : _floatsegmenttree_search_combine(self, self->tree[node], acc);
+
+            if (_floatsegmenttree_within(self, candidate, threshold)) {
+                acc = candidate;
+                empty = false;
+                node--;
+            }
+        }
+        return node + 1 - self->capacity;
+    }
+    return 0;
+}
+
+static PyObject *
+floatsegmenttree_max_right(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"start", "threshold", NULL};
+    Py_ssize_t start;
+    double threshold;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nd|", kwlist,
+                                     &start, &threshold))
+        return NULL;
+
+    if (_floatsegmenttree_check_search(self, "max_right") < 0) {
+        return NULL;
+    }
+
+    if (start > self->size || start < 0) {
+        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+        return NULL;
+    }
+
+    Py_ssize_t res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _floatsegmenttree_max_right(self, start, threshold)));
+    return PyLong_FromSsize_t(res);
+}
+
+static PyObject *
+floatsegmenttree_min_left(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"end", "threshold", NULL};
+    Py_ssize_t end;
+    double threshold;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nd|", kwlist,
+                                     &end, &threshold))
+        return NULL;
+
+    if (_floatsegmenttree_check_search(self, "min_left") < 0) {
+        return NULL;
+    }
+
+    if (end > self->size || end < 0) {
+        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+        return NULL;
+    }
+
+    Py_ssize_t res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _floatsegmenttree_min_left(self, end, threshold)));
+    return PyLong_FromSsize_t(res);
+}
+
+static PyObject *
+floatsegmenttree_find_first(FloatSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"start", "threshold", NULL};
+    Py_ssize_t start;
+    double threshold;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nd|", kwlist,
+                                     &start, &threshold))
+        return NULL;
+
+    if (_floatsegmenttree_check_search(self, "find_first") < 0) {
+        return NULL;
+    }
+
+    if (start > self->size || start < 0) {
+        PyErr_SetString(PyExc_IndexError, "FloatSegmentTree index out of range");
+        return NULL;
+    }
+
+    Py_ssize_t res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _floatsegmenttree_max_right(self, start, threshold)));
+    if (res == self->size) {
+        Py_RETURN_NONE;
+    }
+    return PyLong_FromSsize_t(res);
+}
+
+static Py_ssize_t floatsegmenttree_itemsize = sizeof(double);
+
+/*
+    Exports the whole read-only node array of 2 * N items.
+    The tree leaves are located in the second half of the array.
+*/
+static int
+floatsegmenttree_getbuffer(FloatSegmentTreeObject *self, Py_buffer *view, int flags)
+{
+    if (flags & PyBUF_WRITABLE) {
+        PyErr_SetString(PyExc_BufferError, "FloatSegmentTree buffer is read-only");
+        view->obj = NULL;
+        return -1;
+    }
+
+    self->export_shape = 2 * self->capacity;
+
+    view->buf = self->tree;
+    view->obj = (PyObject *)self;
+    Py_INCREF(self);
+    view->len = self->export_shape * floatsegmenttree_itemsize;
+    view->readonly = 1;
+    view->itemsize = floatsegmenttree_itemsize;
+    view->format = (flags & PyBUF_FORMAT) ? "d" : NULL;
+    view->ndim = 1;
+    view->shape = (flags & PyBUF_ND) ? &self->export_shape : NULL;
+    view->strides = (flags & PyBUF_STRIDES) ? &floatsegmenttree_itemsize : NULL;
+    view->suboffsets = NULL;
+    view->internal = NULL;
+
+    self->exports++;
+    return 0;
+}
+
+static void
+floatsegmenttree_releasebuffer(FloatSegmentTreeObject *self, Py_buffer *view)
+{
+    self->exports--;
+}
+
+static PyObject *
+floatsegmenttree_nodes(FloatSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return PyMemoryView_FromObject((PyObject *)self);
+}
+
+static PyObject *
+floatsegmenttree_leaves(FloatSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *nodes = PyMemoryView_FromObject((PyObject *)self);
+    if (nodes == NULL) {
+        return NULL;
+    }
+
+    PyObject *leaves = PySequence_GetSlice(nodes, self->capacity, self->capacity + self->size);
+    Py_DECREF(nodes);
+    return leaves;
+}
+
+/* Creates the tree copying the node array, no build pass is needed */
+static PyObject *
+_floatsegmenttree_from_nodes(PyTypeObject *type, enum QueryFunc func,
+                        const char *nodes, Py_ssize_t size, int threadsafe)
+{
+    FloatSegmentTreeObject *self = (FloatSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    if (tree_lock_init(&self->lock, threadsafe || TREE_LOCK_DEFAULT) < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    self->tree = (double*) malloc(sizeof(double) * 2 * MAX(size, 1));
+    if (self->tree == NULL) {
+        Py_DECREF(self);
+        return PyErr_NoMemory();
+    }
+    self->tree[0] = 0;
+    memcpy(self->tree, nodes, sizeof(double) * 2 * size);
+    self->size = size;
+    self->capacity = size;
+    self->func = func;
+
+    return (PyObject *)self;
+}
+
+/*
+    Writes the node array of the tree without the unused leaves into `nodes`,
+    the grown tree is rebuilt as if it had exactly `size` leaves, doesn't use the Python API.
+*/
+static void
+_floatsegmenttree_compact(FloatSegmentTreeObject *self, double *nodes)
+{
+    Py_ssize_t size = self->size;
+
+    if (self->capacity == size) {
+        memcpy(nodes, self->tree, sizeof(double) * 2 * size);
+        return;
+    }
+
+    nodes[0] = 0;
+    memcpy(nodes + size, self->tree + self->capacity, sizeof(double) * size);
+    for (Py_ssize_t i = size - 1; i > 0; i--) {
+        nodes[i] = float_combine(self->func, nodes[i << 1], nodes[i << 1 | 1]);
+    }
+}
+
+/* Returns the bytes with the compact node array placed after `offset` bytes */
+static PyObject *
+_floatsegmenttree_dump(FloatSegmentTreeObject *self, Py_ssize_t offset)
+{
+    PyObject *res = PyBytes_FromStringAndSize(NULL, offset + sizeof(double) * 2 * self->size);
+    if (res == NULL) {
+        return NULL;
+    }
+
+    double *nodes = (double *)(PyBytes_AS_STRING(res) + offset);
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, _floatsegmenttree_compact(self, nodes)));
+    return res;
+}
+
+static PyObject *
+floatsegmenttree_to_bytes(FloatSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    SnapshotHeader header;
+
+    PyObject *res = _floatsegmenttree_dump(self, sizeof(SnapshotHeader));
+    if (res == NULL) {
+        return NULL;
+    }
+
+    snapshot_header_fill(&header, 'd', self->func, self->size);
+    memcpy(PyBytes_AS_STRING(res), &header, sizeof(SnapshotHeader));
+    return res;
+}
+
+static PyObject *
+floatsegmenttree_from_bytes(PyTypeObject *type, PyObject *data)
+{
+    Py_buffer view;
+    SnapshotHeader header;
+
+    if (PyObject_GetBuffer(data, &view, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+
+    PyObject *res = NULL;
+    if (snapshot_header_parse(&view, &header, 'd', sizeof(double), "FloatSegmentTree") == 0) {
+        res = _floatsegmenttree_from_nodes(type, (enum QueryFunc)header.func,
+                                      (const char *)view.buf + sizeof(SnapshotHeader),
+                                      (Py_ssize_t)header.size, 0);
+    }
+
+    PyBuffer_Release(&view);
+    return res;
+}
+
+/* Reconstructor used by pickle, `nodes` may be an out-of-band buffer */
+static PyObject *
+floatsegmenttree_restore(PyTypeObject *type, PyObject *args)
+{
+    int func;
+    Py_buffer view;
+    int threadsafe = 0;
+
+    if (!PyArg_ParseTuple(args, "iy*|p", &func, &view, &threadsafe))
+        return NULL;
+
+    PyObject *res = NULL;
+    if (func < Sum || func > FLOAT_QUERY_FUNC_MAX || view.len % (2 * sizeof(double)) != 0) {
+        PyErr_SetString(PyExc_ValueError, "Invalid FloatSegmentTree pickle data");
+    } else {
+        res = _floatsegmenttree_from_nodes(type, (enum QueryFunc)func, (const char *)view.buf,
+                                      view.len / (2 * sizeof(double)), threadsafe);
+    }
+
+    PyBuffer_Release(&view);
+    return res;
+}
+
+/*
+    Creates the tree on top of the snapshot made by `to_bytes` without copying it,
+    so attaching to the memory-mapped file touches only the pages used by queries.
+*/
+static PyObject *
+floatsegmenttree_attach(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"buffer", "sync", NULL};
+    PyObject *buffer;
+    int sync = 0;
+    SnapshotHeader header;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|p", kwlist,
+                                     &buffer, &sync))
+        return NULL;
+
+    FloatSegmentTreeObject *self = (FloatSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    if (tree_lock_init(&self->lock, TREE_LOCK_DEFAULT) < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    if (storage_open(&self->storage, buffer, sync) < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+    if (snapshot_header_parse(&self->storage, &header, 'd', sizeof(double), "FloatSegmentTree") < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    char *nodes = (char *)self->storage.buf + sizeof(SnapshotHeader);
+    if ((uintptr_t)nodes % _Alignof(double) != 0) {
+        PyErr_SetString(PyExc_ValueError, "FloatSegmentTree storage is not properly aligned");
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    self->tree = (double *)nodes;
+    self->seq = (uint64_t *)((char *)self->storage.buf + offsetof(SnapshotHeader, seq));
+    self->size = (Py_ssize_t)header.size;
+    self->capacity = self->size;
+    self->func = (enum QueryFunc)header.func;
+    self->sync = sync;
+
+    return (PyObject *)self;
+}
+
+static PyObject *
+floatsegmenttree_flush(FloatSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    if (self->storage.obj != NULL && !self->storage.readonly
+        && PyObject_HasAttrString(self->storage.obj, "flush")
+        && storage_flush(&self->storage) < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+/*
+    Pickle protocol 5 receives the node array as a PickleBuffer,
+    so it can be transferred out-of-band without copying.
+    Older protocols use the binary snapshot, or the copy of the node array
+    if the tree has the lock, which the snapshot doesn't record.
+*/
+static PyObject *
+floatsegmenttree_reduce_ex(FloatSegmentTreeObject *self, PyObject *args)
+{
+    int protocol;
+    PyObject *pickle_buffer = NULL;
+
+    if (!PyArg_ParseTuple(args, "i", &protocol))
+        return NULL;
+
+    if (protocol >= 5 || self->lock.enabled) {
+        /* The grown tree has the unused leaves, so its node array is compacted into the copy */
+        if (protocol >= 5 && self->capacity == self->size) {
+            PyObject *pickle = PyImport_ImportModule("pickle");
+            if (pickle == NULL) {
+                return NULL;
+            }
+            pickle_buffer = PyObject_CallMethod(pickle, "PickleBuffer", "O", self);
+            Py_DECREF(pickle);
+        } else {
+            pickle_buffer = _floatsegmenttree_dump(self, 0);
+        }
+        if (pickle_buffer == NULL) {
+            return NULL;
+        }
+
+        PyObject *restore = PyObject_GetAttrString((PyObject *)Py_TYPE(self), "_restore");
+        if (restore == NULL) {
+            Py_DECREF(pickle_buffer);
+            return NULL;
+        }
+        return Py_BuildValue("(N(iNO))", restore, (int)self->func, pickle_buffer,
+                             self->lock.enabled ? Py_True : Py_False);
+    }
+
+    PyObject *from_bytes = PyObject_GetAttrString((PyObject *)Py_TYPE(self), "from_bytes");
+    if (from_bytes == NULL) {
+        return NULL;
+    }
+    return Py_BuildValue("(N(N))", from_bytes, floatsegmenttree_to_bytes(self, NULL));
+}
+
+static PyBufferProcs floatsegmenttree_as_buffer = {
+    .bf_getbuffer = (getbufferproc)floatsegmenttree_getbuffer,
+    .bf_releasebuffer = (releasebufferproc)floatsegmenttree_releasebuffer,
+};
+
+static PyMappingMethods floatsegmenttree_mapping = {
+    .mp_length = (lenfunc)floatsegmenttree_mp_len,
+    .mp_subscript = (binaryfunc)floatsegmenttree_mp_subscript,
+    .mp_ass_subscript = (objobjargproc)floatsegmenttree_mp_ass_subscript,
+};
+
+static PySequenceMethods floatsegmenttree_sequence = {
+    .sq_length = (lenfunc)floatsegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)floatsegmenttree_sq_item,
 };
 
 static PyMethodDef floatsegmenttree_methods[] = {
-    {"query", (PyCFunction) floatsegmenttree_query, METH_VARARGS | METH_KEYWORDS,
+    {"query", (PyCFunction)(void(*)(void)) floatsegmenttree_query, METH_FASTCALL_KEYWORDS,
     "Performs the query operation"},
-    {"update", (PyCFunction) floatsegmenttree_update, METH_VARARGS | METH_KEYWORDS,
+    {"update", (PyCFunction)(void(*)(void)) floatsegmenttree_update, METH_FASTCALL_KEYWORDS,
     "Performs the update operation"},
+    {"query_many", (PyCFunction) floatsegmenttree_query_many, METH_VARARGS | METH_KEYWORDS,
+    "Performs the query operation for every pair of interval bounds"},
+    {"update_many", (PyCFunction) floatsegmenttree_update_many, METH_VARARGS | METH_KEYWORDS,
+    "Performs the update operation for every pair of index and value"},
+    {"query_arg", (PyCFunction) floatsegmenttree_query_arg, METH_VARARGS | METH_KEYWORDS,
+    "Finds the leftmost index and the value of the minimum or maximum on the interval"},
+    {"max_right", (PyCFunction) floatsegmenttree_max_right, METH_VARARGS | METH_KEYWORDS,
+    "Finds the largest end, such that the interval [start, end) satisfies the threshold"},
+    {"min_left", (PyCFunction) floatsegmenttree_min_left, METH_VARARGS | METH_KEYWORDS,
+    "Finds the smallest start, such that the interval [start, end) satisfies the threshold"},
+    {"find_first", (PyCFunction) floatsegmenttree_find_first, METH_VARARGS | METH_KEYWORDS,
+    "Finds the first index, where the aggregated value crosses the threshold"},
+    {"to_bytes", (PyCFunction) floatsegmenttree_to_bytes, METH_NOARGS,
+    "Returns the binary snapshot of the tree"},
+    {"from_bytes", (PyCFunction) floatsegmenttree_from_bytes, METH_O | METH_CLASS,
+    "Creates the tree from the binary snapshot"},
+    {"_restore", (PyCFunction) floatsegmenttree_restore, METH_VARARGS | METH_CLASS,
+    "Creates the tree from the node array, used by pickle"},
+    {"attach", (PyCFunction)(void(*)(void)) floatsegmenttree_attach, METH_VARARGS | METH_KEYWORDS | METH_CLASS,
+    "Creates the tree on top of the snapshot buffer without copying"},
+    {"flush", (PyCFunction) floatsegmenttree_flush, METH_NOARGS,
+    "Writes the attached storage back to the file"},
+    {"__reduce_ex__", (PyCFunction) floatsegmenttree_reduce_ex, METH_VARARGS,
+    "Helper for pickle"},
+    {"append", (PyCFunction) floatsegmenttree_append, METH_O,
+    "Appends the value to the end of the tree"},
+    {"extend", (PyCFunction) floatsegmenttree_extend, METH_O,
+    "Appends the values to the end of the tree"},
+    {"pop", (PyCFunction) floatsegmenttree_pop, METH_NOARGS,
+    "Removes and returns the last value of the tree"},
+    {"leaves", (PyCFunction) floatsegmenttree_leaves, METH_NOARGS,
+    "Returns a read-only memoryview of the tree leaves"},
+    {"nodes", (PyCFunction) floatsegmenttree_nodes, METH_NOARGS,
+    "Returns a read-only memoryview of the whole node array"},
     {NULL},  /* Sentinel */
 };
 
@@ -242,9 +1535,15 @@ static PyTypeObject floatsegmenttree_type = {
     .tp_dealloc = (destructor)floatsegmenttree_dealloc,
     .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
     .tp_doc = "FloatSegmentTree",
+    .tp_as_sequence = &floatsegmenttree_sequence,
     .tp_as_mapping = &floatsegmenttree_mapping,
+    .tp_as_buffer = &floatsegmenttree_as_buffer,
+    .tp_iter = (getiterfunc)floatsegmenttree_iter,
     .tp_methods = floatsegmenttree_methods,
     .tp_init = (initproc)floatsegmenttree_init,
     .tp_alloc = PyType_GenericAlloc,
     .tp_new = floatsegmenttree_new,
+#if PY_VERSION_HEX >= 0x03090000
+    .tp_vectorcall = floatsegmenttree_vectorcall,
+#endif
 };
@@ -0,0 +1,221 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Sparse table for the static min/max queries.
+
+    Row k of the table holds the results of the intervals [i, i + 2^k),
+    so any interval is covered by two overlapping rows' items in O(1) time.
+    It works only for the idempotent functions and doesn't support updates.
+    The table takes N * (Log[N] + 1) items, rows are stored with the stride N.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    double *table;
+    enum QueryFunc func;
+} FloatSparseTableObject;
+
+static void
+floatsparsetable_dealloc(FloatSparseTableObject* self)
+{
+    free(self->table);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+floatsparsetable_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    FloatSparseTableObject *self;
+
+    self = (FloatSparseTableObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static inline double
+_floatsparsetable_combine(enum QueryFunc func, double a, double b)
+{
+    return func == Min ? MIN(a, b) : MAX(a, b);
+}
+
+static int
+_floatsparsetable_build(FloatSparseTableObject *self, PyObject *source)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, true) < 0) {
+        return -1;
+    }
+
+    int levels = src.size > 0 ? floor_log2(src.size) + 1 : 1;
+    if (src.size > PY_SSIZE_T_MAX / (Py_ssize_t)sizeof(double) / levels) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    double *table = (double*) malloc(sizeof(double) * (src.size * levels + 1));
+    if (table == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->table);
+    self->table = table;
+    self->size = 0;
+
+    int res = tree_source_read_doubles(&src, self->table);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+
+    for (int k = 1; k < levels; k++) {
+        double *row = self->table + k * src.size;
+        double *prev = row - src.size;
+        Py_ssize_t half = (Py_ssize_t)1 << (k - 1);
+
+        for (Py_ssize_t i = 0; i + 2 * half <= src.size; i++) {
+            row[i] = _floatsparsetable_combine(self->func, prev[i], prev[i + half]);
+        }
+    }
+    self->size = src.size;
+    return 0;
+}
+
+static int
+floatsparsetable_init(FloatSparseTableObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Os", kwlist,
+                                     &source, &func))
+        return -1;
+
+    enum QueryFunc query_func;
+    if (strcmp(func, "min") == 0) {
+        query_func = Min;
+    } else if (strcmp(func, "max") == 0) {
+        query_func = Max;
+    } else {
+        PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'min' or 'max'");
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    self->func = query_func;
+    res = _floatsparsetable_build(self, source);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+floatsparsetable_mp_len(FloatSparseTableObject *self)
+{
+    return self->size;
+}
+
+static PyObject *
+floatsparsetable_query(FloatSparseTableObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    double res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        int k = floor_log2(right - left);
+        double *row = self->table + k * self->size;
+
+        res = _floatsparsetable_combine(self->func, row[left], row[right - ((Py_ssize_t)1 << k)]);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatSparseTable index out of range");
+        return NULL;
+    }
+    return PyFloat_FromDouble(res);
+}
+
+static PyObject *
+floatsparsetable_update(FloatSparseTableObject *self, PyObject *args, PyObject *kwds)
+{
+    PyErr_SetString(PyExc_TypeError, "FloatSparseTable is static, use FloatSegmentTree for updates");
+    return NULL;
+}
+
+/* `tree[i]` reads the 0-th row of the table */
+static PyObject *
+floatsparsetable_sq_item(FloatSparseTableObject *self, Py_ssize_t i)
+{
+    double res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        res = self->table[i];
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "FloatSparseTable index out of range");
+        return NULL;
+    }
+    return PyFloat_FromDouble(res);
+}
+
+static PyMappingMethods floatsparsetable_mapping = {
+    .mp_length = (lenfunc)floatsparsetable_mp_len,
+    .mp_subscript = sequence_subscript,
+};
+
+static PySequenceMethods floatsparsetable_sequence = {
+    .sq_length = (lenfunc)floatsparsetable_mp_len,
+    .sq_item = (ssizeargfunc)floatsparsetable_sq_item,
+};
+
+static PyMethodDef floatsparsetable_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) floatsparsetable_query, METH_FASTCALL_KEYWORDS,
+    "Perform query on the [start, end) interval"},
+    {"update", (PyCFunction)(void(*)(void)) floatsparsetable_update, METH_VARARGS | METH_KEYWORDS,
+    "Not supported, the table is static"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject floatsparsetable_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.FloatSparseTable",
+    sizeof(FloatSparseTableObject),
+    .tp_dealloc = (destructor)floatsparsetable_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "FloatSparseTable",
+    .tp_as_mapping = &floatsparsetable_mapping,
+    .tp_as_sequence = &floatsparsetable_sequence,
+    .tp_methods = floatsparsetable_methods,
+    .tp_init = (initproc)floatsparsetable_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = floatsparsetable_new,
+};
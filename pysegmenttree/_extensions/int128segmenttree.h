@@ -0,0 +1,14 @@
+/* Segment tree with 128-bit signed integer items, see typedsegmenttree.h */
+#include "common.h"
+
+#ifdef HAVE_INT128
+#define TYPED_NAME "Int128SegmentTree"
+#define TYPED_PREFIX int128segmenttree
+#define TYPED_T __int128
+#define TYPED_ACC __int128
+#define TYPED_KIND TYPED_SIGNED
+#define TYPED_MIN INT128_MIN_VALUE
+#define TYPED_MAX INT128_MAX_VALUE
+#define TYPED_WIDE 1
+#include "typedsegmenttree.h"
+#endif
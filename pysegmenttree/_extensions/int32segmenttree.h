@@ -0,0 +1,10 @@
+/* Segment tree with 32-bit signed integer items, see typedsegmenttree.h */
+#define TYPED_NAME "Int32SegmentTree"
+#define TYPED_PREFIX int32segmenttree
+#define TYPED_T int32_t
+#define TYPED_ACC long long
+#define TYPED_FORMAT "i"
+#define TYPED_KIND TYPED_SIGNED
+#define TYPED_MIN INT32_MIN
+#define TYPED_MAX INT32_MAX
+#include "typedsegmenttree.h"
@@ -0,0 +1,429 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Dynamic (implicit-node) segment tree over the [0, size) index space.
+
+    Nodes are created on the first update of the covered interval and are taken
+    from the arena, which grows by doubling, so the memory is proportional to
+    the number of touched leaves times Log[size]. Children are referenced by
+    their arena index, the 0-th node is the shared empty subtree holding
+    the identity element of the query function.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    IntArenaNode *nodes;
+    Py_ssize_t count;
+    Py_ssize_t capacity;
+    enum QueryFunc func;
+    bool overflow;
+} IntDynamicSegmentTreeObject;
+
+static void
+intdynamicsegmenttree_dealloc(IntDynamicSegmentTreeObject* self)
+{
+    free(self->nodes);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+intdynamicsegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    IntDynamicSegmentTreeObject *self;
+
+    self = (IntDynamicSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+        self->count = 0;
+        self->capacity = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+/* Takes the empty node from the arena, returns 0 on failure */
+static uint32_t
+_intdynamicsegmenttree_alloc(IntDynamicSegmentTreeObject *self)
+{
+    if (self->count == self->capacity) {
+        Py_ssize_t capacity = self->capacity * 2;
+        if (capacity > DYNAMIC_MAX_NODES) {
+            capacity = DYNAMIC_MAX_NODES;
+        }
+        if (capacity <= self->count) {
+            PyErr_SetString(PyExc_MemoryError, "IntDynamicSegmentTree node limit is reached");
+            return 0;
+        }
+
+        IntArenaNode *nodes = (IntArenaNode*) realloc(self->nodes, sizeof(IntArenaNode) * capacity);
+        if (nodes == NULL) {
+            PyErr_NoMemory();
+            return 0;
+        }
+        self->nodes = nodes;
+        self->capacity = capacity;
+    }
+
+    IntArenaNode *node = &self->nodes[self->count];
+    node->value = int_identity(self->func);
+    node->left = node->right = 0;
+    return (uint32_t)self->count++;
+}
+
+static int
+_intdynamicsegmenttree_reset(IntDynamicSegmentTreeObject *self, Py_ssize_t size)
+{
+    IntArenaNode *nodes = (IntArenaNode*) malloc(sizeof(IntArenaNode) * DYNAMIC_INITIAL_CAPACITY);
+    if (nodes == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->nodes);
+    self->nodes = nodes;
+    self->capacity = DYNAMIC_INITIAL_CAPACITY;
+    self->count = 0;
+
+    /* The empty subtree and the root */
+    _intdynamicsegmenttree_alloc(self);
+    _intdynamicsegmenttree_alloc(self);
+    self->size = size;
+    return 0;
+}
+
+/*
+    Sets i-th element to value, creating the missing nodes on the path.
+    New values of the path are calculated before the assignment,
+    so the tree isn't modified on overflow (except for the new empty nodes).
+*/
+static int
+_intdynamicsegmenttree_update(IntDynamicSegmentTreeObject *self, Py_ssize_t i, long long value)
+{
+    uint32_t path[DYNAMIC_MAX_DEPTH + 1];
+    bool to_left[DYNAMIC_MAX_DEPTH + 1];
+    long long values[DYNAMIC_MAX_DEPTH + 1];
+    int depth = 0;
+    Py_ssize_t lo = 0, hi = self->size;
+
+    path[0] = DYNAMIC_ROOT;
+    while (hi - lo > 1) {
+        Py_ssize_t mid = lo + (hi - lo) / 2;
+        uint32_t child;
+
+        to_left[depth] = i < mid;
+        child = to_left[depth] ? self->nodes[path[depth]].left : self->nodes[path[depth]].right;
+        if (child == 0) {
+            child = _intdynamicsegmenttree_alloc(self);
+            if (child == 0) {
+                return -1;
+            }
+            if (to_left[depth]) {
+                self->nodes[path[depth]].left = child;
+            } else {
+                self->nodes[path[depth]].right = child;
+            }
+        }
+
+        if (to_left[depth]) {
+            hi = mid;
+        } else {
+            lo = mid;
+        }
+        path[++depth] = child;
+    }
+
+    self->overflow = false;
+    values[depth] = value;
+    for (int k = depth - 1; k >= 0; k--) {
+        IntArenaNode *node = &self->nodes[path[k]];
+
+        values[k] = to_left[k]
+            ? int_combine(self->func, values[k + 1], self->nodes[node->right].value, &self->overflow)
+            : int_combine(self->func, self->nodes[node->left].value, values[k + 1], &self->overflow);
+    }
+    if (self->overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        return -1;
+    }
+
+    for (int k = 0; k <= depth; k++) {
+        self->nodes[path[k]].value = values[k];
+    }
+    return 0;
+}
+
+/* Result of the [left, right) query in the subtree of the node covering [lo, hi) */
+static long long
+_intdynamicsegmenttree_query(IntDynamicSegmentTreeObject *self, uint32_t k, Py_ssize_t lo,
+                             Py_ssize_t hi, Py_ssize_t left, Py_ssize_t right)
+{
+    if (k == 0 || (left <= lo && hi <= right)) {
+        return self->nodes[k].value;
+    }
+
+    Py_ssize_t mid = lo + (hi - lo) / 2;
+    long long res = int_identity(self->func);
+
+    if (left < mid) {
+        res = _intdynamicsegmenttree_query(self, self->nodes[k].left, lo, mid, left, right);
+    }
+    if (right > mid) {
+        res = int_combine(
+            self->func, res, _intdynamicsegmenttree_query(self, self->nodes[k].right, mid, hi, left, right),
+            &self->overflow
+        );
+    }
+    return res;
+}
+
+/* Applies the updates of the {index: value} mapping */
+static int
+_intdynamicsegmenttree_update_mapping(IntDynamicSegmentTreeObject *self, PyObject *source)
+{
+    PyObject *items = PyMapping_Items(source);
+    if (items == NULL) {
+        return -1;
+    }
+    Py_SETREF(items, PySequence_Fast(items, "'source' items must be a sequence"));
+    if (items == NULL) {
+        return -1;
+    }
+
+    for (Py_ssize_t j = 0; j < PySequence_Fast_GET_SIZE(items); j++) {
+        PyObject *item = PySequence_Fast_GET_ITEM(items, j);
+        Py_ssize_t i;
+        long long value;
+
+        if (!PyTuple_Check(item) || PyTuple_GET_SIZE(item) != 2) {
+            PyErr_SetString(PyExc_TypeError, "'source' items must be (index, value) pairs");
+            Py_DECREF(items);
+            return -1;
+        }
+        if (ssize_from_object(PyTuple_GET_ITEM(item, 0), &i) < 0
+            || longlong_from_object(PyTuple_GET_ITEM(item, 1), &value) < 0) {
+            Py_DECREF(items);
+            return -1;
+        }
+        if (i > self->size - 1 || i < 0) {
+            PyErr_SetString(PyExc_IndexError, "IntDynamicSegmentTree index out of range");
+            Py_DECREF(items);
+            return -1;
+        }
+        if (_intdynamicsegmenttree_update(self, i, value) < 0) {
+            Py_DECREF(items);
+            return -1;
+        }
+    }
+
+    Py_DECREF(items);
+    return 0;
+}
+
+static int
+intdynamicsegmenttree_init(IntDynamicSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"size", "func", "source", NULL};
+    Py_ssize_t size;
+    char* func = NULL;
+    PyObject *source = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "n|zO", kwlist,
+                                     &size, &func, &source))
+        return -1;
+
+    if (size < 0) {
+        PyErr_SetString(PyExc_ValueError, "'size' must be non-negative");
+        return -1;
+    }
+
+    enum QueryFunc query_func;
+    if (query_func_parse(func, QUERY_FUNC_MAX, &query_func) < 0) {
+        return -1;
+    }
+
+    if (source != NULL && source != Py_None && !PyObject_HasAttrString(source, "items")) {
+        PyErr_SetString(PyExc_TypeError, "'source' must be a mapping of indices to values");
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    self->func = query_func;
+    res = _intdynamicsegmenttree_reset(self, size);
+    if (res == 0 && source != NULL && source != Py_None) {
+        res = _intdynamicsegmenttree_update_mapping(self, source);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+intdynamicsegmenttree_mp_len(IntDynamicSegmentTreeObject *self)
+{
+    return self->size;
+}
+
+static PyObject *
+intdynamicsegmenttree_query(IntDynamicSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    long long res = 0;
+    bool out_of_range, overflow = false;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        self->overflow = false;
+        res = _intdynamicsegmenttree_query(self, DYNAMIC_ROOT, 0, self->size, left, right);
+        overflow = self->overflow;
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntDynamicSegmentTree index out of range");
+        return NULL;
+    }
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while calculating the query");
+        return NULL;
+    }
+    return PyLong_FromLongLong(res);
+}
+
+static PyObject *
+intdynamicsegmenttree_update(IntDynamicSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    long long value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || longlong_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntDynamicSegmentTree index out of range");
+        return NULL;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _intdynamicsegmenttree_update(self, i, value);
+    Py_END_CRITICAL_SECTION();
+    if (res < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+intdynamicsegmenttree_sizeof(IntDynamicSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return PyLong_FromSsize_t(Py_TYPE(self)->tp_basicsize + self->capacity * sizeof(IntArenaNode));
+}
+
+/* `tree[i]` descends to the leaf, the untouched ones hold the identity of func */
+static PyObject *
+intdynamicsegmenttree_sq_item(IntDynamicSegmentTreeObject *self, Py_ssize_t i)
+{
+    long long res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        res = _intdynamicsegmenttree_query(self, DYNAMIC_ROOT, 0, self->size, i, i + 1);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntDynamicSegmentTree index out of range");
+        return NULL;
+    }
+    return PyLong_FromLongLong(res);
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+intdynamicsegmenttree_sq_ass_item(IntDynamicSegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    long long item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("IntDynamicSegmentTree");
+    }
+    if (longlong_from_object(value, &item) < 0) {
+        return -1;
+    }
+
+    int res = -1;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (i < 0 || i >= self->size) {
+        PyErr_SetString(PyExc_IndexError, "IntDynamicSegmentTree index out of range");
+    } else {
+        res = _intdynamicsegmenttree_update(self, i, item);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyMappingMethods intdynamicsegmenttree_mapping = {
+    .mp_length = (lenfunc)intdynamicsegmenttree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods intdynamicsegmenttree_sequence = {
+    .sq_length = (lenfunc)intdynamicsegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)intdynamicsegmenttree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)intdynamicsegmenttree_sq_ass_item,
+};
+
+static PyMemberDef intdynamicsegmenttree_members[] = {
+    {"node_count", T_PYSSIZET, offsetof(IntDynamicSegmentTreeObject, count), READONLY,
+    "Number of the allocated nodes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef intdynamicsegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) intdynamicsegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Perform query on the [start, end) interval"},
+    {"update", (PyCFunction)(void(*)(void)) intdynamicsegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Set element with index 'i' to 'value'"},
+    {"__sizeof__", (PyCFunction) intdynamicsegmenttree_sizeof, METH_NOARGS,
+    "Size of the tree in memory, in bytes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject intdynamicsegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.IntDynamicSegmentTree",
+    sizeof(IntDynamicSegmentTreeObject),
+    .tp_dealloc = (destructor)intdynamicsegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "IntDynamicSegmentTree",
+    .tp_as_mapping = &intdynamicsegmenttree_mapping,
+    .tp_as_sequence = &intdynamicsegmenttree_sequence,
+    .tp_members = intdynamicsegmenttree_members,
+    .tp_methods = intdynamicsegmenttree_methods,
+    .tp_init = (initproc)intdynamicsegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = intdynamicsegmenttree_new,
+};
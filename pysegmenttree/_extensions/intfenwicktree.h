@@ -0,0 +1,359 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Fenwick tree (binary indexed tree), supports only the sum queries.
+
+    The tree takes N + 1 items instead of 2 * N: node k (1-based) holds the sum
+    of the elements (k - lowbit(k), k], the 0-th node is unused.
+    Every node is checked for overflow on build and update. Prefix sums are
+    calculated modulo 2^64, so the query result is correct whenever it fits
+    into `long long`, even if the prefix sums themselves overflow.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    long long *tree;
+} IntFenwickTreeObject;
+
+#ifndef LOWBIT
+#define LOWBIT(k) ((k) & -(k))
+#endif
+
+static void
+intfenwicktree_dealloc(IntFenwickTreeObject* self)
+{
+    free(self->tree);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+intfenwicktree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    IntFenwickTreeObject *self;
+
+    self = (IntFenwickTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static int
+_intfenwicktree_build(IntFenwickTreeObject *self, PyObject *source)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, false) < 0) {
+        return -1;
+    }
+
+    long long *tree = (long long*) malloc(sizeof(long long) * (src.size + 1));
+    if (tree == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->tree);
+    self->tree = tree;
+    self->size = 0;
+    self->tree[0] = 0;
+
+    int res = tree_source_read_ints(&src, self->tree + 1);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+
+    /* O(N) build: every node pushes its sum to the parent */
+    for (Py_ssize_t k = 1; k <= src.size; k++) {
+        Py_ssize_t parent = k + LOWBIT(k);
+
+        if (parent <= src.size
+            && __builtin_saddll_overflow(self->tree[parent], self->tree[k], &self->tree[parent])) {
+            PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+            return -1;
+        }
+    }
+    self->size = src.size;
+    return 0;
+}
+
+static int
+intfenwicktree_init(IntFenwickTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|s", kwlist,
+                                     &source, &func))
+        return -1;
+
+    if (func != NULL && strcmp(func, "sum") != 0) {
+        PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, IntFenwickTree supports only 'sum'");
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _intfenwicktree_build(self, source);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+intfenwicktree_mp_len(IntFenwickTreeObject *self)
+{
+    return self->size;
+}
+
+/* Sum of the first `count` elements modulo 2^64 */
+static inline unsigned long long
+_intfenwicktree_prefix(IntFenwickTreeObject *self, Py_ssize_t count)
+{
+    unsigned long long res = 0;
+
+    for (Py_ssize_t k = count; k > 0; k -= LOWBIT(k)) {
+        res += (unsigned long long)self->tree[k];
+    }
+    return res;
+}
+
+/* Restores the element from the nodes in O(Log[N]) */
+static long long
+_intfenwicktree_get(IntFenwickTreeObject *self, Py_ssize_t i)
+{
+    Py_ssize_t k = i + 1;
+    Py_ssize_t stop = k - LOWBIT(k);
+    unsigned long long res = (unsigned long long)self->tree[k];
+
+    for (k--; k > stop; k -= LOWBIT(k)) {
+        res -= (unsigned long long)self->tree[k];
+    }
+    return (long long)res;
+}
+
+/* Adds delta to the element, the tree isn't modified if any node overflows */
+static PyObject *
+_intfenwicktree_add(IntFenwickTreeObject *self, Py_ssize_t i, long long delta, bool set)
+{
+    long long res;
+
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntFenwickTree index out of range");
+        return NULL;
+    }
+
+    if (set) {
+        /* delta holds the new value here */
+        long long old = _intfenwicktree_get(self, i);
+        res = (long long)((unsigned long long)delta - (unsigned long long)old);
+        if ((delta < 0) != (old < 0) && (res < 0) != (delta < 0)) {
+            PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+            return NULL;
+        }
+        delta = res;
+    }
+
+    for (Py_ssize_t k = i + 1; k <= self->size; k += LOWBIT(k)) {
+        if (__builtin_saddll_overflow(self->tree[k], delta, &res)) {
+            PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+            return NULL;
+        }
+    }
+    for (Py_ssize_t k = i + 1; k <= self->size; k += LOWBIT(k)) {
+        self->tree[k] += delta;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+intfenwicktree_query(IntFenwickTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    unsigned long long res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        res = _intfenwicktree_prefix(self, right) - _intfenwicktree_prefix(self, left);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntFenwickTree index out of range");
+        return NULL;
+    }
+    return PyLong_FromLongLong((long long)res);
+}
+
+static PyObject *
+intfenwicktree_update(IntFenwickTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    long long value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || longlong_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _intfenwicktree_add(self, i, value, true);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyObject *
+intfenwicktree_add(IntFenwickTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "delta"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    long long delta;
+
+    if (fastcall_unpack("add", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || longlong_from_object(argv[1], &delta) < 0)
+        return NULL;
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _intfenwicktree_add(self, i, delta, false);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+/*
+    Finds the smallest index i, such that the sum of the elements [0, i] is not less than value.
+    Descends from the highest power of two, so it takes O(Log[N]) time.
+    Elements must be non-negative, otherwise the prefix sums aren't monotone.
+*/
+static PyObject *
+intfenwicktree_lower_bound(IntFenwickTreeObject *self, PyObject *arg)
+{
+    long long value;
+
+    if (longlong_from_object(arg, &value) < 0) {
+        return NULL;
+    }
+
+    Py_ssize_t pos = 0;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    Py_ssize_t step = 1;
+    while (step <= self->size / 2) {
+        step <<= 1;
+    }
+
+    unsigned long long rest = (unsigned long long)value;
+
+    for (; step > 0 && self->size > 0; step >>= 1) {
+        Py_ssize_t next = pos + step;
+
+        if (next <= self->size && self->tree[next] < (long long)rest) {
+            pos = next;
+            rest -= (unsigned long long)self->tree[next];
+        }
+    }
+    Py_END_CRITICAL_SECTION();
+    return PyLong_FromSsize_t(pos);
+}
+
+/* `tree[i]` restores the element from the nodes in O(Log[N]) */
+static PyObject *
+intfenwicktree_sq_item(IntFenwickTreeObject *self, Py_ssize_t i)
+{
+    long long res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        res = _intfenwicktree_get(self, i);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntFenwickTree index out of range");
+        return NULL;
+    }
+    return PyLong_FromLongLong(res);
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+intfenwicktree_sq_ass_item(IntFenwickTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    long long item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("IntFenwickTree");
+    }
+    if (longlong_from_object(value, &item) < 0) {
+        return -1;
+    }
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _intfenwicktree_add(self, i, item, true);
+    Py_END_CRITICAL_SECTION();
+    return sequence_status(res);
+}
+
+static PyMappingMethods intfenwicktree_mapping = {
+    .mp_length = (lenfunc)intfenwicktree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods intfenwicktree_sequence = {
+    .sq_length = (lenfunc)intfenwicktree_mp_len,
+    .sq_item = (ssizeargfunc)intfenwicktree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)intfenwicktree_sq_ass_item,
+};
+
+static PyMethodDef intfenwicktree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) intfenwicktree_query, METH_FASTCALL_KEYWORDS,
+    "Perform sum query on the [start, end) interval"},
+    {"update", (PyCFunction)(void(*)(void)) intfenwicktree_update, METH_FASTCALL_KEYWORDS,
+    "Set element with index 'i' to 'value'"},
+    {"add", (PyCFunction)(void(*)(void)) intfenwicktree_add, METH_FASTCALL_KEYWORDS,
+    "Add 'delta' to the element with index 'i'"},
+    {"lower_bound", (PyCFunction) intfenwicktree_lower_bound, METH_O,
+    "Find the first index where the prefix sum reaches 'value'"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject intfenwicktree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.IntFenwickTree",
+    sizeof(IntFenwickTreeObject),
+    .tp_dealloc = (destructor)intfenwicktree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "IntFenwickTree",
+    .tp_as_mapping = &intfenwicktree_mapping,
+    .tp_as_sequence = &intfenwicktree_sequence,
+    .tp_methods = intfenwicktree_methods,
+    .tp_init = (initproc)intfenwicktree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = intfenwicktree_new,
+};
@@ -0,0 +1,594 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Segment tree with lazy propagation.
+
+    Unlike IntSegmentTree the number of leaves is rounded up to the power of two
+    (capacity), so every internal node covers a contiguous range of 2^k leaves.
+    The padding leaves hold the identity element of the query function.
+    Internal nodes store a pending operation (tag) which hasn't been applied
+    to their children yet.
+
+    Every write made by the operation is recorded in the undo journal first,
+    so the operation failed with the overflow is rolled back completely.
+*/
+enum LazyUndoKind {
+    UndoTree = 0,
+    UndoLazy,
+    UndoTag,
+};
+
+typedef struct {
+    Py_ssize_t index;
+    long long value;
+    char kind;
+} LazyUndo;
+
+/*
+    The operation writes at most 22 * log + 6 fields: 7 per push of the bounds,
+    3 per applied node and 1 per pulled node on both borders of the interval.
+*/
+#define LAZY_UNDO_CAPACITY(log) (24 * ((Py_ssize_t)(log) + 1))
+
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    Py_ssize_t capacity;
+    int log;
+    long long *tree;
+    long long *lazy;
+    char *tag;
+    enum QueryFunc func;
+    bool overflow;
+    /* Journal of the previous values overwritten by the current operation */
+    LazyUndo *undo;
+    Py_ssize_t undo_length;
+} IntLazySegmentTreeObject;
+
+static void
+intlazysegmenttree_dealloc(IntLazySegmentTreeObject* self)
+{
+    free(self->tree);
+    free(self->lazy);
+    free(self->tag);
+    free(self->undo);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+intlazysegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    IntLazySegmentTreeObject *self;
+
+    self = (IntLazySegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static inline long long
+_intlazysegmenttree_identity(IntLazySegmentTreeObject *self)
+{
+    switch(self->func) {
+        case Sum:
+            return 0;
+        case Min:
+            return LLONG_MAX;
+        case Max:
+            return LLONG_MIN;
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+static inline long long
+_intlazysegmenttree_combine(IntLazySegmentTreeObject *self, long long left, long long right)
+{
+    long long res = 0;
+
+    switch(self->func) {
+        case Sum:
+            if (__builtin_saddll_overflow(left, right, &res)) {
+                self->overflow = true;
+            }
+            return res;
+        case Min:
+            return MIN(left, right);
+        case Max:
+            return MAX(left, right);
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+/* Records the previous value of the field in the undo journal */
+static inline void
+_intlazysegmenttree_journal(IntLazySegmentTreeObject *self, char kind, Py_ssize_t k, long long value)
+{
+    LazyUndo *entry = &self->undo[self->undo_length++];
+
+    entry->kind = kind;
+    entry->index = k;
+    entry->value = value;
+}
+
+static inline void
+_intlazysegmenttree_set_tree(IntLazySegmentTreeObject *self, Py_ssize_t k, long long value)
+{
+    _intlazysegmenttree_journal(self, UndoTree, k, self->tree[k]);
+    self->tree[k] = value;
+}
+
+static inline void
+_intlazysegmenttree_set_lazy(IntLazySegmentTreeObject *self, Py_ssize_t k, long long value)
+{
+    _intlazysegmenttree_journal(self, UndoLazy, k, self->lazy[k]);
+    self->lazy[k] = value;
+}
+
+static inline void
+_intlazysegmenttree_set_tag(IntLazySegmentTreeObject *self, Py_ssize_t k, char tag)
+{
+    _intlazysegmenttree_journal(self, UndoTag, k, self->tag[k]);
+    self->tag[k] = tag;
+}
+
+/* Starts the operation with the empty journal and the cleared overflow flag */
+static inline void
+_intlazysegmenttree_begin(IntLazySegmentTreeObject *self)
+{
+    self->overflow = false;
+    self->undo_length = 0;
+}
+
+/* Restores the fields overwritten since `_intlazysegmenttree_begin` in the reverse order */
+static void
+_intlazysegmenttree_rollback(IntLazySegmentTreeObject *self)
+{
+    while (self->undo_length > 0) {
+        LazyUndo *entry = &self->undo[--self->undo_length];
+
+        switch(entry->kind) {
+            case UndoTree:
+                self->tree[entry->index] = entry->value;
+                break;
+            case UndoLazy:
+                self->lazy[entry->index] = entry->value;
+                break;
+            default:
+                self->tag[entry->index] = (char)entry->value;
+                break;
+        }
+    }
+}
+
+/* Recomputes k-th node using its children */
+static inline void
+_intlazysegmenttree_pull(IntLazySegmentTreeObject *self, Py_ssize_t k)
+{
+    _intlazysegmenttree_set_tree(
+        self, k, _intlazysegmenttree_combine(self, self->tree[k << 1], self->tree[k << 1 | 1]));
+}
+
+/* Applies the operation to k-th node covering `length` leaves */
+static inline void
+_intlazysegmenttree_apply(IntLazySegmentTreeObject *self, Py_ssize_t k,
+                          char tag, long long value, Py_ssize_t length)
+{
+    long long total = value, node = value, lazy;
+
+    if (self->func == Sum && __builtin_smulll_overflow(value, (long long)length, &total)) {
+        self->overflow = true;
+    }
+
+    if (self->func == Sum) {
+        node = total;
+    }
+    if (tag != AssignTag && __builtin_saddll_overflow(self->tree[k], node, &node)) {
+        self->overflow = true;
+    }
+    _intlazysegmenttree_set_tree(self, k, node);
+
+    if (k < self->capacity) {
+        if (tag == AssignTag || self->tag[k] == NoTag) {
+            _intlazysegmenttree_set_tag(self, k, tag);
+            _intlazysegmenttree_set_lazy(self, k, value);
+        } else {
+            /* An addition on top of any pending operation just shifts its value */
+            if (__builtin_saddll_overflow(self->lazy[k], value, &lazy)) {
+                self->overflow = true;
+            }
+            _intlazysegmenttree_set_lazy(self, k, lazy);
+        }
+    }
+}
+
+/* Pushes the pending operation of k-th node covering `length` leaves to its children */
+static inline void
+_intlazysegmenttree_push(IntLazySegmentTreeObject *self, Py_ssize_t k, Py_ssize_t length)
+{
+    if (self->tag[k] != NoTag) {
+        _intlazysegmenttree_apply(self, k << 1, self->tag[k], self->lazy[k], length >> 1);
+        _intlazysegmenttree_apply(self, k << 1 | 1, self->tag[k], self->lazy[k], length >> 1);
+        _intlazysegmenttree_set_tag(self, k, NoTag);
+    }
+}
+
+/* Pushes pending operations down to the boundaries of [left, right) */
+static void
+_intlazysegmenttree_push_bounds(IntLazySegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right)
+{
+    for (int i = self->log; i >= 1; i--) {
+        if (((left >> i) << i) != left) {
+            _intlazysegmenttree_push(self, left >> i, (Py_ssize_t)1 << i);
+        }
+        if (((right >> i) << i) != right) {
+            _intlazysegmenttree_push(self, (right - 1) >> i, (Py_ssize_t)1 << i);
+        }
+    }
+}
+
+/* Applies the operation to the non-empty interval [left, right) */
+static void
+_intlazysegmenttree_range_apply(IntLazySegmentTreeObject *self, Py_ssize_t left,
+                                Py_ssize_t right, char tag, long long value)
+{
+    left += self->capacity;
+    right += self->capacity;
+    _intlazysegmenttree_push_bounds(self, left, right);
+
+    Py_ssize_t l = left, r = right, length = 1;
+    while (l < r) {
+        if (l & 1) {
+            _intlazysegmenttree_apply(self, l++, tag, value, length);
+        }
+        if (r & 1) {
+            _intlazysegmenttree_apply(self, --r, tag, value, length);
+        }
+        l >>= 1;
+        r >>= 1;
+        length <<= 1;
+    }
+
+    for (int i = 1; i <= self->log; i++) {
+        if (((left >> i) << i) != left) {
+            _intlazysegmenttree_pull(self, left >> i);
+        }
+        if (((right >> i) << i) != right) {
+            _intlazysegmenttree_pull(self, (right - 1) >> i);
+        }
+    }
+}
+
+/* Allocates the tree and builds it from the source */
+static int
+_intlazysegmenttree_build(IntLazySegmentTreeObject *self, PyObject *source)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, false) < 0) {
+        return -1;
+    }
+
+    Py_ssize_t capacity = 1;
+    int log = 0;
+    while (capacity < src.size) {
+        capacity <<= 1;
+        log++;
+    }
+
+    free(self->tree);
+    free(self->lazy);
+    free(self->tag);
+    free(self->undo);
+    self->tree = (long long*) malloc(sizeof(long long) * 2 * capacity);
+    self->lazy = (long long*) malloc(sizeof(long long) * capacity);
+    self->tag = (char*) calloc(capacity, sizeof(char));
+    self->undo = (LazyUndo*) malloc(sizeof(LazyUndo) * LAZY_UNDO_CAPACITY(log));
+    self->size = 0;
+    self->capacity = capacity;
+    self->log = log;
+    self->overflow = false;
+    self->undo_length = 0;
+
+    if (self->tree == NULL || self->lazy == NULL || self->tag == NULL || self->undo == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    int res = tree_source_read_ints(&src, self->tree + capacity);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+    self->size = src.size;
+
+    long long identity = _intlazysegmenttree_identity(self);
+    for (Py_ssize_t i = capacity + self->size; i < 2 * capacity; i++) {
+        self->tree[i] = identity;
+    }
+
+    /* The failed build discards the tree anyway, so the nodes are written bypassing the journal */
+    for (Py_ssize_t i = capacity - 1; i > 0; i--) {
+        self->tree[i] = _intlazysegmenttree_combine(self, self->tree[i << 1], self->tree[i << 1 | 1]);
+    }
+
+    if (self->overflow) {
+        self->size = 0;
+        PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+        return -1;
+    }
+    return 0;
+}
+
+static int
+intlazysegmenttree_init(IntLazySegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|s", kwlist,
+                                     &source, &func))
+        return -1;
+
+    enum QueryFunc query_func;
+    if (func != NULL) {
+        if (strcmp(func, "sum") == 0) {
+            query_func = Sum;
+        } else if (strcmp(func, "min") == 0) {
+            query_func = Min;
+        } else if (strcmp(func, "max") == 0) {
+            query_func = Max;
+        } else {
+            PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'sum', 'min' or 'max'");
+            return -1;
+        }
+    } else {
+        query_func = Sum;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    self->func = query_func;
+    res = _intlazysegmenttree_build(self, source);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+intlazysegmenttree_mp_len(IntLazySegmentTreeObject *self)
+{
+    return self->size;
+}
+
+static PyObject *
+_intlazysegmenttree_query(IntLazySegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right)
+{
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+    if (right > self->size) {
+        PyErr_SetString(PyExc_IndexError, "IntLazySegmentTree index out of range");
+        return NULL;
+    }
+
+    left += self->capacity;
+    right += self->capacity;
+
+    /* Pushing the pending sums to the children may overflow, the query mustn't change the tree then */
+    _intlazysegmenttree_begin(self);
+    _intlazysegmenttree_push_bounds(self, left, right);
+    if (self->overflow) {
+        _intlazysegmenttree_rollback(self);
+        PyErr_SetString(PyExc_OverflowError, "Overflow while querying the tree");
+        return NULL;
+    }
+
+    long long res = _intlazysegmenttree_identity(self);
+
+    while (left < right) {
+        if (left & 1) {
+            res = _intlazysegmenttree_combine(self, res, self->tree[left++]);
+        }
+        if (right & 1) {
+            res = _intlazysegmenttree_combine(self, res, self->tree[--right]);
+        }
+        left >>= 1;
+        right >>= 1;
+    }
+
+    if (self->overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while querying the tree");
+        return NULL;
+    }
+    return PyLong_FromLongLong(res);
+}
+
+static PyObject *
+intlazysegmenttree_query(IntLazySegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _intlazysegmenttree_query(self, left, right);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+/* Validates the interval and applies the operation */
+static PyObject *
+_intlazysegmenttree_range_modify(IntLazySegmentTreeObject *self, Py_ssize_t left,
+                                 Py_ssize_t right, char tag, long long value)
+{
+    if (left > right || left < 0 || right > self->size) {
+        PyErr_SetString(PyExc_IndexError, "IntLazySegmentTree index out of range");
+        return NULL;
+    }
+    if (left == right) {
+        Py_RETURN_NONE;
+    }
+
+    _intlazysegmenttree_begin(self);
+    _intlazysegmenttree_range_apply(self, left, right, tag, value);
+
+    if (self->overflow) {
+        _intlazysegmenttree_rollback(self);
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+/* Shared by all modifying methods */
+static PyObject *
+_intlazysegmenttree_modify(IntLazySegmentTreeObject *self, Py_ssize_t left,
+                           Py_ssize_t right, char tag, long long value)
+{
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _intlazysegmenttree_range_modify(self, left, right, tag, value);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyObject *
+intlazysegmenttree_update(IntLazySegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    long long value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || longlong_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntLazySegmentTree index out of range");
+        return NULL;
+    }
+
+    return _intlazysegmenttree_modify(self, i, i + 1, AssignTag, value);
+}
+
+static PyObject *
+intlazysegmenttree_range_add(IntLazySegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end", "delta"};
+    PyObject *argv[3] = {NULL, NULL, NULL};
+    Py_ssize_t left, right;
+    long long delta;
+
+    if (fastcall_unpack("range_add", args, nargs, kwnames, kwlist, 3, 3, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0
+        || longlong_from_object(argv[2], &delta) < 0)
+        return NULL;
+
+    return _intlazysegmenttree_modify(self, left, right, AddTag, delta);
+}
+
+static PyObject *
+intlazysegmenttree_range_assign(IntLazySegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end", "value"};
+    PyObject *argv[3] = {NULL, NULL, NULL};
+    Py_ssize_t left, right;
+    long long value;
+
+    if (fastcall_unpack("range_assign", args, nargs, kwnames, kwlist, 3, 3, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0
+        || longlong_from_object(argv[2], &value) < 0)
+        return NULL;
+
+    return _intlazysegmenttree_modify(self, left, right, AssignTag, value);
+}
+
+/* `tree[i]` pushes the pending operations down to the leaf, same as `query(i, i + 1)` */
+static PyObject *
+intlazysegmenttree_sq_item(IntLazySegmentTreeObject *self, Py_ssize_t i)
+{
+    PyObject *res = NULL;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (i < 0 || i >= self->size) {
+        PyErr_SetString(PyExc_IndexError, "IntLazySegmentTree index out of range");
+    } else {
+        res = _intlazysegmenttree_query(self, i, i + 1);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+intlazysegmenttree_sq_ass_item(IntLazySegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    long long item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("IntLazySegmentTree");
+    }
+    if (longlong_from_object(value, &item) < 0) {
+        return -1;
+    }
+    return sequence_status(_intlazysegmenttree_modify(self, i, i + 1, AssignTag, item));
+}
+
+static PyMappingMethods intlazysegmenttree_mapping = {
+    .mp_length = (lenfunc)intlazysegmenttree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods intlazysegmenttree_sequence = {
+    .sq_length = (lenfunc)intlazysegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)intlazysegmenttree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)intlazysegmenttree_sq_ass_item,
+};
+
+static PyMethodDef intlazysegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) intlazysegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Performs the query operation"},
+    {"update", (PyCFunction)(void(*)(void)) intlazysegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Performs the update operation"},
+    {"range_add", (PyCFunction)(void(*)(void)) intlazysegmenttree_range_add, METH_FASTCALL_KEYWORDS,
+    "Adds the value to every element of the interval"},
+    {"range_assign", (PyCFunction)(void(*)(void)) intlazysegmenttree_range_assign, METH_FASTCALL_KEYWORDS,
+    "Sets every element of the interval to the value"},
+    {NULL},  /* Sentinel */
+};
+
+static PyTypeObject intlazysegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.IntLazySegmentTree",
+    sizeof(IntLazySegmentTreeObject),
+    .tp_dealloc = (destructor)intlazysegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "IntLazySegmentTree",
+    .tp_as_mapping = &intlazysegmenttree_mapping,
+    .tp_as_sequence = &intlazysegmenttree_sequence,
+    .tp_methods = intlazysegmenttree_methods,
+    .tp_init = (initproc)intlazysegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = intlazysegmenttree_new,
+};
@@ -0,0 +1,417 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Segment tree keeping several aggregates (sum, min, max) of the same data.
+
+    Every aggregate has its own node array of 2 * N items (structure of arrays),
+    the arrays are allocated in one block. Update walks the root path once
+    and refreshes all aggregates, query accumulates all requested aggregates
+    in one walk. The count of the interval is calculated from its bounds.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    /* Node arrays indexed by `func - Sum`, NULL if the aggregate isn't kept */
+    long long *nodes[MULTI_FUNCS];
+    long long *block;
+    unsigned int funcs;
+    /* Tuple of the kept aggregate names */
+    PyObject *names;
+} IntMultiSegmentTreeObject;
+
+static void
+intmultisegmenttree_dealloc(IntMultiSegmentTreeObject* self)
+{
+    free(self->block);
+    Py_XDECREF(self->names);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+intmultisegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    IntMultiSegmentTreeObject *self;
+
+    self = (IntMultiSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static int
+_intmultisegmenttree_build(IntMultiSegmentTreeObject *self, PyObject *source, unsigned int funcs)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, false) < 0) {
+        return -1;
+    }
+
+    int kept = 0;
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        kept += (funcs >> f) & 1;
+    }
+
+    Py_ssize_t stride = 2 * MAX(src.size, 1);
+    if (stride > PY_SSIZE_T_MAX / (Py_ssize_t)sizeof(long long) / MAX(kept, 1)) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    long long *block = (long long*) malloc(sizeof(long long) * stride * MAX(kept, 1));
+    if (block == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->block);
+    self->block = block;
+    self->size = 0;
+    self->funcs = funcs;
+
+    /* The leaves are read into the scratch array if no aggregate is kept */
+    for (int f = 0, k = 0; f < MULTI_FUNCS; f++) {
+        self->nodes[f] = funcs & (1u << f) ? block + stride * k++ : NULL;
+    }
+
+    int res = tree_source_read_ints(&src, block + src.size);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        long long *nodes = self->nodes[f];
+        bool overflow = false;
+
+        if (nodes == NULL) {
+            continue;
+        }
+        if (nodes != block) {
+            memcpy(nodes + src.size, block + src.size, sizeof(long long) * src.size);
+        }
+        nodes[0] = 0;
+        for (Py_ssize_t i = src.size - 1; i > 0 && !overflow; i--) {
+            nodes[i] = int_combine(Sum + f, nodes[i << 1], nodes[i << 1 | 1], &overflow);
+        }
+        if (overflow) {
+            PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+            return -1;
+        }
+    }
+    self->size = src.size;
+    return 0;
+}
+
+static int
+intmultisegmenttree_init(IntMultiSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "funcs", NULL};
+    PyObject *source = NULL, *funcs_obj = Py_None;
+    unsigned int funcs;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist,
+                                     &source, &funcs_obj))
+        return -1;
+
+    if (multi_funcs_parse(funcs_obj, MULTI_ALL, &funcs) < 0) {
+        return -1;
+    }
+    PyObject *names = multi_funcs_names(funcs);
+    if (names == NULL) {
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _intmultisegmenttree_build(self, source, funcs);
+    if (res == 0) {
+        Py_XSETREF(self->names, names);
+        names = NULL;
+    }
+    Py_END_CRITICAL_SECTION();
+    Py_XDECREF(names);
+    return res;
+}
+
+static inline Py_ssize_t
+intmultisegmenttree_mp_len(IntMultiSegmentTreeObject *self)
+{
+    return self->size;
+}
+
+/* Accumulates the aggregates in the mask on the non-empty interval [left, right) */
+static void
+_intmultisegmenttree_query(IntMultiSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right,
+                           unsigned int mask, long long res[MULTI_FUNCS], bool *overflow)
+{
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        res[f] = int_identity(Sum + f);
+    }
+
+    left += self->size;
+    right += self->size;
+    while (left < right) {
+        if (left & 1) {
+            for (int f = 0; f < MULTI_FUNCS; f++) {
+                if (mask & (1u << f)) {
+                    res[f] = int_combine(Sum + f, res[f], self->nodes[f][left], overflow);
+                }
+            }
+            left++;
+        }
+        if (right & 1) {
+            --right;
+            for (int f = 0; f < MULTI_FUNCS; f++) {
+                if (mask & (1u << f)) {
+                    res[f] = int_combine(Sum + f, res[f], self->nodes[f][right], overflow);
+                }
+            }
+        }
+        left >>= 1;
+        right >>= 1;
+    }
+}
+
+static PyObject *
+intmultisegmenttree_query(IntMultiSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end", "funcs"};
+    PyObject *argv[3] = {NULL, NULL, NULL};
+    Py_ssize_t left, right;
+    unsigned int mask;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 3, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0
+        || multi_funcs_parse(argv[2], self->funcs, &mask) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    long long res[MULTI_FUNCS];
+    bool out_of_range, overflow = false;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        _intmultisegmenttree_query(self, left, right, mask, res, &overflow);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntMultiSegmentTree index out of range");
+        return NULL;
+    }
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while calculating the query");
+        return NULL;
+    }
+
+    PyObject *values[MULTI_FUNCS] = {NULL};
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        if ((mask & (1u << f)) && (values[f] = PyLong_FromLongLong(res[f])) == NULL) {
+            for (int k = 0; k < f; k++) {
+                Py_XDECREF(values[k]);
+            }
+            return NULL;
+        }
+    }
+    return aggregates_new(values, right - left);
+}
+
+/*
+    Sets the leaf and recalculates its ancestors in all node arrays.
+    The new values are calculated before the assignment, so the tree isn't modified on overflow.
+*/
+static bool
+_intmultisegmenttree_update(IntMultiSegmentTreeObject *self, Py_ssize_t i, long long value)
+{
+    long long values[MULTI_FUNCS][8 * sizeof(Py_ssize_t) + 1];
+    bool overflow = false;
+    int depth = 0;
+
+    for (Py_ssize_t k = i + self->size; k > 1; k >>= 1) {
+        depth++;
+    }
+
+    for (int f = 0; f < MULTI_FUNCS && !overflow; f++) {
+        long long *nodes = self->nodes[f];
+        Py_ssize_t k = i + self->size;
+
+        if (nodes == NULL) {
+            continue;
+        }
+        values[f][0] = value;
+        for (int d = 0; d < depth && !overflow; d++, k >>= 1) {
+            values[f][d + 1] = k & 1
+                ? int_combine(Sum + f, nodes[k ^ 1], values[f][d], &overflow)
+                : int_combine(Sum + f, values[f][d], nodes[k ^ 1], &overflow);
+        }
+    }
+    if (overflow) {
+        return true;
+    }
+
+    Py_ssize_t k = i + self->size;
+    for (int d = 0; d <= depth; d++, k >>= 1) {
+        for (int f = 0; f < MULTI_FUNCS; f++) {
+            if (self->nodes[f] != NULL) {
+                self->nodes[f][k] = values[f][d];
+            }
+        }
+    }
+    return false;
+}
+
+static PyObject *
+intmultisegmenttree_update(IntMultiSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    long long value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || longlong_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    bool out_of_range, overflow = false;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i > self->size - 1 || i < 0;
+    if (!out_of_range) {
+        overflow = _intmultisegmenttree_update(self, i, value);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntMultiSegmentTree index out of range");
+        return NULL;
+    }
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+intmultisegmenttree_sizeof(IntMultiSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    Py_ssize_t res = Py_TYPE(self)->tp_basicsize;
+
+    for (int f = 0; f < MULTI_FUNCS; f++) {
+        if (self->nodes[f] != NULL) {
+            res += 2 * MAX(self->size, 1) * sizeof(long long);
+        }
+    }
+    return PyLong_FromSsize_t(res);
+}
+
+/* `tree[i]` reads the leaf of the first kept aggregate, the leaves of all aggregates are equal */
+static PyObject *
+intmultisegmenttree_sq_item(IntMultiSegmentTreeObject *self, Py_ssize_t i)
+{
+    long long res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    for (int f = 0; f < MULTI_FUNCS && !out_of_range; f++) {
+        if (self->nodes[f] != NULL) {
+            res = self->nodes[f][i + self->size];
+            break;
+        }
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntMultiSegmentTree index out of range");
+        return NULL;
+    }
+    return PyLong_FromLongLong(res);
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+intmultisegmenttree_sq_ass_item(IntMultiSegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    long long item;
+
+    if (value == NULL) {
+        return sequence_no_deletion("IntMultiSegmentTree");
+    }
+    if (longlong_from_object(value, &item) < 0) {
+        return -1;
+    }
+
+    bool out_of_range, overflow = false;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        overflow = _intmultisegmenttree_update(self, i, item);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntMultiSegmentTree index out of range");
+        return -1;
+    }
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        return -1;
+    }
+    return 0;
+}
+
+static PyMappingMethods intmultisegmenttree_mapping = {
+    .mp_length = (lenfunc)intmultisegmenttree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods intmultisegmenttree_sequence = {
+    .sq_length = (lenfunc)intmultisegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)intmultisegmenttree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)intmultisegmenttree_sq_ass_item,
+};
+
+static PyMemberDef intmultisegmenttree_members[] = {
+    {"funcs", T_OBJECT, offsetof(IntMultiSegmentTreeObject, names), READONLY,
+    "Names of the kept aggregates"},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef intmultisegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) intmultisegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Calculates the aggregates on the [start, end) interval"},
+    {"update", (PyCFunction)(void(*)(void)) intmultisegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Performs the update operation"},
+    {"__sizeof__", (PyCFunction) intmultisegmenttree_sizeof, METH_NOARGS,
+    "Size of the tree in memory, in bytes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject intmultisegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.IntMultiSegmentTree",
+    sizeof(IntMultiSegmentTreeObject),
+    .tp_dealloc = (destructor)intmultisegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "IntMultiSegmentTree",
+    .tp_as_mapping = &intmultisegmenttree_mapping,
+    .tp_as_sequence = &intmultisegmenttree_sequence,
+    .tp_members = intmultisegmenttree_members,
+    .tp_methods = intmultisegmenttree_methods,
+    .tp_init = (initproc)intmultisegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = intmultisegmenttree_new,
+};
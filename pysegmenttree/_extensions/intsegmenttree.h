@@ -6,46 +6,35 @@
 #include "structmember.h"
 #include "common.h"
 
-#if defined(_WIN32)
-    #define __builtin_saddll_overflow saddll_overflow
-
-    /*
-        msvc doesn't have builtin intrinsic function for safe integer addition,
-        thus we create our own.
-    */
-    inline bool saddll_overflow(long long a, long long b, long long *res) {
-        unsigned long long buf = 0;
-
-        if (a > 0 && b > 0) {
-            buf = a + b;
-
-            if (buf > LLONG_MAX) {
-                return true;
-            }
-        } else if (a < 0 && b < 0) {
-            buf = -a - b;
-
-            if (buf > -LLONG_MIN) {
-                return true;
-            }
-        }
-
-        *res = a + b;
-        return false;
-    }
-#endif
-
 typedef struct {
     PyObject_HEAD
     Py_ssize_t size;
+    /* Number of the allocated leaves, the leaves are located at [capacity, capacity + size) */
+    Py_ssize_t capacity;
     long long *tree;
     enum QueryFunc func;
+    /* Modulus of the product tree, the nodes are the residues in [0, modulus). 0 if it isn't set */
+    long long modulus;
+    /* Number of alive buffer exports and the shape of the exported node array */
+    Py_ssize_t exports;
+    Py_ssize_t export_shape;
+    /* External node array of the attached tree, `storage.obj` is NULL if the tree owns its memory */
+    Py_buffer storage;
+    bool sync;
+    /* seqlock counter in the header of the attached snapshot, NULL for the trees owning their memory */
+    uint64_t *seq;
+    TreeLock lock;
 } IntSegmentTreeObject;
 
 static void
 intsegmenttree_dealloc(IntSegmentTreeObject* self)
 {
-    free(self->tree);
+    if (self->storage.obj != NULL) {
+        PyBuffer_Release(&self->storage);
+    } else {
+        free(self->tree);
+    }
+    tree_lock_destroy(&self->lock);
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -62,185 +51,386 @@ intsegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
     return (PyObject *)self;
 }
 
+/* Allocates the tree and fills in the leaves from the source */
 static int
-intsegmenttree_init(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+_intsegmenttree_fill_leaves(IntSegmentTreeObject *self, PyObject *source)
 {
-    static char *kwlist[] = {"source", "func", NULL};
-    PyObject *source = NULL;
-    char* func = NULL;
+    TreeSource src;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|s", kwlist,
-                                     &source, &func))
+    if (tree_source_open(&src, source, false) < 0) {
         return -1;
+    }
 
-    if (func != NULL) {
-        if (strcmp(func, "sum") == 0) {
-            self->func = Sum;
-        } else if (strcmp(func, "min") == 0) {
-            self->func = Min;
-        } else if (strcmp(func, "max") == 0) {
-            self->func = Max;
-        } else {
-            PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'sum', 'min' or 'max'");
-            return -1;
-        }
+    long long *tree = (long long*) malloc(sizeof(long long) * 2 * MAX(src.size, 1));
+    if (tree == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    if (self->storage.obj != NULL) {
+        PyBuffer_Release(&self->storage);
+        self->sync = false;
+        self->seq = NULL;
     } else {
-        self->func = Sum;
+        free(self->tree);
     }
+    self->tree = tree;
+    self->size = src.size;
+    self->capacity = src.size;
+    /* The 0-th node is never used, but it's visible through the buffer protocol */
+    self->tree[0] = 0;
 
-    if (source) {
-        Py_ssize_t size = PyList_Size(source);
-        self->size = size;
-        self->tree = (long long*) malloc(sizeof(long long) * 2 * size);
+    int res = tree_source_read_ints(&src, self->tree + src.size);
+    tree_source_close(&src);
+    return res;
+}
+
+static inline long long
+_intsegmenttree_identity(IntSegmentTreeObject *self)
+{
+    return self->modulus != 0 ? 1 % self->modulus : int_identity(self->func);
+}
+
+/* Combines the nodes or the query results, sets `overflow` if the result doesn't fit into long long */
+static inline long long
+_intsegmenttree_combine(IntSegmentTreeObject *self, long long left, long long right, bool *overflow)
+{
+    if (self->modulus != 0) {
+        return int_mulmod(left, right, self->modulus);
+    }
+    return int_combine(self->func, left, right, overflow);
+}
+
+/* Builds the tree, shared by the constructor and the vectorcall entry point */
+static int
+_intsegmenttree_setup(IntSegmentTreeObject *self, PyObject *source, const char *func, int threadsafe,
+                      long long modulus)
+{
+    if (self->exports > 0) {
+        PyErr_SetString(PyExc_BufferError, "Existing exports of data: IntSegmentTree cannot be re-initialized");
+        return -1;
+    }
+    /* Other threads may walk the locked tree without the GIL */
+    if (self->lock.enabled) {
+        PyErr_SetString(PyExc_RuntimeError, "Threadsafe IntSegmentTree cannot be re-initialized");
+        return -1;
+    }
+    if (tree_lock_init(&self->lock, threadsafe || TREE_LOCK_DEFAULT) < 0) {
+        return -1;
+    }
 
-        /* Fill in the elements from source */
-        for (Py_ssize_t i = 0; i < size; i++) {
-            PyObject *item = PyList_GetItem(source, i);
+    enum QueryFunc query_func;
+    if (query_func_parse(func, QUERY_FUNC_MAX, &query_func) < 0) {
+        return -1;
+    }
+    if (modulus != 0 && query_func != Product) {
+        PyErr_SetString(PyExc_ValueError, "'modulus' is supported only by the 'product' function");
+        return -1;
+    }
+    if (modulus < 0) {
+        PyErr_SetString(PyExc_ValueError, "'modulus' must be positive");
+        return -1;
+    }
+    self->func = query_func;
+    self->modulus = modulus;
 
-            int overflow;
-            long long val = PyLong_AsLongLongAndOverflow(item, &overflow);
+    if (source) {
+        if (_intsegmenttree_fill_leaves(self, source) < 0) {
+            return -1;
+        }
+        Py_ssize_t size = self->size;
 
-            if (overflow != 0) {
-                PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
-                return -1;
+        if (modulus != 0) {
+            for (Py_ssize_t i = size; i < 2 * size; i++) {
+                self->tree[i] = int_mod(self->tree[i], modulus);
             }
-            self->tree[size + i] = val;
-        }
-
-        for (Py_ssize_t i = size - 1; i > 0; i--) {
-            long long left = self->tree[i << 1];
-            long long right = self->tree[i << 1 | 1];
-
-            long long res;
-
-            switch(self->func) {
-                case Sum:
-                    if (__builtin_saddll_overflow(left, right, &res)) {
-                        PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
-                        return -1;
-                    }
-                    break;
-                case Min:
-                    res = MIN(left, right);
-                    break;
-                case Max:
-                    res = MAX(left, right);
-                    break;
-                default:
-                    Py_UNREACHABLE();
-                    return -1;
-            }
-            self->tree[i] = res;
+        }
+
+        bool overflow = false;
+        for (Py_ssize_t i = size - 1; i > 0 && !overflow; i--) {
+            self->tree[i] = _intsegmenttree_combine(self, self->tree[i << 1], self->tree[i << 1 | 1], &overflow);
+        }
+        if (overflow) {
+            PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+            return -1;
         }
     }
     return 0;
 }
 
-static inline Py_ssize_t
-intsegmenttree_mp_len(IntSegmentTreeObject *self)
+static int
+intsegmenttree_init(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
 {
-    return self->size;
+    static char *kwlist[] = {"source", "func", "threadsafe", "modulus", NULL};
+    PyObject *source = NULL, *modulus_obj = Py_None;
+    char* func = NULL;
+    int threadsafe = 0;
+    long long modulus = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|spO", kwlist,
+                                     &source, &func, &threadsafe, &modulus_obj))
+        return -1;
+
+    if (modulus_obj != Py_None && (longlong_from_object(modulus_obj, &modulus) < 0 || modulus == 0)) {
+        if (!PyErr_Occurred()) {
+            PyErr_SetString(PyExc_ValueError, "'modulus' must be positive");
+        }
+        return -1;
+    }
+    return _intsegmenttree_setup(self, source, func, threadsafe, modulus);
 }
 
+#if PY_VERSION_HEX >= 0x03090000
+/* Calling the type itself skips the generic tp_new/tp_init argument handling */
 static PyObject *
-intsegmenttree_query(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+intsegmenttree_vectorcall(PyObject *type, PyObject *const *args, size_t nargsf, PyObject *kwnames)
 {
-    static char *kwlist[] = {"start", "end", NULL};
-    Py_ssize_t left, right;
+    static const char *const kwlist[] = {"source", "func", "threadsafe", "modulus"};
+    PyObject *argv[4] = {NULL, NULL, NULL, NULL};
+    const char *func = NULL;
+    int threadsafe = 0;
+    long long modulus = 0;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nn|", kwlist,
-                                     &left, &right))
+    if (fastcall_unpack("IntSegmentTree", args, PyVectorcall_NARGS(nargsf), kwnames, kwlist, 1, 4, argv) < 0)
         return NULL;
 
-    if (left >= right || left < 0) {
-        Py_RETURN_NONE;
+    if (argv[1] != NULL) {
+        if (!PyUnicode_Check(argv[1])) {
+            PyErr_Format(PyExc_TypeError, "IntSegmentTree() argument 'func' must be str, not %.50s",
+                         Py_TYPE(argv[1])->tp_name);
+            return NULL;
+        }
+        if ((func = PyUnicode_AsUTF8(argv[1])) == NULL) {
+            return NULL;
+        }
     }
-
-    left += self->size;
-    right += self->size;
-    long long res;
-
-    switch(self->func) {
-        case Sum:
-            res = 0;
-            break;
-        case Min:
-        case Max:
-            res = self->tree[left];
-            break;
-        default:
-            Py_UNREACHABLE();
+    if (argv[2] != NULL && (threadsafe = PyObject_IsTrue(argv[2])) < 0) {
+        return NULL;
+    }
+    if (argv[3] != NULL && argv[3] != Py_None) {
+        if (longlong_from_object(argv[3], &modulus) < 0) {
+            return NULL;
+        }
+        if (modulus == 0) {
+            PyErr_SetString(PyExc_ValueError, "'modulus' must be positive");
             return NULL;
+        }
     }
 
+    PyObject *self = ((PyTypeObject *)type)->tp_alloc((PyTypeObject *)type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    if (_intsegmenttree_setup((IntSegmentTreeObject *)self, argv[0], func, threadsafe, modulus) < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+    return self;
+}
+#endif
+
+static inline Py_ssize_t
+intsegmenttree_mp_len(IntSegmentTreeObject *self)
+{
+    return self->size;
+}
+
+/* Performs the query on the non-empty interval [left, right), sets `overflow` if the result doesn't fit */
+static long long
+_intsegmenttree_query(IntSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right, bool *overflow)
+{
+    long long res = _intsegmenttree_identity(self);
+
+    *overflow = false;
+    left += self->capacity;
+    right += self->capacity;
     while (left < right) {
         if (left & 1) {
-            switch(self->func) {
-                case Sum:
-                    res += self->tree[left];
-                    break;
-                case Min:
-                    res = MIN(self->tree[left], res);
-                    break;
-                case Max:
-                    res = MAX(self->tree[left], res);
-                    break;
-                default:
-                    Py_UNREACHABLE();
-                    return NULL;
-            }
-
-            left++;
+            res = _intsegmenttree_combine(self, res, self->tree[left++], overflow);
         }
-
         if (right & 1) {
-            --right;
-
-            switch(self->func) {
-                case Sum:
-                    res += self->tree[right];
-                    break;
-                case Min:
-                    res = MIN(res, self->tree[right]);
-                    break;
-                case Max:
-                    res = MAX(res, self->tree[right]);
-                    break;
-                default:
-                    Py_UNREACHABLE();
-                    return NULL;
-            }
+            res = _intsegmenttree_combine(self, res, self->tree[--right], overflow);
         }
+        left >>= 1;
+        right >>= 1;
+    }
+    return res;
+}
+
+#ifdef HAVE_INT128
+/* Calculates the sum on the non-empty interval [left, right) in 128 bits, it can't overflow */
+static __int128
+_intsegmenttree_query_wide(IntSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right)
+{
+    __int128 res = 0;
 
+    left += self->capacity;
+    right += self->capacity;
+    while (left < right) {
+        if (left & 1) {
+            res += self->tree[left++];
+        }
+        if (right & 1) {
+            res += self->tree[--right];
+        }
         left >>= 1;
         right >>= 1;
     }
+    return res;
+}
+#endif
+
+static PyObject *
+intsegmenttree_query(IntSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    long long res;
+    bool overflow;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _intsegmenttree_query(self, left, right, &overflow)));
+
+#ifdef HAVE_INT128
+    if (overflow && self->func == Sum) {
+        /* The sum of the long long nodes is exact in 128 bits, so the result stays in C */
+        __int128 wide;
+        TREE_RUN(&self->lock, TREE_READ, false,
+                 SEQLOCK_READ(self->seq, wide = _intsegmenttree_query_wide(self, left, right)));
+        return int128_to_object(wide);
+    }
+#endif
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while calculating the query");
+        return NULL;
+    }
 
     PyObject *respy = PyLong_FromLongLong(res);
     return respy;
 }
 
+/*
+    Writes the results of the queries on the intervals [starts[i], ends[i]) into `results`.
+    Returns the number of the first invalid interval or -1, doesn't use the Python API.
+    The interval is invalid if it's empty, out of range or its result doesn't fit into long long.
+*/
+static Py_ssize_t
+_intsegmenttree_query_many(IntSegmentTreeObject *self, Py_buffer *starts, Py_buffer *ends,
+                           long long *results, Py_ssize_t count, bool *empty, bool *sum_overflow)
+{
+    for (Py_ssize_t i = 0; i < count; i++) {
+        int overflow = 0;
+        long long left = buffer_get_integer(starts, i, &overflow);
+        long long right = buffer_get_integer(ends, i, &overflow);
+
+        if (overflow || left < 0 || right > self->size) {
+            return i;
+        }
+        if (left >= right) {
+            *empty = true;
+            return i;
+        }
+
+        SEQLOCK_READ(self->seq, results[i] = _intsegmenttree_query(self, (Py_ssize_t)left, (Py_ssize_t)right, sum_overflow));
+        if (*sum_overflow) {
+            return i;
+        }
+    }
+    return -1;
+}
 
 static PyObject *
-intsegmenttree_update(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+intsegmenttree_query_many(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
 {
-    static char *kwlist[] = {"i", "value", NULL};
-    Py_ssize_t i;
-    long long value;
+    static char *kwlist[] = {"starts", "ends", "out", NULL};
+    PyObject *starts_obj, *ends_obj, *out_obj = Py_None;
+    Py_buffer starts, ends, out;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nL|", kwlist,
-                                     &i, &value))
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|O", kwlist,
+                                     &starts_obj, &ends_obj, &out_obj))
         return NULL;
 
-    if (i > self->size - 1 || i < 0) {
-        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+    if (get_integer_buffer(starts_obj, &starts, "starts") < 0) {
+        return NULL;
+    }
+    if (get_integer_buffer(ends_obj, &ends, "ends") < 0) {
+        PyBuffer_Release(&starts);
         return NULL;
     }
 
+    Py_ssize_t count = starts.shape[0];
+    PyObject *res = NULL;
+
+    if (ends.shape[0] != count) {
+        PyErr_SetString(PyExc_ValueError, "'starts' and 'ends' must have the same length");
+        goto finally;
+    }
+
+    if (out_obj == Py_None) {
+        res = new_typed_array('q', sizeof(long long), count);
+    } else {
+        Py_INCREF(out_obj);
+        res = out_obj;
+    }
+    if (res == NULL || get_output_buffer(res, &out, 'q', count) < 0) {
+        Py_CLEAR(res);
+        goto finally;
+    }
+
+    bool empty = false, overflow = false;
+    Py_ssize_t failed;
+
+    /* The tree can't be re-initialized while the GIL is released */
+    self->exports++;
+    TREE_RUN(&self->lock, TREE_READ, true,
+             failed = _intsegmenttree_query_many(self, &starts, &ends, (long long*) out.buf, count, &empty, &overflow));
+    self->exports--;
+
+    if (failed >= 0) {
+        if (empty) {
+            PyErr_Format(PyExc_ValueError, "IntSegmentTree interval #%zd is empty", failed);
+        } else if (overflow) {
+            PyErr_Format(PyExc_OverflowError, "Overflow while calculating the query on interval #%zd", failed);
+        } else {
+            PyErr_Format(PyExc_IndexError, "IntSegmentTree interval #%zd out of range", failed);
+        }
+        Py_CLEAR(res);
+    }
+    PyBuffer_Release(&out);
+
+finally:
+    PyBuffer_Release(&starts);
+    PyBuffer_Release(&ends);
+    return res;
+}
+
+
+/*
+    Sets the leaf and recalculates its ancestors. Returns 1 on overflow and -1 if
+    the index is out of range, the size is checked under the lock as well.
+*/
+static int
+_intsegmenttree_update(IntSegmentTreeObject *self, Py_ssize_t i, long long value)
+{
     Py_ssize_t parent, indx;
     long long left_child = 0, right_child = 0;
+    bool overflow = false;
 
-    indx = i + self->size;
+    if (i >= self->size) {
+        return -1;
+    }
+    seqlock_write_begin(self->seq);
+    indx = i + self->capacity;
     self->tree[indx] = value;
     parent = indx >> 1;
 
@@ -248,54 +438,1267 @@ intsegmenttree_update(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds
         left_child = self->tree[parent << 1];
         right_child = self->tree[parent << 1 | 1];
 
-        switch(self->func) {
-            case Sum:
-                if (__builtin_saddll_overflow(left_child, right_child, &self->tree[parent])) {
-                    PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
-                    return NULL;
-                };
-                break;
-            case Min:
-                self->tree[parent] = MIN(left_child, right_child);
-                break;
-            case Max:
-                self->tree[parent] = MAX(left_child, right_child);
-                break;
-            default:
-                Py_UNREACHABLE();
-                return NULL;
+        long long res = _intsegmenttree_combine(self, left_child, right_child, &overflow);
+        if (overflow) {
+            break;
         }
+        self->tree[parent] = res;
 
         parent >>= 1;
     }
+    seqlock_write_end(self->seq);
+    return overflow ? 1 : 0;
+}
+
+static PyObject *
+intsegmenttree_update(IntSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    long long value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || longlong_from_object(argv[1], &value) < 0)
+        return NULL;
+
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+        return NULL;
+    }
+
+    if (storage_check_writable(&self->storage, "IntSegmentTree") < 0) {
+        return NULL;
+    }
+    if (self->modulus != 0) {
+        value = int_mod(value, self->modulus);
+    }
+
+    int status;
+    TREE_RUN(&self->lock, TREE_WRITE, false, status = _intsegmenttree_update(self, i, value));
 
+    if (status < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+        return NULL;
+    }
+    if (status > 0) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        return NULL;
+    }
+    if (self->sync && storage_flush(&self->storage) < 0) {
+        return NULL;
+    }
     Py_RETURN_NONE;
 }
 
 
-static PyMappingMethods intsegmenttree_mapping = {
-    .mp_length = (lenfunc)intsegmenttree_mp_len,
-};
+/*
+    Recalculates every ancestor of the leaves `nodes` exactly once, the array is
+    reordered and used as the queue. Returns true on overflow, doesn't use the Python API.
+*/
+static bool
+_intsegmenttree_pull_nodes(IntSegmentTreeObject *self, Py_ssize_t *nodes, Py_ssize_t count)
+{
+    DirtyQueue queue = {nodes, MAX(count, 1), 0, dirty_queue_init(nodes, count)};
+    Py_ssize_t node;
+    bool overflow = false;
 
+    while (!overflow && (node = dirty_queue_next(&queue)) > 0) {
+        if (node >= self->capacity) {
+            continue;
+        }
 
-static PyMethodDef intsegmenttree_methods[] = {
-    {"query", (PyCFunction) intsegmenttree_query, METH_VARARGS | METH_KEYWORDS,
-    "Performs the query operation"},
-    {"update", (PyCFunction) intsegmenttree_update, METH_VARARGS | METH_KEYWORDS,
-    "Performs the update operation"},
-    {NULL},  /* Sentinel */
-};
+        long long res = _intsegmenttree_combine(self, self->tree[node << 1], self->tree[node << 1 | 1], &overflow);
+        if (!overflow) {
+            self->tree[node] = res;
+        }
+    }
+    return overflow;
+}
 
-static PyTypeObject intsegmenttree_type = {
-    PyVarObject_HEAD_INIT(NULL, 0)
-    "pysegmenttree.c_extensions.IntSegmentTree",
-    sizeof(IntSegmentTreeObject),
-    .tp_dealloc = (destructor)intsegmenttree_dealloc,
-    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
-    .tp_doc = "IntSegmentTree",
-    .tp_as_mapping = &intsegmenttree_mapping,
-    .tp_methods = intsegmenttree_methods,
-    .tp_init = (initproc)intsegmenttree_init,
-    .tp_alloc = PyType_GenericAlloc,
-    .tp_new = intsegmenttree_new,
+/*
+    Writes the validated batch into the leaves at `indices` and recalculates every
+    dirty ancestor exactly once. The indices are checked against the size and turned
+    into the nodes in place under the lock, as a concurrent `pop` could shrink the tree.
+    `nodes` holds 2 * count items, the second half keeps the leaves and `prev`
+    the previous values for the rollback on overflow.
+    Returns 1 on overflow and -1 if an index is out of range, doesn't use the Python API.
+*/
+static int
+_intsegmenttree_update_nodes(IntSegmentTreeObject *self, Py_ssize_t *nodes, Py_buffer *values,
+                             long long *prev, Py_ssize_t count)
+{
+    Py_ssize_t *leaves = nodes + count;
+    bool overflow;
+
+    for (Py_ssize_t i = 0; i < count; i++) {
+        if (nodes[i] >= self->size) {
+            return -1;
+        }
+        nodes[i] += self->capacity;
+        leaves[i] = nodes[i];
+    }
+
+    /* Write all leaves first, the last value wins for duplicated indices */
+    seqlock_write_begin(self->seq);
+    for (Py_ssize_t i = 0; i < count; i++) {
+        int item_overflow = 0;
+        prev[i] = self->tree[leaves[i]];
+        self->tree[leaves[i]] = buffer_get_integer(values, i, &item_overflow);
+        if (self->modulus != 0) {
+            self->tree[leaves[i]] = int_mod(self->tree[leaves[i]], self->modulus);
+        }
+    }
+
+    overflow = _intsegmenttree_pull_nodes(self, nodes, count);
+    if (overflow) {
+        /*
+            Restoring in the reverse order leaves the original value of the duplicated
+            indices, then the previous nodes are recalculated, they can't overflow
+        */
+        for (Py_ssize_t i = count - 1; i >= 0; i--) {
+            self->tree[leaves[i]] = prev[i];
+        }
+        memcpy(nodes, leaves, sizeof(Py_ssize_t) * count);
+        _intsegmenttree_pull_nodes(self, nodes, count);
+    }
+    seqlock_write_end(self->seq);
+    return overflow ? 1 : 0;
+}
+
+static PyObject *
+intsegmenttree_update_many(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"indices", "values", NULL};
+    PyObject *indices_obj, *values_obj;
+    Py_buffer indices, values;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|", kwlist,
+                                     &indices_obj, &values_obj))
+        return NULL;
+
+    if (storage_check_writable(&self->storage, "IntSegmentTree") < 0) {
+        return NULL;
+    }
+    if (get_integer_buffer(indices_obj, &indices, "indices") < 0) {
+        return NULL;
+    }
+    if (get_integer_buffer(values_obj, &values, "values") < 0) {
+        PyBuffer_Release(&indices);
+        return NULL;
+    }
+
+    Py_ssize_t count = indices.shape[0];
+    Py_ssize_t *nodes = NULL;
+    long long *prev = NULL;
+    PyObject *res = NULL;
+
+    if (values.shape[0] != count) {
+        PyErr_SetString(PyExc_ValueError, "'indices' and 'values' must have the same length");
+        goto finally;
+    }
+
+    nodes = (Py_ssize_t*) PyMem_Malloc(sizeof(Py_ssize_t) * 2 * MAX(count, 1));
+    prev = (long long*) PyMem_Malloc(sizeof(long long) * MAX(count, 1));
+    if (nodes == NULL || prev == NULL) {
+        PyErr_NoMemory();
+        goto finally;
+    }
+
+    /* Validate the whole batch before touching the tree */
+    for (Py_ssize_t i = 0; i < count; i++) {
+        int overflow = 0;
+        long long indx = buffer_get_integer(&indices, i, &overflow);
+
+        if (overflow || indx > PY_SSIZE_T_MAX || indx < 0) {
+            PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+            goto finally;
+        }
+        buffer_get_integer(&values, i, &overflow);
+        if (overflow) {
+            PyErr_SetString(PyExc_OverflowError, "Python int too large to convert to C long long");
+            goto finally;
+        }
+        nodes[i] = (Py_ssize_t)indx;
+    }
+
+    int status;
+    TREE_RUN(&self->lock, TREE_WRITE, false,
+             status = _intsegmenttree_update_nodes(self, nodes, &values, prev, count));
+
+    if (status < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+        goto finally;
+    }
+    if (status > 0) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        goto finally;
+    }
+
+    if (self->sync && storage_flush(&self->storage) < 0) {
+        goto finally;
+    }
+
+    Py_INCREF(Py_None);
+    res = Py_None;
+
+finally:
+    PyMem_Free(nodes);
+    PyMem_Free(prev);
+    PyBuffer_Release(&indices);
+    PyBuffer_Release(&values);
+    return res;
+}
+
+
+/*
+    Recalculates the ancestors of the leaf nodes [first, last] level by level.
+    Ancestors of the contiguous leaves are contiguous at every level, and every node
+    is recalculated after its children, so it takes O(K + Log[N]) for K leaves.
+    Returns true on overflow, doesn't use the Python API.
+*/
+static bool
+_intsegmenttree_pull(IntSegmentTreeObject *self, Py_ssize_t first, Py_ssize_t last)
+{
+    bool overflow = false;
+
+    for (first >>= 1, last >>= 1; last > 0 && !overflow; first >>= 1, last >>= 1) {
+        for (Py_ssize_t node = MAX(first, 1); node <= last && !overflow; node++) {
+            long long res = _intsegmenttree_combine(self, self->tree[node << 1], self->tree[node << 1 | 1], &overflow);
+            if (!overflow) {
+                self->tree[node] = res;
+            }
+        }
+    }
+    return overflow;
+}
+
+/*
+    Moves the leaves into the new node array with room for `capacity` leaves and rebuilds it,
+    the unused leaves hold the identity. Returns -1 if there is no memory and 1 on overflow
+    leaving the tree unchanged, doesn't use the Python API.
+*/
+static int
+_intsegmenttree_grow(IntSegmentTreeObject *self, Py_ssize_t capacity)
+{
+    long long *tree = (long long*) malloc(sizeof(long long) * 2 * capacity);
+    if (tree == NULL) {
+        return -1;
+    }
+
+    long long identity = _intsegmenttree_identity(self);
+    bool overflow = false;
+
+    tree[0] = 0;
+    memcpy(tree + capacity, self->tree + self->capacity, sizeof(long long) * self->size);
+    for (Py_ssize_t i = capacity + self->size; i < 2 * capacity; i++) {
+        tree[i] = identity;
+    }
+    for (Py_ssize_t i = capacity - 1; i > 0 && !overflow; i--) {
+        tree[i] = _intsegmenttree_combine(self, tree[i << 1], tree[i << 1 | 1], &overflow);
+    }
+    if (overflow) {
+        free(tree);
+        return 1;
+    }
+
+    free(self->tree);
+    self->tree = tree;
+    self->capacity = capacity;
+    return 0;
+}
+
+/*
+    Appends the leaves, doubling the capacity if they don't fit, so the build pass
+    is paid only on growth. Returns -1 if there is no memory and 1 on overflow
+    leaving the tree unchanged, doesn't use the Python API.
+*/
+static int
+_intsegmenttree_push(IntSegmentTreeObject *self, const long long *values, Py_ssize_t count)
+{
+    Py_ssize_t size = self->size + count;
+
+    if (size > self->capacity) {
+        int res = _intsegmenttree_grow(self, MAX(size, 2 * self->capacity));
+        if (res != 0) {
+            return res;
+        }
+    }
+    if (count == 0) {
+        return 0;
+    }
+
+    Py_ssize_t first = self->capacity + self->size, last = self->capacity + size - 1;
+    memcpy(self->tree + first, values, sizeof(long long) * count);
+
+    if (_intsegmenttree_pull(self, first, last)) {
+        /* Restoring the identity recalculates the previous values, they can't overflow */
+        long long identity = _intsegmenttree_identity(self);
+        for (Py_ssize_t i = first; i <= last; i++) {
+            self->tree[i] = identity;
+        }
+        _intsegmenttree_pull(self, first, last);
+        return 1;
+    }
+    self->size = size;
+    return 0;
+}
+
+/* Replaces the last leaf with the identity, returns true on overflow leaving the tree unchanged */
+static bool
+_intsegmenttree_pop(IntSegmentTreeObject *self, long long *value)
+{
+    Py_ssize_t leaf = self->capacity + self->size - 1;
+
+    *value = self->tree[leaf];
+    self->tree[leaf] = _intsegmenttree_identity(self);
+    if (_intsegmenttree_pull(self, leaf, leaf)) {
+        self->tree[leaf] = *value;
+        _intsegmenttree_pull(self, leaf, leaf);
+        return true;
+    }
+    self->size--;
+    return false;
+}
+
+/* Only the trees owning their memory can change the size */
+static int
+_intsegmenttree_check_resizable(IntSegmentTreeObject *self, Py_ssize_t count)
+{
+    if (self->storage.obj != NULL) {
+        PyErr_SetString(PyExc_BufferError, "Attached IntSegmentTree cannot be resized");
+        return -1;
+    }
+    /* Even `pop` would change the leaves seen through the exported views */
+    if (self->exports > 0) {
+        PyErr_SetString(PyExc_BufferError, "Existing exports of data: IntSegmentTree cannot be resized");
+        return -1;
+    }
+    if (self->size + count > self->capacity
+        && count > PY_SSIZE_T_MAX / (4 * (Py_ssize_t)sizeof(long long)) - self->size) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    return 0;
+}
+
+/* Appends the values, applying the modulus, and raises the exception on failure */
+static PyObject *
+_intsegmenttree_extend_values(IntSegmentTreeObject *self, long long *values, Py_ssize_t count)
+{
+    if (_intsegmenttree_check_resizable(self, count) < 0) {
+        return NULL;
+    }
+    if (self->modulus != 0) {
+        for (Py_ssize_t i = 0; i < count; i++) {
+            values[i] = int_mod(values[i], self->modulus);
+        }
+    }
+
+    /*
+        The GIL stays held while the node array may be reallocated, so no buffer
+        can be exported from the old one. Readers holding the lock don't wait for the GIL.
+    */
+    tree_lock_acquire(&self->lock, TREE_WRITE);
+    int res = _intsegmenttree_push(self, values, count);
+    tree_lock_release(&self->lock, TREE_WRITE);
+
+    if (res < 0) {
+        return PyErr_NoMemory();
+    }
+    if (res > 0) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+intsegmenttree_append(IntSegmentTreeObject *self, PyObject *arg)
+{
+    long long value;
+
+    if (longlong_from_object(arg, &value) < 0) {
+        return NULL;
+    }
+    return _intsegmenttree_extend_values(self, &value, 1);
+}
+
+static PyObject *
+intsegmenttree_extend(IntSegmentTreeObject *self, PyObject *arg)
+{
+    TreeSource src;
+
+    if (tree_source_open_iterable(&src, arg, false) < 0) {
+        return NULL;
+    }
+
+    long long *values = (long long*) PyMem_Malloc(sizeof(long long) * MAX(src.size, 1));
+    if (values == NULL) {
+        tree_source_close(&src);
+        return PyErr_NoMemory();
+    }
+
+    int read = tree_source_read_ints(&src, values);
+    Py_ssize_t count = src.size;
+
+    /* The source may be the buffer of the tree itself, it must be released before growing */
+    tree_source_close(&src);
+
+    PyObject *res = read < 0 ? NULL : _intsegmenttree_extend_values(self, values, count);
+    PyMem_Free(values);
+    return res;
+}
+
+static PyObject *
+intsegmenttree_pop(IntSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    if (_intsegmenttree_check_resizable(self, 0) < 0) {
+        return NULL;
+    }
+    if (self->size == 0) {
+        PyErr_SetString(PyExc_IndexError, "pop from empty IntSegmentTree");
+        return NULL;
+    }
+
+    long long value;
+    bool overflow;
+    TREE_RUN(&self->lock, TREE_WRITE, false, overflow = _intsegmenttree_pop(self, &value));
+
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        return NULL;
+    }
+    return PyLong_FromLongLong(value);
+}
+
+
+/* Copies the leaves start, start + step, ... into `dest`, doesn't use the Python API */
+static void
+_intsegmenttree_read_leaves(IntSegmentTreeObject *self, Py_ssize_t start, Py_ssize_t step,
+                            Py_ssize_t count, long long *dest)
+{
+    const long long *leaves = self->tree + self->capacity;
+
+    if (step == 1) {
+        memcpy(dest, leaves + start, sizeof(long long) * count);
+        return;
+    }
+    for (Py_ssize_t i = 0; i < count; i++) {
+        dest[i] = leaves[start + i * step];
+    }
+}
+
+/*
+    Writes the values into the leaves start, start + step, ... and recalculates
+    the ancestors of the touched leaves once, so it takes O(K + Log[N]) for the contiguous slice.
+    `prev` receives the replaced values. Returns true on overflow leaving the tree unchanged,
+    doesn't use the Python API.
+*/
+static bool
+_intsegmenttree_assign(IntSegmentTreeObject *self, Py_ssize_t start, Py_ssize_t step,
+                       Py_ssize_t count, const long long *values, long long *prev)
+{
+    long long *leaves = self->tree + self->capacity;
+    Py_ssize_t first, last;
+    bool overflow;
+
+    sequence_slice_bounds(start, step, count, &first, &last);
+
+    seqlock_write_begin(self->seq);
+    for (Py_ssize_t i = 0; i < count; i++) {
+        prev[i] = leaves[start + i * step];
+        leaves[start + i * step] = values[i];
+    }
+    overflow = _intsegmenttree_pull(self, self->capacity + first, self->capacity + last);
+    if (overflow) {
+        /* Restoring the previous values recalculates the previous nodes, they can't overflow */
+        for (Py_ssize_t i = 0; i < count; i++) {
+            leaves[start + i * step] = prev[i];
+        }
+        _intsegmenttree_pull(self, self->capacity + first, self->capacity + last);
+    }
+    seqlock_write_end(self->seq);
+    return overflow;
+}
+
+static PyObject *
+intsegmenttree_sq_item(IntSegmentTreeObject *self, Py_ssize_t i)
+{
+    if (i < 0 || i >= self->size) {
+        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+        return NULL;
+    }
+
+    long long value;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, value = self->tree[self->capacity + i]));
+    return PyLong_FromLongLong(value);
+}
+
+/* `tree[i]` returns the leaf, `tree[start:stop:step]` returns the leaves as array('q') */
+static PyObject *
+intsegmenttree_mp_subscript(IntSegmentTreeObject *self, PyObject *key)
+{
+    Py_ssize_t start, step, count;
+    int kind = sequence_key_unpack(key, self->size, "IntSegmentTree", &start, &step, &count);
+
+    if (kind < 0) {
+        return NULL;
+    }
+    if (kind == SEQUENCE_INDEX) {
+        return intsegmenttree_sq_item(self, start);
+    }
+
+    PyObject *res = new_typed_array('q', sizeof(long long), count);
+    Py_buffer out;
+
+    if (res == NULL || get_output_buffer(res, &out, 'q', count) < 0) {
+        Py_XDECREF(res);
+        return NULL;
+    }
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, _intsegmenttree_read_leaves(self, start, step, count, (long long*) out.buf)));
+    PyBuffer_Release(&out);
+    return res;
+}
+
+/* `tree[i] = value` and `tree[start:stop:step] = values`, the slice keeps its length */
+static int
+intsegmenttree_mp_ass_subscript(IntSegmentTreeObject *self, PyObject *key, PyObject *value)
+{
+    Py_ssize_t start, step, count;
+    long long item, *values = &item, prev_item, *prev = &prev_item;
+    int kind, res = -1;
+
+    if (value == NULL) {
+        PyErr_SetString(PyExc_TypeError, "IntSegmentTree doesn't support item deletion");
+        return -1;
+    }
+    if ((kind = sequence_key_unpack(key, self->size, "IntSegmentTree", &start, &step, &count)) < 0) {
+        return -1;
+    }
+    if (storage_check_writable(&self->storage, "IntSegmentTree") < 0) {
+        return -1;
+    }
+
+    if (kind == SEQUENCE_INDEX) {
+        if (longlong_from_object(value, &item) < 0) {
+            return -1;
+        }
+    } else {
+        TreeSource src;
+
+        if (tree_source_open_iterable(&src, value, false) < 0) {
+            return -1;
+        }
+        if (src.size != count) {
+            PyErr_Format(PyExc_ValueError, "attempt to assign sequence of size %zd to slice of size %zd",
+                         src.size, count);
+            tree_source_close(&src);
+            return -1;
+        }
+
+        values = (long long*) PyMem_Malloc(sizeof(long long) * 2 * MAX(count, 1));
+        if (values == NULL) {
+            tree_source_close(&src);
+            PyErr_NoMemory();
+            return -1;
+        }
+        prev = values + count;
+
+        int read = tree_source_read_ints(&src, values);
+        tree_source_close(&src);
+        if (read < 0) {
+            goto finally;
+        }
+        if (count == 0) {
+            res = 0;
+            goto finally;
+        }
+    }
+
+    if (self->modulus != 0) {
+        for (Py_ssize_t i = 0; i < count; i++) {
+            values[i] = int_mod(values[i], self->modulus);
+        }
+    }
+
+    bool overflow;
+    TREE_RUN(&self->lock, TREE_WRITE, false,
+             overflow = _intsegmenttree_assign(self, start, step, count, values, prev));
+
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        goto finally;
+    }
+    if (self->sync && storage_flush(&self->storage) < 0) {
+        goto finally;
+    }
+    res = 0;
+
+finally:
+    if (values != &item) {
+        PyMem_Free(values);
+    }
+    return res;
+}
+
+/* Iterates over the leaves through `tree[i]`, so no buffer is exported */
+static PyObject *
+intsegmenttree_iter(IntSegmentTreeObject *self)
+{
+    return PySeqIter_New((PyObject *)self);
+}
+
+
+static Py_ssize_t
+_intsegmenttree_query_arg(IntSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right, long long *value)
+{
+    Py_ssize_t nodes[CANONICAL_NODES_MAX];
+    int count = canonical_nodes(left, right, self->capacity, nodes);
+
+    /* Only min and max are supported, they can't overflow */
+    bool overflow;
+    *value = _intsegmenttree_query(self, left, right, &overflow);
+    for (int i = 0; i < count; i++) {
+        Py_ssize_t node = nodes[i];
+
+        if (self->tree[node] != *value) {
+            continue;
+        }
+
+        while (node < self->capacity) {
+            node <<= 1;
+            if (self->tree[node] != *value) {
+                node++;
+            }
+        }
+        return node - self->capacity;
+    }
+    return -1;
+}
+
+/*
+    Finds the leftmost index of the extreme value on the interval [left, right).
+    The value is found by the regular query first, then the first canonical node
+    holding it is descended to the leaf, so no additional memory is needed.
+*/
+static PyObject *
+intsegmenttree_query_arg(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"start", "end", NULL};
+    Py_ssize_t left, right;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nn|", kwlist,
+                                     &left, &right))
+        return NULL;
+
+    if (self->func != Min && self->func != Max) {
+        PyErr_SetString(PyExc_ValueError, "query_arg is supported only for 'min' and 'max' trees");
+        return NULL;
+    }
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+    if (right > self->size) {
+        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+        return NULL;
+    }
+
+    long long value;
+    Py_ssize_t res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _intsegmenttree_query_arg(self, left, right, &value)));
+
+    if (res < 0) {
+        /* Unreachable unless the tree contains NaN values */
+        Py_RETURN_NONE;
+    }
+    return Py_BuildValue("(nN)", res, PyLong_FromLongLong(value));
+}
+
+static inline long long
+_intsegmenttree_search_combine(IntSegmentTreeObject *self, long long left, long long right)
+{
+    long long res;
+
+    switch(self->func) {
+        case Sum:
+            /* Saturate instead of overflowing, comparisons with the threshold stay correct */
+            if (__builtin_saddll_overflow(left, right, &res)) {
+                res = right > 0 ? LLONG_MAX : LLONG_MIN;
+            }
+            return res;
+        case Min:
+            return MIN(left, right);
+        case Max:
+            return MAX(left, right);
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+/*
+    Checks if the aggregated value satisfies the threshold of the search methods:
+    the sum or the maximum must not exceed it, the minimum must not fall below it.
+*/
+static inline bool
+_intsegmenttree_within(IntSegmentTreeObject *self, long long value, long long threshold)
+{
+    return self->func == Min ? value >= threshold : value <= threshold;
+}
+
+/* Thresholds are meaningful only for the monotone functions */
+static int
+_intsegmenttree_check_search(IntSegmentTreeObject *self, const char *method)
+{
+    if (self->func != Sum && self->func != Min && self->func != Max) {
+        PyErr_Format(PyExc_ValueError, "%s is supported only for 'sum', 'min' and 'max' trees", method);
+        return -1;
+    }
+    return 0;
+}
+
+/* Returns the largest end, such that [start, end) satisfies the threshold */
+static Py_ssize_t
+_intsegmenttree_max_right(IntSegmentTreeObject *self, Py_ssize_t start, long long threshold)
+{
+    Py_ssize_t nodes[CANONICAL_NODES_MAX];
+    int count = canonical_nodes(start, self->size, self->capacity, nodes);
+    bool empty = true;
+    long long acc = 0;
+
+    for (int i = 0; i < count; i++) {
+        Py_ssize_t node = nodes[i];
+        long long candidate = empty ? self->tree[node] : _intsegmenttree_search_combine(self, acc, self->tree[node]);
+
+        if (_intsegmenttree_within(self, candidate, threshold)) {
+            acc = candidate;
+            empty = false;
+            continue;
+        }
+
+        /* The answer is inside this node, descend to the leaf */
+        while (node < self->capacity) {
+            node <<= 1;
+            candidate = empty ? self->tree[node] : _intsegmenttree_search_combine(self, acc, self->tree[node]);
+
+            if (_intsegmenttree_within(self, candidate, threshold)) {
+                acc = candidate;
+                empty = false;
+                node++;
+            }
+        }
+        return node - self->capacity;
+    }
+    return self->size;
+}
+
+/* Returns the smallest start, such that [start, end) satisfies the threshold */
+static Py_ssize_t
+_intsegmenttree_min_left(IntSegmentTreeObject *self, Py_ssize_t end, long long threshold)
+{
+    Py_ssize_t nodes[CANONICAL_NODES_MAX];
+    int count = canonical_nodes(0, end, self->capacity, nodes);
+    bool empty = true;
+    long long acc = 0;
+
+    for (int i = count - 1; i >= 0; i--) {
+        Py_ssize_t node = nodes[i];
+        long long candidate = empty ? self->tree[node] : _intsegmenttree_search_combine(self, self->tree[node], acc);
+
+        if (_intsegmenttree_within(self, candidate, threshold)) {
+            acc = candidate;
+            empty = false;
+            continue;
+        }
+
+        /* The answer is inside this node, descend to the leaf */
+        while (node < self->capacity) {
+            node = node << 1 | 1;
+            candidate = empty ? self->tree[node] : _intsegmenttree_search_combine(self, self->tree[node], acc);
+
+            if (_intsegmenttree_within(self, candidate, threshold)) {
+                acc = candidate;
+                empty = false;
+                node--;
+            }
+        }
+        return node + 1 - self->capacity;
+    }
+    return 0;
+}
+
+static PyObject *
+intsegmenttree_max_right(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"start", "threshold", NULL};
+    Py_ssize_t start;
+    long long threshold;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nL|", kwlist,
+                                     &start, &threshold))
+        return NULL;
+
+    if (_intsegmenttree_check_search(self, "max_right") < 0) {
+        return NULL;
+    }
+
+    if (start > self->size || start < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+        return NULL;
+    }
+
+    Py_ssize_t res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _intsegmenttree_max_right(self, start, threshold)));
+    return PyLong_FromSsize_t(res);
+}
+
+static PyObject *
+intsegmenttree_min_left(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"end", "threshold", NULL};
+    Py_ssize_t end;
+    long long threshold;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nL|", kwlist,
+                                     &end, &threshold))
+        return NULL;
+
+    if (_intsegmenttree_check_search(self, "min_left") < 0) {
+        return NULL;
+    }
+
+    if (end > self->size || end < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+        return NULL;
+    }
+
+    Py_ssize_t res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _intsegmenttree_min_left(self, end, threshold)));
+    return PyLong_FromSsize_t(res);
+}
+
+static PyObject *
+intsegmenttree_find_first(IntSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"start", "threshold", NULL};
+    Py_ssize_t start;
+    long long threshold;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nL|", kwlist,
+                                     &start, &threshold))
+        return NULL;
+
+    if (_intsegmenttree_check_search(self, "find_first") < 0) {
+        return NULL;
+    }
+
+    if (start > self->size || start < 0) {
+        PyErr_SetString(PyExc_IndexError, "IntSegmentTree index out of range");
+        return NULL;
+    }
+
+    Py_ssize_t res;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, res = _intsegmenttree_max_right(self, start, threshold)));
+    if (res == self->size) {
+        Py_RETURN_NONE;
+    }
+    return PyLong_FromSsize_t(res);
+}
+
+static Py_ssize_t intsegmenttree_itemsize = sizeof(long long);
+
+/*
+    Exports the whole read-only node array of 2 * N items.
+    The tree leaves are located in the second half of the array.
+*/
+static int
+intsegmenttree_getbuffer(IntSegmentTreeObject *self, Py_buffer *view, int flags)
+{
+    if (flags & PyBUF_WRITABLE) {
+        PyErr_SetString(PyExc_BufferError, "IntSegmentTree buffer is read-only");
+        view->obj = NULL;
+        return -1;
+    }
+
+    self->export_shape = 2 * self->capacity;
+
+    view->buf = self->tree;
+    view->obj = (PyObject *)self;
+    Py_INCREF(self);
+    view->len = self->export_shape * intsegmenttree_itemsize;
+    view->readonly = 1;
+    view->itemsize = intsegmenttree_itemsize;
+    view->format = (flags & PyBUF_FORMAT) ? "q" : NULL;
+    view->ndim = 1;
+    view->shape = (flags & PyBUF_ND) ? &self->export_shape : NULL;
+    view->strides = (flags & PyBUF_STRIDES) ? &intsegmenttree_itemsize : NULL;
+    view->suboffsets = NULL;
+    view->internal = NULL;
+
+    self->exports++;
+    return 0;
+}
+
+static void
+intsegmenttree_releasebuffer(IntSegmentTreeObject *self, Py_buffer *view)
+{
+    self->exports--;
+}
+
+static PyObject *
+intsegmenttree_nodes(IntSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return PyMemoryView_FromObject((PyObject *)self);
+}
+
+static PyObject *
+intsegmenttree_leaves(IntSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *nodes = PyMemoryView_FromObject((PyObject *)self);
+    if (nodes == NULL) {
+        return NULL;
+    }
+
+    PyObject *leaves = PySequence_GetSlice(nodes, self->capacity, self->capacity + self->size);
+    Py_DECREF(nodes);
+    return leaves;
+}
+
+/* Creates the tree copying the node array, no build pass is needed */
+static PyObject *
+_intsegmenttree_from_nodes(PyTypeObject *type, enum QueryFunc func, long long modulus,
+                        const char *nodes, Py_ssize_t size, int threadsafe)
+{
+    IntSegmentTreeObject *self = (IntSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    if (tree_lock_init(&self->lock, threadsafe || TREE_LOCK_DEFAULT) < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    self->tree = (long long*) malloc(sizeof(long long) * 2 * MAX(size, 1));
+    if (self->tree == NULL) {
+        Py_DECREF(self);
+        return PyErr_NoMemory();
+    }
+    self->tree[0] = 0;
+    memcpy(self->tree, nodes, sizeof(long long) * 2 * size);
+    self->size = size;
+    self->capacity = size;
+    self->func = func;
+    self->modulus = modulus;
+
+    return (PyObject *)self;
+}
+
+/*
+    Writes the node array of the tree without the unused leaves into `nodes`,
+    the grown tree is rebuilt as if it had exactly `size` leaves.
+    Returns true on overflow, doesn't use the Python API.
+*/
+static bool
+_intsegmenttree_compact(IntSegmentTreeObject *self, long long *nodes)
+{
+    Py_ssize_t size = self->size;
+    bool overflow = false;
+
+    if (self->capacity == size) {
+        memcpy(nodes, self->tree, sizeof(long long) * 2 * size);
+        return false;
+    }
+
+    nodes[0] = 0;
+    memcpy(nodes + size, self->tree + self->capacity, sizeof(long long) * size);
+    for (Py_ssize_t i = size - 1; i > 0 && !overflow; i--) {
+        nodes[i] = _intsegmenttree_combine(self, nodes[i << 1], nodes[i << 1 | 1], &overflow);
+    }
+    return overflow;
+}
+
+/* Returns the bytes with the compact node array placed after `offset` bytes */
+static PyObject *
+_intsegmenttree_dump(IntSegmentTreeObject *self, Py_ssize_t offset)
+{
+    PyObject *res = PyBytes_FromStringAndSize(NULL, offset + sizeof(long long) * 2 * self->size);
+    if (res == NULL) {
+        return NULL;
+    }
+
+    long long *nodes = (long long *)(PyBytes_AS_STRING(res) + offset);
+    bool overflow;
+    TREE_RUN(&self->lock, TREE_READ, false,
+             SEQLOCK_READ(self->seq, overflow = _intsegmenttree_compact(self, nodes)));
+
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+        Py_DECREF(res);
+        return NULL;
+    }
+    return res;
+}
+
+static PyObject *
+intsegmenttree_to_bytes(IntSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    SnapshotHeader header;
+
+    /* The snapshot header has no room for the modulus */
+    if (self->modulus != 0) {
+        PyErr_SetString(PyExc_ValueError, "Snapshots of IntSegmentTree with 'modulus' aren't supported");
+        return NULL;
+    }
+
+    PyObject *res = _intsegmenttree_dump(self, sizeof(SnapshotHeader));
+    if (res == NULL) {
+        return NULL;
+    }
+
+    snapshot_header_fill(&header, 'q', self->func, self->size);
+    memcpy(PyBytes_AS_STRING(res), &header, sizeof(SnapshotHeader));
+    return res;
+}
+
+static PyObject *
+intsegmenttree_from_bytes(PyTypeObject *type, PyObject *data)
+{
+    Py_buffer view;
+    SnapshotHeader header;
+
+    if (PyObject_GetBuffer(data, &view, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+
+    PyObject *res = NULL;
+    if (snapshot_header_parse(&view, &header, 'q', sizeof(long long), "IntSegmentTree") == 0) {
+        res = _intsegmenttree_from_nodes(type, (enum QueryFunc)header.func, 0,
+                                      (const char *)view.buf + sizeof(SnapshotHeader),
+                                      (Py_ssize_t)header.size, 0);
+    }
+
+    PyBuffer_Release(&view);
+    return res;
+}
+
+/* Reconstructor used by pickle, `nodes` may be an out-of-band buffer */
+static PyObject *
+intsegmenttree_restore(PyTypeObject *type, PyObject *args)
+{
+    int func;
+    Py_buffer view;
+    long long modulus = 0;
+    int threadsafe = 0;
+
+    if (!PyArg_ParseTuple(args, "iy*|Lp", &func, &view, &modulus, &threadsafe))
+        return NULL;
+
+    PyObject *res = NULL;
+    if (func < Sum || func > QUERY_FUNC_MAX || view.len % (2 * sizeof(long long)) != 0
+        || modulus < 0 || (modulus != 0 && func != Product)) {
+        PyErr_SetString(PyExc_ValueError, "Invalid IntSegmentTree pickle data");
+    } else {
+        res = _intsegmenttree_from_nodes(type, (enum QueryFunc)func, modulus, (const char *)view.buf,
+                                      view.len / (2 * sizeof(long long)), threadsafe);
+    }
+
+    PyBuffer_Release(&view);
+    return res;
+}
+
+/*
+    Creates the tree on top of the snapshot made by `to_bytes` without copying it,
+    so attaching to the memory-mapped file touches only the pages used by queries.
+*/
+static PyObject *
+intsegmenttree_attach(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"buffer", "sync", NULL};
+    PyObject *buffer;
+    int sync = 0;
+    SnapshotHeader header;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|p", kwlist,
+                                     &buffer, &sync))
+        return NULL;
+
+    IntSegmentTreeObject *self = (IntSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    if (tree_lock_init(&self->lock, TREE_LOCK_DEFAULT) < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    if (storage_open(&self->storage, buffer, sync) < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+    if (snapshot_header_parse(&self->storage, &header, 'q', sizeof(long long), "IntSegmentTree") < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    char *nodes = (char *)self->storage.buf + sizeof(SnapshotHeader);
+    if ((uintptr_t)nodes % _Alignof(long long) != 0) {
+        PyErr_SetString(PyExc_ValueError, "IntSegmentTree storage is not properly aligned");
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    self->tree = (long long *)nodes;
+    self->seq = (uint64_t *)((char *)self->storage.buf + offsetof(SnapshotHeader, seq));
+    self->size = (Py_ssize_t)header.size;
+    self->capacity = self->size;
+    self->func = (enum QueryFunc)header.func;
+    self->sync = sync;
+
+    return (PyObject *)self;
+}
+
+static PyObject *
+intsegmenttree_flush(IntSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    if (self->storage.obj != NULL && !self->storage.readonly
+        && PyObject_HasAttrString(self->storage.obj, "flush")
+        && storage_flush(&self->storage) < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+/*
+    Pickle protocol 5 receives the node array as a PickleBuffer,
+    so it can be transferred out-of-band without copying.
+    Older protocols use the binary snapshot, or the copy of the node array
+    if the tree has the modulus or the lock, which the snapshot doesn't record.
+*/
+static PyObject *
+intsegmenttree_reduce_ex(IntSegmentTreeObject *self, PyObject *args)
+{
+    int protocol;
+    PyObject *pickle_buffer = NULL;
+
+    if (!PyArg_ParseTuple(args, "i", &protocol))
+        return NULL;
+
+    if (protocol >= 5 || self->modulus != 0 || self->lock.enabled) {
+        /* The grown tree has the unused leaves, so its node array is compacted into the copy */
+        if (protocol >= 5 && self->capacity == self->size) {
+            PyObject *pickle = PyImport_ImportModule("pickle");
+            if (pickle == NULL) {
+                return NULL;
+            }
+            pickle_buffer = PyObject_CallMethod(pickle, "PickleBuffer", "O", self);
+            Py_DECREF(pickle);
+        } else {
+            pickle_buffer = _intsegmenttree_dump(self, 0);
+        }
+        if (pickle_buffer == NULL) {
+            return NULL;
+        }
+
+        PyObject *restore = PyObject_GetAttrString((PyObject *)Py_TYPE(self), "_restore");
+        if (restore == NULL) {
+            Py_DECREF(pickle_buffer);
+            return NULL;
+        }
+        return Py_BuildValue("(N(iNLO))", restore, (int)self->func, pickle_buffer, self->modulus,
+                             self->lock.enabled ? Py_True : Py_False);
+    }
+
+    PyObject *from_bytes = PyObject_GetAttrString((PyObject *)Py_TYPE(self), "from_bytes");
+    if (from_bytes == NULL) {
+        return NULL;
+    }
+    return Py_BuildValue("(N(N))", from_bytes, intsegmenttree_to_bytes(self, NULL));
+}
+
+static PyBufferProcs intsegmenttree_as_buffer = {
+    .bf_getbuffer = (getbufferproc)intsegmenttree_getbuffer,
+    .bf_releasebuffer = (releasebufferproc)intsegmenttree_releasebuffer,
+};
+
+static PyMappingMethods intsegmenttree_mapping = {
+    .mp_length = (lenfunc)intsegmenttree_mp_len,
+    .mp_subscript = (binaryfunc)intsegmenttree_mp_subscript,
+    .mp_ass_subscript = (objobjargproc)intsegmenttree_mp_ass_subscript,
+};
+
+static PySequenceMethods intsegmenttree_sequence = {
+    .sq_length = (lenfunc)intsegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)intsegmenttree_sq_item,
+};
+
+
+static PyMethodDef intsegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) intsegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Performs the query operation"},
+    {"update", (PyCFunction)(void(*)(void)) intsegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Performs the update operation"},
+    {"query_many", (PyCFunction) intsegmenttree_query_many, METH_VARARGS | METH_KEYWORDS,
+    "Performs the query operation for every pair of interval bounds"},
+    {"update_many", (PyCFunction) intsegmenttree_update_many, METH_VARARGS | METH_KEYWORDS,
+    "Performs the update operation for every pair of index and value"},
+    {"query_arg", (PyCFunction) intsegmenttree_query_arg, METH_VARARGS | METH_KEYWORDS,
+    "Finds the leftmost index and the value of the minimum or maximum on the interval"},
+    {"max_right", (PyCFunction) intsegmenttree_max_right, METH_VARARGS | METH_KEYWORDS,
+    "Finds the largest end, such that the interval [start, end) satisfies the threshold"},
+    {"min_left", (PyCFunction) intsegmenttree_min_left, METH_VARARGS | METH_KEYWORDS,
+    "Finds the smallest start, such that the interval [start, end) satisfies the threshold"},
+    {"find_first", (PyCFunction) intsegmenttree_find_first, METH_VARARGS | METH_KEYWORDS,
+    "Finds the first index, where the aggregated value crosses the threshold"},
+    {"to_bytes", (PyCFunction) intsegmenttree_to_bytes, METH_NOARGS,
+    "Returns the binary snapshot of the tree"},
+    {"from_bytes", (PyCFunction) intsegmenttree_from_bytes, METH_O | METH_CLASS,
+    "Creates the tree from the binary snapshot"},
+    {"_restore", (PyCFunction) intsegmenttree_restore, METH_VARARGS | METH_CLASS,
+    "Creates the tree from the node array, used by pickle"},
+    {"attach", (PyCFunction)(void(*)(void)) intsegmenttree_attach, METH_VARARGS | METH_KEYWORDS | METH_CLASS,
+    "Creates the tree on top of the snapshot buffer without copying"},
+    {"flush", (PyCFunction) intsegmenttree_flush, METH_NOARGS,
+    "Writes the attached storage back to the file"},
+    {"__reduce_ex__", (PyCFunction) intsegmenttree_reduce_ex, METH_VARARGS,
+    "Helper for pickle"},
+    {"append", (PyCFunction) intsegmenttree_append, METH_O,
+    "Appends the value to the end of the tree"},
+    {"extend", (PyCFunction) intsegmenttree_extend, METH_O,
+    "Appends the values to the end of the tree"},
+    {"pop", (PyCFunction) intsegmenttree_pop, METH_NOARGS,
+    "Removes and returns the last value of the tree"},
+    {"leaves", (PyCFunction) intsegmenttree_leaves, METH_NOARGS,
+    "Returns a read-only memoryview of the tree leaves"},
+    {"nodes", (PyCFunction) intsegmenttree_nodes, METH_NOARGS,
+    "Returns a read-only memoryview of the whole node array"},
+    {NULL},  /* Sentinel */
+};
+
+static PyTypeObject intsegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.IntSegmentTree",
+    sizeof(IntSegmentTreeObject),
+    .tp_dealloc = (destructor)intsegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "IntSegmentTree",
+    .tp_as_sequence = &intsegmenttree_sequence,
+    .tp_as_mapping = &intsegmenttree_mapping,
+    .tp_as_buffer = &intsegmenttree_as_buffer,
+    .tp_iter = (getiterfunc)intsegmenttree_iter,
+    .tp_methods = intsegmenttree_methods,
+    .tp_init = (initproc)intsegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = intsegmenttree_new,
+#if PY_VERSION_HEX >= 0x03090000
+    .tp_vectorcall = intsegmenttree_vectorcall,
+#endif
 };
@@ -0,0 +1,221 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Sparse table for the static min/max queries.
+
+    Row k of the table holds the results of the intervals [i, i + 2^k),
+    so any interval is covered by two overlapping rows' items in O(1) time.
+    It works only for the idempotent functions and doesn't support updates.
+    The table takes N * (Log[N] + 1) items, rows are stored with the stride N.
+*/
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    long long *table;
+    enum QueryFunc func;
+} IntSparseTableObject;
+
+static void
+intsparsetable_dealloc(IntSparseTableObject* self)
+{
+    free(self->table);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+intsparsetable_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    IntSparseTableObject *self;
+
+    self = (IntSparseTableObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static inline long long
+_intsparsetable_combine(enum QueryFunc func, long long a, long long b)
+{
+    return func == Min ? MIN(a, b) : MAX(a, b);
+}
+
+static int
+_intsparsetable_build(IntSparseTableObject *self, PyObject *source)
+{
+    TreeSource src;
+    if (tree_source_open(&src, source, false) < 0) {
+        return -1;
+    }
+
+    int levels = src.size > 0 ? floor_log2(src.size) + 1 : 1;
+    if (src.size > PY_SSIZE_T_MAX / (Py_ssize_t)sizeof(long long) / levels) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    long long *table = (long long*) malloc(sizeof(long long) * (src.size * levels + 1));
+    if (table == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->table);
+    self->table = table;
+    self->size = 0;
+
+    int res = tree_source_read_ints(&src, self->table);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+
+    for (int k = 1; k < levels; k++) {
+        long long *row = self->table + k * src.size;
+        long long *prev = row - src.size;
+        Py_ssize_t half = (Py_ssize_t)1 << (k - 1);
+
+        for (Py_ssize_t i = 0; i + 2 * half <= src.size; i++) {
+            row[i] = _intsparsetable_combine(self->func, prev[i], prev[i + half]);
+        }
+    }
+    self->size = src.size;
+    return 0;
+}
+
+static int
+intsparsetable_init(IntSparseTableObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Os", kwlist,
+                                     &source, &func))
+        return -1;
+
+    enum QueryFunc query_func;
+    if (strcmp(func, "min") == 0) {
+        query_func = Min;
+    } else if (strcmp(func, "max") == 0) {
+        query_func = Max;
+    } else {
+        PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'min' or 'max'");
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    self->func = query_func;
+    res = _intsparsetable_build(self, source);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+intsparsetable_mp_len(IntSparseTableObject *self)
+{
+    return self->size;
+}
+
+static PyObject *
+intsparsetable_query(IntSparseTableObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    long long res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        int k = floor_log2(right - left);
+        long long *row = self->table + k * self->size;
+
+        res = _intsparsetable_combine(self->func, row[left], row[right - ((Py_ssize_t)1 << k)]);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntSparseTable index out of range");
+        return NULL;
+    }
+    return PyLong_FromLongLong(res);
+}
+
+static PyObject *
+intsparsetable_update(IntSparseTableObject *self, PyObject *args, PyObject *kwds)
+{
+    PyErr_SetString(PyExc_TypeError, "IntSparseTable is static, use IntSegmentTree for updates");
+    return NULL;
+}
+
+/* `tree[i]` reads the 0-th row of the table */
+static PyObject *
+intsparsetable_sq_item(IntSparseTableObject *self, Py_ssize_t i)
+{
+    long long res = 0;
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        res = self->table[i];
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "IntSparseTable index out of range");
+        return NULL;
+    }
+    return PyLong_FromLongLong(res);
+}
+
+static PyMappingMethods intsparsetable_mapping = {
+    .mp_length = (lenfunc)intsparsetable_mp_len,
+    .mp_subscript = sequence_subscript,
+};
+
+static PySequenceMethods intsparsetable_sequence = {
+    .sq_length = (lenfunc)intsparsetable_mp_len,
+    .sq_item = (ssizeargfunc)intsparsetable_sq_item,
+};
+
+static PyMethodDef intsparsetable_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) intsparsetable_query, METH_FASTCALL_KEYWORDS,
+    "Perform query on the [start, end) interval"},
+    {"update", (PyCFunction)(void(*)(void)) intsparsetable_update, METH_VARARGS | METH_KEYWORDS,
+    "Not supported, the table is static"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject intsparsetable_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.IntSparseTable",
+    sizeof(IntSparseTableObject),
+    .tp_dealloc = (destructor)intsparsetable_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "IntSparseTable",
+    .tp_as_mapping = &intsparsetable_mapping,
+    .tp_as_sequence = &intsparsetable_sequence,
+    .tp_methods = intsparsetable_methods,
+    .tp_init = (initproc)intsparsetable_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = intsparsetable_new,
+};
@@ -0,0 +1,546 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Segment trees of the non-commutative monoids with the fixed-size items:
+    square matrices of doubles combined by the matrix product (MatrixSegmentTree)
+    and affine maps `x -> a * x + b` combined by the composition (AffineSegmentTree).
+
+    Items are packed into the flat array of doubles: the k-th node takes
+    `width` doubles starting at `nodes + k * width`. Queries keep separate
+    accumulators for the left and the right border, so the items are
+    always combined in their order.
+*/
+#define MATRIX_MAX_DIM 4
+#define PACKED_MAX_WIDTH (MATRIX_MAX_DIM * MATRIX_MAX_DIM)
+
+enum PackedKind {
+    PackedMatrix = 0,
+    PackedAffine,
+};
+
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    double *nodes;
+    enum PackedKind kind;
+    /* Dimension of the matrices, 1 for the affine maps */
+    int dim;
+    /* Number of doubles per item */
+    int width;
+} PackedSegmentTreeObject;
+
+static void
+packedsegmenttree_dealloc(PackedSegmentTreeObject* self)
+{
+    free(self->nodes);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+packedsegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    PackedSegmentTreeObject *self;
+
+    self = (PackedSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+static inline void
+_packedsegmenttree_identity(PackedSegmentTreeObject *self, double *out)
+{
+    if (self->kind == PackedAffine) {
+        out[0] = 1.0;
+        out[1] = 0.0;
+        return;
+    }
+
+    for (int i = 0; i < self->dim; i++) {
+        for (int j = 0; j < self->dim; j++) {
+            out[i * self->dim + j] = i == j ? 1.0 : 0.0;
+        }
+    }
+}
+
+/*
+    Combines the left item with the right one: the product `a @ b` of the matrices,
+    or the map applying `a` first and `b` then. `out` may alias any argument.
+*/
+static inline void
+_packedsegmenttree_combine(PackedSegmentTreeObject *self, const double *a, const double *b, double *out)
+{
+    if (self->kind == PackedAffine) {
+        double scale = a[0] * b[0], shift = b[0] * a[1] + b[1];
+        out[0] = scale;
+        out[1] = shift;
+        return;
+    }
+
+    int n = self->dim;
+    double res[PACKED_MAX_WIDTH];
+    for (int i = 0; i < n; i++) {
+        for (int j = 0; j < n; j++) {
+            double value = 0.0;
+            for (int k = 0; k < n; k++) {
+                value += a[i * n + k] * b[k * n + j];
+            }
+            res[i * n + j] = value;
+        }
+    }
+    memcpy(out, res, sizeof(double) * n * n);
+}
+
+/* Reads `count` numbers of the sequence into `out` */
+static int
+_packedsegmenttree_read_row(PyObject *obj, int count, const char *error, double *out)
+{
+    PyObject *row = PySequence_Fast(obj, error);
+    if (row == NULL) {
+        return -1;
+    }
+    if (PySequence_Fast_GET_SIZE(row) != count) {
+        PyErr_SetString(PyExc_ValueError, error);
+        Py_DECREF(row);
+        return -1;
+    }
+
+    for (int j = 0; j < count; j++) {
+        if (double_from_object(PySequence_Fast_GET_ITEM(row, j), &out[j]) < 0) {
+            Py_DECREF(row);
+            return -1;
+        }
+    }
+    Py_DECREF(row);
+    return 0;
+}
+
+/* Reads the item: (a, b) pair for the affine maps, sequence of `dim` rows for the matrices */
+static int
+_packedsegmenttree_from_object(PackedSegmentTreeObject *self, PyObject *obj, double *out)
+{
+    if (self->kind == PackedAffine) {
+        return _packedsegmenttree_read_row(obj, 2, "Affine map must be a pair of numbers (a, b)", out);
+    }
+
+    static const char *error = "Matrix must be a sequence of rows with the tree dimension";
+    PyObject *matrix = PySequence_Fast(obj, error);
+    if (matrix == NULL) {
+        return -1;
+    }
+    if (PySequence_Fast_GET_SIZE(matrix) != self->dim) {
+        PyErr_SetString(PyExc_ValueError, error);
+        Py_DECREF(matrix);
+        return -1;
+    }
+
+    for (int i = 0; i < self->dim; i++) {
+        if (_packedsegmenttree_read_row(PySequence_Fast_GET_ITEM(matrix, i), self->dim, error,
+                                        out + i * self->dim) < 0) {
+            Py_DECREF(matrix);
+            return -1;
+        }
+    }
+    Py_DECREF(matrix);
+    return 0;
+}
+
+/* Returns (a, b) for the affine maps and the tuple of rows for the matrices */
+static PyObject *
+_packedsegmenttree_to_object(PackedSegmentTreeObject *self, const double *item)
+{
+    if (self->kind == PackedAffine) {
+        return Py_BuildValue("(dd)", item[0], item[1]);
+    }
+
+    PyObject *res = PyTuple_New(self->dim);
+    if (res == NULL) {
+        return NULL;
+    }
+    for (int i = 0; i < self->dim; i++) {
+        PyObject *row = PyTuple_New(self->dim);
+        if (row == NULL) {
+            Py_DECREF(res);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(res, i, row);
+
+        for (int j = 0; j < self->dim; j++) {
+            PyObject *value = PyFloat_FromDouble(item[i * self->dim + j]);
+            if (value == NULL) {
+                Py_DECREF(res);
+                return NULL;
+            }
+            PyTuple_SET_ITEM(row, j, value);
+        }
+    }
+    return res;
+}
+
+/* Dimension of the first matrix of the source, used if it isn't passed explicitly */
+static int
+_matrixsegmenttree_source_dim(PyObject *items)
+{
+    if (PySequence_Fast_GET_SIZE(items) == 0) {
+        return 1;
+    }
+
+    Py_ssize_t dim = PyObject_Length(PySequence_Fast_GET_ITEM(items, 0));
+    if (dim < 0) {
+        return -1;
+    }
+    if (dim < 1 || dim > MATRIX_MAX_DIM) {
+        PyErr_Format(PyExc_ValueError, "Matrix dimension must be in the [1, %d] range", MATRIX_MAX_DIM);
+        return -1;
+    }
+    return (int)dim;
+}
+
+static int
+_packedsegmenttree_build(PackedSegmentTreeObject *self, PyObject *source, enum PackedKind kind, int dim)
+{
+    PyObject *items = PySequence_Fast(source, "'source' must be a sequence");
+    if (items == NULL) {
+        return -1;
+    }
+
+    if (kind == PackedMatrix && dim == 0 && (dim = _matrixsegmenttree_source_dim(items)) < 0) {
+        Py_DECREF(items);
+        return -1;
+    }
+
+    Py_ssize_t size = PySequence_Fast_GET_SIZE(items);
+    int width = kind == PackedAffine ? 2 : dim * dim;
+    if (size > PY_SSIZE_T_MAX / 2 / width / (Py_ssize_t)sizeof(double)) {
+        Py_DECREF(items);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    double *nodes = (double*) malloc(sizeof(double) * 2 * MAX(size, 1) * width);
+    if (nodes == NULL) {
+        Py_DECREF(items);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    /* The tree isn't modified until all items are read */
+    PackedSegmentTreeObject builder = {.kind = kind, .dim = dim, .width = width};
+    for (Py_ssize_t i = 0; i < size; i++) {
+        if (_packedsegmenttree_from_object(&builder, PySequence_Fast_GET_ITEM(items, i),
+                                           nodes + (size + i) * width) < 0) {
+            free(nodes);
+            Py_DECREF(items);
+            return -1;
+        }
+    }
+    Py_DECREF(items);
+
+    _packedsegmenttree_identity(&builder, nodes);
+    for (Py_ssize_t i = size - 1; i > 0; i--) {
+        _packedsegmenttree_combine(&builder, nodes + (i << 1) * width, nodes + (i << 1 | 1) * width,
+                                   nodes + i * width);
+    }
+
+    free(self->nodes);
+    self->nodes = nodes;
+    self->size = size;
+    self->kind = kind;
+    self->dim = dim;
+    self->width = width;
+    return 0;
+}
+
+static int
+matrixsegmenttree_init(PackedSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "dim", NULL};
+    PyObject *source = NULL, *dim_obj = Py_None;
+    int dim = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist,
+                                     &source, &dim_obj))
+        return -1;
+
+    if (dim_obj != Py_None) {
+        Py_ssize_t value;
+        if (ssize_from_object(dim_obj, &value) < 0) {
+            return -1;
+        }
+        if (value < 1 || value > MATRIX_MAX_DIM) {
+            PyErr_Format(PyExc_ValueError, "Matrix dimension must be in the [1, %d] range", MATRIX_MAX_DIM);
+            return -1;
+        }
+        dim = (int)value;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _packedsegmenttree_build(self, source, PackedMatrix, dim);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static int
+affinesegmenttree_init(PackedSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", NULL};
+    PyObject *source = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O", kwlist,
+                                     &source))
+        return -1;
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _packedsegmenttree_build(self, source, PackedAffine, 1);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+packedsegmenttree_mp_len(PackedSegmentTreeObject *self)
+{
+    return self->size;
+}
+
+/* Combines the items of the non-empty interval [left, right) in their order */
+static void
+_packedsegmenttree_query(PackedSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right, double *out)
+{
+    double res_right[PACKED_MAX_WIDTH];
+    int width = self->width;
+
+    _packedsegmenttree_identity(self, out);
+    _packedsegmenttree_identity(self, res_right);
+
+    left += self->size;
+    right += self->size;
+    while (left < right) {
+        if (left & 1) {
+            _packedsegmenttree_combine(self, out, self->nodes + left++ * width, out);
+        }
+        if (right & 1) {
+            _packedsegmenttree_combine(self, self->nodes + --right * width, res_right, res_right);
+        }
+        left >>= 1;
+        right >>= 1;
+    }
+    _packedsegmenttree_combine(self, out, res_right, out);
+}
+
+static PyObject *
+packedsegmenttree_query(PackedSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    double res[PACKED_MAX_WIDTH];
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        _packedsegmenttree_query(self, left, right, res);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_Format(PyExc_IndexError, "%s index out of range", Py_TYPE(self)->tp_doc);
+        return NULL;
+    }
+    return _packedsegmenttree_to_object(self, res);
+}
+
+/* Sets the leaf and recalculates its ancestors, returns -1 with exception set */
+static int
+_packedsegmenttree_update(PackedSegmentTreeObject *self, Py_ssize_t i, const double *value)
+{
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i > self->size - 1 || i < 0;
+    if (!out_of_range) {
+        int width = self->width;
+        Py_ssize_t k = i + self->size;
+
+        memcpy(self->nodes + k * width, value, sizeof(double) * width);
+        for (k >>= 1; k > 0; k >>= 1) {
+            _packedsegmenttree_combine(self, self->nodes + (k << 1) * width,
+                                       self->nodes + (k << 1 | 1) * width, self->nodes + k * width);
+        }
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_Format(PyExc_IndexError, "%s index out of range", Py_TYPE(self)->tp_doc);
+        return -1;
+    }
+    return 0;
+}
+
+static PyObject *
+packedsegmenttree_update(PackedSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    double value[PACKED_MAX_WIDTH];
+    Py_ssize_t i;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || _packedsegmenttree_from_object(self, argv[1], value) < 0
+        || _packedsegmenttree_update(self, i, value) < 0)
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
+/* `tree[i]` returns the leaf in the format of `leaves` */
+static PyObject *
+packedsegmenttree_sq_item(PackedSegmentTreeObject *self, Py_ssize_t i)
+{
+    double res[PACKED_MAX_WIDTH];
+    bool out_of_range;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        memcpy(res, self->nodes + (self->size + i) * self->width, sizeof(double) * self->width);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_Format(PyExc_IndexError, "%s index out of range", Py_TYPE(self)->tp_doc);
+        return NULL;
+    }
+    return _packedsegmenttree_to_object(self, res);
+}
+
+/* `tree[i] = value`, same as `update(i, value)` */
+static int
+packedsegmenttree_sq_ass_item(PackedSegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    double item[PACKED_MAX_WIDTH];
+
+    if (value == NULL) {
+        return sequence_no_deletion(Py_TYPE(self)->tp_doc);
+    }
+    if (_packedsegmenttree_from_object(self, value, item) < 0) {
+        return -1;
+    }
+    return _packedsegmenttree_update(self, i, item);
+}
+
+static PyObject *
+packedsegmenttree_leaves(PackedSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *leaves = PyList_New(self->size);
+    if (leaves == NULL) {
+        return NULL;
+    }
+
+    for (Py_ssize_t i = 0; i < self->size; i++) {
+        PyObject *item = _packedsegmenttree_to_object(self, self->nodes + (self->size + i) * self->width);
+        if (item == NULL) {
+            Py_DECREF(leaves);
+            return NULL;
+        }
+        PyList_SET_ITEM(leaves, i, item);
+    }
+    return leaves;
+}
+
+/* The tree is pickled as the list of leaves and rebuilt by the constructor */
+static PyObject *
+packedsegmenttree_reduce(PackedSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *leaves = packedsegmenttree_leaves(self, NULL);
+    if (leaves == NULL) {
+        return NULL;
+    }
+    if (self->kind == PackedAffine) {
+        return Py_BuildValue("(O(N))", Py_TYPE(self), leaves);
+    }
+    return Py_BuildValue("(O(Ni))", Py_TYPE(self), leaves, self->dim);
+}
+
+static PyObject *
+packedsegmenttree_get_dim(PackedSegmentTreeObject *self, void *Py_UNUSED(closure))
+{
+    return PyLong_FromLong(self->dim);
+}
+
+static PyMappingMethods packedsegmenttree_mapping = {
+    .mp_length = (lenfunc)packedsegmenttree_mp_len,
+    .mp_subscript = sequence_subscript,
+    .mp_ass_subscript = sequence_ass_subscript,
+};
+
+static PySequenceMethods packedsegmenttree_sequence = {
+    .sq_length = (lenfunc)packedsegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)packedsegmenttree_sq_item,
+    .sq_ass_item = (ssizeobjargproc)packedsegmenttree_sq_ass_item,
+};
+
+static PyMethodDef packedsegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) packedsegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Combines the items of the [start, end) interval in their order"},
+    {"update", (PyCFunction)(void(*)(void)) packedsegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Performs the update operation"},
+    {"leaves", (PyCFunction) packedsegmenttree_leaves, METH_NOARGS,
+    "Returns the list of the tree leaves"},
+    {"__reduce__", (PyCFunction) packedsegmenttree_reduce, METH_NOARGS,
+    "Helper for pickle"},
+    {NULL}  /* Sentinel */
+};
+
+static PyGetSetDef matrixsegmenttree_getset[] = {
+    {"dim", (getter)packedsegmenttree_get_dim, NULL, "Dimension of the matrices", NULL},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject matrixsegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.MatrixSegmentTree",
+    sizeof(PackedSegmentTreeObject),
+    .tp_dealloc = (destructor)packedsegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "MatrixSegmentTree",
+    .tp_as_mapping = &packedsegmenttree_mapping,
+    .tp_as_sequence = &packedsegmenttree_sequence,
+    .tp_methods = packedsegmenttree_methods,
+    .tp_getset = matrixsegmenttree_getset,
+    .tp_init = (initproc)matrixsegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = packedsegmenttree_new,
+};
+
+static PyTypeObject affinesegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.AffineSegmentTree",
+    sizeof(PackedSegmentTreeObject),
+    .tp_dealloc = (destructor)packedsegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = "AffineSegmentTree",
+    .tp_as_mapping = &packedsegmenttree_mapping,
+    .tp_as_sequence = &packedsegmenttree_sequence,
+    .tp_methods = packedsegmenttree_methods,
+    .tp_init = (initproc)affinesegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = packedsegmenttree_new,
+};
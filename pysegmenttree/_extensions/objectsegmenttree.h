@@ -0,0 +1,1297 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include "structmember.h"
+#include "common.h"
+
+/*
+    Segment tree of arbitrary python objects combined by the python callable.
+
+    Nodes hold strong references, so the tree takes part in the garbage collection.
+    `func` may run any python code, including the calls of the tree methods:
+    every node is referenced by the caller while it's passed to `func`,
+    and the capacity of the tree is checked after each call, so the tree
+    re-initialized or grown by `func` raises RuntimeError instead of reading freed nodes.
+*/
+enum ObjectFunc {
+    ObjectCall = 0,
+    /* operator.add, builtin min and max don't need the python call */
+    ObjectAdd,
+    ObjectMin,
+    ObjectMax,
+};
+
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    /* Number of the allocated leaves, the unused leaves [capacity + size, 2 * capacity) are NULL */
+    Py_ssize_t capacity;
+    PyObject **nodes;
+    PyObject *func;
+    enum ObjectFunc kind;
+} ObjectSegmentTreeObject;
+
+/* Callables with the fast paths, borrowed from their modules on the first use */
+static PyObject *object_func_add = NULL;
+static PyObject *object_func_min = NULL;
+static PyObject *object_func_max = NULL;
+
+static int
+_objectsegmenttree_resolve_funcs(void)
+{
+    if (object_func_add != NULL) {
+        return 0;
+    }
+
+    PyObject *operator = PyImport_ImportModule("operator");
+    if (operator == NULL) {
+        return -1;
+    }
+    PyObject *builtins = PyImport_ImportModule("builtins");
+    if (builtins == NULL) {
+        Py_DECREF(operator);
+        return -1;
+    }
+
+    PyObject *add = PyObject_GetAttrString(operator, "add");
+    PyObject *min = PyObject_GetAttrString(builtins, "min");
+    PyObject *max = PyObject_GetAttrString(builtins, "max");
+    Py_DECREF(operator);
+    Py_DECREF(builtins);
+    if (add == NULL || min == NULL || max == NULL) {
+        Py_XDECREF(add);
+        Py_XDECREF(min);
+        Py_XDECREF(max);
+        return -1;
+    }
+
+    object_func_min = min;
+    object_func_max = max;
+    object_func_add = add;
+    return 0;
+}
+
+/* Returns func(a, b) as the new reference, the caller keeps both arguments alive */
+static PyObject *
+_objectsegmenttree_combine(ObjectSegmentTreeObject *self, PyObject *a, PyObject *b)
+{
+    int cmp;
+
+    switch (self->kind) {
+        case ObjectAdd:
+            return PyNumber_Add(a, b);
+        case ObjectMin:
+        case ObjectMax:
+            /* The first of the equal items is returned, as by the builtins */
+            cmp = PyObject_RichCompareBool(b, a, self->kind == ObjectMin ? Py_LT : Py_GT);
+            if (cmp < 0) {
+                return NULL;
+            }
+            a = cmp ? b : a;
+            Py_INCREF(a);
+            return a;
+        default:
+            break;
+    }
+
+#if PY_VERSION_HEX >= 0x03090000
+    PyObject *args[2] = {a, b};
+    return PyObject_Vectorcall(self->func, args, 2, NULL);
+#else
+    return PyObject_CallFunctionObjArgs(self->func, a, b, NULL);
+#endif
+}
+
+/*
+    Returns the new reference to the k-th node, if the tree still has the expected capacity.
+    The node is NULL, if `func` popped its leaves.
+*/
+static PyObject *
+_objectsegmenttree_node(ObjectSegmentTreeObject *self, Py_ssize_t k, Py_ssize_t capacity)
+{
+    PyObject *node = self->capacity == capacity ? self->nodes[k] : NULL;
+    if (node == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "ObjectSegmentTree changed size during the call");
+        return NULL;
+    }
+
+    Py_INCREF(node);
+    return node;
+}
+
+/* Drops the node array of the given capacity with all its references */
+static void
+_objectsegmenttree_free_nodes(PyObject **nodes, Py_ssize_t capacity)
+{
+    if (nodes == NULL) {
+        return;
+    }
+    for (Py_ssize_t i = 0; i < 2 * capacity; i++) {
+        Py_XDECREF(nodes[i]);
+    }
+    PyMem_Free(nodes);
+}
+
+static int
+objectsegmenttree_traverse(ObjectSegmentTreeObject *self, visitproc visit, void *arg)
+{
+    for (Py_ssize_t i = 1; i < 2 * self->capacity; i++) {
+        Py_VISIT(self->nodes[i]);
+    }
+    Py_VISIT(self->func);
+    return 0;
+}
+
+static int
+objectsegmenttree_clear(ObjectSegmentTreeObject *self)
+{
+    PyObject **nodes = self->nodes;
+    Py_ssize_t capacity = self->capacity;
+
+    /* Detach the nodes first, the finalizers of the items may access the tree */
+    self->nodes = NULL;
+    self->size = 0;
+    self->capacity = 0;
+    _objectsegmenttree_free_nodes(nodes, capacity);
+    Py_CLEAR(self->func);
+    return 0;
+}
+
+static void
+objectsegmenttree_dealloc(ObjectSegmentTreeObject *self)
+{
+    PyObject_GC_UnTrack(self);
+    objectsegmenttree_clear(self);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+objectsegmenttree_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    ObjectSegmentTreeObject *self;
+
+    self = (ObjectSegmentTreeObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+        self->kind = ObjectCall;
+    }
+
+    return (PyObject *)self;
+}
+
+/*
+    Calculates the internal nodes of the new node array, the nodes over
+    the unused leaves only keep their single child. The array must be
+    NULL-initialized, so it can be freed by the caller on failure.
+*/
+static int
+_objectsegmenttree_build_nodes(ObjectSegmentTreeObject *builder, PyObject **nodes, Py_ssize_t capacity)
+{
+    for (Py_ssize_t i = capacity - 1; i > 0; i--) {
+        PyObject *left = nodes[i << 1], *right = nodes[i << 1 | 1];
+
+        if (left == NULL || right == NULL) {
+            nodes[i] = left != NULL ? left : right;
+            Py_XINCREF(nodes[i]);
+        } else if ((nodes[i] = _objectsegmenttree_combine(builder, left, right)) == NULL) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+/*
+    Builds the new node array aside, so `func` called during the build
+    still sees the previous state of the tree.
+*/
+static int
+_objectsegmenttree_build(ObjectSegmentTreeObject *self, PyObject *source, PyObject *func)
+{
+    PyObject *items = PySequence_Fast(source, "'source' must be a sequence");
+    if (items == NULL) {
+        return -1;
+    }
+
+    Py_ssize_t size = PySequence_Fast_GET_SIZE(items);
+    PyObject **nodes = PyMem_New(PyObject *, 2 * MAX(size, 1));
+    if (nodes == NULL) {
+        Py_DECREF(items);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    for (Py_ssize_t i = 0; i < size; i++) {
+        nodes[i] = NULL;
+        nodes[size + i] = PySequence_Fast_GET_ITEM(items, i);
+        Py_INCREF(nodes[size + i]);
+    }
+    Py_DECREF(items);
+
+    /* The tree is switched to the new function only after the successful build */
+    ObjectSegmentTreeObject builder = {.func = func};
+    builder.kind = func == object_func_add ? ObjectAdd
+        : func == object_func_min ? ObjectMin
+        : func == object_func_max ? ObjectMax
+        : ObjectCall;
+
+    if (_objectsegmenttree_build_nodes(&builder, nodes, size) < 0) {
+        _objectsegmenttree_free_nodes(nodes, size);
+        return -1;
+    }
+
+    PyObject **prev_nodes = self->nodes;
+    Py_ssize_t prev_capacity = self->capacity;
+
+    PyObject *prev_func = self->func;
+    Py_INCREF(func);
+    self->nodes = nodes;
+    self->size = size;
+    self->capacity = size;
+    self->func = func;
+    self->kind = builder.kind;
+
+    _objectsegmenttree_free_nodes(prev_nodes, prev_capacity);
+    Py_XDECREF(prev_func);
+    return 0;
+}
+
+static int
+objectsegmenttree_init(ObjectSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL, *func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO", kwlist,
+                                     &source, &func))
+        return -1;
+
+    if (!PyCallable_Check(func)) {
+        PyErr_SetString(PyExc_TypeError, "'func' must be callable");
+        return -1;
+    }
+    if (_objectsegmenttree_resolve_funcs() < 0) {
+        return -1;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _objectsegmenttree_build(self, source, func);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+objectsegmenttree_mp_len(ObjectSegmentTreeObject *self)
+{
+    return self->size;
+}
+
+/*
+    Folds the k-th node into the accumulator: `*res = func(*res, node)` for the left side
+    and `*res = func(node, *res)` for the right one. NULL accumulator is the empty result.
+*/
+static int
+_objectsegmenttree_accumulate(ObjectSegmentTreeObject *self, PyObject **res, Py_ssize_t k,
+                              Py_ssize_t capacity, bool left)
+{
+    PyObject *node = _objectsegmenttree_node(self, k, capacity);
+    if (node == NULL) {
+        return -1;
+    }
+    if (*res == NULL) {
+        *res = node;
+        return 0;
+    }
+
+    PyObject *value = left
+        ? _objectsegmenttree_combine(self, *res, node)
+        : _objectsegmenttree_combine(self, node, *res);
+    Py_DECREF(node);
+    Py_SETREF(*res, value);
+    return value == NULL ? -1 : 0;
+}
+
+/* Returns the new reference to the result on the non-empty interval [left, right) */
+static PyObject *
+_objectsegmenttree_query(ObjectSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right)
+{
+    Py_ssize_t capacity = self->capacity;
+    PyObject *res_left = NULL, *res_right = NULL;
+
+    left += capacity;
+    right += capacity;
+    while (left < right) {
+        if (left & 1) {
+            if (_objectsegmenttree_accumulate(self, &res_left, left++, capacity, true) < 0) {
+                goto error;
+            }
+        }
+        if (right & 1) {
+            if (_objectsegmenttree_accumulate(self, &res_right, --right, capacity, false) < 0) {
+                goto error;
+            }
+        }
+        left >>= 1;
+        right >>= 1;
+    }
+
+    if (res_left == NULL || res_right == NULL) {
+        return res_left != NULL ? res_left : res_right;
+    }
+    PyObject *res = _objectsegmenttree_combine(self, res_left, res_right);
+    Py_DECREF(res_left);
+    Py_DECREF(res_right);
+    return res;
+
+error:
+    Py_XDECREF(res_left);
+    Py_XDECREF(res_right);
+    return NULL;
+}
+
+/* Same checks as PySegmentTree.query, the empty interval gives None */
+static PyObject *
+_objectsegmenttree_query_checked(ObjectSegmentTreeObject *self, Py_ssize_t left, Py_ssize_t right)
+{
+    if (left > right) {
+        PyErr_Format(PyExc_IndexError, "Invalid interval start > end (%zd > %zd)", left, right);
+        return NULL;
+    }
+    if (left < 0 || right > self->size) {
+        PyErr_SetString(PyExc_IndexError, "ObjectSegmentTree index out of range");
+        return NULL;
+    }
+    if (left == right) {
+        Py_RETURN_NONE;
+    }
+    return _objectsegmenttree_query(self, left, right);
+}
+
+static PyObject *
+objectsegmenttree_query(ObjectSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    PyObject *res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _objectsegmenttree_query_checked(self, left, right);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyObject *
+objectsegmenttree_query_many(ObjectSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"starts", "ends", NULL};
+    PyObject *starts_obj = NULL, *ends_obj = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO", kwlist,
+                                     &starts_obj, &ends_obj))
+        return NULL;
+
+    PyObject *starts = PySequence_Fast(starts_obj, "'starts' must be a sequence");
+    if (starts == NULL) {
+        return NULL;
+    }
+    PyObject *ends = PySequence_Fast(ends_obj, "'ends' must be a sequence");
+    if (ends == NULL) {
+        Py_DECREF(starts);
+        return NULL;
+    }
+
+    Py_ssize_t count = PySequence_Fast_GET_SIZE(starts);
+    PyObject *res = NULL;
+    if (count != PySequence_Fast_GET_SIZE(ends)) {
+        PyErr_SetString(PyExc_ValueError, "'starts' and 'ends' must have the same length");
+        goto done;
+    }
+    if ((res = PyList_New(count)) == NULL) {
+        goto done;
+    }
+
+    for (Py_ssize_t j = 0; j < count; j++) {
+        Py_ssize_t left, right;
+        PyObject *value = NULL;
+
+        if (ssize_from_object(PySequence_Fast_GET_ITEM(starts, j), &left) < 0
+            || ssize_from_object(PySequence_Fast_GET_ITEM(ends, j), &right) < 0) {
+            Py_CLEAR(res);
+            goto done;
+        }
+
+        /* Same as the typed trees, which can't store None in their output buffers */
+        Py_BEGIN_CRITICAL_SECTION(self);
+        if (left < 0 || right > self->size) {
+            PyErr_Format(PyExc_IndexError, "ObjectSegmentTree interval #%zd out of range", j);
+        } else if (left >= right) {
+            PyErr_Format(PyExc_ValueError, "ObjectSegmentTree interval #%zd is empty", j);
+        } else {
+            value = _objectsegmenttree_query(self, left, right);
+        }
+        Py_END_CRITICAL_SECTION();
+        if (value == NULL) {
+            Py_CLEAR(res);
+            goto done;
+        }
+        PyList_SET_ITEM(res, j, value);
+    }
+
+done:
+    Py_DECREF(starts);
+    Py_DECREF(ends);
+    return res;
+}
+
+/*
+    Recalculates the k-th internal node from its children,
+    the nodes over the unused leaves only keep their single child.
+*/
+static int
+_objectsegmenttree_pull(ObjectSegmentTreeObject *self, Py_ssize_t k, Py_ssize_t capacity)
+{
+    if (self->capacity != capacity) {
+        PyErr_SetString(PyExc_RuntimeError, "ObjectSegmentTree changed size during the call");
+        return -1;
+    }
+
+    PyObject *left = self->nodes[k << 1], *right = self->nodes[k << 1 | 1], *value;
+    if (left == NULL || right == NULL) {
+        value = left != NULL ? left : right;
+        Py_XINCREF(value);
+        Py_XSETREF(self->nodes[k], value);
+        return 0;
+    }
+
+    Py_INCREF(left);
+    Py_INCREF(right);
+    value = _objectsegmenttree_combine(self, left, right);
+    Py_DECREF(left);
+    Py_DECREF(right);
+    if (value == NULL) {
+        return -1;
+    }
+    if (self->capacity != capacity) {
+        Py_DECREF(value);
+        PyErr_SetString(PyExc_RuntimeError, "ObjectSegmentTree changed size during the call");
+        return -1;
+    }
+    Py_XSETREF(self->nodes[k], value);
+    return 0;
+}
+
+/* Recalculates the ancestors of the leaf nodes [first, last] level by level, O(K + Log[N]) */
+static int
+_objectsegmenttree_pull_range(ObjectSegmentTreeObject *self, Py_ssize_t first, Py_ssize_t last,
+                              Py_ssize_t capacity)
+{
+    for (first >>= 1, last >>= 1; last > 0; first >>= 1, last >>= 1) {
+        for (Py_ssize_t k = MAX(first, 1); k <= last; k++) {
+            if (_objectsegmenttree_pull(self, k, capacity) < 0) {
+                return -1;
+            }
+        }
+    }
+    return 0;
+}
+
+/* Replaces the i-th leaf, its ancestors are recalculated by the caller */
+static inline void
+_objectsegmenttree_set_leaf(ObjectSegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    Py_INCREF(value);
+    Py_XSETREF(self->nodes[i + self->capacity], value);
+}
+
+static int
+_objectsegmenttree_update(ObjectSegmentTreeObject *self, Py_ssize_t i, PyObject *value)
+{
+    if (i > self->size - 1 || i < 0) {
+        PyErr_SetString(PyExc_IndexError, "ObjectSegmentTree index out of range");
+        return -1;
+    }
+
+    Py_ssize_t capacity = self->capacity;
+    _objectsegmenttree_set_leaf(self, i, value);
+    for (Py_ssize_t k = (i + capacity) >> 1; k > 0; k >>= 1) {
+        if (_objectsegmenttree_pull(self, k, capacity) < 0) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+static PyObject *
+objectsegmenttree_update(ObjectSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0)
+        return NULL;
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _objectsegmenttree_update(self, i, argv[1]);
+    Py_END_CRITICAL_SECTION();
+
+    if (res < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static int
+_objectsegmenttree_compare_desc(const void *a, const void *b)
+{
+    Py_ssize_t x = *(const Py_ssize_t *)a, y = *(const Py_ssize_t *)b;
+    return (x < y) - (x > y);
+}
+
+/*
+    Writes all leaves, then recalculates every dirty ancestor once.
+    Children have greater indices than their parents, so the nodes are processed
+    in the descending order: the sorted leaves are merged with the queue of parents,
+    which are produced in the non-increasing order as well. Every level holds
+    at most `count` dirty nodes, and the queue spans two levels at most.
+*/
+static int
+_objectsegmenttree_update_many(ObjectSegmentTreeObject *self, PyObject *indices, PyObject *values)
+{
+    Py_ssize_t count = PySequence_Fast_GET_SIZE(indices);
+    Py_ssize_t size = self->size, capacity = self->capacity;
+
+    if (count > (PY_SSIZE_T_MAX / (Py_ssize_t)sizeof(Py_ssize_t) - 1) / 3) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    Py_ssize_t *leaves = PyMem_New(Py_ssize_t, 3 * count + 1);
+    if (leaves == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    Py_ssize_t *queue = leaves + count, queue_capacity = 2 * count + 1;
+
+    for (Py_ssize_t j = 0; j < count; j++) {
+        if (ssize_from_object(PySequence_Fast_GET_ITEM(indices, j), &leaves[j]) < 0) {
+            PyMem_Free(leaves);
+            return -1;
+        }
+        if (leaves[j] > size - 1 || leaves[j] < 0) {
+            PyErr_SetString(PyExc_IndexError, "ObjectSegmentTree index out of range");
+            PyMem_Free(leaves);
+            return -1;
+        }
+    }
+
+    for (Py_ssize_t j = 0; j < count; j++) {
+        /* The finalizer of the replaced leaf may re-initialize the tree */
+        if (self->size != size || self->capacity != capacity) {
+            PyErr_SetString(PyExc_RuntimeError, "ObjectSegmentTree changed size during the call");
+            PyMem_Free(leaves);
+            return -1;
+        }
+        _objectsegmenttree_set_leaf(self, leaves[j], PySequence_Fast_GET_ITEM(values, j));
+        leaves[j] += capacity;
+    }
+    qsort(leaves, count, sizeof(Py_ssize_t), _objectsegmenttree_compare_desc);
+
+    Py_ssize_t next_leaf = 0, head = 0, queued = 0;
+    int res = 0;
+    while (res == 0 && (next_leaf < count || queued > 0)) {
+        Py_ssize_t k;
+
+        if (queued == 0 || (next_leaf < count && leaves[next_leaf] > queue[head])) {
+            k = leaves[next_leaf++];
+            if (next_leaf < count && leaves[next_leaf] == k) {
+                /* Duplicated index, its parent is queued by the last occurrence */
+                continue;
+            }
+        } else {
+            k = queue[head];
+            head = (head + 1) % queue_capacity;
+            queued--;
+        }
+
+        if (k < capacity) {
+            res = _objectsegmenttree_pull(self, k, capacity);
+        }
+        Py_ssize_t last = (head + queued - 1 + queue_capacity) % queue_capacity;
+        if (k > 1 && (queued == 0 || queue[last] != k >> 1)) {
+            queue[(head + queued) % queue_capacity] = k >> 1;
+            queued++;
+        }
+    }
+
+    PyMem_Free(leaves);
+    return res;
+}
+
+static PyObject *
+objectsegmenttree_update_many(ObjectSegmentTreeObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"indices", "values", NULL};
+    PyObject *indices_obj = NULL, *values_obj = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO", kwlist,
+                                     &indices_obj, &values_obj))
+        return NULL;
+
+    PyObject *indices = PySequence_Fast(indices_obj, "'indices' must be a sequence");
+    if (indices == NULL) {
+        return NULL;
+    }
+    PyObject *values = PySequence_Fast(values_obj, "'values' must be a sequence");
+    if (values == NULL) {
+        Py_DECREF(indices);
+        return NULL;
+    }
+
+    int res = -1;
+    if (PySequence_Fast_GET_SIZE(indices) != PySequence_Fast_GET_SIZE(values)) {
+        PyErr_SetString(PyExc_ValueError, "'indices' and 'values' must have the same length");
+    } else {
+        Py_BEGIN_CRITICAL_SECTION(self);
+        res = _objectsegmenttree_update_many(self, indices, values);
+        Py_END_CRITICAL_SECTION();
+    }
+
+    Py_DECREF(indices);
+    Py_DECREF(values);
+    if (res < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+objectsegmenttree_sq_item(ObjectSegmentTreeObject *self, Py_ssize_t i)
+{
+    PyObject *res = NULL;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (i < 0 || i >= self->size) {
+        PyErr_SetString(PyExc_IndexError, "ObjectSegmentTree index out of range");
+    } else {
+        res = self->nodes[self->capacity + i];
+        Py_INCREF(res);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+/* Returns the list of the leaves start, start + step, ... */
+static PyObject *
+_objectsegmenttree_slice(ObjectSegmentTreeObject *self, Py_ssize_t start, Py_ssize_t step, Py_ssize_t count)
+{
+    PyObject *res = PyList_New(count);
+
+    for (Py_ssize_t i = 0; res != NULL && i < count; i++) {
+        PyObject *item = self->nodes[self->capacity + start + i * step];
+        Py_INCREF(item);
+        PyList_SET_ITEM(res, i, item);
+    }
+    return res;
+}
+
+/* `tree[i]` returns the leaf, `tree[start:stop:step]` returns the list of the leaves */
+static PyObject *
+objectsegmenttree_mp_subscript(ObjectSegmentTreeObject *self, PyObject *key)
+{
+    Py_ssize_t start, step, count;
+    PyObject *res = NULL;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    int kind = sequence_key_unpack(key, self->size, "ObjectSegmentTree", &start, &step, &count);
+    if (kind == SEQUENCE_INDEX) {
+        res = self->nodes[self->capacity + start];
+        Py_INCREF(res);
+    } else if (kind == SEQUENCE_SLICE) {
+        res = _objectsegmenttree_slice(self, start, step, count);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+/*
+    Writes the leaves start, start + step, ... and recalculates the ancestors
+    of the touched leaves once, so it takes O(K + Log[N]) calls of func for the contiguous slice.
+*/
+static int
+_objectsegmenttree_assign(ObjectSegmentTreeObject *self, PyObject *key, PyObject *values)
+{
+    Py_ssize_t start, step, count;
+    Py_ssize_t size = self->size, capacity = self->capacity;
+    int kind = sequence_key_unpack(key, size, "ObjectSegmentTree", &start, &step, &count);
+
+    if (kind < 0) {
+        return -1;
+    }
+    if (kind == SEQUENCE_INDEX) {
+        return _objectsegmenttree_update(self, start, values);
+    }
+    if (PySequence_Fast_GET_SIZE(values) != count) {
+        PyErr_Format(PyExc_ValueError, "attempt to assign sequence of size %zd to slice of size %zd",
+                     PySequence_Fast_GET_SIZE(values), count);
+        return -1;
+    }
+    if (count == 0) {
+        return 0;
+    }
+
+    for (Py_ssize_t i = 0; i < count; i++) {
+        /* The finalizer of the replaced leaf may re-initialize the tree */
+        if (self->size != size || self->capacity != capacity) {
+            PyErr_SetString(PyExc_RuntimeError, "ObjectSegmentTree changed size during the call");
+            return -1;
+        }
+        _objectsegmenttree_set_leaf(self, start + i * step, PySequence_Fast_GET_ITEM(values, i));
+    }
+
+    Py_ssize_t first, last;
+    sequence_slice_bounds(start, step, count, &first, &last);
+    return _objectsegmenttree_pull_range(self, capacity + first, capacity + last, capacity);
+}
+
+/* `tree[i] = value` and `tree[start:stop:step] = values`, the slice keeps its length */
+static int
+objectsegmenttree_mp_ass_subscript(ObjectSegmentTreeObject *self, PyObject *key, PyObject *value)
+{
+    if (value == NULL) {
+        PyErr_SetString(PyExc_TypeError, "ObjectSegmentTree doesn't support item deletion");
+        return -1;
+    }
+
+    PyObject *values = value;
+    if (PySlice_Check(key)) {
+        values = PySequence_Fast(value, "can only assign an iterable");
+        if (values == NULL) {
+            return -1;
+        }
+    } else {
+        Py_INCREF(values);
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _objectsegmenttree_assign(self, key, values);
+    Py_END_CRITICAL_SECTION();
+
+    Py_DECREF(values);
+    return res;
+}
+
+/* Iterates over the leaves through `tree[i]` */
+static PyObject *
+objectsegmenttree_iter(ObjectSegmentTreeObject *self)
+{
+    return PySeqIter_New((PyObject *)self);
+}
+
+/*
+    Predicate of the search methods: either the callable or the numeric threshold
+    compared with the result, as in PySegmentTree.
+*/
+typedef struct {
+    PyObject *predicate;
+    int op;
+    bool negate;
+} ObjectPredicate;
+
+static int
+_objectsegmenttree_predicate_init(ObjectSegmentTreeObject *self, PyObject *predicate,
+                                  bool negate, ObjectPredicate *res)
+{
+    res->predicate = predicate;
+    res->negate = false;
+
+    if (PyCallable_Check(predicate)) {
+        res->op = -1;
+        res->negate = negate;
+        return 0;
+    }
+
+    switch (self->kind) {
+        case ObjectMin:
+            res->op = Py_GE;
+            return 0;
+        case ObjectAdd:
+        case ObjectMax:
+            res->op = Py_LE;
+            return 0;
+        default:
+            PyErr_SetString(PyExc_TypeError, "Numeric threshold is supported only for add, min and max functions");
+            return -1;
+    }
+}
+
+static int
+_objectsegmenttree_predicate_test(ObjectPredicate *predicate, PyObject *value)
+{
+    if (predicate->op >= 0) {
+        return PyObject_RichCompareBool(value, predicate->predicate, predicate->op);
+    }
+
+    PyObject *res = PyObject_CallFunctionObjArgs(predicate->predicate, value, NULL);
+    if (res == NULL) {
+        return -1;
+    }
+    int truth = PyObject_IsTrue(res);
+    Py_DECREF(res);
+    return truth < 0 ? -1 : truth ^ predicate->negate;
+}
+
+/*
+    Tries to extend the accumulated result by the k-th node: `func(*res, node)`
+    for the right search direction and `func(node, *res)` for the left one.
+    Returns 1 and replaces the result, if the predicate holds for the candidate.
+*/
+static int
+_objectsegmenttree_try_extend(ObjectSegmentTreeObject *self, ObjectPredicate *predicate,
+                              PyObject **res, Py_ssize_t k, Py_ssize_t capacity, bool right)
+{
+    PyObject *candidate = _objectsegmenttree_node(self, k, capacity);
+    if (candidate == NULL) {
+        return -1;
+    }
+    if (*res != NULL) {
+        PyObject *node = candidate;
+        candidate = right
+            ? _objectsegmenttree_combine(self, *res, node)
+            : _objectsegmenttree_combine(self, node, *res);
+        Py_DECREF(node);
+        if (candidate == NULL) {
+            return -1;
+        }
+    }
+
+    int ok = _objectsegmenttree_predicate_test(predicate, candidate);
+    if (ok > 0) {
+        Py_XSETREF(*res, candidate);
+    } else {
+        Py_DECREF(candidate);
+    }
+    return ok;
+}
+
+/* Largest end, such that the predicate holds for query(start, end), -1 on error */
+static Py_ssize_t
+_objectsegmenttree_max_right(ObjectSegmentTreeObject *self, Py_ssize_t start, ObjectPredicate *predicate)
+{
+    Py_ssize_t nodes[CANONICAL_NODES_MAX], size = self->size, capacity = self->capacity;
+    int count = canonical_nodes(start, size, capacity, nodes);
+    PyObject *res = NULL;
+
+    for (int j = 0; j < count; j++) {
+        Py_ssize_t node = nodes[j];
+        int ok = _objectsegmenttree_try_extend(self, predicate, &res, node, capacity, true);
+
+        if (ok != 0) {
+            if (ok < 0) {
+                goto error;
+            }
+            continue;
+        }
+
+        /* The answer is inside this node, descend to the leaf */
+        while (node < capacity) {
+            node <<= 1;
+            ok = _objectsegmenttree_try_extend(self, predicate, &res, node, capacity, true);
+            if (ok < 0) {
+                goto error;
+            }
+            node += ok;
+        }
+        Py_XDECREF(res);
+        return node - capacity;
+    }
+
+    Py_XDECREF(res);
+    return size;
+
+error:
+    Py_XDECREF(res);
+    return -1;
+}
+
+/* Smallest start, such that the predicate holds for query(start, end), -1 on error */
+static Py_ssize_t
+_objectsegmenttree_min_left(ObjectSegmentTreeObject *self, Py_ssize_t end, ObjectPredicate *predicate)
+{
+    Py_ssize_t nodes[CANONICAL_NODES_MAX], capacity = self->capacity;
+    int count = canonical_nodes(0, end, capacity, nodes);
+    PyObject *res = NULL;
+
+    for (int j = count - 1; j >= 0; j--) {
+        Py_ssize_t node = nodes[j];
+        int ok = _objectsegmenttree_try_extend(self, predicate, &res, node, capacity, false);
+
+        if (ok != 0) {
+            if (ok < 0) {
+                goto error;
+            }
+            continue;
+        }
+
+        /* The answer is inside this node, descend to the leaf */
+        while (node < capacity) {
+            node = node << 1 | 1;
+            ok = _objectsegmenttree_try_extend(self, predicate, &res, node, capacity, false);
+            if (ok < 0) {
+                goto error;
+            }
+            node -= ok;
+        }
+        Py_XDECREF(res);
+        return node + 1 - capacity;
+    }
+
+    Py_XDECREF(res);
+    return 0;
+
+error:
+    Py_XDECREF(res);
+    return -1;
+}
+
+/* Unpacks the arguments of the search methods, `bound` must lie within [0, size] */
+static int
+_objectsegmenttree_search_args(ObjectSegmentTreeObject *self, const char *fname, const char *bound_name,
+                               PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames,
+                               bool negate, Py_ssize_t *bound, ObjectPredicate *predicate)
+{
+    const char *const kwlist[] = {bound_name, "predicate"};
+    PyObject *argv[2] = {NULL, NULL};
+
+    if (fastcall_unpack(fname, args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], bound) < 0)
+        return -1;
+
+    if (*bound > self->size || *bound < 0) {
+        PyErr_SetString(PyExc_IndexError, "ObjectSegmentTree index out of range");
+        return -1;
+    }
+    return _objectsegmenttree_predicate_init(self, argv[1], negate, predicate);
+}
+
+static PyObject *
+objectsegmenttree_max_right(ObjectSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    ObjectPredicate predicate;
+    Py_ssize_t start, res = -1;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (_objectsegmenttree_search_args(self, "max_right", "start", args, nargs, kwnames,
+                                       false, &start, &predicate) == 0) {
+        res = _objectsegmenttree_max_right(self, start, &predicate);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    return res < 0 ? NULL : PyLong_FromSsize_t(res);
+}
+
+static PyObject *
+objectsegmenttree_min_left(ObjectSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    ObjectPredicate predicate;
+    Py_ssize_t end, res = -1;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (_objectsegmenttree_search_args(self, "min_left", "end", args, nargs, kwnames,
+                                       false, &end, &predicate) == 0) {
+        res = _objectsegmenttree_min_left(self, end, &predicate);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    return res < 0 ? NULL : PyLong_FromSsize_t(res);
+}
+
+/* The first index, where the callable predicate becomes true or the threshold is crossed */
+static PyObject *
+objectsegmenttree_find_first(ObjectSegmentTreeObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    ObjectPredicate predicate;
+    Py_ssize_t start, size = 0, res = -1;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (_objectsegmenttree_search_args(self, "find_first", "start", args, nargs, kwnames,
+                                       true, &start, &predicate) == 0) {
+        size = self->size;
+        res = _objectsegmenttree_max_right(self, start, &predicate);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (res < 0) {
+        return NULL;
+    }
+    if (res >= size) {
+        Py_RETURN_NONE;
+    }
+    return PyLong_FromSsize_t(res);
+}
+
+/*
+    Moves the leaves into the new node array with room for `capacity` leaves.
+    The array is built aside, and `func` called meanwhile must not resize the tree.
+*/
+static int
+_objectsegmenttree_grow(ObjectSegmentTreeObject *self, Py_ssize_t capacity)
+{
+    Py_ssize_t size = self->size, prev_capacity = self->capacity;
+
+    if (capacity > PY_SSIZE_T_MAX / (2 * (Py_ssize_t)sizeof(PyObject *))) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    PyObject **nodes = PyMem_New(PyObject *, 2 * capacity);
+    if (nodes == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    for (Py_ssize_t i = 0; i < 2 * capacity; i++) {
+        nodes[i] = i >= capacity && i < capacity + size ? self->nodes[prev_capacity + i - capacity] : NULL;
+        Py_XINCREF(nodes[i]);
+    }
+
+    ObjectSegmentTreeObject builder = {.func = self->func, .kind = self->kind};
+    Py_INCREF(builder.func);
+    int res = _objectsegmenttree_build_nodes(&builder, nodes, capacity);
+    Py_DECREF(builder.func);
+
+    if (res == 0 && (self->capacity != prev_capacity || self->size != size || self->func != builder.func)) {
+        PyErr_SetString(PyExc_RuntimeError, "ObjectSegmentTree changed size during the call");
+        res = -1;
+    }
+    if (res < 0) {
+        _objectsegmenttree_free_nodes(nodes, capacity);
+        return -1;
+    }
+
+    PyObject **prev_nodes = self->nodes;
+    self->nodes = nodes;
+    self->capacity = capacity;
+    _objectsegmenttree_free_nodes(prev_nodes, prev_capacity);
+    return 0;
+}
+
+/*
+    Appends the items, doubling the capacity if they don't fit, so the build pass
+    is paid only on growth. The ancestors of the new leaves are recalculated once.
+*/
+static int
+_objectsegmenttree_extend(ObjectSegmentTreeObject *self, PyObject *items)
+{
+    Py_ssize_t count = PySequence_Fast_GET_SIZE(items), size = self->size;
+
+    if (count == 0) {
+        return 0;
+    }
+    if (self->func == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "ObjectSegmentTree is not initialized");
+        return -1;
+    }
+    if (count > PY_SSIZE_T_MAX / 2 - size) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    if (size + count > self->capacity
+        && _objectsegmenttree_grow(self, MAX(size + count, 2 * self->capacity)) < 0) {
+        return -1;
+    }
+
+    Py_ssize_t capacity = self->capacity, first = capacity + size;
+    for (Py_ssize_t j = 0; j < count; j++) {
+        PyObject *item = PySequence_Fast_GET_ITEM(items, j);
+        Py_INCREF(item);
+        Py_XSETREF(self->nodes[first + j], item);
+    }
+    self->size = size + count;
+    return _objectsegmenttree_pull_range(self, first, first + count - 1, capacity);
+}
+
+static PyObject *
+objectsegmenttree_append(ObjectSegmentTreeObject *self, PyObject *arg)
+{
+    PyObject *items = PyTuple_Pack(1, arg);
+    if (items == NULL) {
+        return NULL;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _objectsegmenttree_extend(self, items);
+    Py_END_CRITICAL_SECTION();
+
+    Py_DECREF(items);
+    if (res < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+objectsegmenttree_extend(ObjectSegmentTreeObject *self, PyObject *arg)
+{
+    PyObject *items = PySequence_Fast(arg, "'values' must be iterable");
+    if (items == NULL) {
+        return NULL;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _objectsegmenttree_extend(self, items);
+    Py_END_CRITICAL_SECTION();
+
+    Py_DECREF(items);
+    if (res < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+/* Detaches the last leaf and recalculates its ancestors, returns the new reference to it */
+static PyObject *
+_objectsegmenttree_pop(ObjectSegmentTreeObject *self)
+{
+    if (self->size == 0) {
+        PyErr_SetString(PyExc_IndexError, "pop from empty ObjectSegmentTree");
+        return NULL;
+    }
+
+    Py_ssize_t capacity = self->capacity, leaf = capacity + self->size - 1;
+    PyObject *value = self->nodes[leaf];
+
+    self->nodes[leaf] = NULL;
+    self->size--;
+    for (Py_ssize_t k = leaf >> 1; k > 0; k >>= 1) {
+        if (_objectsegmenttree_pull(self, k, capacity) < 0) {
+            Py_DECREF(value);
+            return NULL;
+        }
+    }
+    return value;
+}
+
+static PyObject *
+objectsegmenttree_pop(ObjectSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *res;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    res = _objectsegmenttree_pop(self);
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static PyObject *
+objectsegmenttree_leaves(ObjectSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *leaves;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    leaves = PyList_New(self->size);
+    for (Py_ssize_t i = 0; leaves != NULL && i < self->size; i++) {
+        PyObject *item = self->nodes[self->capacity + i];
+        Py_INCREF(item);
+        PyList_SET_ITEM(leaves, i, item);
+    }
+    Py_END_CRITICAL_SECTION();
+    return leaves;
+}
+
+/* The tree is pickled as the list of leaves and rebuilt by the constructor */
+static PyObject *
+objectsegmenttree_reduce(ObjectSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *leaves = objectsegmenttree_leaves(self, NULL);
+    if (leaves == NULL) {
+        return NULL;
+    }
+    return Py_BuildValue("(O(NO))", Py_TYPE(self), leaves, self->func);
+}
+
+static PyObject *
+objectsegmenttree_sizeof(ObjectSegmentTreeObject *self, PyObject *Py_UNUSED(ignored))
+{
+    Py_ssize_t res = Py_TYPE(self)->tp_basicsize;
+
+    if (self->nodes != NULL) {
+        res += 2 * MAX(self->capacity, 1) * sizeof(PyObject *);
+    }
+    return PyLong_FromSsize_t(res);
+}
+
+static PyMappingMethods objectsegmenttree_mapping = {
+    .mp_length = (lenfunc)objectsegmenttree_mp_len,
+    .mp_subscript = (binaryfunc)objectsegmenttree_mp_subscript,
+    .mp_ass_subscript = (objobjargproc)objectsegmenttree_mp_ass_subscript,
+};
+
+static PySequenceMethods objectsegmenttree_sequence = {
+    .sq_length = (lenfunc)objectsegmenttree_mp_len,
+    .sq_item = (ssizeargfunc)objectsegmenttree_sq_item,
+};
+
+static PyMemberDef objectsegmenttree_members[] = {
+    {"func", T_OBJECT, offsetof(ObjectSegmentTreeObject, func), READONLY,
+    "Function combining the nodes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef objectsegmenttree_methods[] = {
+    {"query", (PyCFunction)(void(*)(void)) objectsegmenttree_query, METH_FASTCALL_KEYWORDS,
+    "Performs the query operation"},
+    {"update", (PyCFunction)(void(*)(void)) objectsegmenttree_update, METH_FASTCALL_KEYWORDS,
+    "Performs the update operation"},
+    {"query_many", (PyCFunction)(void(*)(void)) objectsegmenttree_query_many, METH_VARARGS | METH_KEYWORDS,
+    "Performs the query operation for every [starts[i], ends[i]) interval"},
+    {"update_many", (PyCFunction)(void(*)(void)) objectsegmenttree_update_many, METH_VARARGS | METH_KEYWORDS,
+    "Sets every indices[i]-th element to values[i]"},
+    {"max_right", (PyCFunction)(void(*)(void)) objectsegmenttree_max_right, METH_FASTCALL_KEYWORDS,
+    "Finds the largest end, such that the predicate holds for query(start, end)"},
+    {"min_left", (PyCFunction)(void(*)(void)) objectsegmenttree_min_left, METH_FASTCALL_KEYWORDS,
+    "Finds the smallest start, such that the predicate holds for query(start, end)"},
+    {"find_first", (PyCFunction)(void(*)(void)) objectsegmenttree_find_first, METH_FASTCALL_KEYWORDS,
+    "Finds the first index, where the predicate becomes true"},
+    {"append", (PyCFunction) objectsegmenttree_append, METH_O,
+    "Appends the value to the end of the tree"},
+    {"extend", (PyCFunction) objectsegmenttree_extend, METH_O,
+    "Appends the values to the end of the tree"},
+    {"pop", (PyCFunction) objectsegmenttree_pop, METH_NOARGS,
+    "Removes and returns the last value of the tree"},
+    {"leaves", (PyCFunction) objectsegmenttree_leaves, METH_NOARGS,
+    "Returns the list of the tree leaves"},
+    {"__reduce__", (PyCFunction) objectsegmenttree_reduce, METH_NOARGS,
+    "Helper for pickle"},
+    {"__sizeof__", (PyCFunction) objectsegmenttree_sizeof, METH_NOARGS,
+    "Size of the tree in memory, in bytes"},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject objectsegmenttree_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions.ObjectSegmentTree",
+    sizeof(ObjectSegmentTreeObject),
+    .tp_dealloc = (destructor)objectsegmenttree_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,
+    .tp_doc = "ObjectSegmentTree",
+    .tp_traverse = (traverseproc)objectsegmenttree_traverse,
+    .tp_clear = (inquiry)objectsegmenttree_clear,
+    .tp_as_sequence = &objectsegmenttree_sequence,
+    .tp_as_mapping = &objectsegmenttree_mapping,
+    .tp_iter = (getiterfunc)objectsegmenttree_iter,
+    .tp_members = objectsegmenttree_members,
+    .tp_methods = objectsegmenttree_methods,
+    .tp_init = (initproc)objectsegmenttree_init,
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = objectsegmenttree_new,
+};
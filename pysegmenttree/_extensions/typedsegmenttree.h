@@ -0,0 +1,837 @@
+/*
+    Template of the segment trees with compact item types.
+
+    The including header defines the parameters and includes this file:
+
+        TYPED_NAME    name of the python type, e.g. "Int32SegmentTree"
+        TYPED_PREFIX  prefix of the C identifiers, e.g. int32segmenttree
+        TYPED_T       item type of the node array
+        TYPED_ACC     type used to accumulate the query results, wide enough
+                      to sum up to 128 nodes without overflow (except for 64-bit items)
+        TYPED_FORMAT  struct format of the items, the node array is exported
+                      through the buffer protocol only if it's defined
+        TYPED_KIND    TYPED_SIGNED, TYPED_UNSIGNED or TYPED_FLOAT
+        TYPED_MIN     the smallest item value (-inf for floats)
+        TYPED_MAX     the largest item value (inf for floats)
+        TYPED_FINITE_MAX  the largest finite item value, required for floats:
+                      finite values beyond it raise OverflowError instead of becoming inf
+        TYPED_WIDE    optional, items are 128-bit integers converted with
+                      the int128_* helpers and summed with the overflow checks
+
+    Nodes are checked for overflow on build and update, the query results
+    are calculated in TYPED_ACC, so they may exceed the range of TYPED_T.
+*/
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <float.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <string.h>
+#include "structmember.h"
+#include "common.h"
+
+#ifndef TYPED_SIGNED
+#define TYPED_SIGNED 1
+#define TYPED_UNSIGNED 2
+#define TYPED_FLOAT 3
+
+#define TYPED_CAT_(a, b) a ## b
+#define TYPED_CAT(a, b) TYPED_CAT_(a, b)
+#endif
+
+/* Public and underscored identifiers of the instance */
+#define TF(name) TYPED_CAT(TYPED_PREFIX, name)
+#define TF_(name) TYPED_CAT(_, TF(name))
+#define TYPED_OBJECT TF(Object)
+
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t size;
+    TYPED_T *tree;
+    enum QueryFunc func;
+    /* Number of alive buffer exports and the shape of the exported node array */
+    Py_ssize_t exports;
+    Py_ssize_t export_shape;
+} TYPED_OBJECT;
+
+
+static void
+TF(_dealloc)(TYPED_OBJECT* self)
+{
+    free(self->tree);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+TF(_new)(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    TYPED_OBJECT *self;
+
+    self = (TYPED_OBJECT *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->size = 0;
+    }
+
+    return (PyObject *)self;
+}
+
+#if TYPED_KIND == TYPED_FLOAT
+/* Returns true if the finite value turns into the infinity item */
+static inline bool
+TF_(_float_overflow)(double value)
+{
+    return isfinite(value) && fabs(value) > TYPED_FINITE_MAX;
+}
+#endif
+
+/* Converts the python number to the item, sets OverflowError if it's out of range */
+static int
+TF_(_from_object)(PyObject *obj, TYPED_T *res)
+{
+#if defined(TYPED_WIDE)
+    return int128_from_object(obj, res);
+#elif TYPED_KIND == TYPED_FLOAT
+    double value;
+
+    if (double_from_object(obj, &value) < 0) {
+        return -1;
+    }
+    if (TF_(_float_overflow)(value)) {
+        PyErr_SetString(PyExc_OverflowError, "Value is out of range of the " TYPED_NAME " items");
+        return -1;
+    }
+    *res = (TYPED_T)value;
+    return 0;
+#elif TYPED_KIND == TYPED_UNSIGNED && TYPED_MAX > LLONG_MAX
+    if (PyFloat_Check(obj)) {
+        PyErr_SetString(PyExc_TypeError, "an integer is required");
+        return -1;
+    }
+    unsigned long long value = PyLong_AsUnsignedLongLong(obj);
+
+    if (value == (unsigned long long)-1 && PyErr_Occurred()) {
+        return -1;
+    }
+    *res = (TYPED_T)value;
+    return 0;
+#else
+    long long value;
+
+    if (longlong_from_object(obj, &value) < 0) {
+        return -1;
+    }
+    if (value < TYPED_MIN || value > TYPED_MAX) {
+        PyErr_SetString(PyExc_OverflowError, "Value is out of range of the " TYPED_NAME " items");
+        return -1;
+    }
+    *res = (TYPED_T)value;
+    return 0;
+#endif
+}
+
+/* Reads i-th element of the source buffer, sets OverflowError if it's out of range */
+static int
+TF_(_from_buffer)(const Py_buffer *view, Py_ssize_t i, TYPED_T *res)
+{
+    int overflow = 0;
+
+#if defined(TYPED_WIDE)
+    long long value = buffer_get_integer(view, i, &overflow);
+
+    /* Only the unsigned 64-bit items don't fit into long long */
+    if (overflow) {
+        overflow = 0;
+        *res = (TYPED_T)buffer_get_unsigned(view, i, &overflow);
+    } else {
+        *res = value;
+    }
+#elif TYPED_KIND == TYPED_FLOAT
+    double value = buffer_get_double(view, i);
+
+    overflow = TF_(_float_overflow)(value);
+    *res = (TYPED_T)value;
+#elif TYPED_KIND == TYPED_UNSIGNED
+    unsigned long long value = buffer_get_unsigned(view, i, &overflow);
+
+    overflow = overflow || value > TYPED_MAX;
+    *res = (TYPED_T)value;
+#else
+    long long value = buffer_get_integer(view, i, &overflow);
+
+    overflow = overflow || value < TYPED_MIN || value > TYPED_MAX;
+    *res = (TYPED_T)value;
+#endif
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+        return -1;
+    }
+    return 0;
+}
+
+static PyObject *
+TF_(_to_object)(TYPED_ACC value)
+{
+#if defined(TYPED_WIDE)
+    return int128_to_object(value);
+#elif TYPED_KIND == TYPED_FLOAT
+    return PyFloat_FromDouble(value);
+#elif TYPED_KIND == TYPED_UNSIGNED
+    return PyLong_FromUnsignedLongLong(value);
+#else
+    return PyLong_FromLongLong(value);
+#endif
+}
+
+static inline TYPED_ACC
+TF_(_identity)(TYPED_OBJECT *self)
+{
+    switch(self->func) {
+        case Sum:
+            return 0;
+        case Min:
+            return TYPED_MAX;
+        case Max:
+            return TYPED_MIN;
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+/* Combines the query results, only the sums of 64-bit and wider items may overflow */
+static inline TYPED_ACC
+TF_(_accumulate)(TYPED_OBJECT *self, TYPED_ACC left, TYPED_ACC right, bool *overflow)
+{
+    switch(self->func) {
+        case Sum:
+#if defined(TYPED_WIDE)
+        {
+            TYPED_ACC res;
+            if (__builtin_add_overflow(left, right, &res)) {
+                *overflow = true;
+            }
+            return res;
+        }
+#elif TYPED_KIND == TYPED_UNSIGNED
+            if (left + right < left) {
+                *overflow = true;
+            }
+#endif
+            return left + right;
+        case Min:
+            return MIN(left, right);
+        case Max:
+            return MAX(left, right);
+        default:
+            Py_UNREACHABLE();
+            return 0;
+    }
+}
+
+/* Calculates the node from its children, returns true if it doesn't fit into the item */
+static inline bool
+TF_(_combine)(TYPED_OBJECT *self, TYPED_T left, TYPED_T right, TYPED_T *res)
+{
+    bool overflow = false;
+    TYPED_ACC value = TF_(_accumulate)(self, left, right, &overflow);
+
+#if TYPED_KIND == TYPED_FLOAT
+    overflow = TF_(_float_overflow)(value);
+#elif !defined(TYPED_WIDE)
+    overflow = overflow || value < TYPED_MIN || value > TYPED_MAX;
+#endif
+    *res = (TYPED_T)value;
+    return overflow;
+}
+
+/* Converts the items of the opened source into `dest`, sets OverflowError if they are out of range */
+static int
+TF_(_read_source)(TreeSource *src, TYPED_T *dest)
+{
+    int res = 0;
+
+    if (src->list == NULL) {
+#ifdef TYPED_FORMAT
+        if (src->view.itemsize == sizeof(TYPED_T) && buffer_format_char(&src->view) == TYPED_FORMAT[0]) {
+            buffer_copy_items(&src->view, dest, src->size);
+            return 0;
+        }
+#endif
+        for (Py_ssize_t i = 0; i < src->size && res == 0; i++) {
+            res = TF_(_from_buffer)(&src->view, i, &dest[i]);
+        }
+    } else {
+        for (Py_ssize_t i = 0; i < src->size && res == 0; i++) {
+            res = TF_(_from_object)(PyList_GET_ITEM(src->list, i), &dest[i]);
+        }
+    }
+    return res;
+}
+
+static int
+TF_(_build)(TYPED_OBJECT *self, PyObject *source)
+{
+    TreeSource src;
+
+    if (tree_source_open(&src, source, TYPED_KIND == TYPED_FLOAT) < 0) {
+        return -1;
+    }
+
+    TYPED_T *tree = (TYPED_T*) malloc(sizeof(TYPED_T) * 2 * MAX(src.size, 1));
+    if (tree == NULL) {
+        tree_source_close(&src);
+        PyErr_NoMemory();
+        return -1;
+    }
+    free(self->tree);
+    self->tree = tree;
+    self->size = 0;
+    /* The 0-th node is never used, but it's visible through the buffer protocol */
+    self->tree[0] = 0;
+
+    int res = TF_(_read_source)(&src, self->tree + src.size);
+    tree_source_close(&src);
+    if (res < 0) {
+        return -1;
+    }
+
+    for (Py_ssize_t i = src.size - 1; i > 0; i--) {
+        if (TF_(_combine)(self, self->tree[i << 1], self->tree[i << 1 | 1], &self->tree[i])) {
+            PyErr_SetString(PyExc_OverflowError, "Overflow while building the tree");
+            return -1;
+        }
+    }
+    self->size = src.size;
+    return 0;
+}
+
+static int
+TF(_init)(TYPED_OBJECT *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"source", "func", NULL};
+    PyObject *source = NULL;
+    char* func = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|s", kwlist,
+                                     &source, &func))
+        return -1;
+
+    enum QueryFunc query_func;
+    if (func != NULL) {
+        if (strcmp(func, "sum") == 0) {
+            query_func = Sum;
+        } else if (strcmp(func, "min") == 0) {
+            query_func = Min;
+        } else if (strcmp(func, "max") == 0) {
+            query_func = Max;
+        } else {
+            PyErr_SetString(PyExc_ValueError, "Invalid 'func' argument, must be 'sum', 'min' or 'max'");
+            return -1;
+        }
+    } else {
+        query_func = Sum;
+    }
+
+    int res;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (self->exports > 0) {
+        PyErr_SetString(PyExc_BufferError, "Existing exports of data: " TYPED_NAME " cannot be re-initialized");
+        res = -1;
+    } else {
+        self->func = query_func;
+        res = TF_(_build)(self, source);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+static inline Py_ssize_t
+TF(_mp_len)(TYPED_OBJECT *self)
+{
+    return self->size;
+}
+
+/* Performs the query on the non-empty interval [left, right) */
+static TYPED_ACC
+TF_(_query)(TYPED_OBJECT *self, Py_ssize_t left, Py_ssize_t right, bool *overflow)
+{
+    TYPED_ACC res_left = TF_(_identity)(self), res_right = res_left;
+
+    left += self->size;
+    right += self->size;
+    while (left < right) {
+        if (left & 1) {
+            res_left = TF_(_accumulate)(self, res_left, self->tree[left++], overflow);
+        }
+        if (right & 1) {
+            res_right = TF_(_accumulate)(self, self->tree[--right], res_right, overflow);
+        }
+        left >>= 1;
+        right >>= 1;
+    }
+    return TF_(_accumulate)(self, res_left, res_right, overflow);
+}
+
+static PyObject *
+TF(_query)(TYPED_OBJECT *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"start", "end"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t left, right;
+
+    if (fastcall_unpack("query", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &left) < 0
+        || ssize_from_object(argv[1], &right) < 0)
+        return NULL;
+
+    if (left >= right || left < 0) {
+        Py_RETURN_NONE;
+    }
+
+    TYPED_ACC res = 0;
+    bool out_of_range, overflow = false;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = right > self->size;
+    if (!out_of_range) {
+        res = TF_(_query)(self, left, right, &overflow);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, TYPED_NAME " index out of range");
+        return NULL;
+    }
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while calculating the query");
+        return NULL;
+    }
+    return TF_(_to_object)(res);
+}
+
+/*
+    Sets the leaf and recalculates its ancestors.
+    The new values are calculated before the assignment, so the tree isn't modified on overflow.
+*/
+static bool
+TF_(_update)(TYPED_OBJECT *self, Py_ssize_t i, TYPED_T value)
+{
+    TYPED_T values[8 * sizeof(Py_ssize_t) + 1];
+    Py_ssize_t k = i + self->size;
+    int depth = 0;
+
+    values[0] = value;
+    for (; k > 1; k >>= 1, depth++) {
+        TYPED_T sibling = self->tree[k ^ 1];
+        bool overflow = k & 1
+            ? TF_(_combine)(self, sibling, values[depth], &values[depth + 1])
+            : TF_(_combine)(self, values[depth], sibling, &values[depth + 1]);
+
+        if (overflow) {
+            return true;
+        }
+    }
+
+    k = i + self->size;
+    for (int d = 0; d <= depth && k > 0; d++, k >>= 1) {
+        self->tree[k] = values[d];
+    }
+    return false;
+}
+
+static PyObject *
+TF(_update)(TYPED_OBJECT *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+{
+    static const char *const kwlist[] = {"i", "value"};
+    PyObject *argv[2] = {NULL, NULL};
+    Py_ssize_t i;
+    TYPED_T value;
+
+    if (fastcall_unpack("update", args, nargs, kwnames, kwlist, 2, 2, argv) < 0
+        || ssize_from_object(argv[0], &i) < 0
+        || TF_(_from_object)(argv[1], &value) < 0)
+        return NULL;
+
+    bool out_of_range, overflow = false;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i > self->size - 1 || i < 0;
+    if (!out_of_range) {
+        overflow = TF_(_update)(self, i, value);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, TYPED_NAME " index out of range");
+        return NULL;
+    }
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+/*
+    Recalculates the ancestors of the leaf nodes [first, last] level by level,
+    so it takes O(K + Log[N]) for K contiguous leaves. Returns true on overflow.
+*/
+static bool
+TF_(_pull)(TYPED_OBJECT *self, Py_ssize_t first, Py_ssize_t last)
+{
+    for (first >>= 1, last >>= 1; last > 0; first >>= 1, last >>= 1) {
+        for (Py_ssize_t node = MAX(first, 1); node <= last; node++) {
+            if (TF_(_combine)(self, self->tree[node << 1], self->tree[node << 1 | 1], &self->tree[node])) {
+                return true;
+            }
+        }
+    }
+    return false;
+}
+
+/*
+    Writes the values into the leaves start, start + step, ... and recalculates
+    the ancestors of the touched leaves once. `prev` receives the replaced values.
+    Returns true on overflow leaving the tree unchanged.
+*/
+static bool
+TF_(_assign)(TYPED_OBJECT *self, Py_ssize_t start, Py_ssize_t step,
+             Py_ssize_t count, const TYPED_T *values, TYPED_T *prev)
+{
+    TYPED_T *leaves = self->tree + self->size;
+    Py_ssize_t first, last;
+
+    sequence_slice_bounds(start, step, count, &first, &last);
+    for (Py_ssize_t i = 0; i < count; i++) {
+        prev[i] = leaves[start + i * step];
+        leaves[start + i * step] = values[i];
+    }
+    if (!TF_(_pull)(self, self->size + first, self->size + last)) {
+        return false;
+    }
+
+    /* Restoring the previous values recalculates the previous nodes, they can't overflow */
+    for (Py_ssize_t i = 0; i < count; i++) {
+        leaves[start + i * step] = prev[i];
+    }
+    TF_(_pull)(self, self->size + first, self->size + last);
+    return true;
+}
+
+static PyObject *
+TF(_sq_item)(TYPED_OBJECT *self, Py_ssize_t i)
+{
+    TYPED_T value = 0;
+    bool out_of_range;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    out_of_range = i < 0 || i >= self->size;
+    if (!out_of_range) {
+        value = self->tree[self->size + i];
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, TYPED_NAME " index out of range");
+        return NULL;
+    }
+    return TF_(_to_object)(value);
+}
+
+#ifdef TYPED_FORMAT
+/* Copies the leaves start, start + step, ... into the typed array */
+static PyObject *
+TF_(_slice)(TYPED_OBJECT *self, Py_ssize_t start, Py_ssize_t step, Py_ssize_t count)
+{
+    PyObject *res = new_typed_array(TYPED_FORMAT[0], sizeof(TYPED_T), count);
+    Py_buffer out;
+
+    if (res == NULL || get_output_buffer(res, &out, TYPED_FORMAT[0], count) < 0) {
+        Py_XDECREF(res);
+        return NULL;
+    }
+
+    TYPED_T *dest = (TYPED_T*) out.buf;
+    for (Py_ssize_t i = 0; i < count; i++) {
+        dest[i] = self->tree[self->size + start + i * step];
+    }
+    PyBuffer_Release(&out);
+    return res;
+}
+#else
+/* Copies the leaves start, start + step, ... into the list */
+static PyObject *
+TF_(_slice)(TYPED_OBJECT *self, Py_ssize_t start, Py_ssize_t step, Py_ssize_t count)
+{
+    PyObject *res = PyList_New(count);
+    if (res == NULL) {
+        return NULL;
+    }
+
+    for (Py_ssize_t i = 0; i < count; i++) {
+        PyObject *item = TF_(_to_object)(self->tree[self->size + start + i * step]);
+        if (item == NULL) {
+            Py_DECREF(res);
+            return NULL;
+        }
+        PyList_SET_ITEM(res, i, item);
+    }
+    return res;
+}
+#endif
+
+/* `tree[i]` returns the leaf, `tree[start:stop:step]` returns the leaves */
+static PyObject *
+TF(_mp_subscript)(TYPED_OBJECT *self, PyObject *key)
+{
+    Py_ssize_t start, step, count;
+    PyObject *res = NULL;
+    int kind;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    kind = sequence_key_unpack(key, self->size, TYPED_NAME, &start, &step, &count);
+    if (kind == SEQUENCE_SLICE) {
+        res = TF_(_slice)(self, start, step, count);
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (kind == SEQUENCE_INDEX) {
+        return TF(_sq_item)(self, start);
+    }
+    return res;
+}
+
+/* `tree[i] = value` and `tree[start:stop:step] = values`, the slice keeps its length */
+static int
+TF(_mp_ass_subscript)(TYPED_OBJECT *self, PyObject *key, PyObject *value)
+{
+    Py_ssize_t start, step, count, length = 1;
+    TYPED_T item, *values = &item, prev_item, *prev = &prev_item;
+    int kind, res = -1;
+
+    if (value == NULL) {
+        PyErr_SetString(PyExc_TypeError, TYPED_NAME " doesn't support item deletion");
+        return -1;
+    }
+
+    /* The values are converted first, so the size can't change until the assignment */
+    if (PyIndex_Check(key)) {
+        if (TF_(_from_object)(value, &item) < 0) {
+            return -1;
+        }
+    } else if (PySlice_Check(key)) {
+        TreeSource src;
+
+        if (tree_source_open_iterable(&src, value, TYPED_KIND == TYPED_FLOAT) < 0) {
+            return -1;
+        }
+        values = (TYPED_T*) PyMem_Malloc(sizeof(TYPED_T) * 2 * MAX(src.size, 1));
+        if (values == NULL) {
+            tree_source_close(&src);
+            PyErr_NoMemory();
+            return -1;
+        }
+        prev = values + src.size;
+        length = src.size;
+
+        int read = TF_(_read_source)(&src, values);
+        tree_source_close(&src);
+        if (read < 0) {
+            PyMem_Free(values);
+            return -1;
+        }
+    }
+
+    bool overflow = false;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    kind = sequence_key_unpack(key, self->size, TYPED_NAME, &start, &step, &count);
+    if (kind == SEQUENCE_SLICE && length != count) {
+        PyErr_Format(PyExc_ValueError, "attempt to assign sequence of size %zd to slice of size %zd",
+                     length, count);
+    } else if (kind >= 0) {
+        overflow = count > 0 && TF_(_assign)(self, start, step, count, values, prev);
+        res = 0;
+    }
+    Py_END_CRITICAL_SECTION();
+
+    if (overflow) {
+        PyErr_SetString(PyExc_OverflowError, "Overflow while updating the tree");
+        res = -1;
+    }
+    if (values != &item) {
+        PyMem_Free(values);
+    }
+    return res;
+}
+
+/* Iterates over the leaves through `tree[i]` */
+static PyObject *
+TF(_iter)(TYPED_OBJECT *self)
+{
+    return PySeqIter_New((PyObject *)self);
+}
+
+#ifdef TYPED_FORMAT
+static Py_ssize_t TF(_itemsize) = sizeof(TYPED_T);
+
+/*
+    Exports the whole read-only node array of 2 * N items.
+    The tree leaves are located in the second half of the array.
+*/
+static int
+TF(_getbuffer)(TYPED_OBJECT *self, Py_buffer *view, int flags)
+{
+    if (flags & PyBUF_WRITABLE) {
+        PyErr_SetString(PyExc_BufferError, TYPED_NAME " buffer is read-only");
+        view->obj = NULL;
+        return -1;
+    }
+
+    self->export_shape = 2 * self->size;
+
+    view->buf = self->tree;
+    view->obj = (PyObject *)self;
+    Py_INCREF(self);
+    view->len = self->export_shape * TF(_itemsize);
+    view->readonly = 1;
+    view->itemsize = TF(_itemsize);
+    view->format = (flags & PyBUF_FORMAT) ? TYPED_FORMAT : NULL;
+    view->ndim = 1;
+    view->shape = (flags & PyBUF_ND) ? &self->export_shape : NULL;
+    view->strides = (flags & PyBUF_STRIDES) ? &TF(_itemsize) : NULL;
+    view->suboffsets = NULL;
+    view->internal = NULL;
+
+    self->exports++;
+    return 0;
+}
+
+static void
+TF(_releasebuffer)(TYPED_OBJECT *self, Py_buffer *view)
+{
+    self->exports--;
+}
+
+static PyObject *
+TF(_nodes)(TYPED_OBJECT *self, PyObject *Py_UNUSED(ignored))
+{
+    return PyMemoryView_FromObject((PyObject *)self);
+}
+
+static PyObject *
+TF(_leaves)(TYPED_OBJECT *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *nodes = PyMemoryView_FromObject((PyObject *)self);
+    if (nodes == NULL) {
+        return NULL;
+    }
+
+    PyObject *leaves = PySequence_GetSlice(nodes, self->size, 2 * self->size);
+    Py_DECREF(nodes);
+    return leaves;
+}
+#else
+static PyObject *
+TF(_leaves)(TYPED_OBJECT *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *leaves = PyList_New(self->size);
+    if (leaves == NULL) {
+        return NULL;
+    }
+
+    for (Py_ssize_t i = 0; i < self->size; i++) {
+        PyObject *item = TF_(_to_object)(self->tree[self->size + i]);
+        if (item == NULL) {
+            Py_DECREF(leaves);
+            return NULL;
+        }
+        PyList_SET_ITEM(leaves, i, item);
+    }
+    return leaves;
+}
+#endif
+
+/* The tree is pickled as the list of leaves and rebuilt by the constructor */
+static PyObject *
+TF(_reduce)(TYPED_OBJECT *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *leaves = TF(_leaves)(self, NULL);
+    if (leaves == NULL) {
+        return NULL;
+    }
+
+    PyObject *items = PySequence_List(leaves);
+    Py_DECREF(leaves);
+    if (items == NULL) {
+        return NULL;
+    }
+    return Py_BuildValue("(O(Ns))", Py_TYPE(self), items, query_func_names[self->func]);
+}
+
+#ifdef TYPED_FORMAT
+static PyBufferProcs TF(_as_buffer) = {
+    .bf_getbuffer = (getbufferproc)TF(_getbuffer),
+    .bf_releasebuffer = (releasebufferproc)TF(_releasebuffer),
+};
+#endif
+
+static PyMappingMethods TF(_mapping) = {
+    .mp_length = (lenfunc)TF(_mp_len),
+    .mp_subscript = (binaryfunc)TF(_mp_subscript),
+    .mp_ass_subscript = (objobjargproc)TF(_mp_ass_subscript),
+};
+
+static PySequenceMethods TF(_sequence) = {
+    .sq_length = (lenfunc)TF(_mp_len),
+    .sq_item = (ssizeargfunc)TF(_sq_item),
+};
+
+static PyMethodDef TF(_methods)[] = {
+    {"query", (PyCFunction)(void(*)(void)) TF(_query), METH_FASTCALL_KEYWORDS,
+    "Performs the query operation"},
+    {"update", (PyCFunction)(void(*)(void)) TF(_update), METH_FASTCALL_KEYWORDS,
+    "Performs the update operation"},
+    {"__reduce__", (PyCFunction) TF(_reduce), METH_NOARGS,
+    "Helper for pickle"},
+#ifdef TYPED_FORMAT
+    {"leaves", (PyCFunction) TF(_leaves), METH_NOARGS,
+    "Returns a read-only memoryview of the tree leaves"},
+    {"nodes", (PyCFunction) TF(_nodes), METH_NOARGS,
+    "Returns a read-only memoryview of the whole node array"},
+#else
+    {"leaves", (PyCFunction) TF(_leaves), METH_NOARGS,
+    "Returns the list of the tree leaves"},
+#endif
+    {NULL},  /* Sentinel */
+};
+
+static PyTypeObject TF(_type) = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysegmenttree.c_extensions." TYPED_NAME,
+    sizeof(TYPED_OBJECT),
+    .tp_dealloc = (destructor)TF(_dealloc),
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_doc = TYPED_NAME,
+    .tp_as_sequence = &TF(_sequence),
+    .tp_as_mapping = &TF(_mapping),
+#ifdef TYPED_FORMAT
+    .tp_as_buffer = &TF(_as_buffer),
+#endif
+    .tp_iter = (getiterfunc)TF(_iter),
+    .tp_methods = TF(_methods),
+    .tp_init = (initproc)TF(_init),
+    .tp_alloc = PyType_GenericAlloc,
+    .tp_new = TF(_new),
+};
+
+#undef TF
+#undef TF_
+#undef TYPED_OBJECT
+#undef TYPED_NAME
+#undef TYPED_PREFIX
+#undef TYPED_T
+#undef TYPED_ACC
+#undef TYPED_FORMAT
+#undef TYPED_KIND
+#undef TYPED_MIN
+#undef TYPED_MAX
+#undef TYPED_FINITE_MAX
+#undef TYPED_WIDE
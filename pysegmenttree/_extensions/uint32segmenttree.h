@@ -0,0 +1,10 @@
+/* Segment tree with 32-bit unsigned integer items, see typedsegmenttree.h */
+#define TYPED_NAME "UInt32SegmentTree"
+#define TYPED_PREFIX uint32segmenttree
+#define TYPED_T uint32_t
+#define TYPED_ACC unsigned long long
+#define TYPED_FORMAT "I"
+#define TYPED_KIND TYPED_UNSIGNED
+#define TYPED_MIN 0
+#define TYPED_MAX UINT32_MAX
+#include "typedsegmenttree.h"
@@ -0,0 +1,10 @@
+/* Segment tree with 64-bit unsigned integer items, see typedsegmenttree.h */
+#define TYPED_NAME "UInt64SegmentTree"
+#define TYPED_PREFIX uint64segmenttree
+#define TYPED_T uint64_t
+#define TYPED_ACC unsigned long long
+#define TYPED_FORMAT "Q"
+#define TYPED_KIND TYPED_UNSIGNED
+#define TYPED_MIN 0
+#define TYPED_MAX UINT64_MAX
+#include "typedsegmenttree.h"
@@ -1,27 +1,68 @@
+import math
 import operator
-from typing import Callable, List, Optional, Union
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+    cast,
+    overload,
+)
 
 from ._abc import AbstractSegmentTree, Func, QueryFunction, T
 
+# Identity elements used by default, if all items of the source are numbers.
+# Folding gcd from 0 gives the absolute value of the single item, like the C trees
+NUMERIC_IDENTITIES = {
+    QueryFunction.SUM: 0,
+    QueryFunction.MIN: math.inf,
+    QueryFunction.MAX: -math.inf,
+    QueryFunction.GCD: 0,
+}
 
-class PySegmentTree(AbstractSegmentTree):
+
+class PySegmentTree(AbstractSegmentTree[T]):
     """Pure python segment tree implementation."""
 
     def __init__(
         self,
         source: List[T],
         func: Optional[Union[Func, QueryFunction]] = QueryFunction.SUM,
+        identity: Optional[T] = None,
+        commutative: bool = True,
     ):
         if isinstance(func, QueryFunction):
             self.func = func.to_python_func()
+            self._query_function: Optional[QueryFunction] = func
         else:
             self.func = func
+            self._query_function = None
+
+        if (
+            identity is None
+            and isinstance(func, QueryFunction)
+            and func in NUMERIC_IDENTITIES
+            and all(isinstance(value, (int, float)) for value in source)
+        ):
+            # The numeric items accept the numeric identities
+            identity = cast(T, NUMERIC_IDENTITIES[func])
+        # Neutral element of func: the loops start from it instead of checking for None
+        self.identity = identity
+        # Non-commutative functions need the separate accumulators of the right nodes
+        self.commutative = commutative
+
         self._size = len(source)
-        self._tree = [*[None] * self._size, *source]
+        # Leaves are located at [capacity, capacity + size), the unused ones hold the identity
+        self._capacity = self._size
+        self._tree: List[Any] = [*[None] * self._size, *source]
         self._build()
 
     def _build(self):
-        for i in range(self._size - 1, 0, -1):
+        for i in range(self._capacity - 1, 0, -1):
             # Iteratively construct parent nodes using child ones
             self._tree[i] = self.func(self._tree[i << 1], self._tree[i << 1 | 1])
 
@@ -35,7 +76,27 @@ class PySegmentTree(AbstractSegmentTree):
         if start > end:
             raise IndexError(f"Invalid interval start > end ({start} > {end})")
 
-        left, right = start + self._size, end + self._size
+        left, right = start + self._capacity, end + self._capacity
+        if not self.commutative:
+            return self._query_ordered(left, right) if left < right else None
+
+        if self.identity is not None:
+            if left == right:
+                return None
+
+            func, tree = self.func, self._tree
+            res: Optional[T] = self.identity
+            while left < right:
+                if left & 1:
+                    res = func(res, tree[left])
+                    left += 1
+                if right & 1:
+                    right -= 1
+                    res = func(res, tree[right])
+                left >>= 1
+                right >>= 1
+            return res
+
         res = None
         while left < right:
             if left & 1:
@@ -57,6 +118,172 @@ class PySegmentTree(AbstractSegmentTree):
             right >>= 1
         return res
 
+    def _query_ordered(self, left: int, right: int) -> Optional[T]:
+        """
+        Folds the nodes of the left border and the right one into separate results,
+        so the items are combined in their order: func(func(a, b), c) for [a, b, c].
+        """
+        func, tree = self.func, self._tree
+        res_left = res_right = self.identity
+        while left < right:
+            if left & 1:
+                node = tree[left]
+                res_left = node if res_left is None else func(res_left, node)
+                left += 1
+            if right & 1:
+                right -= 1
+                node = tree[right]
+                res_right = node if res_right is None else func(node, res_right)
+            left >>= 1
+            right >>= 1
+
+        if res_left is None:
+            return res_right
+        if res_right is None:
+            return res_left
+        return func(res_left, res_right)
+
+    def query_many(self, starts: Sequence[int], ends: Sequence[int]) -> List[T]:
+        """
+        Perform a query for every interval [starts[i], ends[i]).
+        Emulates the batch method of the c-extension trees, so the intervals
+        must be non-empty and lie within the tree.
+
+        Computational complexity: O(K * Log[N])
+        """
+        if len(starts) != len(ends):
+            raise ValueError("'starts' and 'ends' must have the same length")
+
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            if start < 0 or end > self._size:
+                raise IndexError(f"SegmentTree interval #{i} out of range")
+            if start >= end:
+                raise ValueError(f"SegmentTree interval #{i} is empty")
+
+        # Queries of the non-empty intervals never return None
+        return [cast(T, self.query(start, end)) for start, end in zip(starts, ends)]
+
+    def _canonical_nodes(self, start: int, end: int) -> List[int]:
+        """
+        Decompose the interval [start, end) into the nodes used by queries.
+        Nodes are listed from left to right, all leaves of every node lie within the interval.
+        """
+        left, right = start + self._capacity, end + self._capacity
+        left_nodes, right_nodes = [], []
+        while left < right:
+            if left & 1:
+                left_nodes.append(left)
+                left += 1
+            if right & 1:
+                right -= 1
+                right_nodes.append(right)
+
+            left >>= 1
+            right >>= 1
+        return left_nodes + right_nodes[::-1]
+
+    def _search_predicate(
+        self, predicate: Union[Callable[[T], bool], T]
+    ) -> Callable[[T], bool]:
+        if callable(predicate):
+            return predicate
+
+        # Numeric thresholds are compared with the aggregates of the numeric items
+        threshold: Any = predicate
+        if self._query_function is QueryFunction.MIN:
+            return lambda value: threshold <= value
+        if self._query_function is not None:
+            return lambda value: threshold >= value
+        raise TypeError("Numeric threshold is supported only for QueryFunction trees")
+
+    def max_right(self, start: int, predicate: Union[Callable[[T], bool], T]) -> int:
+        """
+        Find the largest end, such that predicate(query(start, end)) is true.
+        The predicate must be monotone: once false it stays false for larger ends,
+        for the empty interval it's assumed to be true.
+        Trees with QueryFunction accept a numeric threshold as well: the sum or the maximum
+        must not exceed it, the minimum must not fall below it.
+
+        Computational complexity: O(Log[N])
+        """
+        if start > self._size or start < 0:
+            raise IndexError("SegmentTree index out of range")
+
+        predicate = self._search_predicate(predicate)
+        res = None
+        for node in self._canonical_nodes(start, self._size):
+            candidate = (
+                self._tree[node] if res is None else self.func(res, self._tree[node])
+            )
+            if predicate(candidate):
+                res = candidate
+                continue
+
+            # The answer is inside this node, descend to the leaf
+            while node < self._capacity:
+                node <<= 1
+                candidate = (
+                    self._tree[node]
+                    if res is None
+                    else self.func(res, self._tree[node])
+                )
+                if predicate(candidate):
+                    res = candidate
+                    node += 1
+            return node - self._capacity
+        return self._size
+
+    def min_left(self, end: int, predicate: Union[Callable[[T], bool], T]) -> int:
+        """
+        Find the smallest start, such that predicate(query(start, end)) is true.
+        Mirrored version of the `max_right`.
+
+        Computational complexity: O(Log[N])
+        """
+        if end > self._size or end < 0:
+            raise IndexError("SegmentTree index out of range")
+
+        predicate = self._search_predicate(predicate)
+        res = None
+        for node in reversed(self._canonical_nodes(0, end)):
+            candidate = (
+                self._tree[node] if res is None else self.func(self._tree[node], res)
+            )
+            if predicate(candidate):
+                res = candidate
+                continue
+
+            # The answer is inside this node, descend to the leaf
+            while node < self._capacity:
+                node = node << 1 | 1
+                candidate = (
+                    self._tree[node]
+                    if res is None
+                    else self.func(self._tree[node], res)
+                )
+                if predicate(candidate):
+                    res = candidate
+                    node -= 1
+            return node + 1 - self._capacity
+        return 0
+
+    def find_first(
+        self, start: int, predicate: Union[Callable[[T], bool], T]
+    ) -> Optional[int]:
+        """
+        Find the first index i >= start, such that predicate(query(start, i + 1)) is true.
+        For a numeric threshold it's the first index, where the sum or the maximum exceeds it,
+        or the minimum falls below it. Returns None if there is no such index.
+
+        Computational complexity: O(Log[N])
+        """
+        if callable(predicate):
+            func = predicate
+            res = self.max_right(start, lambda value: not func(value))
+        else:
+            res = self.max_right(start, predicate)
+        return res if res < self._size else None
+
     def update(self, i: int, value: T):
         """
         Set i-th element of the tree to the specified value.
@@ -66,10 +293,18 @@ class PySegmentTree(AbstractSegmentTree):
         if i > self._size - 1 or i < 0:
             raise IndexError("SegmentTree index out of range")
 
-        indx = i + self._size
+        indx = i + self._capacity
         self._tree[indx] = value
         parent = indx >> 1
 
+        if self.identity is not None:
+            # Children are never None, if the identity is known
+            func, tree = self.func, self._tree
+            while parent > 0:
+                tree[parent] = func(tree[parent << 1], tree[parent << 1 | 1])
+                parent >>= 1
+            return
+
         while parent > 0:
             left_child = self._tree[parent << 1]
             right_child = self._tree[parent << 1 | 1]
@@ -83,5 +318,202 @@ class PySegmentTree(AbstractSegmentTree):
 
             parent >>= 1
 
+    def update_many(self, indices: Sequence[int], values: Sequence[T]):
+        """
+        Set every indices[i]-th element of the tree to the values[i].
+        Leaves are written first, then every dirty ancestor is recomputed once.
+
+        Computational complexity: O(K * Log[N]), O(K + Log[N]) for neighbouring indices
+        """
+        if len(indices) != len(values):
+            raise ValueError("'indices' and 'values' must have the same length")
+
+        for i in indices:
+            if i > self._size - 1 or i < 0:
+                raise IndexError("SegmentTree index out of range")
+
+        for i, value in zip(indices, values):
+            self._tree[i + self._capacity] = value
+
+        # Parents have smaller indices than their children, so processing nodes
+        # in descending order recomputes every ancestor after all its children.
+        dirty = sorted({i + self._capacity for i in indices}, reverse=True)
+        for node in dirty:
+            if node < self._capacity and self.identity is not None:
+                self._tree[node] = self.func(
+                    self._tree[node << 1], self._tree[node << 1 | 1]
+                )
+            elif node < self._capacity:
+                left_child = self._tree[node << 1]
+                right_child = self._tree[node << 1 | 1]
+
+                if left_child is not None and right_child is not None:
+                    self._tree[node] = self.func(left_child, right_child)
+                elif left_child is not None:
+                    self._tree[node] = left_child
+                else:
+                    self._tree[node] = right_child
+
+            parent = node >> 1
+            if parent > 0 and dirty[-1] != parent:
+                dirty.append(parent)
+
+    def _pull(self, node: int):
+        left_child = self._tree[node << 1]
+        right_child = self._tree[node << 1 | 1]
+
+        if left_child is not None and right_child is not None:
+            self._tree[node] = self.func(left_child, right_child)
+        elif left_child is not None:
+            self._tree[node] = left_child
+        else:
+            self._tree[node] = right_child
+
+    def _pull_range(self, first: int, last: int):
+        """
+        Recompute the ancestors of the leaves [first, last] level by level.
+        Ancestors of the contiguous leaves are contiguous at every level.
+        """
+        first, last = first >> 1, last >> 1
+        while last > 0:
+            for node in range(max(first, 1), last + 1):
+                self._pull(node)
+            first, last = first >> 1, last >> 1
+
+    def _grow(self, capacity: int):
+        """Move the leaves into the tree with room for capacity leaves and rebuild it."""
+        leaves = self._tree[self._capacity : self._capacity + self._size]
+        self._tree = [
+            *[None] * capacity,
+            *leaves,
+            *[self.identity] * (capacity - self._size),
+        ]
+        self._capacity = capacity
+        for node in range(capacity - 1, 0, -1):
+            self._pull(node)
+
+    def append(self, value: T):
+        """
+        Append the value to the end of the tree.
+
+        Computational complexity: amortized O(Log[N])
+        """
+        self.extend([value])
+
+    def extend(self, values: Iterable[T]):
+        """
+        Append the values to the end of the tree.
+        The capacity is doubled when it's exhausted, so the tree is rebuilt only on growth,
+        otherwise only the ancestors of the new leaves are recomputed.
+
+        Computational complexity: amortized O(K + Log[N])
+        """
+        values = list(values)
+        if not values:
+            return
+
+        size = self._size + len(values)
+        if size > self._capacity:
+            self._grow(max(size, 2 * self._capacity))
+
+        first = self._capacity + self._size
+        self._tree[first : first + len(values)] = values
+        self._size = size
+        self._pull_range(first, first + len(values) - 1)
+
+    def pop(self) -> T:
+        """
+        Remove and return the last element of the tree.
+
+        Computational complexity: O(Log[N])
+        """
+        if self._size == 0:
+            raise IndexError("pop from empty SegmentTree")
+
+        leaf = self._capacity + self._size - 1
+        value = self._tree[leaf]
+        self._tree[leaf] = self.identity
+        self._size -= 1
+        self._pull_range(leaf, leaf)
+        return value
+
+    def _slice_indices(self, key: Union[int, slice]) -> range:
+        if isinstance(key, slice):
+            return range(*key.indices(self._size))
+
+        try:
+            i = operator.index(key)
+        except TypeError:
+            raise TypeError(
+                "SegmentTree indices must be integers or slices, "
+                f"not {type(key).__name__}"
+            ) from None
+        if i < 0:
+            i += self._size
+        if i < 0 or i >= self._size:
+            raise IndexError("SegmentTree index out of range")
+        return range(i, i + 1)
+
+    @overload
+    def __getitem__(self, key: int) -> T:
+        ...
+
+    @overload
+    def __getitem__(self, key: slice) -> List[T]:
+        ...
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[T, List[T]]:
+        """
+        Return the i-th element of the tree or the list of the elements of the slice.
+
+        Computational complexity: O(1), O(K) for the slice
+        """
+        indices = self._slice_indices(key)
+        if not isinstance(key, slice):
+            return self._tree[indices[0] + self._capacity]
+        return [self._tree[i + self._capacity] for i in indices]
+
+    @overload
+    def __setitem__(self, key: int, value: T) -> None:
+        ...
+
+    @overload
+    def __setitem__(self, key: slice, value: Iterable[T]) -> None:
+        ...
+
+    def __setitem__(self, key: Union[int, slice], value: Union[T, Iterable[T]]) -> None:
+        """
+        Set the i-th element of the tree or the elements of the slice,
+        the slice can't change the size of the tree. The leaves are written first,
+        then the ancestors of the touched leaves are recomputed once.
+
+        Computational complexity: O(Log[N]), O(K + Log[N]) for the contiguous slice
+        """
+        indices = self._slice_indices(key)
+        if not isinstance(key, slice):
+            self.update(indices[0], cast(T, value))
+            return
+
+        values = list(cast(Iterable[T], value))
+        if len(values) != len(indices):
+            raise ValueError(
+                f"attempt to assign sequence of size {len(values)} "
+                f"to slice of size {len(indices)}"
+            )
+        if not values:
+            return
+
+        for i, item in zip(indices, values):
+            self._tree[i + self._capacity] = item
+        first, last = min(indices[0], indices[-1]), max(indices[0], indices[-1])
+        self._pull_range(first + self._capacity, last + self._capacity)
+
+    def __delitem__(self, key: Union[int, slice]):
+        raise TypeError("SegmentTree doesn't support item deletion")
+
+    def __iter__(self) -> Iterator[T]:
+        for i in range(self._capacity, self._capacity + self._size):
+            yield self._tree[i]
+
     def __len__(self):
         return self._size
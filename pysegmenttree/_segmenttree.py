@@ -1,30 +1,380 @@
-from typing import List, Optional, Union
+import mmap
+import os
+import struct
+import sys
+from typing import Any, List, Mapping, Optional, Sequence, Tuple, Type, Union, cast
 
 from ._abc import AbstractSegmentTree, Func, QueryFunction, T
 from ._pysegmenttree_py import PySegmentTree
 
 try:
-    from .c_extensions import FloatSegmentTree, IntSegmentTree
+    from . import c_extensions
+    from .c_extensions import (
+        Float32SegmentTree,
+        FloatDynamicSegmentTree,
+        FloatFenwickTree,
+        FloatLazySegmentTree,
+        FloatMultiSegmentTree,
+        FloatPersistentSegmentTree,
+        FloatSegmentTree,
+        FloatSparseTable,
+        Int32SegmentTree,
+        IntDynamicSegmentTree,
+        IntFenwickTree,
+        IntLazySegmentTree,
+        IntMultiSegmentTree,
+        IntPersistentSegmentTree,
+        IntSegmentTree,
+        IntSparseTable,
+        ObjectSegmentTree,
+        UInt32SegmentTree,
+        UInt64SegmentTree,
+    )
 
     C_EXTENSIONS = True
+    DTYPES = {
+        "int32": Int32SegmentTree,
+        "int64": IntSegmentTree,
+        "uint32": UInt32SegmentTree,
+        "uint64": UInt64SegmentTree,
+        "float32": Float32SegmentTree,
+        "float64": FloatSegmentTree,
+    }
+
+    # Compilers without 128-bit integers (msvc) don't build this tree
+    Int128SegmentTree = getattr(c_extensions, "Int128SegmentTree", None)
+    if Int128SegmentTree is not None:
+        DTYPES["int128"] = Int128SegmentTree
 except ImportError:
     C_EXTENSIONS = False
+    Int128SegmentTree = None
+
+
+# Trees with the `to_bytes` snapshot, which can be saved and attached
+SnapshotTree = Union["IntSegmentTree", "FloatSegmentTree"]
+
+# Header of the `to_bytes` snapshot: magic, version, dtype, func, flags, size, seq
+SNAPSHOT_HEADER = struct.Struct("=4sBcBBQQ")
+
+INT_FORMATS = frozenset("bBhHiIlLqQnN")
+FLOAT_FORMATS = frozenset("fd")
+
+# Functions of the trees other than IntSegmentTree, gcd and bitwise ones are int only
+BASIC_FUNCTIONS = frozenset([QueryFunction.SUM, QueryFunction.MIN, QueryFunction.MAX])
+FLOAT_FUNCTIONS = BASIC_FUNCTIONS | {QueryFunction.PRODUCT}
+
+
+def _buffer_format(source: Any) -> Optional[str]:
+    """Returns struct format of the 1-D buffer source or None for other containers."""
+    try:
+        with memoryview(source) as view:
+            if view.ndim != 1:
+                return None
+            return view.format.lstrip("@")
+    except TypeError:
+        return None
+
+
+def _item_type(source: List[T]) -> Optional[type]:
+    """Returns the type of source items, if all of them are either int or float."""
+    # Buffers (array.array, NumPy arrays, ...) are detected by their format,
+    # so they can be copied without creating intermediate python objects.
+    buffer_format = _buffer_format(source)
+    if buffer_format is not None:
+        if buffer_format in INT_FORMATS:
+            return int
+        if buffer_format in FLOAT_FORMATS:
+            return float
+        return None
+
+    if source and isinstance(source[0], int):
+        return int
+    if source and isinstance(source[0], float):
+        return float
+    return None
+
+
+def _object_tree(
+    source: List[T], func: Union[Func, QueryFunction]
+) -> AbstractSegmentTree:
+    """Returns the tree of arbitrary objects, which calls `func` from C if possible."""
+    # ObjectSegmentTree has no identity, so its single items would keep their sign
+    if not C_EXTENSIONS or func is QueryFunction.GCD:
+        return PySegmentTree(source=source, func=func)
+    if isinstance(func, QueryFunction):
+        return ObjectSegmentTree(source, func=func.to_python_func())
+    return ObjectSegmentTree(source, func=func)
 
 
 def stree(
-    source: List[T], func: Union[Func, QueryFunction] = QueryFunction.SUM
+    source: Union[List[T], Mapping[int, T]],
+    func: Union[Func, QueryFunction, Sequence[QueryFunction]] = QueryFunction.SUM,
+    lazy: bool = False,
+    threadsafe: bool = False,
+    compact: bool = False,
+    static: bool = False,
+    persistent: bool = False,
+    dtype: Optional[str] = None,
+    modulus: Optional[int] = None,
 ) -> AbstractSegmentTree:
     """
     Automatically detects the type of input container, and uses the
     fastest possible segment tree implementation.
+
+    If `lazy` is set, the tree with O(Log[N]) `range_add` and `range_assign`
+    methods is returned.
+
+    If `threadsafe` is set, the C tree is protected by the reader/writer lock
+    and releases the GIL in all methods, so concurrent queries run in parallel.
+
+    If `compact` is set and `func` is `QueryFunction.SUM`, the Fenwick tree
+    taking N + 1 items instead of 2 * N is returned.
+
+    If `static` is set and `func` is `QueryFunction.MIN` or `QueryFunction.MAX`,
+    the sparse table with O(1) `query` is returned. It doesn't support updates.
+
+    If `persistent` is set, the tree with `snapshot` method and `version`
+    argument of `query` is returned.
+
+    `dtype` sets the item type of the C tree: one of "int32", "int64", "uint32",
+    "uint64", "float32", "float64" or "int128" (if the compiler supports it).
+    Narrower items take less memory, items out of the range raise OverflowError.
+    The nodes are stored in the same type, so with QueryFunction.SUM the sums
+    of the items must fit into it too, e.g. 2**31 - 1 for "int32".
+    Trees with the items other than int64 and float64 support only `query`,
+    `update` and the sequence protocol. `dtype` can't be combined with the other
+    options and mapping sources.
+
+    If the int items or their sums don't fit into 64 bits, the tree with 128-bit
+    items is used. Other sources and custom functions are handled by the tree
+    of python objects, which calls `func` from C.
+
+    If `source` is a mapping of indices to values, the dynamic tree over
+    the whole [0, sys.maxsize) index space is returned, untouched positions
+    hold the identity element of `func`.
+
+    `modulus` is supported only by `QueryFunction.PRODUCT` over int items,
+    the products are calculated modulo it.
+
+    If `func` is a sequence of `QueryFunction.SUM`, `QueryFunction.MIN` and
+    `QueryFunction.MAX`, the multi-aggregate tree is returned. Its `query`
+    returns all aggregates at once and `update` refreshes them in one walk.
+    It keeps only int and float items, the int items and their sums must fit
+    into 64 bits, ValueError is raised otherwise.
     """
+    if dtype is not None:
+        options = {
+            "lazy": lazy,
+            "threadsafe": threadsafe,
+            "compact": compact,
+            "static": static,
+            "persistent": persistent,
+            "modulus": modulus is not None,
+        }
+        conflicts = [repr(name) for name, value in options.items() if value]
+        if conflicts:
+            raise ValueError(f"'dtype' can't be combined with {', '.join(conflicts)}")
+        if isinstance(source, Mapping):
+            raise ValueError("Dynamic segment trees don't support 'dtype'")
+        if not C_EXTENSIONS or not isinstance(func, QueryFunction):
+            raise ValueError("Typed segment trees support only QueryFunction members")
+        if dtype not in DTYPES:
+            raise ValueError(
+                f"Unknown dtype {dtype!r}, must be one of {', '.join(DTYPES)}"
+            )
+        return DTYPES[dtype](source, func=func.value)
+
+    if modulus is not None:
+        if func is not QueryFunction.PRODUCT:
+            raise ValueError("'modulus' is supported only by QueryFunction.PRODUCT")
+        if modulus <= 0:
+            raise ValueError("'modulus' must be positive")
+        if isinstance(source, Mapping):
+            raise ValueError("Dynamic segment trees don't support 'modulus'")
+        if C_EXTENSIONS and modulus <= sys.maxsize and _item_type(source) is int:
+            try:
+                return IntSegmentTree(source, func=func.value, modulus=modulus)
+            except OverflowError:
+                pass
+        return _object_tree(
+            [value % modulus for value in cast(List[int], source)],
+            func=lambda left, right: left * right % modulus,
+        )
+
+    if isinstance(func, Sequence):
+        if not C_EXTENSIONS or not all(f in BASIC_FUNCTIONS for f in func):
+            raise ValueError(
+                "Multi-aggregate trees support only SUM, MIN and MAX functions"
+            )
+        if isinstance(source, Mapping):
+            raise ValueError("Dynamic segment trees don't support multiple functions")
+        funcs = [f.value for f in func]
+        try:
+            if _item_type(source) is float:
+                return FloatMultiSegmentTree(source, funcs=funcs)
+            return IntMultiSegmentTree(source, funcs=funcs)
+        except OverflowError:
+            raise ValueError(
+                "Multi-aggregate trees support only int items and sums fitting into 64 bits"
+            ) from None
+        except TypeError:
+            pass
+        # The first item is int, but the others are floats
+        if all(isinstance(value, (int, float)) for value in source):
+            return FloatMultiSegmentTree(source, funcs=funcs)
+        raise ValueError("Multi-aggregate trees support only int and float items")
+
+    if isinstance(source, Mapping):
+        if not C_EXTENSIONS or not isinstance(func, QueryFunction):
+            raise ValueError("Dynamic segment trees support only QueryFunction members")
+        if any(isinstance(value, float) for value in source.values()):
+            return FloatDynamicSegmentTree(
+                sys.maxsize, func=func.value, source=cast(Mapping[int, float], source)
+            )
+        return IntDynamicSegmentTree(
+            sys.maxsize, func=func.value, source=cast(Mapping[int, int], source)
+        )
+
+    if lazy:
+        if not C_EXTENSIONS or not isinstance(func, QueryFunction):
+            raise ValueError("Lazy segment trees support only QueryFunction members")
+        if _item_type(source) is float:
+            return FloatLazySegmentTree(source, func=func.value)
+        return IntLazySegmentTree(source, func=func.value)
+
+    if persistent:
+        if not C_EXTENSIONS or not isinstance(func, QueryFunction):
+            raise ValueError(
+                "Persistent segment trees support only QueryFunction members"
+            )
+        if _item_type(source) is float:
+            return FloatPersistentSegmentTree(source, func=func.value)
+        return IntPersistentSegmentTree(source, func=func.value)
+
     try:
         if C_EXTENSIONS and isinstance(func, QueryFunction):
-            if source and isinstance(source[0], int):
-                return IntSegmentTree(source, func=func.value)
-            if source and isinstance(source[0], float):
-                return FloatSegmentTree(source, func=func.value)
+            item_type = _item_type(source)
+            if static and func in (QueryFunction.MIN, QueryFunction.MAX):
+                if item_type is int:
+                    return IntSparseTable(source, func=func.value)
+                if item_type is float:
+                    return FloatSparseTable(source, func=func.value)
+            if compact and func is QueryFunction.SUM:
+                if item_type is int:
+                    return IntFenwickTree(source)
+                if item_type is float:
+                    return FloatFenwickTree(source)
+            if item_type is int:
+                return IntSegmentTree(source, func=func.value, threadsafe=threadsafe)
+            if item_type is float and func in FLOAT_FUNCTIONS:
+                return FloatSegmentTree(source, func=func.value, threadsafe=threadsafe)
     except OverflowError:
-        pass
+        if (
+            Int128SegmentTree is not None
+            and item_type is int
+            and func in BASIC_FUNCTIONS
+        ):
+            try:
+                return Int128SegmentTree(source, func=func.value)
+            except OverflowError:
+                pass
+
+    return _object_tree(source, func=func)
+
+
+def _snapshot_tree_type(header: bytes) -> Tuple[Type[SnapshotTree], int]:
+    """Returns the tree class and the whole length of the snapshot by its header."""
+    if len(header) < SNAPSHOT_HEADER.size:
+        raise ValueError("Invalid segment tree snapshot: data is too short")
+
+    _, _, dtype, _, _, size, _ = SNAPSHOT_HEADER.unpack_from(header)
+    kls: Type[SnapshotTree]
+    if dtype == b"q":
+        kls = IntSegmentTree
+    elif dtype == b"d":
+        kls = FloatSegmentTree
+    else:
+        raise ValueError("Invalid segment tree snapshot: unknown item type")
+    return kls, SNAPSHOT_HEADER.size + 2 * size * struct.calcsize(dtype.decode())
+
+
+def _check_snapshot_tree(tree: object) -> None:
+    """Raises TypeError for the trees without the `to_bytes` snapshot."""
+    if not C_EXTENSIONS or not isinstance(tree, (IntSegmentTree, FloatSegmentTree)):
+        raise TypeError(
+            f"{type(tree).__name__} doesn't support snapshots, "
+            "only IntSegmentTree and FloatSegmentTree can be saved or shared"
+        )
+
+
+def save_stree(tree: SnapshotTree, path: Union[str, os.PathLike]) -> None:
+    """
+    Persists the snapshot of the C tree to the file,
+    so it can be opened later by `open_stree` without the rebuild.
+    """
+    _check_snapshot_tree(tree)
+    with open(path, "wb") as f:
+        f.write(tree.to_bytes())
+
+
+def open_stree(
+    path: Union[str, os.PathLike], mode: str = "r", sync: bool = False
+) -> SnapshotTree:
+    """
+    Attaches the tree to the memory-mapped snapshot file created by `save_stree`.
+
+    The file is opened read-only for the "r" mode, in the "r+" mode
+    updates are written through to the file. If `sync` is set, every update
+    is flushed to the disk before returning.
+    """
+    if not C_EXTENSIONS:
+        raise RuntimeError("C extensions are required to open the tree snapshot")
+    if mode not in ("r", "r+"):
+        raise ValueError("Invalid 'mode' argument, must be 'r' or 'r+'")
+
+    with open(path, "rb" if mode == "r" else "r+b") as f:
+        kls, _ = _snapshot_tree_type(f.read(SNAPSHOT_HEADER.size))
+        access = mmap.ACCESS_READ if mode == "r" else mmap.ACCESS_WRITE
+        storage = mmap.mmap(f.fileno(), 0, access=access)
+
+    # The tree holds the buffer of the mapping, so it stays alive as long as the tree
+    return kls.attach(storage, sync=sync)
+
+
+def share_stree(
+    tree: SnapshotTree, name: Optional[str] = None
+) -> Tuple[SnapshotTree, Any]:
+    """
+    Copies the C tree into the new shared memory block and attaches to it.
+
+    Returns the writable tree and the `multiprocessing.shared_memory.SharedMemory`
+    object, which must stay open while the tree is alive. Other processes
+    attach to the block by its name with `attach_stree`.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    _check_snapshot_tree(tree)
+    snapshot = tree.to_bytes()
+    shm = SharedMemory(name=name, create=True, size=len(snapshot))
+    # The buffer of the block is released only by `close`
+    buf = cast(memoryview, shm.buf)
+    buf[: len(snapshot)] = snapshot
+    return type(tree).attach(buf[: len(snapshot)]), shm
+
+
+def attach_stree(name: str, readonly: bool = True) -> Tuple[SnapshotTree, Any]:
+    """
+    Attaches the tree to the shared memory block created by `share_stree`.
+
+    Readers see the updates of the single writer process. Queries are
+    protected by the seqlock, so they never observe the half-updated tree.
+    """
+    from multiprocessing.shared_memory import SharedMemory
 
-    return PySegmentTree(source=source, func=func)
+    shm = SharedMemory(name=name)
+    buf = cast(memoryview, shm.buf)
+    kls, length = _snapshot_tree_type(bytes(buf[: SNAPSHOT_HEADER.size]))
+    storage = buf[:length]
+    if readonly:
+        storage = storage.toreadonly()
+    return kls.attach(storage), shm
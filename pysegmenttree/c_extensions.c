@@ -5,41 +5,259 @@
 
 #include "_extensions/intsegmenttree.h"
 #include "_extensions/floatsegmenttree.h"
+#include "_extensions/intlazysegmenttree.h"
+#include "_extensions/floatlazysegmenttree.h"
+#include "_extensions/intfenwicktree.h"
+#include "_extensions/floatfenwicktree.h"
+#include "_extensions/intsparsetable.h"
+#include "_extensions/floatsparsetable.h"
+#include "_extensions/intdynamicsegmenttree.h"
+#include "_extensions/floatdynamicsegmenttree.h"
+#include "_extensions/intpersistentsegmenttree.h"
+#include "_extensions/floatpersistentsegmenttree.h"
+#include "_extensions/int32segmenttree.h"
+#include "_extensions/uint32segmenttree.h"
+#include "_extensions/uint64segmenttree.h"
+#include "_extensions/float32segmenttree.h"
+#include "_extensions/int128segmenttree.h"
+#include "_extensions/intmultisegmenttree.h"
+#include "_extensions/floatmultisegmenttree.h"
+#include "_extensions/objectsegmenttree.h"
+#include "_extensions/matrixsegmenttree.h"
 
-static PyModuleDef c_extensions = {
-    PyModuleDef_HEAD_INIT,           /* m_base */
-    "pysegmenttree.c_extensions",    /* m_name */
-    .m_doc = "Example module that creates an extension type.",
-    .m_size = -1,
-};
-
-PyMODINIT_FUNC
-PyInit_c_extensions(void)
+static int
+c_extensions_exec(PyObject *m)
 {
-    PyObject* m;
-
     if (PyType_Ready(&intsegmenttree_type) < 0 || PyType_Ready(&floatsegmenttree_type) < 0)
-        return NULL;
+        return -1;
+
+    if (PyType_Ready(&intlazysegmenttree_type) < 0 || PyType_Ready(&floatlazysegmenttree_type) < 0)
+        return -1;
+
+    if (PyType_Ready(&intfenwicktree_type) < 0 || PyType_Ready(&floatfenwicktree_type) < 0)
+        return -1;
+
+    if (PyType_Ready(&intsparsetable_type) < 0 || PyType_Ready(&floatsparsetable_type) < 0)
+        return -1;
 
-    m = PyModule_Create(&c_extensions);
-    if (m == NULL)
-        return NULL;
+    if (PyType_Ready(&intdynamicsegmenttree_type) < 0 || PyType_Ready(&floatdynamicsegmenttree_type) < 0)
+        return -1;
+
+    if (PyType_Ready(&intpersistentsegmenttree_type) < 0 || PyType_Ready(&floatpersistentsegmenttree_type) < 0)
+        return -1;
+
+    if (PyType_Ready(&int32segmenttree_type) < 0 || PyType_Ready(&uint32segmenttree_type) < 0
+        || PyType_Ready(&uint64segmenttree_type) < 0 || PyType_Ready(&float32segmenttree_type) < 0)
+        return -1;
+
+#ifdef HAVE_INT128
+    if (PyType_Ready(&int128segmenttree_type) < 0)
+        return -1;
+#endif
+
+    if (PyType_Ready(&intmultisegmenttree_type) < 0 || PyType_Ready(&floatmultisegmenttree_type) < 0)
+        return -1;
+
+    if (PyType_Ready(&objectsegmenttree_type) < 0)
+        return -1;
+
+    if (PyType_Ready(&matrixsegmenttree_type) < 0 || PyType_Ready(&affinesegmenttree_type) < 0)
+        return -1;
+
+    /* The static struct sequence type is initialized once per process */
+    if (aggregates_type.tp_name == NULL && PyStructSequence_InitType2(&aggregates_type, &aggregates_desc) < 0)
+        return -1;
 
     Py_INCREF(&intsegmenttree_type);
     if (PyModule_AddObject(m, "IntSegmentTree", (PyObject*)&intsegmenttree_type) < 0)
     {
         Py_DECREF(&intsegmenttree_type);
-        Py_DECREF(m);
-        return NULL;
+        return -1;
     }
 
     Py_INCREF(&floatsegmenttree_type);
     if (PyModule_AddObject(m, "FloatSegmentTree", (PyObject*)&floatsegmenttree_type) < 0)
     {
         Py_DECREF(&floatsegmenttree_type);
-        Py_DECREF(m);
-        return NULL;
+        return -1;
+    }
+
+    Py_INCREF(&intlazysegmenttree_type);
+    if (PyModule_AddObject(m, "IntLazySegmentTree", (PyObject*)&intlazysegmenttree_type) < 0)
+    {
+        Py_DECREF(&intlazysegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&floatlazysegmenttree_type);
+    if (PyModule_AddObject(m, "FloatLazySegmentTree", (PyObject*)&floatlazysegmenttree_type) < 0)
+    {
+        Py_DECREF(&floatlazysegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&intfenwicktree_type);
+    if (PyModule_AddObject(m, "IntFenwickTree", (PyObject*)&intfenwicktree_type) < 0)
+    {
+        Py_DECREF(&intfenwicktree_type);
+        return -1;
+    }
+
+    Py_INCREF(&floatfenwicktree_type);
+    if (PyModule_AddObject(m, "FloatFenwickTree", (PyObject*)&floatfenwicktree_type) < 0)
+    {
+        Py_DECREF(&floatfenwicktree_type);
+        return -1;
+    }
+
+    Py_INCREF(&intsparsetable_type);
+    if (PyModule_AddObject(m, "IntSparseTable", (PyObject*)&intsparsetable_type) < 0)
+    {
+        Py_DECREF(&intsparsetable_type);
+        return -1;
+    }
+
+    Py_INCREF(&floatsparsetable_type);
+    if (PyModule_AddObject(m, "FloatSparseTable", (PyObject*)&floatsparsetable_type) < 0)
+    {
+        Py_DECREF(&floatsparsetable_type);
+        return -1;
+    }
+
+    Py_INCREF(&intdynamicsegmenttree_type);
+    if (PyModule_AddObject(m, "IntDynamicSegmentTree", (PyObject*)&intdynamicsegmenttree_type) < 0)
+    {
+        Py_DECREF(&intdynamicsegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&floatdynamicsegmenttree_type);
+    if (PyModule_AddObject(m, "FloatDynamicSegmentTree", (PyObject*)&floatdynamicsegmenttree_type) < 0)
+    {
+        Py_DECREF(&floatdynamicsegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&intpersistentsegmenttree_type);
+    if (PyModule_AddObject(m, "IntPersistentSegmentTree", (PyObject*)&intpersistentsegmenttree_type) < 0)
+    {
+        Py_DECREF(&intpersistentsegmenttree_type);
+        return -1;
     }
 
-    return m;
+    Py_INCREF(&floatpersistentsegmenttree_type);
+    if (PyModule_AddObject(m, "FloatPersistentSegmentTree", (PyObject*)&floatpersistentsegmenttree_type) < 0)
+    {
+        Py_DECREF(&floatpersistentsegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&int32segmenttree_type);
+    if (PyModule_AddObject(m, "Int32SegmentTree", (PyObject*)&int32segmenttree_type) < 0)
+    {
+        Py_DECREF(&int32segmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&uint32segmenttree_type);
+    if (PyModule_AddObject(m, "UInt32SegmentTree", (PyObject*)&uint32segmenttree_type) < 0)
+    {
+        Py_DECREF(&uint32segmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&uint64segmenttree_type);
+    if (PyModule_AddObject(m, "UInt64SegmentTree", (PyObject*)&uint64segmenttree_type) < 0)
+    {
+        Py_DECREF(&uint64segmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&float32segmenttree_type);
+    if (PyModule_AddObject(m, "Float32SegmentTree", (PyObject*)&float32segmenttree_type) < 0)
+    {
+        Py_DECREF(&float32segmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&intmultisegmenttree_type);
+    if (PyModule_AddObject(m, "IntMultiSegmentTree", (PyObject*)&intmultisegmenttree_type) < 0)
+    {
+        Py_DECREF(&intmultisegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&floatmultisegmenttree_type);
+    if (PyModule_AddObject(m, "FloatMultiSegmentTree", (PyObject*)&floatmultisegmenttree_type) < 0)
+    {
+        Py_DECREF(&floatmultisegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&aggregates_type);
+    if (PyModule_AddObject(m, "Aggregates", (PyObject*)&aggregates_type) < 0)
+    {
+        Py_DECREF(&aggregates_type);
+        return -1;
+    }
+
+    Py_INCREF(&objectsegmenttree_type);
+    if (PyModule_AddObject(m, "ObjectSegmentTree", (PyObject*)&objectsegmenttree_type) < 0)
+    {
+        Py_DECREF(&objectsegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&matrixsegmenttree_type);
+    if (PyModule_AddObject(m, "MatrixSegmentTree", (PyObject*)&matrixsegmenttree_type) < 0)
+    {
+        Py_DECREF(&matrixsegmenttree_type);
+        return -1;
+    }
+
+    Py_INCREF(&affinesegmenttree_type);
+    if (PyModule_AddObject(m, "AffineSegmentTree", (PyObject*)&affinesegmenttree_type) < 0)
+    {
+        Py_DECREF(&affinesegmenttree_type);
+        return -1;
+    }
+
+#ifdef HAVE_INT128
+    /* Not available on the compilers without 128-bit integers */
+    Py_INCREF(&int128segmenttree_type);
+    if (PyModule_AddObject(m, "Int128SegmentTree", (PyObject*)&int128segmenttree_type) < 0)
+    {
+        Py_DECREF(&int128segmenttree_type);
+        return -1;
+    }
+#endif
+
+    return 0;
+}
+
+static PyModuleDef_Slot c_extensions_slots[] = {
+    {Py_mod_exec, c_extensions_exec},
+#ifdef Py_mod_multiple_interpreters
+    /* The tree types are static */
+    {Py_mod_multiple_interpreters, Py_MOD_MULTIPLE_INTERPRETERS_NOT_SUPPORTED},
+#endif
+#ifdef Py_mod_gil
+    /* The trees use their own locks in the free-threaded builds */
+    {Py_mod_gil, Py_MOD_GIL_NOT_USED},
+#endif
+    {0, NULL}
+};
+
+static PyModuleDef c_extensions = {
+    PyModuleDef_HEAD_INIT,           /* m_base */
+    "pysegmenttree.c_extensions",    /* m_name */
+    .m_doc = "Example module that creates an extension type.",
+    .m_size = 0,
+    .m_slots = c_extensions_slots,
+};
+
+PyMODINIT_FUNC
+PyInit_c_extensions(void)
+{
+    return PyModuleDef_Init(&c_extensions);
 }
@@ -1,11 +1,549 @@
-from typing import List, Optional
+from array import array
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
 
-from ._abc import AbstractSegmentTree, T
+from ._abc import AbstractSegmentTree, Func, T
 
-class IntSegmentTree(AbstractSegmentTree):
-    def __init__(self, source: List[T], func: Optional[str] = None):
+class IntSegmentTree(AbstractSegmentTree[int]):
+    def __init__(
+        self,
+        source: Union[List[int], Any],
+        func: Optional[str] = None,
+        threadsafe: bool = False,
+        modulus: Optional[int] = None,
+    ):
+        pass
+    def query_many(
+        self, starts: Sequence[int], ends: Sequence[int], out: Optional[Any] = None
+    ) -> Any:
+        pass
+    def update_many(self, indices: Sequence[int], values: Sequence[int]) -> None:
+        pass
+    def query_arg(self, start: int, end: int) -> Optional[Tuple[int, int]]:
+        pass
+    def max_right(self, start: int, threshold: int) -> int:  # type: ignore[override]
+        pass
+    def min_left(self, end: int, threshold: int) -> int:  # type: ignore[override]
+        pass
+    def find_first(self, start: int, threshold: int) -> Optional[int]:  # type: ignore[override]
+        pass
+    def append(self, value: int) -> None:
+        pass
+    def extend(self, values: Union[Iterable[int], Any]) -> None:
+        pass
+    def pop(self) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> array:
+        pass
+    @overload
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    @overload
+    def __setitem__(self, key: slice, value: Union[Iterable[int], Any]) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+    def leaves(self) -> memoryview:
+        pass
+    def nodes(self) -> memoryview:
+        pass
+    def to_bytes(self) -> bytes:
+        pass
+    @classmethod
+    def from_bytes(cls, data: Any) -> "IntSegmentTree":
+        pass
+    @classmethod
+    def attach(cls, buffer: Any, sync: bool = False) -> "IntSegmentTree":
+        pass
+    def flush(self) -> None:
         pass
 
-class FloatSegmentTree(AbstractSegmentTree):
-    def __init__(self, source: List[T], func: Optional[str] = None):
+class FloatSegmentTree(AbstractSegmentTree[float]):
+    def __init__(
+        self,
+        source: Union[List[float], Any],
+        func: Optional[str] = None,
+        threadsafe: bool = False,
+    ):
+        pass
+    def query_many(
+        self, starts: Sequence[int], ends: Sequence[int], out: Optional[Any] = None
+    ) -> Any:
+        pass
+    def update_many(self, indices: Sequence[int], values: Sequence[float]) -> None:
+        pass
+    def query_arg(self, start: int, end: int) -> Optional[Tuple[int, float]]:
+        pass
+    def max_right(self, start: int, threshold: float) -> int:  # type: ignore[override]
+        pass
+    def min_left(self, end: int, threshold: float) -> int:  # type: ignore[override]
+        pass
+    def find_first(self, start: int, threshold: float) -> Optional[int]:  # type: ignore[override]
+        pass
+    def append(self, value: float) -> None:
+        pass
+    def extend(self, values: Union[Iterable[float], Any]) -> None:
+        pass
+    def pop(self) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> array:
+        pass
+    @overload
+    def __setitem__(self, key: int, value: float) -> None:
+        pass
+    @overload
+    def __setitem__(self, key: slice, value: Union[Iterable[float], Any]) -> None:
+        pass
+    def __iter__(self) -> Iterator[float]:
+        pass
+    def leaves(self) -> memoryview:
+        pass
+    def nodes(self) -> memoryview:
+        pass
+    def to_bytes(self) -> bytes:
+        pass
+    @classmethod
+    def from_bytes(cls, data: Any) -> "FloatSegmentTree":
+        pass
+    @classmethod
+    def attach(cls, buffer: Any, sync: bool = False) -> "FloatSegmentTree":
+        pass
+    def flush(self) -> None:
+        pass
+
+class IntLazySegmentTree(AbstractSegmentTree[int]):
+    def __init__(self, source: Union[List[int], Any], func: Optional[str] = None):
+        pass
+    def range_add(self, start: int, end: int, delta: int) -> None:
+        pass
+    def range_assign(self, start: int, end: int, value: int) -> None:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[int]:
+        pass
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+
+class FloatLazySegmentTree(AbstractSegmentTree[float]):
+    def __init__(self, source: Union[List[float], Any], func: Optional[str] = None):
+        pass
+    def range_add(self, start: int, end: int, delta: float) -> None:
+        pass
+    def range_assign(self, start: int, end: int, value: float) -> None:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[float]:
+        pass
+    def __setitem__(self, key: int, value: float) -> None:
+        pass
+    def __iter__(self) -> Iterator[float]:
+        pass
+
+class IntFenwickTree(AbstractSegmentTree[int]):
+    def __init__(self, source: Union[List[int], Any], func: Optional[str] = None):
+        pass
+    def add(self, i: int, delta: int) -> None:
+        pass
+    def lower_bound(self, value: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[int]:
+        pass
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+
+class FloatFenwickTree(AbstractSegmentTree[float]):
+    def __init__(self, source: Union[List[float], Any], func: Optional[str] = None):
+        pass
+    def add(self, i: int, delta: float) -> None:
+        pass
+    def lower_bound(self, value: float) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[float]:
+        pass
+    def __setitem__(self, key: int, value: float) -> None:
+        pass
+    def __iter__(self) -> Iterator[float]:
+        pass
+
+class IntSparseTable(AbstractSegmentTree[int]):
+    def __init__(self, source: Union[List[int], Any], func: str):
+        pass
+    def update(self, i: int, value: int) -> None:
+        """Always raises TypeError, the table is static, use IntSegmentTree for updates."""
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[int]:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+
+class FloatSparseTable(AbstractSegmentTree[float]):
+    def __init__(self, source: Union[List[float], Any], func: str):
+        pass
+    def update(self, i: int, value: float) -> None:
+        """Always raises TypeError, the table is static, use FloatSegmentTree for updates."""
+    @overload
+    def __getitem__(self, key: int) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[float]:
+        pass
+    def __iter__(self) -> Iterator[float]:
+        pass
+
+class IntDynamicSegmentTree(AbstractSegmentTree[int]):
+    node_count: int
+    def __init__(
+        self,
+        size: int,
+        func: Optional[str] = None,
+        source: Optional[Mapping[int, int]] = None,
+    ):
+        pass
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[int]:
+        pass
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+
+class FloatDynamicSegmentTree(AbstractSegmentTree[float]):
+    node_count: int
+    def __init__(
+        self,
+        size: int,
+        func: Optional[str] = None,
+        source: Optional[Mapping[int, float]] = None,
+    ):
+        pass
+    @overload
+    def __getitem__(self, key: int) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[float]:
+        pass
+    def __setitem__(self, key: int, value: float) -> None:
+        pass
+    def __iter__(self) -> Iterator[float]:
+        pass
+
+class IntPersistentSegmentTree(AbstractSegmentTree[int]):
+    node_count: int
+    def __init__(self, source: Union[List[int], Any], func: Optional[str] = None):
+        pass
+    def query(
+        self, start: int, end: int, version: Optional[int] = None
+    ) -> Optional[int]:
+        pass
+    def snapshot(self) -> int:
+        pass
+    def release(self, version: int) -> None:
+        pass
+    def collect(self) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[int]:
+        pass
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+
+class FloatPersistentSegmentTree(AbstractSegmentTree[float]):
+    node_count: int
+    def __init__(self, source: Union[List[float], Any], func: Optional[str] = None):
+        pass
+    def query(
+        self, start: int, end: int, version: Optional[int] = None
+    ) -> Optional[float]:
+        pass
+    def snapshot(self) -> int:
+        pass
+    def release(self, version: int) -> None:
+        pass
+    def collect(self) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[float]:
+        pass
+    def __setitem__(self, key: int, value: float) -> None:
+        pass
+    def __iter__(self) -> Iterator[float]:
+        pass
+
+class Int32SegmentTree(AbstractSegmentTree[int]):
+    def __init__(self, source: Union[List[int], Any], func: Optional[str] = None):
+        """The nodes are int32_t too, with "sum" the total of the items must fit into it."""
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> array:
+        pass
+    @overload
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    @overload
+    def __setitem__(self, key: slice, value: Union[Iterable[int], Any]) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+    def leaves(self) -> memoryview:
+        pass
+    def nodes(self) -> memoryview:
+        pass
+
+class UInt32SegmentTree(AbstractSegmentTree[int]):
+    def __init__(self, source: Union[List[int], Any], func: Optional[str] = None):
+        """The nodes are uint32_t too, with "sum" the total of the items must fit into it."""
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> array:
+        pass
+    @overload
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    @overload
+    def __setitem__(self, key: slice, value: Union[Iterable[int], Any]) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+    def leaves(self) -> memoryview:
+        pass
+    def nodes(self) -> memoryview:
+        pass
+
+class UInt64SegmentTree(AbstractSegmentTree[int]):
+    def __init__(self, source: Union[List[int], Any], func: Optional[str] = None):
+        pass
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> array:
+        pass
+    @overload
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    @overload
+    def __setitem__(self, key: slice, value: Union[Iterable[int], Any]) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+    def leaves(self) -> memoryview:
+        pass
+    def nodes(self) -> memoryview:
+        pass
+
+class Float32SegmentTree(AbstractSegmentTree[float]):
+    def __init__(self, source: Union[List[float], Any], func: Optional[str] = None):
+        pass
+    @overload
+    def __getitem__(self, key: int) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> array:
+        pass
+    @overload
+    def __setitem__(self, key: int, value: float) -> None:
+        pass
+    @overload
+    def __setitem__(self, key: slice, value: Union[Iterable[float], Any]) -> None:
+        pass
+    def __iter__(self) -> Iterator[float]:
+        pass
+    def leaves(self) -> memoryview:
+        pass
+    def nodes(self) -> memoryview:
+        pass
+
+class Int128SegmentTree(AbstractSegmentTree[int]):
+    def __init__(self, source: Union[List[int], Any], func: Optional[str] = None):
+        pass
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[int]:
+        pass
+    @overload
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    @overload
+    def __setitem__(self, key: slice, value: Union[Iterable[int], Any]) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+    def leaves(self) -> List[int]:
+        pass
+
+class ObjectSegmentTree(AbstractSegmentTree[T]):
+    func: Func
+    def __init__(self, source: List[T], func: Func):
+        pass
+    def query_many(self, starts: Sequence[int], ends: Sequence[int]) -> List[T]:
+        pass
+    def update_many(self, indices: Sequence[int], values: Sequence[T]) -> None:
+        pass
+    def append(self, value: T) -> None:
+        pass
+    def extend(self, values: Iterable[T]) -> None:
+        pass
+    def pop(self) -> T:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> T:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[T]:
+        pass
+    @overload
+    def __setitem__(self, key: int, value: T) -> None:
+        pass
+    @overload
+    def __setitem__(self, key: slice, value: Iterable[T]) -> None:
+        pass
+    def __iter__(self) -> Iterator[T]:
+        pass
+    def leaves(self) -> List[T]:
+        pass
+
+class MatrixSegmentTree(AbstractSegmentTree[Tuple[Tuple[float, ...], ...]]):
+    dim: int
+    def __init__(
+        self, source: List[Sequence[Sequence[float]]], dim: Optional[int] = None
+    ):
+        pass
+    def query(self, start: int, end: int) -> Optional[Tuple[Tuple[float, ...], ...]]:
+        pass
+    def leaves(self) -> List[Tuple[Tuple[float, ...], ...]]:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> Tuple[Tuple[float, ...], ...]:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[Tuple[Tuple[float, ...], ...]]:
+        pass
+    def __setitem__(self, key: int, value: Tuple[Tuple[float, ...], ...]) -> None:
+        pass
+    def __iter__(self) -> Iterator[Tuple[Tuple[float, ...], ...]]:
+        pass
+
+class AffineSegmentTree(AbstractSegmentTree[Tuple[float, float]]):
+    def __init__(self, source: List[Tuple[float, float]]):
+        pass
+    def query(self, start: int, end: int) -> Optional[Tuple[float, float]]:
+        pass
+    def leaves(self) -> List[Tuple[float, float]]:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> Tuple[float, float]:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[Tuple[float, float]]:
+        pass
+    def __setitem__(self, key: int, value: Tuple[float, float]) -> None:
+        pass
+    def __iter__(self) -> Iterator[Tuple[float, float]]:
+        pass
+
+class Aggregates(Tuple[Optional[T], Optional[T], Optional[T], int]):
+    sum: Optional[T]
+    min: Optional[T]
+    max: Optional[T]
+    # The field shadows the tuple.count method of the struct sequence
+    @property
+    def count(self) -> int:  # type: ignore[override]
+        pass
+
+class IntMultiSegmentTree(AbstractSegmentTree):
+    funcs: Tuple[str, ...]
+    def __init__(
+        self, source: Union[List[int], Any], funcs: Optional[Sequence[str]] = None
+    ):
+        pass
+    def query(
+        self, start: int, end: int, funcs: Optional[Sequence[str]] = None
+    ) -> Optional[Aggregates[int]]:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> int:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[int]:
+        pass
+    def __setitem__(self, key: int, value: int) -> None:
+        pass
+    def __iter__(self) -> Iterator[int]:
+        pass
+
+class FloatMultiSegmentTree(AbstractSegmentTree):
+    funcs: Tuple[str, ...]
+    def __init__(
+        self, source: Union[List[float], Any], funcs: Optional[Sequence[str]] = None
+    ):
+        pass
+    def query(
+        self, start: int, end: int, funcs: Optional[Sequence[str]] = None
+    ) -> Optional[Aggregates[float]]:
+        pass
+    @overload
+    def __getitem__(self, key: int) -> float:
+        pass
+    @overload
+    def __getitem__(self, key: slice) -> List[float]:
+        pass
+    def __setitem__(self, key: int, value: float) -> None:
+        pass
+    def __iter__(self) -> Iterator[float]:
         pass
@@ -1,12 +1,12 @@
 import dataclasses
 import functools
 import operator
-from typing import List, Union
+from typing import List, Sequence, Union
 
 from ._abc import AbstractSegmentTree, Func, QueryFunction, T
 
 
-class VerifySegmentTree(AbstractSegmentTree):
+class VerifySegmentTree(AbstractSegmentTree[T]):
     def __init__(
         self,
         source: List[T],
@@ -27,6 +27,10 @@ class VerifySegmentTree(AbstractSegmentTree):
     def update(self, i: int, value):
         self.source[i] = value
 
+    def update_many(self, indices: Sequence[int], values: Sequence[T]):
+        for i, value in zip(indices, values):
+            self.source[i] = value
+
 
 @dataclasses.dataclass
 @functools.total_ordering
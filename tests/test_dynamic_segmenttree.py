@@ -0,0 +1,141 @@
+import random
+import sys
+
+import pytest
+
+from pysegmenttree import QueryFunction, stree
+from pysegmenttree.c_extensions import FloatDynamicSegmentTree, IntDynamicSegmentTree
+from pysegmenttree.test_utils import VerifySegmentTree
+
+CLASSES = [IntDynamicSegmentTree, FloatDynamicSegmentTree]
+SUPPORTED_FUNCTIONS = [QueryFunction.SUM, QueryFunction.MIN, QueryFunction.MAX]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_dense_random(cls: type, func: QueryFunction):
+    random.seed(42)
+
+    size = 300
+    rng = 1000
+    queries = 1000
+
+    source = [random.randint(-rng, rng) for _ in range(size)]
+    tree = cls(size, func=func.value, source=dict(enumerate(source)))
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    for _ in range(queries):
+        i = random.randrange(size)
+        value = random.randint(-rng, rng)
+        tree.update(i, value)
+        verify_tree.update(i, value)
+
+        left, right = sorted(random.sample(range(size + 1), 2))
+        assert tree.query(left, right) == verify_tree.query(left, right)
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sparse_indices(cls: type):
+    random.seed(42)
+
+    tree = cls(sys.maxsize)
+    values = {}
+    for _ in range(1000):
+        i = random.randrange(sys.maxsize)
+        values[i] = random.randint(-1000, 1000)
+        tree.update(i, values[i])
+
+    assert len(tree) == sys.maxsize
+    # Memory is proportional to the number of touched leaves
+    assert tree.node_count <= 2 + 64 * len(values)
+
+    indices = sorted(values)
+    for _ in range(100):
+        left, right = sorted(random.sample(indices, 2))
+        expected = sum(values[i] for i in indices if left <= i < right)
+        assert tree.query(left, right) == expected
+    assert tree.query(0, sys.maxsize) == sum(values.values())
+
+
+def test_identity():
+    assert IntDynamicSegmentTree(100, func="min").query(0, 100) == 2 ** 63 - 1
+    assert IntDynamicSegmentTree(100, func="max").query(0, 100) == -(2 ** 63)
+    assert FloatDynamicSegmentTree(100, func="min").query(0, 100) == float("inf")
+    assert FloatDynamicSegmentTree(100).query(0, 100) == 0.0
+
+    tree = IntDynamicSegmentTree(100, func="max", source={50: -7})
+    assert tree.query(0, 50) == -(2 ** 63)
+    assert tree.query(0, 51) == -7
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sequence(cls: type):
+    tree = cls(4, source={0: 5, 1: 1, 2: 9, 3: 4})
+    assert tree[1] == 1
+    assert tree[-1] == 4
+    assert tree[1:3] == [1, 9]
+    assert tree[::-2] == [4, 1]
+    assert list(tree) == [5, 1, 9, 4]
+
+    tree[0] = 2
+    tree[-2] = 3
+    assert list(tree) == [2, 1, 3, 4]
+    assert tree.query(0, 4) == 10
+
+    with pytest.raises(IndexError):
+        tree[4]
+    with pytest.raises(IndexError):
+        tree[-5] = 1
+    with pytest.raises(TypeError):
+        tree["1"]
+    with pytest.raises(TypeError):
+        tree[0:2] = [1, 2]
+    with pytest.raises(TypeError):
+        del tree[0]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_invalid_operations(cls: type):
+    tree = cls(10)
+    assert tree.query(2, 2) is None
+
+    with pytest.raises(IndexError):
+        tree.query(0, 11)
+
+    with pytest.raises(IndexError):
+        tree.update(10, 1)
+
+    with pytest.raises(IndexError):
+        cls(10, source={10: 1})
+
+    with pytest.raises(ValueError):
+        cls(-1)
+
+    with pytest.raises(TypeError):
+        cls(10, source=[1, 2, 3])
+
+
+def test_overflow():
+    tree = IntDynamicSegmentTree(4, source={0: 2 ** 62})
+    with pytest.raises(OverflowError):
+        tree.update(3, 2 ** 62)
+
+    # The failed update leaves the tree untouched
+    assert tree.query(0, 4) == 2 ** 62
+
+    tree.update(3, -(2 ** 62))
+    tree.update(2, 2 ** 62)
+    with pytest.raises(OverflowError):
+        tree.query(0, 3)
+
+
+def test_stree_mapping():
+    tree = stree({10 ** 18: 1, 5: 2})
+    assert isinstance(tree, IntDynamicSegmentTree)
+    assert tree.query(0, 10 ** 18 + 1) == 3
+
+    tree = stree({1: 1.5}, func=QueryFunction.MAX)
+    assert isinstance(tree, FloatDynamicSegmentTree)
+
+    with pytest.raises(ValueError):
+        stree({1: 1}, func=max)
@@ -0,0 +1,139 @@
+import array
+import itertools
+import random
+
+import pytest
+
+from pysegmenttree import QueryFunction, stree
+from pysegmenttree.c_extensions import FloatFenwickTree, IntFenwickTree
+from pysegmenttree.test_utils import VerifySegmentTree
+
+CLASSES = [IntFenwickTree, FloatFenwickTree]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_point_operations(cls: type):
+    tree = cls([18, 17, 13, 19, 15, 11, 20, 12, 33, 25])
+    assert tree.query(0, 10) == 183
+    assert tree.query(3, 7) == 65
+
+    tree.update(4, 0)
+    assert tree.query(3, 7) == 50
+
+    tree.add(9, -5)
+    assert tree.query(8, 10) == 53
+    assert tree.query(start=9, end=10) == 20
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_point_operations_random(cls: type):
+    random.seed(42)
+
+    size = 300
+    rng = 1000
+    queries = 1000
+
+    source = [random.randint(-rng, rng) for _ in range(size)]
+    tree = cls(source)
+    verify_tree = VerifySegmentTree(source=source, func=QueryFunction.SUM)
+
+    for _ in range(queries):
+        i = random.randrange(size)
+        value = random.randint(-rng, rng)
+
+        if random.random() < 0.5:
+            tree.update(i, value)
+            verify_tree.update(i, value)
+        else:
+            tree.add(i, value)
+            verify_tree.update(i, verify_tree.source[i] + value)
+
+        left, right = sorted(random.sample(range(size + 1), 2))
+        assert tree.query(left, right) == verify_tree.query(left, right)
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_lower_bound(cls: type):
+    random.seed(42)
+
+    source = [random.randint(0, 10) for _ in range(100)]
+    tree = cls(source)
+    prefix_sums = list(itertools.accumulate(source))
+
+    for value in range(-1, prefix_sums[-1] + 2):
+        expected = next(
+            (i for i, prefix in enumerate(prefix_sums) if prefix >= value),
+            len(source),
+        )
+        assert tree.lower_bound(value) == expected
+
+    assert cls([]).lower_bound(1) == 0
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sequence(cls: type):
+    tree = cls([5, 1, 9, 4])
+    assert tree[1] == 1
+    assert tree[-1] == 4
+    assert tree[1:3] == [1, 9]
+    assert tree[::-2] == [4, 1]
+    assert list(tree) == [5, 1, 9, 4]
+
+    tree[0] = 2
+    tree[-2] = 3
+    assert list(tree) == [2, 1, 3, 4]
+    assert tree.query(0, 4) == 10
+
+    with pytest.raises(IndexError):
+        tree[4]
+    with pytest.raises(IndexError):
+        tree[-5] = 1
+    with pytest.raises(TypeError):
+        tree["1"]
+    with pytest.raises(TypeError):
+        tree[0:2] = [1, 2]
+    with pytest.raises(TypeError):
+        del tree[0]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_invalid_intervals(cls: type):
+    tree = cls([1, 2, 3, 4])
+    assert len(tree) == 4
+    assert tree.query(2, 2) is None
+
+    with pytest.raises(IndexError):
+        tree.query(0, 5)
+
+    with pytest.raises(IndexError):
+        tree.update(4, 1)
+
+    with pytest.raises(IndexError):
+        tree.add(-1, 1)
+
+    with pytest.raises(ValueError):
+        cls([1, 2, 3], func="max")
+
+
+def test_overflow():
+    with pytest.raises(OverflowError):
+        IntFenwickTree([2 ** 62, 2 ** 62])
+
+    tree = IntFenwickTree([2 ** 62, 2 ** 61])
+    with pytest.raises(OverflowError):
+        tree.add(0, 2 ** 62)
+
+    # The failed update leaves the tree untouched
+    assert tree.query(0, 1) == 2 ** 62
+    assert tree.query(0, 2) == 2 ** 62 + 2 ** 61
+
+
+def test_stree_compact():
+    tree = stree([1, 2, 3], compact=True)
+    assert isinstance(tree, IntFenwickTree)
+
+    tree = stree(array.array("d", [1.0, 2.0]), compact=True)
+    assert isinstance(tree, FloatFenwickTree)
+
+    tree = stree([1, 2, 3], func=QueryFunction.MIN, compact=True)
+    assert not isinstance(tree, IntFenwickTree)
@@ -1,3 +1,4 @@
+import array
 import random
 
 import pytest
@@ -38,3 +39,39 @@ def test_float_query_n_update_random():
         assert pytest.approx(tree.query(left, right)) == pytest.approx(
             verify_tree.query(left, right)
         )
+
+
+def test_update_many_mixed_types():
+    float_tree = FloatSegmentTree([1.0, 2.0, 3.0, 4.0])
+
+    float_tree.update_many(array.array("q", [0, 3]), array.array("i", [5, 6]))
+    assert float_tree.query(0, 4) == 16.0
+
+    float_tree.update_many(array.array("q", [1, 1]), array.array("f", [0.5, 1.5]))
+    assert float_tree.query(0, 4) == 15.5
+
+
+def test_build_from_buffer():
+    source = [1.5, 2.0, -3.25, 4.0]
+
+    for typecode in "fd":
+        float_tree = FloatSegmentTree(array.array(typecode, source), func="min")
+        assert float_tree.query(0, 4) == -3.25
+
+    float_tree = FloatSegmentTree(array.array("q", [1, 2, 3]))
+    assert float_tree.query(0, 3) == 6.0
+
+    float_tree = FloatSegmentTree(memoryview(array.array("d", source))[::-1])
+    assert float_tree.query(0, 2) == 0.75
+
+
+def test_product():
+    float_tree = FloatSegmentTree([1.5, 2.0, -0.5, 4.0], func="product")
+    assert float_tree.query(0, 4) == -6.0
+    assert float_tree.query(1, 3) == -1.0
+
+    float_tree.update(2, 0.25)
+    assert float_tree.query(0, 4) == 3.0
+
+    with pytest.raises(ValueError):
+        FloatSegmentTree([1.0, 2.0], func="gcd")
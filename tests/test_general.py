@@ -1,19 +1,26 @@
+import array
+import pickle
 import random
+import threading
 from typing import List, Union
 
 import pytest
 
 from pysegmenttree import PySegmentTree, QueryFunction, stree
 from pysegmenttree._abc import T
-from pysegmenttree.c_extensions import FloatSegmentTree, IntSegmentTree
+from pysegmenttree.c_extensions import (
+    FloatSegmentTree,
+    IntSegmentTree,
+    ObjectSegmentTree,
+)
 from pysegmenttree.test_utils import VerifySegmentTree
 
-CLASSES = [PySegmentTree, IntSegmentTree, FloatSegmentTree]
-SUPPORTED_FUNCTIONS = [f for f in QueryFunction]
+CLASSES = [PySegmentTree, IntSegmentTree, FloatSegmentTree, ObjectSegmentTree]
+SUPPORTED_FUNCTIONS = [QueryFunction.SUM, QueryFunction.MIN, QueryFunction.MAX]
 
 
 def construct_tree(
-    kls: Union[PySegmentTree, IntSegmentTree, FloatSegmentTree],
+    kls: Union[PySegmentTree, IntSegmentTree, FloatSegmentTree, ObjectSegmentTree],
     source: List[T],
     func: QueryFunction,
 ):
@@ -21,6 +28,8 @@ def construct_tree(
         return kls(source=source, func=func)
     elif kls in (IntSegmentTree, FloatSegmentTree):
         return kls(source=source, func=func.value)
+    elif kls is ObjectSegmentTree:
+        return kls(source=source, func=func.to_python_func())
     else:
         raise RuntimeError(f"Unexpected tree class {kls}")
 
@@ -82,6 +91,27 @@ def test_query_random(cls: type, func: QueryFunction):
         assert tree.query(left, right) == verify_tree.query(left, right)
 
 
+@pytest.mark.parametrize("cls", CLASSES)
+def test_query_many_invalid(cls: type):
+    tree = construct_tree(cls, [1, 2, 3, 4], func=QueryFunction.SUM)
+
+    def query_many(starts: List[int], ends: List[int]):
+        return list(tree.query_many(array.array("q", starts), array.array("q", ends)))
+
+    # All trees reject the intervals the same way, whatever stree() has picked
+    assert query_many([0, 3], [1, 4]) == [1, 4]
+    with pytest.raises(ValueError):
+        query_many([0, 2], [4, 2])
+    with pytest.raises(ValueError):
+        query_many([3], [1])
+    with pytest.raises(IndexError):
+        query_many([0], [5])
+    with pytest.raises(IndexError):
+        query_many([-1], [2])
+    with pytest.raises(ValueError):
+        query_many([0, 1], [2])
+
+
 @pytest.mark.parametrize("cls", CLASSES)
 @pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
 def test_query_n_update_random(cls: type, func: QueryFunction):
@@ -104,3 +134,465 @@ def test_query_n_update_random(cls: type, func: QueryFunction):
 
         left, right = sorted((random.randint(0, size - 1), random.randint(0, size - 1)))
         assert tree.query(left, right) == verify_tree.query(left, right)
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_query_many_random(cls: type, func: QueryFunction):
+    random.seed(42)
+
+    size = 500
+    rng = 100000
+    queries = 1000
+
+    source = [random.randint(-rng, rng) for _ in range(size)]
+    tree = construct_tree(cls, source, func=func)
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    intervals = [sorted(random.sample(range(size + 1), 2)) for _ in range(queries)]
+    starts = array.array("q", [start for start, _ in intervals])
+    ends = array.array("q", [end for _, end in intervals])
+
+    results = tree.query_many(starts, ends)
+    assert list(results) == [verify_tree.query(s, e) for s, e in intervals]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_update_many_random(cls: type, func: QueryFunction):
+    random.seed(-42)
+
+    size = 500
+    rng = 100000
+    batches = 100
+
+    source = [random.randint(-rng, rng) for _ in range(size)]
+    tree = construct_tree(cls, source, func=func)
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    for _ in range(batches):
+        start = random.randint(0, size - 1)
+        indices = array.array(
+            "q", [min(start + random.randint(0, 20), size - 1) for _ in range(10)]
+        )
+        values = array.array("q", [random.randint(-rng, rng) for _ in indices])
+
+        tree.update_many(indices, values)
+        verify_tree.update_many(indices, values)
+
+        for _ in range(10):
+            left, right = sorted(random.sample(range(size + 1), 2))
+            assert tree.query(left, right) == verify_tree.query(left, right)
+
+
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+def test_buffer_export(cls: type):
+    source = [18, 17, 13, 19, 15, 11, 20, 12, 33, 25]
+    tree = construct_tree(cls, source, func=QueryFunction.MAX)
+
+    nodes = memoryview(tree)
+    assert nodes.readonly
+    assert nodes.tolist() == tree.nodes().tolist()
+    assert len(nodes) == 2 * len(source)
+    assert nodes[1] == 33
+
+    leaves = tree.leaves()
+    assert leaves.tolist() == source
+
+    tree.update(0, 40)
+    assert leaves[0] == 40
+    assert nodes[1] == 40
+
+    with pytest.raises(TypeError):
+        leaves[0] = 0
+
+    with pytest.raises(BufferError):
+        tree.__init__(source)
+
+    nodes.release()
+    leaves.release()
+    tree.__init__([1, 2])
+    assert tree.leaves().tolist() == [1, 2]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+@pytest.mark.parametrize("protocol", [2, pickle.HIGHEST_PROTOCOL])
+def test_pickle(cls: type, func: QueryFunction, protocol: int):
+    source = [18, 17, 13, 19, 15, 11, 20, 12, 33, 25]
+    tree = construct_tree(cls, source, func=func)
+
+    restored = pickle.loads(pickle.dumps(tree, protocol=protocol))
+    assert type(restored) is type(tree)
+    assert len(restored) == len(source)
+    for start in range(len(source)):
+        for end in range(start + 1, len(source) + 1):
+            assert restored.query(start, end) == tree.query(start, end)
+
+    restored.update(0, 40)
+    assert tree.query(0, 1) == 18
+
+
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+@pytest.mark.parametrize("protocol", [2, pickle.HIGHEST_PROTOCOL])
+def test_pickle_threadsafe(cls: type, protocol: int):
+    tree = cls([18, 17, 13, 19], threadsafe=True)
+
+    restored = pickle.loads(pickle.dumps(tree, protocol=protocol))
+    assert restored.query(0, 4) == 67
+    # Only the locked tree refuses the re-initialization
+    with pytest.raises(RuntimeError):
+        restored.__init__([1, 2])
+
+
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+def test_snapshot(cls: type):
+    source = [18, 17, 13, 19, 15, 11, 20, 12, 33, 25]
+    tree = construct_tree(cls, source, func=QueryFunction.MIN)
+
+    restored = cls.from_bytes(tree.to_bytes())
+    assert restored.nodes().tolist() == tree.nodes().tolist()
+    assert restored.query(0, 10) == 11
+    assert restored.to_bytes() == tree.to_bytes()
+
+    empty = cls.from_bytes(cls([]).to_bytes())
+    assert len(empty) == 0
+
+
+@pytest.mark.skipif(pickle.HIGHEST_PROTOCOL < 5, reason="requires pickle protocol 5")
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+def test_pickle_out_of_band(cls: type):
+    tree = construct_tree(cls, [3, 1, 2, 5], func=QueryFunction.MAX)
+
+    buffers = []
+    data = pickle.dumps(tree, protocol=5, buffer_callback=buffers.append)
+    assert len(buffers) == 1
+
+    restored = pickle.loads(data, buffers=buffers)
+    assert restored.query(0, 4) == 5
+    assert restored.nodes().tolist() == tree.nodes().tolist()
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_search_random(cls: type, func: QueryFunction):
+    random.seed(42)
+
+    size = 100
+    rng = 1000
+    queries = 200
+
+    # Sum search requires non-negative elements to be monotone
+    source = [
+        random.randint(0 if func is QueryFunction.SUM else -rng, rng)
+        for _ in range(size)
+    ]
+    tree = construct_tree(cls, source, func=func)
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    def within(value, threshold):
+        if func is QueryFunction.MIN:
+            return value >= threshold
+        return value <= threshold
+
+    for _ in range(queries):
+        pos = random.randint(0, size)
+        threshold = random.randint(-rng, rng * (10 if func is QueryFunction.SUM else 1))
+
+        expected_right = max(
+            end
+            for end in range(pos, size + 1)
+            if end == pos or within(verify_tree.query(pos, end), threshold)
+        )
+        expected_left = min(
+            start
+            for start in range(0, pos + 1)
+            if start == pos or within(verify_tree.query(start, pos), threshold)
+        )
+
+        assert tree.max_right(pos, threshold) == expected_right
+        assert tree.min_left(pos, threshold) == expected_left
+        assert tree.find_first(pos, threshold) == (
+            expected_right if expected_right < size else None
+        )
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_search_invalid(cls: type):
+    tree = construct_tree(cls, [1, 2, 3], func=QueryFunction.SUM)
+
+    with pytest.raises(IndexError):
+        tree.max_right(4, 10)
+
+    with pytest.raises(IndexError):
+        tree.min_left(-1, 10)
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_append_extend_pop_random(cls: type, func: QueryFunction):
+    random.seed(24)
+
+    rng = 1000
+    source = [random.randint(-rng, rng) for _ in range(3)]
+    tree = construct_tree(cls, source, func=func)
+
+    for _ in range(300):
+        op = random.random()
+        if op < 0.5:
+            value = random.randint(-rng, rng)
+            tree.append(value)
+            source.append(value)
+        elif op < 0.7:
+            values = [random.randint(-rng, rng) for _ in range(random.randint(0, 20))]
+            tree.extend(iter(values))
+            source.extend(values)
+        elif op < 0.9 and source:
+            assert tree.pop() == source.pop()
+        elif source:
+            i = random.randrange(len(source))
+            source[i] = random.randint(-rng, rng)
+            tree.update(i, source[i])
+
+        verify_tree = VerifySegmentTree(source=source, func=func)
+        assert len(tree) == len(source)
+        for _ in range(5):
+            left, right = sorted(random.sample(range(len(source) + 2), 2))
+            right -= 1
+            assert tree.query(left, right) == verify_tree.query(left, right)
+
+    # The descent must stop at the real leaves, the unused ones hold the identity
+    if func is not QueryFunction.SUM:
+        threshold = random.randint(-rng, rng)
+        crossed = [
+            value < threshold if func is QueryFunction.MIN else value > threshold
+            for value in source
+        ]
+        expected = crossed.index(True) if True in crossed else len(source)
+        assert tree.max_right(0, threshold) == expected
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("protocol", [2, pickle.HIGHEST_PROTOCOL])
+def test_pickle_grown(cls: type, protocol: int):
+    tree = construct_tree(cls, [], func=QueryFunction.MAX)
+    tree.extend([3, 1, 2])
+    tree.append(5)
+    tree.append(4)
+    tree.pop()
+
+    restored = pickle.loads(pickle.dumps(tree, protocol=protocol))
+    assert len(restored) == 4
+    assert [restored.query(i, 4) for i in range(4)] == [5, 5, 5, 5]
+    restored.append(7)
+    assert restored.query(0, 5) == 7
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_pop_empty(cls: type):
+    tree = construct_tree(cls, [1], func=QueryFunction.SUM)
+    assert tree.pop() == 1
+    assert len(tree) == 0
+    assert tree.query(0, 0) is None
+
+    with pytest.raises(IndexError):
+        tree.pop()
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_sequence_random(cls: type, func: QueryFunction):
+    random.seed(25)
+
+    rng = 1000
+    size = 100
+    source = [random.randint(-rng, rng) for _ in range(size)]
+    tree = construct_tree(cls, source, func=func)
+
+    for _ in range(200):
+        start, stop = sorted(random.sample(range(-size - 5, size + 5), 2))
+        step = random.choice([None, 1, 2, 3, -1, -2])
+        key = slice(start, stop, step)
+        if random.random() < 0.5:
+            values = [random.randint(-rng, rng) for _ in source[key]]
+            tree[key] = values
+            source[key] = values
+        else:
+            i = random.randrange(-size, size)
+            tree[i] = source[i] = random.randint(-rng, rng)
+
+        assert list(tree[key]) == source[key]
+        verify_tree = VerifySegmentTree(source=source, func=func)
+        for _ in range(5):
+            left, right = sorted(random.sample(range(size + 1), 2))
+            assert tree.query(left, right) == verify_tree.query(left, right)
+
+    assert list(tree) == source
+    assert [tree[i] for i in range(-size, size)] == source + source
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sequence_invalid(cls: type):
+    tree = construct_tree(cls, [1, 2, 3, 4], func=QueryFunction.SUM)
+
+    with pytest.raises(IndexError):
+        tree[4]
+    with pytest.raises(IndexError):
+        tree[-5] = 1
+    with pytest.raises(TypeError):
+        tree["1"]
+    with pytest.raises(TypeError):
+        del tree[0]
+
+    # Slices can't change the size of the tree
+    with pytest.raises(ValueError):
+        tree[1:3] = [1, 2, 3]
+    with pytest.raises(ValueError):
+        tree[::2] = [1]
+    assert list(tree) == [1, 2, 3, 4]
+
+    tree[4:] = []
+    tree[1:3] = iter([20, 30])
+    assert list(tree[10:20]) == []
+    assert list(tree) == [1, 20, 30, 4]
+    assert tree.query(0, 4) == 55
+
+
+@pytest.mark.parametrize(
+    "cls, typecode", [(IntSegmentTree, "q"), (FloatSegmentTree, "d")]
+)
+def test_slice_array(cls: type, typecode: str):
+    tree = construct_tree(cls, [5, 1, 9, 4], func=QueryFunction.MIN)
+
+    # Slices are copied into the typed arrays, no buffer export is left behind
+    leaves = tree[::-1]
+    assert leaves == array.array(typecode, [4, 9, 1, 5])
+    tree[1:3] = array.array(typecode, [7, 8])
+    tree.append(3)
+    assert tree[:] == array.array(typecode, [5, 7, 8, 4, 3])
+    assert tree.query(0, 5) == 3
+
+
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+def test_grown_buffer_export(cls: type):
+    tree = construct_tree(cls, [1, 2, 3], func=QueryFunction.SUM)
+    tree.append(4)
+
+    assert tree.leaves().tolist() == [1, 2, 3, 4]
+    assert cls.from_bytes(tree.to_bytes()).nodes().tolist() == (
+        cls([1, 2, 3, 4]).nodes().tolist()
+    )
+
+    nodes = memoryview(tree)
+    leaves = tree.leaves()
+    for resize in (lambda: tree.append(5), lambda: tree.extend([6, 7]), tree.pop):
+        with pytest.raises(BufferError):
+            resize()
+    assert leaves.tolist() == [1, 2, 3, 4]
+
+    nodes.release()
+    leaves.release()
+    tree.extend([6, 7])
+    assert tree.leaves().tolist() == [1, 2, 3, 4, 6, 7]
+    assert tree.query(0, 6) == 23
+
+
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+@pytest.mark.parametrize("func", [QueryFunction.MIN, QueryFunction.MAX])
+def test_query_arg_random(cls: type, func: QueryFunction):
+    random.seed(42)
+
+    size = 300
+    queries = 1000
+
+    # Narrow range of values to check the tie-breaking rule
+    source = [random.randint(-10, 10) for _ in range(size)]
+    tree = construct_tree(cls, source, func=func)
+    extreme = func.to_python_func()
+
+    for _ in range(queries):
+        left, right = sorted(random.sample(range(size + 1), 2))
+        value = extreme(source[left:right])
+
+        assert tree.query_arg(left, right) == (source.index(value, left), value)
+
+    assert tree.query_arg(5, 5) is None
+
+
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+def test_query_arg_invalid(cls: type):
+    tree = construct_tree(cls, [1, 2, 3], func=QueryFunction.SUM)
+    with pytest.raises(ValueError):
+        tree.query_arg(0, 3)
+
+    tree = construct_tree(cls, [1, 2, 3], func=QueryFunction.MIN)
+    with pytest.raises(IndexError):
+        tree.query_arg(0, 4)
+
+
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+def test_threadsafe(cls: type):
+    size = 1000
+    tree = cls(list(range(size)), threadsafe=True)
+    total = tree.query(0, size)
+    errors = []
+
+    def move_values(seed: int):
+        rnd = random.Random(seed)
+        indices = array.array("q", [0, 0])
+        values = array.array(tree.nodes().format, [0, 0])
+        for _ in range(500):
+            indices[0], indices[1] = rnd.sample(range(size), 2)
+            delta = rnd.randint(-10, 10)
+            values[0] = tree.query(indices[0], indices[0] + 1) - delta
+            values[1] = tree.query(indices[1], indices[1] + 1) + delta
+            # The batch keeps the total sum, readers must never see it changed
+            tree.update_many(indices, values)
+
+    def check_sum():
+        starts = array.array("q", [0] * 10)
+        ends = array.array("q", [size] * 10)
+        for _ in range(500):
+            if tree.query(0, size) != total:
+                errors.append(tree.query(0, size))
+            if any(res != total for res in tree.query_many(starts, ends)):
+                errors.append("query_many")
+
+    threads = [threading.Thread(target=move_values, args=(0,))]
+    threads += [threading.Thread(target=check_sum) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert tree.query(0, size) == total
+
+    with pytest.raises(RuntimeError):
+        tree.__init__([1, 2, 3])
+
+
+@pytest.mark.parametrize("cls", [IntSegmentTree, FloatSegmentTree])
+def test_call_arguments(cls: type):
+    tree = cls(source=[18, 17, 13, 19], func="min")
+    assert tree.query(0, 4) == 13
+    assert tree.query(start=1, end=3) == 13
+    assert tree.query(1, end=2) == 17
+
+    tree.update(i=2, value=20)
+    assert tree.query(0, 4) == 17
+
+    with pytest.raises(TypeError):
+        tree.query(0)
+    with pytest.raises(TypeError):
+        tree.query(0, 1, 2)
+    with pytest.raises(TypeError):
+        tree.query(0, start=1)
+    with pytest.raises(TypeError):
+        tree.query(0, stop=1)
+    with pytest.raises(TypeError):
+        tree.update("0", 1)
+    with pytest.raises(TypeError):
+        cls()
+    with pytest.raises(TypeError):
+        cls([1, 2], func=1)
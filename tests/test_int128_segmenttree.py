@@ -0,0 +1,102 @@
+import array
+import pickle
+import random
+
+import pytest
+
+from pysegmenttree import QueryFunction, c_extensions, stree
+from pysegmenttree.test_utils import VerifySegmentTree
+
+Int128SegmentTree = getattr(c_extensions, "Int128SegmentTree", None)
+pytestmark = pytest.mark.skipif(
+    Int128SegmentTree is None, reason="The compiler doesn't support 128-bit integers"
+)
+
+INT128_MIN = -(2 ** 127)
+INT128_MAX = 2 ** 127 - 1
+SUPPORTED_FUNCTIONS = [QueryFunction.SUM, QueryFunction.MIN, QueryFunction.MAX]
+
+
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_operations_random(func: QueryFunction):
+    random.seed(42)
+
+    size = 300
+    queries = 1000
+
+    def value():
+        return random.randint(-(2 ** 100), 2 ** 100)
+
+    source = [value() for _ in range(size)]
+    tree = Int128SegmentTree(source, func=func.value)
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    for _ in range(queries):
+        if random.random() < 0.5:
+            i = random.randrange(size)
+            new_value = value()
+            tree.update(i, new_value)
+            verify_tree.update(i, new_value)
+        else:
+            left = random.randrange(size)
+            right = random.randint(left + 1, size)
+            assert tree.query(left, right) == verify_tree.query(left, right)
+
+    assert tree.leaves() == verify_tree.source
+
+
+def test_build_from_buffer():
+    tree = Int128SegmentTree(array.array("Q", [2 ** 64 - 1, 2 ** 64 - 1]))
+    assert tree.query(0, 2) == 2 ** 65 - 2
+
+    tree = Int128SegmentTree(array.array("q", [-(2 ** 63), -(2 ** 63)]))
+    assert tree.query(0, 2) == -(2 ** 64)
+
+
+def test_overflow():
+    with pytest.raises(OverflowError):
+        Int128SegmentTree([INT128_MAX + 1])
+
+    with pytest.raises(OverflowError):
+        Int128SegmentTree([INT128_MAX, 1])
+
+    tree = Int128SegmentTree([INT128_MAX, INT128_MIN, INT128_MAX])
+    assert tree.leaves() == [INT128_MAX, INT128_MIN, INT128_MAX]
+
+    tree = Int128SegmentTree([INT128_MAX, 0, 0, 0])
+    with pytest.raises(OverflowError):
+        tree.update(1, 1)
+    # The tree isn't modified on overflow
+    assert tree.query(0, 4) == INT128_MAX
+    with pytest.raises(OverflowError):
+        tree[1:3] = [1, 1]
+    assert tree[:] == [INT128_MAX, 0, 0, 0]
+
+    tree[1:3] = [INT128_MIN, 2 ** 100]
+    assert tree[1::2] == [INT128_MIN, 0]
+    assert tree.query(0, 3) == INT128_MAX + INT128_MIN + 2 ** 100
+
+    with pytest.raises(TypeError):
+        tree.update(0, 1.5)
+
+
+def test_pickle():
+    tree = Int128SegmentTree([2 ** 100, -(2 ** 90), 7], func="max")
+    restored = pickle.loads(pickle.dumps(tree))
+
+    assert type(restored) is Int128SegmentTree
+    assert restored.leaves() == [2 ** 100, -(2 ** 90), 7]
+    assert restored.query(0, 3) == 2 ** 100
+
+
+def test_stree():
+    tree = stree([2 ** 62, 2 ** 62, 2 ** 62])
+    assert isinstance(tree, Int128SegmentTree)
+    assert tree.query(0, 3) == 3 * 2 ** 62
+
+    tree = stree([2 ** 64, 1], func=QueryFunction.MIN)
+    assert isinstance(tree, Int128SegmentTree)
+    assert tree.query(0, 2) == 1
+
+    tree = stree([1, 2, 3], dtype="int128")
+    assert isinstance(tree, Int128SegmentTree)
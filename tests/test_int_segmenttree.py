@@ -1,7 +1,11 @@
+import array
+import pickle
+import random
+
 import pytest
 
 from pysegmenttree import QueryFunction
-from pysegmenttree.c_extensions import IntSegmentTree
+from pysegmenttree.c_extensions import FloatSegmentTree, IntSegmentTree
 from pysegmenttree.test_utils import VerifySegmentTree
 
 
@@ -35,3 +39,286 @@ def test_update_overflow():
     int_tree = IntSegmentTree([int_64, -1, -1])
     with pytest.raises(OverflowError):
         int_tree.update(2, -2)
+
+
+def test_query_overflow():
+    int_64 = int(2 ** 63 - 1)
+    # Leaves 1 and 2 aren't siblings, so their sum isn't stored in the tree
+    int_tree = IntSegmentTree([-5, int_64, 1, -5])
+
+    try:
+        assert int_tree.query(1, 3) == 2 ** 63
+    except OverflowError:
+        # Platforms without 128-bit integers
+        pass
+    assert int_tree.query(0, 4) == 2 ** 63 - 10
+
+    with pytest.raises(OverflowError):
+        int_tree.query_many(array.array("q", [0, 1]), array.array("q", [2, 3]))
+
+
+def test_query_many():
+    int_tree = IntSegmentTree([18, 17, 13, 19, 15, 11, 20, 12, 33, 25])
+
+    results = int_tree.query_many(
+        array.array("i", [0, 2, 6]), memoryview(b"\x03\x07\x07")
+    )
+    assert results == array.array("q", [48, 78, 20])
+
+    out = array.array("q", [0, 0])
+    assert (
+        int_tree.query_many(
+            array.array("q", [0, 9]), array.array("q", [10, 10]), out=out
+        )
+        is out
+    )
+    assert out == array.array("q", [183, 25])
+
+
+def test_query_many_invalid():
+    int_tree = IntSegmentTree([1, 2, 3, 4])
+
+    with pytest.raises(ValueError):
+        int_tree.query_many(array.array("q", [0, 1]), array.array("q", [1]))
+
+    with pytest.raises(IndexError):
+        int_tree.query_many(array.array("q", [0]), array.array("q", [5]))
+
+    with pytest.raises(ValueError):
+        int_tree.query_many(array.array("q", [2]), array.array("q", [2]))
+
+    with pytest.raises(TypeError):
+        int_tree.query_many(array.array("d", [0.0]), array.array("q", [1]))
+
+    with pytest.raises(TypeError):
+        int_tree.query_many(
+            array.array("q", [0]), array.array("q", [1]), out=array.array("d", [0])
+        )
+
+
+def test_update_many_invalid():
+    int_tree = IntSegmentTree([1, 2, 3, 4])
+
+    with pytest.raises(ValueError):
+        int_tree.update_many(array.array("q", [0, 1]), array.array("q", [1]))
+
+    with pytest.raises(IndexError):
+        int_tree.update_many(array.array("q", [0, 4]), array.array("q", [7, 7]))
+
+    with pytest.raises(OverflowError):
+        int_tree.update_many(array.array("q", [0]), array.array("Q", [2 ** 64 - 1]))
+
+    # The batch is validated before the tree is modified
+    assert int_tree.query(0, 4) == 10
+
+
+def test_update_many_overflow():
+    int_64 = int(2 ** 63 - 3)
+    int_tree = IntSegmentTree([int_64, 1, 1])
+    with pytest.raises(OverflowError):
+        int_tree.update_many(array.array("q", [1, 2]), array.array("q", [1, 2]))
+
+
+def test_update_many_overflow_rollback():
+    int_tree = IntSegmentTree([1, 2, 3, 4])
+    with pytest.raises(OverflowError):
+        int_tree.update_many(array.array("q", [0, 1]), array.array("q", [2 ** 62] * 2))
+
+    # The failed batch leaves the tree as it was, duplicated indices included
+    assert list(int_tree) == [1, 2, 3, 4]
+    assert int_tree.query(0, 4) == 10
+    assert int_tree.query(1, 3) == 5
+
+    with pytest.raises(OverflowError):
+        int_tree.update_many(
+            array.array("q", [2, 2, 3]), array.array("q", [7, 2 ** 62, 2 ** 62])
+        )
+    assert list(int_tree) == [1, 2, 3, 4]
+    assert int_tree.nodes().tolist() == IntSegmentTree([1, 2, 3, 4]).nodes().tolist()
+
+
+def test_build_from_buffer():
+    source = [18, 17, 13, 19, 15, 11, 20, 12, 33, 25]
+
+    for typecode in "bhilqBHILQ":
+        int_tree = IntSegmentTree(array.array(typecode, source))
+        assert len(int_tree) == len(source)
+        assert int_tree.query(0, len(source)) == sum(source)
+
+    # Strided buffers are supported as well
+    int_tree = IntSegmentTree(memoryview(array.array("q", source))[::2], func="max")
+    assert len(int_tree) == 5
+    assert int_tree.query(0, 5) == 33
+
+
+def test_build_from_buffer_invalid():
+    with pytest.raises(TypeError):
+        IntSegmentTree(array.array("d", [1.0, 2.0]))
+
+    with pytest.raises(TypeError):
+        IntSegmentTree(memoryview(bytes(8)).cast("B", shape=[2, 4]))
+
+    with pytest.raises(OverflowError):
+        IntSegmentTree(array.array("Q", [2 ** 64 - 1]))
+
+    # Other containers are rejected instead of failing inside the list API
+    with pytest.raises(TypeError):
+        IntSegmentTree((1, 2))
+
+    with pytest.raises(TypeError):
+        IntSegmentTree({0: 1, 1: 2})
+
+
+def test_snapshot_invalid():
+    snapshot = IntSegmentTree([1, 2, 3]).to_bytes()
+
+    invalid = [
+        b"",
+        snapshot[:-1],
+        snapshot + b"\x00",
+        b"XXXX" + snapshot[4:],
+        snapshot[:4] + b"\x02" + snapshot[5:],
+        snapshot[:6] + b"\x09" + snapshot[7:],
+    ]
+    for data in invalid:
+        with pytest.raises(ValueError):
+            IntSegmentTree.from_bytes(data)
+
+    with pytest.raises(ValueError):
+        FloatSegmentTree.from_bytes(snapshot)
+
+
+@pytest.mark.parametrize(
+    "func",
+    [
+        QueryFunction.PRODUCT,
+        QueryFunction.GCD,
+        QueryFunction.XOR,
+        QueryFunction.AND,
+        QueryFunction.OR,
+    ],
+)
+def test_monoids_random(func: QueryFunction):
+    random.seed(42)
+
+    size = 50
+
+    def value():
+        # The product of the whole source must fit into long long
+        if func is QueryFunction.PRODUCT:
+            return random.choice([-1, 1, 2])
+        if func is QueryFunction.GCD:
+            return random.randint(0, 60) * 6
+        return random.randint(-1000, 1000)
+
+    source = [value() for _ in range(size)]
+    int_tree = IntSegmentTree(source, func=func.value)
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    for _ in range(500):
+        if random.random() < 0.3:
+            indx = random.randrange(size)
+            new_value = value()
+            int_tree.update(indx, new_value)
+            verify_tree.update(indx, new_value)
+        else:
+            left = random.randrange(size)
+            right = random.randint(left + 1, min(size, left + 30))
+            assert int_tree.query(left, right) == verify_tree.query(left, right)
+
+
+def test_product_overflow():
+    with pytest.raises(OverflowError):
+        IntSegmentTree([2 ** 32, 2 ** 32], func="product")
+
+    # The zero leaf keeps the nodes small, the leaves 0 and 1 aren't siblings
+    int_tree = IntSegmentTree([2 ** 40, 2 ** 40, 0], func="product")
+    assert int_tree.query(0, 3) == 0
+    with pytest.raises(OverflowError):
+        int_tree.query(0, 2)
+
+
+def test_product_modulus():
+    modulus = 10 ** 9 + 7
+    source = [random.randint(-(10 ** 12), 10 ** 12) for _ in range(50)]
+    int_tree = IntSegmentTree(source, func="product", modulus=modulus)
+    verify_tree = VerifySegmentTree(
+        source=source, func=lambda left, right: left * right % modulus
+    )
+
+    for left in range(0, 50, 7):
+        for right in range(left + 1, 51, 5):
+            assert (
+                int_tree.query(left, right) == verify_tree.query(left, right) % modulus
+            )
+
+    int_tree.update(3, -1)
+    int_tree.update_many(array.array("q", [4]), array.array("q", [-(10 ** 15)]))
+    verify_tree.update_many([3, 4], [-1, -(10 ** 15)])
+    assert int_tree.query(0, 50) == verify_tree.query(0, 50) % modulus
+
+    restored = pickle.loads(pickle.dumps(int_tree))
+    assert restored.query(0, 50) == int_tree.query(0, 50)
+    assert list(restored.leaves()) == list(int_tree.leaves())
+
+    with pytest.raises(ValueError):
+        int_tree.to_bytes()
+
+    with pytest.raises(ValueError):
+        IntSegmentTree([1, 2], func="sum", modulus=7)
+
+    with pytest.raises(ValueError):
+        IntSegmentTree([1, 2], func="product", modulus=0)
+
+
+def test_append_overflow():
+    int_64 = int(2 ** 63 - 3)
+    int_tree = IntSegmentTree([int_64, 1])
+    with pytest.raises(OverflowError):
+        int_tree.extend([1, 1])
+
+    # The failed extend leaves the tree unchanged
+    assert len(int_tree) == 2
+    assert int_tree.query(0, 2) == int_64 + 1
+    int_tree.append(-1)
+    assert int_tree.query(0, 3) == int_64
+
+    with pytest.raises(OverflowError):
+        int_tree.append(2 ** 63)
+
+
+def test_append_modulus():
+    int_tree = IntSegmentTree([], func="product", modulus=7)
+    int_tree.extend(array.array("q", [3, -1]))
+    int_tree.append(10)
+
+    assert int_tree.leaves().tolist() == [3, 6, 3]
+    assert int_tree.query(0, 3) == 3 * 6 * 3 % 7
+    assert int_tree.pop() == 3
+    assert pickle.loads(pickle.dumps(int_tree)).query(0, 2) == 4
+
+
+def test_slice_assign_overflow():
+    int_64 = int(2 ** 63 - 3)
+    int_tree = IntSegmentTree([int_64, 1, 1])
+    with pytest.raises(OverflowError):
+        int_tree[1:] = [2, 2]
+
+    # The failed assignment leaves the tree unchanged
+    assert int_tree.leaves().tolist() == [int_64, 1, 1]
+    assert int_tree.query(0, 3) == int_64 + 2
+
+    int_tree = IntSegmentTree([1, 2, 3], func="product", modulus=7)
+    int_tree[::2] = [10, -1]
+    assert int_tree[:].tolist() == [3, 2, 6]
+    assert int_tree.query(0, 3) == 36 % 7
+
+
+def test_monoids_search_unsupported():
+    int_tree = IntSegmentTree([1, 2, 3], func="xor")
+
+    with pytest.raises(ValueError):
+        int_tree.max_right(0, 2)
+
+    with pytest.raises(ValueError):
+        int_tree.query_arg(0, 2)
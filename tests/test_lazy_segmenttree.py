@@ -0,0 +1,141 @@
+import array
+import random
+
+import pytest
+
+from pysegmenttree import QueryFunction, stree
+from pysegmenttree.c_extensions import FloatLazySegmentTree, IntLazySegmentTree
+from pysegmenttree.test_utils import VerifySegmentTree
+
+CLASSES = [IntLazySegmentTree, FloatLazySegmentTree]
+SUPPORTED_FUNCTIONS = [QueryFunction.SUM, QueryFunction.MIN, QueryFunction.MAX]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_range_operations(cls: type):
+    tree = cls([18, 17, 13, 19, 15, 11, 20, 12, 33, 25])
+
+    tree.range_add(2, 7, 10)
+    assert tree.query(0, 3) == 58
+    assert tree.query(0, 10) == 233
+
+    tree.range_assign(1, 9, 1)
+    assert tree.query(0, 10) == 51
+    assert tree.query(8, 9) == 1
+
+    tree.update(8, 5)
+    tree.range_add(0, 10, -1)
+    assert tree.query(7, 10) == 28
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_range_operations_random(cls: type, func: QueryFunction):
+    random.seed(42)
+
+    size = 300
+    rng = 1000
+    queries = 1000
+
+    source = [random.randint(-rng, rng) for _ in range(size)]
+    tree = cls(source, func=func.value)
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    for _ in range(queries):
+        left, right = sorted(random.sample(range(size + 1), 2))
+        value = random.randint(-rng, rng)
+
+        if random.random() < 0.5:
+            tree.range_add(left, right, value)
+            for i in range(left, right):
+                verify_tree.update(i, verify_tree.source[i] + value)
+        else:
+            tree.range_assign(left, right, value)
+            for i in range(left, right):
+                verify_tree.update(i, value)
+
+        left, right = sorted(random.sample(range(size + 1), 2))
+        assert tree.query(left, right) == verify_tree.query(left, right)
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sequence(cls: type):
+    tree = cls([5, 1, 9, 4])
+    assert tree[1] == 1
+    assert tree[-1] == 4
+    assert tree[1:3] == [1, 9]
+    assert tree[::-2] == [4, 1]
+    assert list(tree) == [5, 1, 9, 4]
+
+    tree[0] = 2
+    tree[-2] = 3
+    assert list(tree) == [2, 1, 3, 4]
+    assert tree.query(0, 4) == 10
+
+    with pytest.raises(IndexError):
+        tree[4]
+    with pytest.raises(IndexError):
+        tree[-5] = 1
+    with pytest.raises(TypeError):
+        tree["1"]
+    with pytest.raises(TypeError):
+        tree[0:2] = [1, 2]
+    with pytest.raises(TypeError):
+        del tree[0]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_invalid_intervals(cls: type):
+    tree = cls([1, 2, 3, 4])
+    assert len(tree) == 4
+    assert tree.query(2, 2) is None
+
+    with pytest.raises(IndexError):
+        tree.range_add(0, 5, 1)
+
+    with pytest.raises(IndexError):
+        tree.range_assign(3, 2, 1)
+
+    with pytest.raises(IndexError):
+        tree.update(4, 1)
+
+
+def test_overflow():
+    with pytest.raises(OverflowError):
+        IntLazySegmentTree([2 ** 62, 2 ** 62])
+
+    tree = IntLazySegmentTree([2 ** 61, 2 ** 61])
+    with pytest.raises(OverflowError):
+        tree.range_add(0, 2, 2 ** 61)
+    # The failed operation is rolled back, the tree stays usable
+    assert tree.query(0, 2) == 2 ** 62
+    tree.range_add(0, 1, -1)
+    assert tree.query(0, 2) == 2 ** 62 - 1
+
+    tree = IntLazySegmentTree([2 ** 62, 2 ** 62], func="max")
+    with pytest.raises(OverflowError):
+        tree.range_add(0, 2, 2 ** 62)
+    assert tree.query(0, 2) == 2 ** 62
+    tree.range_assign(1, 2, 7)
+    assert tree.query(1, 2) == 7
+
+    # The pending addition fits into the root, but not into the left leaf
+    tree = IntLazySegmentTree([3 * 2 ** 61, -3 * 2 ** 61])
+    tree.range_add(0, 2, 2 ** 61)
+    with pytest.raises(OverflowError):
+        tree.query(0, 1)
+    assert tree.query(0, 2) == 2 ** 62
+    tree.range_add(0, 2, -(2 ** 61))
+    assert tree.query(0, 1) == 3 * 2 ** 61
+    assert tree.query(1, 2) == -3 * 2 ** 61
+
+
+def test_stree_lazy():
+    tree = stree([1, 2, 3], lazy=True)
+    assert isinstance(tree, IntLazySegmentTree)
+
+    tree = stree(array.array("d", [1.0, 2.0]), func=QueryFunction.MIN, lazy=True)
+    assert isinstance(tree, FloatLazySegmentTree)
+
+    with pytest.raises(ValueError):
+        stree([1, 2, 3], func=min, lazy=True)
@@ -0,0 +1,126 @@
+import functools
+import pickle
+import random
+
+import pytest
+
+from pysegmenttree import PySegmentTree
+from pysegmenttree.c_extensions import AffineSegmentTree, MatrixSegmentTree
+
+
+def matmul(a, b):
+    return tuple(
+        tuple(sum(a[i][k] * b[k][j] for k in range(len(b))) for j in range(len(b)))
+        for i in range(len(a))
+    )
+
+
+def compose(f, g):
+    # Applies f first, then g
+    return (f[0] * g[0], g[0] * f[1] + g[1])
+
+
+def random_matrix(dim: int):
+    return tuple(
+        tuple(float(random.randint(-2, 2)) for _ in range(dim)) for _ in range(dim)
+    )
+
+
+def random_affine():
+    return (float(random.randint(-2, 2)), float(random.randint(-5, 5)))
+
+
+@pytest.mark.parametrize(
+    "cls,func,random_item",
+    [
+        (MatrixSegmentTree, matmul, lambda: random_matrix(2)),
+        (MatrixSegmentTree, matmul, lambda: random_matrix(3)),
+        (AffineSegmentTree, compose, random_affine),
+    ],
+)
+@pytest.mark.parametrize("size", [1, 2, 7, 30])
+def test_operations_random(cls: type, func, random_item, size: int):
+    random.seed(42)
+
+    source = [random_item() for _ in range(size)]
+    tree = cls(source)
+
+    for _ in range(200):
+        if random.random() < 0.5:
+            i = random.randrange(size)
+            source[i] = random_item()
+            tree.update(i, source[i])
+        else:
+            left, right = sorted(random.sample(range(size + 1), 2))
+            # Small integers keep the products exact
+            assert tree.query(left, right) == functools.reduce(func, source[left:right])
+
+    assert tree.leaves() == source
+
+
+def test_fibonacci():
+    tree = MatrixSegmentTree([[[1, 1], [1, 0]]] * 30)
+    assert tree.dim == 2
+    assert tree.query(0, 30)[0][1] == 832040
+
+
+def test_sequence():
+    tree = MatrixSegmentTree([[[1, 2], [3, 4]], [[0, 1], [1, 0]]])
+    assert tree[-1] == ((0, 1), (1, 0))
+    assert list(tree) == tree.leaves()
+
+    tree[0] = [[1, 0], [0, 1]]
+    assert tree[:] == [((1, 0), (0, 1)), ((0, 1), (1, 0))]
+    assert tree.query(0, 2) == ((0, 1), (1, 0))
+
+    affine = AffineSegmentTree([(2, 1), (3, 0)])
+    affine[1] = (1, 5)
+    assert list(affine) == [(2, 1), (1, 5)]
+
+    with pytest.raises(IndexError):
+        tree[2]
+    with pytest.raises(ValueError):
+        tree[0] = [[1]]
+    with pytest.raises(TypeError):
+        affine[0:1] = [(1, 0)]
+
+
+def test_invalid_operations():
+    tree = MatrixSegmentTree([[[1, 2], [3, 4]], [[0, 1], [1, 0]]])
+    assert tree.query(1, 1) is None
+
+    with pytest.raises(IndexError):
+        tree.query(0, 3)
+
+    with pytest.raises(IndexError):
+        tree.update(2, [[1, 0], [0, 1]])
+
+    with pytest.raises(ValueError):
+        tree.update(0, [[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+
+    with pytest.raises(ValueError):
+        MatrixSegmentTree([[[1, 2], [3, 4]], [[1]]])
+
+    with pytest.raises(ValueError):
+        MatrixSegmentTree([[[1] * 5] * 5])
+
+    with pytest.raises(ValueError):
+        MatrixSegmentTree([], dim=0)
+
+    with pytest.raises(ValueError):
+        AffineSegmentTree([(1, 2, 3)])
+
+    with pytest.raises(TypeError):
+        AffineSegmentTree([("a", 1)])
+
+    assert len(MatrixSegmentTree([], dim=3)) == 0
+
+
+@pytest.mark.parametrize(
+    "tree",
+    [MatrixSegmentTree([[[1, 2], [3, 4]], [[0, 1], [1, 0]]]), AffineSegmentTree([])],
+)
+def test_pickle(tree):
+    restored = pickle.loads(pickle.dumps(tree))
+    assert type(restored) is type(tree)
+    assert restored.leaves() == tree.leaves()
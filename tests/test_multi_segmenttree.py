@@ -0,0 +1,162 @@
+import array
+import random
+import sys
+
+import pytest
+
+from pysegmenttree import QueryFunction, stree
+from pysegmenttree.c_extensions import (
+    Aggregates,
+    FloatMultiSegmentTree,
+    IntMultiSegmentTree,
+)
+from pysegmenttree.test_utils import VerifySegmentTree
+
+CLASSES = [IntMultiSegmentTree, FloatMultiSegmentTree]
+FUNCS = [QueryFunction.SUM, QueryFunction.MIN, QueryFunction.MAX]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 100])
+def test_operations_random(cls: type, size: int):
+    random.seed(42)
+
+    def value():
+        # Small integers are exact in both trees
+        return random.randint(-1000, 1000) * (
+            1.0 if cls is FloatMultiSegmentTree else 1
+        )
+
+    source = [value() for _ in range(size)]
+    tree = cls(source)
+    verify_trees = {func: VerifySegmentTree(source, func=func) for func in FUNCS}
+
+    for _ in range(300):
+        if random.random() < 0.5:
+            i = random.randrange(size)
+            new_value = value()
+            tree.update(i, new_value)
+            for verify_tree in verify_trees.values():
+                verify_tree.update(i, new_value)
+        else:
+            left = random.randrange(size)
+            right = random.randint(left + 1, size)
+            assert tree.query(left, right) == Aggregates(
+                (
+                    *(verify_trees[func].query(left, right) for func in FUNCS),
+                    right - left,
+                )
+            )
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_selected_funcs(cls: type):
+    tree = cls([5, 1, 4, 2, 3], funcs=["min", "max"])
+    assert tree.funcs == ("min", "max")
+
+    res = tree.query(1, 4)
+    assert (res.sum, res.min, res.max, res.count) == (None, 1, 4, 3)
+
+    res = tree.query(1, 4, funcs=["max"])
+    assert (res.sum, res.min, res.max, res.count) == (None, None, 4, 3)
+
+    with pytest.raises(ValueError):
+        tree.query(0, 5, funcs=["sum"])
+
+    with pytest.raises(ValueError):
+        cls([1, 2], funcs=["median"])
+
+    with pytest.raises(TypeError):
+        cls([1, 2], funcs="sum")
+
+    # Only the kept node arrays are allocated
+    assert sys.getsizeof(cls([0] * 1000, funcs=["sum"])) < sys.getsizeof(
+        cls([0] * 1000)
+    )
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sequence(cls: type):
+    tree = cls([5, 1, 9, 4])
+    assert tree[1] == 1
+    assert tree[-1] == 4
+    assert tree[1:3] == [1, 9]
+    assert tree[::-2] == [4, 1]
+    assert list(tree) == [5, 1, 9, 4]
+
+    tree[0] = 2
+    tree[-2] = 3
+    assert list(tree) == [2, 1, 3, 4]
+    assert tree.query(0, 4).sum == 10
+
+    with pytest.raises(IndexError):
+        tree[4]
+    with pytest.raises(IndexError):
+        tree[-5] = 1
+    with pytest.raises(TypeError):
+        tree["1"]
+    with pytest.raises(TypeError):
+        tree[0:2] = [1, 2]
+    with pytest.raises(TypeError):
+        del tree[0]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_invalid_operations(cls: type):
+    tree = cls([1, 2, 3, 4])
+    assert tree.query(2, 2) is None
+    assert cls([]).query(0, 0) is None
+
+    with pytest.raises(IndexError):
+        tree.query(0, 5)
+
+    with pytest.raises(IndexError):
+        tree.update(4, 1)
+
+
+def test_overflow():
+    with pytest.raises(OverflowError):
+        IntMultiSegmentTree([2 ** 62, 2 ** 62])
+
+    tree = IntMultiSegmentTree([2 ** 62, 0, 0, 0])
+    with pytest.raises(OverflowError):
+        tree.update(1, 2 ** 62)
+    # None of the node arrays is modified on overflow
+    assert tree.query(0, 4) == (2 ** 62, 0, 2 ** 62, 4)
+
+    # Min and max of the values, which can't be summed up, are fine
+    tree = IntMultiSegmentTree([2 ** 62, 2 ** 62], funcs=["min", "max"])
+    assert tree.query(0, 2).max == 2 ** 62
+
+
+def test_stree_multi():
+    tree = stree([3, 1, 2], func=[QueryFunction.MIN, QueryFunction.MAX])
+    assert isinstance(tree, IntMultiSegmentTree)
+    assert tree.funcs == ("min", "max")
+
+    tree = stree(array.array("d", [1.5, 2.5]), func=tuple(FUNCS))
+    assert isinstance(tree, FloatMultiSegmentTree)
+    assert tree.query(0, 2).sum == 4.0
+
+    with pytest.raises(ValueError):
+        stree([1, 2], func=[QueryFunction.SUM, QueryFunction.GCD])
+
+    with pytest.raises(ValueError):
+        stree({0: 1, 5: 2}, func=[QueryFunction.SUM, QueryFunction.MAX])
+
+
+def test_stree_multi_fallback():
+    # Mixed int and float items are kept as floats
+    tree = stree([1, 2.5], func=FUNCS)
+    assert isinstance(tree, FloatMultiSegmentTree)
+    assert tree.query(0, 2).sum == 3.5
+
+    with pytest.raises(ValueError, match="64 bits"):
+        stree([2 ** 70, 1], func=FUNCS)
+    with pytest.raises(ValueError, match="64 bits"):
+        stree([2 ** 62, 2 ** 62], func=FUNCS)
+
+    with pytest.raises(ValueError, match="int and float"):
+        stree([object(), object()], func=FUNCS)
+    with pytest.raises(ValueError, match="int and float"):
+        stree(["a", "b"], func=[QueryFunction.MIN])
@@ -0,0 +1,171 @@
+import gc
+import operator
+import pickle
+import random
+import weakref
+
+import pytest
+
+from pysegmenttree import PySegmentTree
+from pysegmenttree.c_extensions import ObjectSegmentTree
+from pysegmenttree.test_utils import Vec2D, VerifySegmentTree
+
+
+def concat(left: str, right: str) -> str:
+    return left + right
+
+
+def random_vec() -> Vec2D:
+    return Vec2D(random.randint(-100, 100), random.randint(-100, 100))
+
+
+@pytest.mark.parametrize("func", [operator.add, min, max, lambda a, b: a + b])
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 100])
+def test_operations_random(func, size: int):
+    random.seed(42)
+
+    source = [random_vec() for _ in range(size)]
+    tree = ObjectSegmentTree(source, func=func)
+    verify_tree = VerifySegmentTree(source, func=func)
+
+    for _ in range(300):
+        if random.random() < 0.3:
+            indices = [random.randrange(size) for _ in range(random.randint(1, 5))]
+            values = [random_vec() for _ in indices]
+            tree.update_many(indices, values)
+            verify_tree.update_many(indices, values)
+        elif random.random() < 0.5:
+            i = random.randrange(size)
+            value = random_vec()
+            tree.update(i, value)
+            verify_tree.update(i, value)
+        else:
+            left = random.randrange(size)
+            right = random.randint(left, size)
+            assert tree.query(left, right) == verify_tree.query(left, right)
+
+    assert tree.leaves() == verify_tree.source
+
+
+def test_non_commutative():
+    random.seed(42)
+
+    source = [chr(ord("a") + i % 26) for i in range(37)]
+    tree = ObjectSegmentTree(source, func=concat)
+
+    for _ in range(200):
+        left, right = sorted(random.sample(range(len(source) + 1), 2))
+        assert tree.query(left, right) == "".join(source[left:right])
+
+    starts, ends = [0, 5, 36], [37, 9, 37]
+    assert tree.query_many(starts, ends) == [
+        "".join(source[s:e]) for s, e in zip(starts, ends)
+    ]
+
+    # Slice assignment keeps the order of the recalculated nodes
+    tree[3:30:4] = source[3:30:4] = "ABCDEFG"
+    tree[-5:] = source[-5:] = "vwxyz"
+    assert tree[:] == source
+    assert tree.query(0, len(source)) == "".join(source)
+
+
+def test_search_predicate():
+    src = [Vec2D(1, 0), Vec2D(2, 0), Vec2D(0, 3), Vec2D(-1, -1), Vec2D(4, 4)]
+    tree = ObjectSegmentTree(src, func=lambda a, b: a + b)
+    py_tree = PySegmentTree(src, func=lambda a, b: a + b)
+
+    def short(vec):
+        return vec.sqr_length() <= 10
+
+    for start in range(len(src) + 1):
+        assert tree.max_right(start, short) == py_tree.max_right(start, short)
+        assert tree.min_left(start, short) == py_tree.min_left(start, short)
+        assert tree.find_first(start, lambda vec: vec.y > 2) == py_tree.find_first(
+            start, lambda vec: vec.y > 2
+        )
+
+    with pytest.raises(TypeError):
+        tree.max_right(0, Vec2D(1, 1))
+
+    with pytest.raises(ZeroDivisionError):
+        tree.max_right(0, lambda vec: 1 / 0)
+
+
+def test_fast_paths():
+    # Ties are resolved exactly as by the builtins
+    source = [Vec2D(1, 0), Vec2D(0, 1), Vec2D(-1, 0)]
+    for func in (min, max):
+        assert ObjectSegmentTree(source, func=func).query(0, 3) is func(*source)
+
+    tree = ObjectSegmentTree([1, 5, 2], func=min)
+    assert tree.max_right(0, 1) == 3
+    assert tree.find_first(0, 2) == 0
+
+    with pytest.raises(TypeError):
+        ObjectSegmentTree([Vec2D(1, 0), "a"], func=operator.add)
+
+
+def test_invalid_operations():
+    tree = ObjectSegmentTree(["a", "b", "c"], func=concat)
+    assert tree.query(1, 1) is None
+    assert ObjectSegmentTree([], func=concat).query(0, 0) is None
+
+    with pytest.raises(IndexError):
+        tree.query(2, 1)
+
+    with pytest.raises(IndexError):
+        tree.query(0, 4)
+
+    with pytest.raises(IndexError):
+        tree.update(3, "d")
+
+    with pytest.raises(IndexError):
+        tree.update_many([0, 3], ["x", "y"])
+    # Nothing is written if any index is invalid
+    assert tree.leaves() == ["a", "b", "c"]
+
+    with pytest.raises(ValueError):
+        tree.update_many([0], ["x", "y"])
+
+    with pytest.raises(TypeError):
+        ObjectSegmentTree([1, 2], func=None)
+
+    # The tree isn't modified by the failed build
+    with pytest.raises(TypeError):
+        tree.__init__([1, "a"], func=concat)
+    assert tree.query(0, 3) == "abc"
+
+
+def test_func_reenters():
+    tree = ObjectSegmentTree(["a", "b", "c", "d"], func=concat)
+
+    def rebuild(left, right):
+        tree.__init__(["x"], func=concat)
+        return left + right
+
+    # The outer build finishes last and replaces the tree built by `func`
+    tree.__init__(["a", "b", "c", "d"], func=rebuild)
+    assert tree.leaves() == ["a", "b", "c", "d"]
+
+    with pytest.raises(RuntimeError):
+        tree.update(0, "z")
+
+
+def test_gc():
+    class Node:
+        pass
+
+    node = Node()
+    node.tree = ObjectSegmentTree([node, node], func=lambda a, b: a)
+    ref = weakref.ref(node)
+    del node
+    gc.collect()
+    assert ref() is None
+
+
+def test_pickle():
+    tree = ObjectSegmentTree([Vec2D(1, 2), Vec2D(3, 4)], func=operator.add)
+
+    restored = pickle.loads(pickle.dumps(tree))
+    assert restored.func is operator.add
+    assert restored.query(0, 2) == Vec2D(4, 6)
@@ -0,0 +1,157 @@
+import random
+
+import pytest
+
+from pysegmenttree import QueryFunction, stree
+from pysegmenttree.c_extensions import (
+    FloatPersistentSegmentTree,
+    IntPersistentSegmentTree,
+)
+from pysegmenttree.test_utils import VerifySegmentTree
+
+CLASSES = [IntPersistentSegmentTree, FloatPersistentSegmentTree]
+SUPPORTED_FUNCTIONS = [QueryFunction.SUM, QueryFunction.MIN, QueryFunction.MAX]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_versions_random(cls: type, func: QueryFunction):
+    random.seed(42)
+
+    size = 100
+    rng = 1000
+
+    source = [random.randint(-rng, rng) for _ in range(size)]
+    tree = cls(source, func=func.value)
+    current = VerifySegmentTree(source=list(source), func=func)
+    versions = {}
+
+    for _ in range(50):
+        versions[tree.snapshot()] = list(current.source)
+        for _ in range(random.randint(0, 10)):
+            i = random.randrange(size)
+            value = random.randint(-rng, rng)
+            tree.update(i, value)
+            current.update(i, value)
+
+        for version, values in versions.items():
+            verify_tree = VerifySegmentTree(source=values, func=func)
+            left, right = sorted(random.sample(range(size + 1), 2))
+            assert tree.query(left, right, version=version) == verify_tree.query(
+                left, right
+            )
+
+        left, right = sorted(random.sample(range(size + 1), 2))
+        assert tree.query(left, right) == current.query(left, right)
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_path_copying(cls: type):
+    size = 1024
+    tree = cls([1] * size)
+    built = tree.node_count
+
+    # The updates before the first snapshot are done in place
+    tree.update(0, 2)
+    assert tree.node_count == built
+
+    tree.snapshot()
+    tree.update(1, 2)
+    assert tree.node_count == built + 11
+    # The path is already copied
+    tree.update(1, 3)
+    assert tree.node_count == built + 11
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_collect(cls: type):
+    tree = cls(list(range(64)))
+    v0 = tree.snapshot()
+    tree.update(0, 100)
+    v1 = tree.snapshot()
+    tree.update(63, 100)
+
+    assert tree.collect() == 0
+    tree.release(v0)
+    assert tree.collect() == 7
+    assert tree.query(0, 64, version=v1) == sum(range(64)) + 100
+    assert tree.query(0, 64) == sum(range(1, 63)) + 200
+
+    # Path copying still respects the remaining version
+    tree.update(5, 0)
+    assert tree.query(0, 64, version=v1) == sum(range(64)) + 100
+
+    with pytest.raises(ValueError):
+        tree.query(0, 64, version=v0)
+
+    with pytest.raises(ValueError):
+        tree.release(v0)
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sequence(cls: type):
+    tree = cls([5, 1, 9, 4])
+    assert tree[1] == 1
+    assert tree[-1] == 4
+    assert tree[1:3] == [1, 9]
+    assert tree[::-2] == [4, 1]
+    assert list(tree) == [5, 1, 9, 4]
+
+    tree[0] = 2
+    tree[-2] = 3
+    assert list(tree) == [2, 1, 3, 4]
+    assert tree.query(0, 4) == 10
+
+    with pytest.raises(IndexError):
+        tree[4]
+    with pytest.raises(IndexError):
+        tree[-5] = 1
+    with pytest.raises(TypeError):
+        tree["1"]
+    with pytest.raises(TypeError):
+        tree[0:2] = [1, 2]
+    with pytest.raises(TypeError):
+        del tree[0]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_invalid_operations(cls: type):
+    tree = cls([1, 2, 3, 4])
+    assert len(tree) == 4
+    assert tree.query(2, 2) is None
+
+    with pytest.raises(IndexError):
+        tree.query(0, 5)
+
+    with pytest.raises(IndexError):
+        tree.update(4, 1)
+
+    with pytest.raises(ValueError):
+        tree.query(0, 4, version=0)
+
+    with pytest.raises(ValueError):
+        cls([]).snapshot()
+
+
+def test_overflow():
+    with pytest.raises(OverflowError):
+        IntPersistentSegmentTree([2 ** 62, 2 ** 62])
+
+    tree = IntPersistentSegmentTree([2 ** 62, 0])
+    version = tree.snapshot()
+    with pytest.raises(OverflowError):
+        tree.update(1, 2 ** 62)
+
+    assert tree.query(0, 2) == 2 ** 62
+    assert tree.query(0, 2, version=version) == 2 ** 62
+
+
+def test_stree_persistent():
+    tree = stree([1, 2, 3], persistent=True)
+    assert isinstance(tree, IntPersistentSegmentTree)
+
+    tree = stree([1.0, 2.0], func=QueryFunction.MIN, persistent=True)
+    assert isinstance(tree, FloatPersistentSegmentTree)
+
+    with pytest.raises(ValueError):
+        stree([1, 2, 3], func=min, persistent=True)
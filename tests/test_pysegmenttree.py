@@ -1,4 +1,9 @@
-from pysegmenttree import PySegmentTree
+import math
+import random
+
+import pytest
+
+from pysegmenttree import PySegmentTree, QueryFunction
 from pysegmenttree.test_utils import Vec2D, VerifySegmentTree
 
 
@@ -23,3 +28,76 @@ def test_custom_obj():
 
     for start, end in queries:
         assert tree.query(start, end) == verify_tree.query(start, end)
+
+
+def test_search_predicate():
+    src = [Vec2D(1, 0), Vec2D(2, 0), Vec2D(0, 3), Vec2D(-1, -1), Vec2D(4, 4)]
+    tree = PySegmentTree(src, func=lambda a, b: a + b)
+
+    def short(vec):
+        return vec.sqr_length() <= 10
+
+    assert tree.max_right(0, short) == 2
+    assert tree.min_left(5, lambda vec: vec.x <= 4) == 2
+    assert tree.find_first(1, lambda vec: vec.y > 2) == 2
+    assert tree.find_first(3, lambda vec: vec.x > 100) is None
+
+    with pytest.raises(TypeError):
+        tree.max_right(0, Vec2D(1, 1))
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64])
+def test_identity_random(size: int):
+    random.seed(42)
+
+    src = [Vec2D(random.randint(-9, 9), random.randint(-9, 9)) for _ in range(size)]
+    tree = PySegmentTree(src, func=lambda a, b: a + b, identity=Vec2D(0, 0))
+    verify_tree = VerifySegmentTree(src, func=lambda a, b: a + b)
+
+    for _ in range(200):
+        if random.random() < 0.5:
+            i = random.randrange(size)
+            value = Vec2D(random.randint(-9, 9), random.randint(-9, 9))
+            tree.update(i, value)
+            verify_tree.update(i, value)
+        else:
+            indices = [random.randrange(size) for _ in range(3)]
+            values = [Vec2D(i, -i) for i in indices]
+            tree.update_many(indices, values)
+            verify_tree.update_many(indices, values)
+
+        left, right = sorted(random.sample(range(size + 1), 2))
+        assert tree.query(left, right) == verify_tree.query(left, right)
+    assert tree.query(0, 0) is None
+
+
+def test_default_identity():
+    assert PySegmentTree([1, 2.5], func=QueryFunction.SUM).identity == 0
+    assert PySegmentTree([1, 2], func=QueryFunction.MIN).identity == math.inf
+    assert PySegmentTree([1, 2], func=QueryFunction.MAX).identity == -math.inf
+
+    # Non-numeric items and custom functions keep the None checks
+    tree = PySegmentTree([Vec2D(1, 0), Vec2D(0, 2)], func=QueryFunction.MIN)
+    assert tree.identity is None
+    assert tree.query(0, 2) == Vec2D(1, 0)
+    assert PySegmentTree([1, 2], func=min).identity is None
+
+
+@pytest.mark.parametrize("identity", [None, ""])
+@pytest.mark.parametrize("size", [1, 2, 7, 33])
+def test_non_commutative(identity, size: int):
+    random.seed(42)
+
+    src = [chr(ord("a") + i % 26) for i in range(size)]
+    tree = PySegmentTree(
+        src, func=lambda a, b: a + b, identity=identity, commutative=False
+    )
+
+    for _ in range(100):
+        i = random.randrange(size)
+        src[i] = random.choice("xyz")
+        tree.update(i, src[i])
+
+        left, right = sorted(random.sample(range(size + 1), 2))
+        assert tree.query(left, right) == "".join(src[left:right])
+    assert tree.query(0, 0) is None
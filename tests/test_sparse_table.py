@@ -0,0 +1,67 @@
+import array
+import random
+
+import pytest
+
+from pysegmenttree import QueryFunction, stree
+from pysegmenttree.c_extensions import FloatSparseTable, IntSparseTable
+from pysegmenttree.test_utils import VerifySegmentTree
+
+CLASSES = [IntSparseTable, FloatSparseTable]
+SUPPORTED_FUNCTIONS = [QueryFunction.MIN, QueryFunction.MAX]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 300])
+def test_query_random(cls: type, func: QueryFunction, size: int):
+    random.seed(42)
+
+    source = [random.randint(-1000, 1000) for _ in range(size)]
+    tree = cls(source, func=func.value)
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    assert len(tree) == size
+    for left in range(size):
+        for right in range(left + 1, min(size, left + 70) + 1):
+            assert tree.query(left, right) == verify_tree.query(left, right)
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sequence(cls: type):
+    tree = cls([5, 1, 9, 4], "min")
+    assert tree[-1] == 4
+    assert tree[1:3] == [1, 9]
+    assert list(tree) == [5, 1, 9, 4]
+
+    with pytest.raises(IndexError):
+        tree[4]
+    with pytest.raises(TypeError):
+        tree[0] = 1
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_invalid_operations(cls: type):
+    tree = cls([1, 2, 3, 4], func="max")
+    assert tree.query(2, 2) is None
+    assert cls([], func="min").query(0, 0) is None
+
+    with pytest.raises(IndexError):
+        tree.query(0, 5)
+
+    with pytest.raises(TypeError):
+        tree.update(0, 1)
+
+    with pytest.raises(ValueError):
+        cls([1, 2, 3], func="sum")
+
+
+def test_stree_static():
+    tree = stree([1, 2, 3], func=QueryFunction.MIN, static=True)
+    assert isinstance(tree, IntSparseTable)
+
+    tree = stree(array.array("d", [1.0, 2.0]), func=QueryFunction.MAX, static=True)
+    assert isinstance(tree, FloatSparseTable)
+
+    tree = stree([1, 2, 3], static=True)
+    assert not isinstance(tree, IntSparseTable)
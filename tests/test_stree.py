@@ -1,5 +1,28 @@
-from pysegmenttree import PySegmentTree, QueryFunction, stree
-from pysegmenttree.c_extensions import FloatSegmentTree, IntSegmentTree
+import array
+import multiprocessing
+import random
+
+import pytest
+
+from pysegmenttree import (
+    PySegmentTree,
+    QueryFunction,
+    attach_stree,
+    c_extensions,
+    open_stree,
+    save_stree,
+    share_stree,
+    stree,
+)
+from pysegmenttree.c_extensions import (
+    FloatSegmentTree,
+    IntSegmentTree,
+    ObjectSegmentTree,
+)
+from pysegmenttree.test_utils import Vec2D
+
+# The large int sources fall back to the object tree without 128-bit integers
+LargeIntSegmentTree = getattr(c_extensions, "Int128SegmentTree", ObjectSegmentTree)
 
 
 def test_stree():
@@ -13,7 +36,12 @@ def test_stree():
     assert isinstance(tree, FloatSegmentTree)
 
     tree = stree([int(2 ** 63 - 1), 17, 13, 19, 15, 11, 20, 12, 33, 25])
-    assert isinstance(tree, PySegmentTree)
+    assert isinstance(tree, LargeIntSegmentTree)
+    assert tree.query(0, 3) == 2 ** 63 + 29
+
+    tree = stree([2 ** 200, 1])
+    assert isinstance(tree, ObjectSegmentTree)
+    assert tree.query(0, 2) == 2 ** 200 + 1
 
     tree = stree(
         [int(2 ** 63 - 1), 17, 13, 19, 15, 11, 20, 12, 33, 25],
@@ -22,4 +50,187 @@ def test_stree():
     assert isinstance(tree, IntSegmentTree)
 
     tree = stree([1, 2, 3, 4, 5], func=min)
-    assert isinstance(tree, PySegmentTree)
+    assert isinstance(tree, ObjectSegmentTree)
+
+    tree = stree([Vec2D(1, 2), Vec2D(3, 4)])
+    assert isinstance(tree, ObjectSegmentTree)
+    assert tree.query(0, 2) == Vec2D(4, 6)
+
+
+def test_stree_monoids():
+    tree = stree([12, 18, 30], func=QueryFunction.GCD)
+    assert isinstance(tree, IntSegmentTree)
+    assert tree.query(0, 3) == 6
+
+    # Every tree returns the non-negative gcd, also for the single items
+    tree = stree([-12, 18, -30], func=QueryFunction.GCD)
+    assert [tree.query(0, 1), tree.query(0, 3)] == [12, 6]
+
+    source = [-12, 3 * 2 ** 70, -(2 ** 65)]
+    for tree in [
+        stree(source, func=QueryFunction.GCD),
+        PySegmentTree(source, func=QueryFunction.GCD),
+    ]:
+        assert isinstance(tree, PySegmentTree)
+        assert [tree.query(0, 1), tree.query(2, 3), tree.query(0, 3)] == [
+            12,
+            2 ** 65,
+            4,
+        ]
+
+    tree = stree([1.5, 2.0], func=QueryFunction.PRODUCT)
+    assert isinstance(tree, FloatSegmentTree)
+    assert tree.query(0, 2) == 3.0
+
+    tree = stree([3, 4, 5], func=QueryFunction.PRODUCT, modulus=7)
+    assert isinstance(tree, IntSegmentTree)
+    assert tree.query(0, 3) == 60 % 7
+
+    # Doesn't fit into long long, but stays exact
+    tree = stree([2 ** 40, 2 ** 40], func=QueryFunction.PRODUCT)
+    assert isinstance(tree, ObjectSegmentTree)
+    assert tree.query(0, 2) == 2 ** 80
+
+    tree = stree([2 ** 70, 3], func=QueryFunction.PRODUCT, modulus=7)
+    assert isinstance(tree, ObjectSegmentTree)
+    assert tree.query(0, 2) == 2 ** 70 * 3 % 7
+
+    with pytest.raises(ValueError):
+        stree([1, 2], func=QueryFunction.SUM, modulus=7)
+
+
+def test_stree_buffer():
+    tree = stree(array.array("i", [18, 17, 13, 19, 15, 11, 20, 12, 33, 25]))
+    assert isinstance(tree, IntSegmentTree)
+    assert tree.query(0, 3) == 48
+
+    tree = stree(array.array("d", [18.5, 17.1, 13.0]), func=QueryFunction.MIN)
+    assert isinstance(tree, FloatSegmentTree)
+    assert tree.query(0, 3) == 13.0
+
+    tree = stree(array.array("Q", [2 ** 64 - 1, 1]))
+    assert isinstance(tree, LargeIntSegmentTree)
+    assert tree.query(0, 2) == 2 ** 64
+
+
+def test_open_stree(tmp_path):
+    path = tmp_path / "tree.pst"
+    save_stree(stree([18, 17, 13, 19, 15, 11, 20, 12, 33, 25]), path)
+
+    reader = open_stree(path)
+    assert isinstance(reader, IntSegmentTree)
+    assert reader.query(0, 10) == 183
+    with pytest.raises(TypeError):
+        reader.update(0, 1)
+
+    writer = open_stree(path, mode="r+", sync=True)
+    writer.update(0, 28)
+    writer.update_many(array.array("q", [1, 2]), array.array("q", [27, 23]))
+    assert writer.query(0, 3) == 78
+    # Both trees share the same file mapping
+    assert reader.query(0, 10) == 213
+
+    del reader, writer
+    assert open_stree(path).query(0, 10) == 213
+
+    path = tmp_path / "float_tree.pst"
+    save_stree(stree([18.5, 17.1, 13.0], func=QueryFunction.MIN), path)
+    tree = open_stree(path, mode="r+")
+    assert isinstance(tree, FloatSegmentTree)
+    tree.update(1, 10.5)
+    tree.flush()
+    assert open_stree(path).query(0, 3) == 10.5
+
+
+def test_open_stree_invalid(tmp_path):
+    path = tmp_path / "tree.pst"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(ValueError):
+        open_stree(path)
+
+    save_stree(stree([1, 2, 3]), path)
+    with pytest.raises(ValueError):
+        open_stree(path, mode="w")
+
+    # Only the int64 and float64 trees have the snapshot format
+    with pytest.raises(TypeError):
+        save_stree(stree([1, 2, 3], dtype="int32"), path)
+    with pytest.raises(TypeError):
+        share_stree(stree([1, 2, 3], lazy=True))
+
+
+def test_attach():
+    snapshot = bytearray(IntSegmentTree([1, 2, 3]).to_bytes())
+    tree = IntSegmentTree.attach(snapshot)
+    tree.update(0, 10)
+    assert IntSegmentTree.from_bytes(snapshot).query(0, 3) == 15
+
+    with pytest.raises(TypeError):
+        IntSegmentTree.attach(snapshot, sync=True)
+
+    with pytest.raises(TypeError):
+        IntSegmentTree.attach(bytes(snapshot)).update(0, 1)
+    with pytest.raises(TypeError):
+        IntSegmentTree.attach(bytes(snapshot))[:2] = [4, 5]
+
+    tree[1:] = [20, 30]
+    assert IntSegmentTree.from_bytes(snapshot)[:].tolist() == [10, 20, 30]
+
+    # The snapshot has no room for the new leaves
+    with pytest.raises(BufferError):
+        tree.append(4)
+    with pytest.raises(BufferError):
+        tree.pop()
+
+
+def test_share_stree():
+    writer, shm = share_stree(stree([18, 17, 13, 19], func=QueryFunction.MAX))
+    try:
+        reader, reader_shm = attach_stree(shm.name)
+        assert isinstance(reader, IntSegmentTree)
+        assert reader.query(0, 4) == 19
+
+        writer.update(0, 40)
+        assert reader.query(0, 4) == 40
+        with pytest.raises(TypeError):
+            reader.update(0, 1)
+
+        del reader
+        reader_shm.close()
+    finally:
+        del writer
+        shm.close()
+        shm.unlink()
+
+
+def _check_sum(name: str, total: int, queries: int) -> int:
+    tree, shm = attach_stree(name)
+    errors = sum(tree.query(0, len(tree)) != total for _ in range(queries))
+    del tree
+    shm.close()
+    return errors
+
+
+def test_share_stree_consistency():
+    size = 1024
+    writer, shm = share_stree(stree(list(range(size))))
+    total = writer.query(0, size)
+    try:
+        with multiprocessing.Pool(1) as pool:
+            result = pool.apply_async(_check_sum, (shm.name, total, 20000))
+            indices = array.array("q", [0, 0])
+            values = array.array("q", [0, 0])
+
+            # Every batch moves the value between two leaves keeping the total sum
+            while not result.ready():
+                indices[0], indices[1] = random.sample(range(size), 2)
+                delta = random.randint(-100, 100)
+                values[0] = writer.query(indices[0], indices[0] + 1) - delta
+                values[1] = writer.query(indices[1], indices[1] + 1) + delta
+                writer.update_many(indices, values)
+
+            assert result.get() == 0
+    finally:
+        del writer
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,205 @@
+import array
+import pickle
+import random
+
+import pytest
+
+from pysegmenttree import QueryFunction, stree
+from pysegmenttree.c_extensions import (
+    Float32SegmentTree,
+    FloatSegmentTree,
+    Int32SegmentTree,
+    IntSegmentTree,
+    UInt32SegmentTree,
+    UInt64SegmentTree,
+)
+from pysegmenttree.test_utils import VerifySegmentTree
+
+# Class, item range and buffer format
+TYPES = [
+    (Int32SegmentTree, -(2 ** 31), 2 ** 31 - 1, "i"),
+    (UInt32SegmentTree, 0, 2 ** 32 - 1, "I"),
+    (UInt64SegmentTree, 0, 2 ** 64 - 1, "Q"),
+]
+CLASSES = [Int32SegmentTree, UInt32SegmentTree, UInt64SegmentTree, Float32SegmentTree]
+SUPPORTED_FUNCTIONS = [QueryFunction.SUM, QueryFunction.MIN, QueryFunction.MAX]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+@pytest.mark.parametrize("func", SUPPORTED_FUNCTIONS)
+def test_operations_random(cls: type, func: QueryFunction):
+    random.seed(42)
+
+    size = 300
+    queries = 1000
+
+    def value():
+        # Small integers are exactly representable by float32
+        return random.randint(0, 1000) * (1.0 if cls is Float32SegmentTree else 1)
+
+    source = [value() for _ in range(size)]
+    tree = cls(source, func=func.value)
+    verify_tree = VerifySegmentTree(source=source, func=func)
+
+    for _ in range(queries):
+        i = random.randrange(size)
+        new_value = value()
+        tree.update(i, new_value)
+        verify_tree.update(i, new_value)
+
+        left, right = sorted(random.sample(range(size + 1), 2))
+        assert tree.query(left, right) == verify_tree.query(left, right)
+
+
+@pytest.mark.parametrize("cls, low, high, format", TYPES)
+def test_item_range(cls: type, low: int, high: int, format: str):
+    tree = cls([low, high], func="max")
+    assert tree.query(0, 2) == high
+    assert tree.nodes().format == format
+    assert tree.nodes().itemsize == array.array(format).itemsize
+
+    with pytest.raises(OverflowError):
+        cls([low - 1])
+
+    with pytest.raises(OverflowError):
+        cls([high + 1])
+
+    with pytest.raises(OverflowError):
+        tree.update(0, high + 1)
+
+    assert cls(array.array(format, [low, high]), func="min").query(0, 2) == low
+
+
+def test_overflow():
+    # Nodes must fit into the item, but query results may exceed it
+    tree = Int32SegmentTree([2 ** 31 - 1, -(2 ** 30) - 1, -(2 ** 30) - 1, 2 ** 31 - 1])
+    assert tree.query(1, 3) == -(2 ** 31) - 2
+    with pytest.raises(OverflowError):
+        Int32SegmentTree([2 ** 30, 2 ** 30])
+
+    tree = UInt32SegmentTree([2 ** 31, 2 ** 31 - 1, 0])
+    with pytest.raises(OverflowError):
+        tree.update(2, 1)
+    # The failed update leaves the tree untouched
+    assert tree.query(0, 3) == 2 ** 32 - 1
+    assert tree.query(2, 3) == 0
+
+    tree = Int32SegmentTree([2 ** 30, 0, 0])
+    with pytest.raises(OverflowError):
+        tree[1:] = [2 ** 30, 1]
+    # The failed slice assignment restores the replaced leaves
+    assert list(tree) == [2 ** 30, 0, 0]
+    assert tree.query(0, 3) == 2 ** 30
+
+    tree = UInt64SegmentTree([2 ** 64 - 1, 0])
+    with pytest.raises(OverflowError):
+        tree.update(1, 1)
+    with pytest.raises(OverflowError):
+        UInt64SegmentTree([-1])
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_invalid_operations(cls: type):
+    tree = cls([1, 2, 3, 4])
+    assert len(tree) == 4
+    assert tree.query(2, 2) is None
+
+    with pytest.raises(IndexError):
+        tree.query(0, 5)
+
+    with pytest.raises(IndexError):
+        tree.update(4, 1)
+
+    with pytest.raises(ValueError):
+        cls([1, 2, 3], func="avg")
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_sequence(cls: type):
+    tree = cls([5, 1, 9, 4], func="max")
+    format = tree.nodes().format
+
+    assert tree[-1] == 4
+    assert tree[1::2] == array.array(format, [1, 4])
+    tree[::2] = [2, 3]
+    tree[3] = 0
+    assert list(tree) == [2, 1, 3, 0]
+    assert tree.query(0, 4) == 3
+
+    with pytest.raises(IndexError):
+        tree[4]
+    with pytest.raises(ValueError):
+        tree[:2] = [1]
+
+
+@pytest.mark.parametrize("cls", CLASSES)
+def test_pickle(cls: type):
+    tree = cls([5, 1, 9, 4], func="min")
+    restored = pickle.loads(pickle.dumps(tree))
+
+    assert type(restored) is cls
+    assert restored.leaves().tolist() == tree.leaves().tolist()
+    assert restored.query(0, 4) == 1
+
+
+def test_stree_dtype():
+    assert isinstance(stree([1, 2, 3], dtype="int32"), Int32SegmentTree)
+    assert isinstance(stree([1, 2, 3], dtype="uint32"), UInt32SegmentTree)
+    assert isinstance(stree([1, 2, 3], dtype="uint64"), UInt64SegmentTree)
+    assert isinstance(stree([1.0, 2.0], dtype="float32"), Float32SegmentTree)
+    assert isinstance(stree([1, 2, 3], dtype="int64"), IntSegmentTree)
+    assert isinstance(stree([1.0, 2.0], dtype="float64"), FloatSegmentTree)
+
+    with pytest.raises(ValueError):
+        stree([1, 2, 3], dtype="int8")
+
+    with pytest.raises(ValueError):
+        stree([1, 2, 3], func=max, dtype="int32")
+
+    for options in [
+        {"lazy": True},
+        {"persistent": True},
+        {"threadsafe": True},
+        {"compact": True},
+        {"static": True, "func": QueryFunction.MIN},
+    ]:
+        with pytest.raises(ValueError):
+            stree([1, 2, 3], dtype="int32", **options)
+
+    with pytest.raises(ValueError):
+        stree({0: 1, 5: 2}, dtype="int32")
+
+
+@pytest.mark.parametrize(
+    "dtype, high", [("int32", 2 ** 31 - 1), ("uint32", 2 ** 32 - 1)]
+)
+def test_stree_dtype_sum_limit(dtype: str, high: int):
+    # The nodes have the item type, so the total is limited by its range
+    half = high // 2 + 1
+    tree = stree([half, high - half], dtype=dtype)
+    assert tree.query(0, 2) == high
+    with pytest.raises(OverflowError):
+        tree.update(1, high - half + 1)
+    assert tree.query(0, 2) == high
+
+    with pytest.raises(OverflowError):
+        stree([half, half], dtype=dtype)
+    assert stree([half, half], func=QueryFunction.MAX, dtype=dtype).query(0, 2) == half
+    assert stree([half, half]).query(0, 2) == 2 * half
+
+
+def test_float32_range():
+    tree = Float32SegmentTree([3.0e38, float("inf")], func="max")
+    assert tree.query(0, 2) == float("inf")
+
+    with pytest.raises(OverflowError):
+        Float32SegmentTree([1e39])
+    with pytest.raises(OverflowError):
+        Float32SegmentTree(array.array("d", [-1e39]))
+    with pytest.raises(OverflowError):
+        tree.update(0, 1e39)
+    # Sums of the nodes must fit into the item as well
+    with pytest.raises(OverflowError):
+        Float32SegmentTree([3.0e38, 3.0e38])
+    with pytest.raises(OverflowError):
+        stree([1e39], dtype="float32")